@@ -0,0 +1,137 @@
+"""face_source_images blob store + face_enrollments.source_image_sha256
+
+Revision ID: t9u0v1w2x3y4
+Revises: s8t9u0v1w2x3
+Create Date: 2026-10-19 10:00:00.000000
+
+注册照片原先以 base64 整张存在 face_enrollments.source_image_b64（Text），
+enrollment 列表 / 人脸库查询虽不选该列，行内几百 KB 的大字段仍拖慢扫描、
+撑大库文件。本迁移：
+
+1) 新建 face_source_images（tenant_id, sha256 唯一；data 为原始字节）；
+2) face_enrollments 加 source_image_sha256 引用列 + (tenant_id, sha256) 索引；
+3) 按 id 分批把能无损解码的 base64 搬成字节、写引用并清空旧列。解不开的
+   遗留值原样保留（读路径兼容旧列），不丢数据。
+
+SQLite 释放的页会被复用，但文件本身不会缩小；需要立即回收空间时停机后手动
+执行 ``VACUUM``。
+
+幂等性：raw init_database()（backend/database.py）同步建表/补列/搬数据，
+走 raw 路径建的库此处按表/列存在与否跳过 DDL；数据搬迁只处理引用为空的行。
+"""
+import base64
+import binascii
+import hashlib
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mysql
+
+revision = 't9u0v1w2x3y4'
+down_revision = 's8t9u0v1w2x3'
+branch_labels = None
+depends_on = None
+
+_BATCH = 200
+
+
+def _decode(b64):
+    s = (b64 or '').strip()
+    if s.startswith('data:') and ',' in s:
+        s = s.split(',', 1)[1]
+    try:
+        data = base64.b64decode(''.join(s.split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return data or None
+
+
+def _migrate_rows(bind):
+    ignore_kw = 'OR IGNORE' if bind.dialect.name == 'sqlite' else 'IGNORE'
+    insert_blob = sa.text(
+        f"INSERT {ignore_kw} INTO face_source_images (tenant_id, sha256, data, byte_size) "
+        "VALUES (:tid, :sha, :data, :n)"
+    )
+    set_ref = sa.text(
+        "UPDATE face_enrollments SET source_image_sha256 = :sha, source_image_b64 = NULL "
+        "WHERE id = :id"
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, tenant_id, source_image_b64 FROM face_enrollments "
+            "WHERE id > :last AND source_image_sha256 IS NULL "
+            "AND source_image_b64 IS NOT NULL AND source_image_b64 != '' "
+            "ORDER BY id LIMIT :n"
+        ), {"last": last_id, "n": _BATCH}).fetchall()
+        if not rows:
+            return
+        for row_id, tenant_id, b64 in rows:
+            last_id = row_id
+            data = _decode(b64)
+            if data is None:
+                continue
+            sha = hashlib.sha256(data).hexdigest()
+            bind.execute(insert_blob, {"tid": tenant_id, "sha": sha, "data": data, "n": len(data)})
+            bind.execute(set_ref, {"sha": sha, "id": row_id})
+
+
+def upgrade():
+    bind = op.get_bind()
+    offline = context.is_offline_mode()
+    inspector = None if offline else inspect(bind)
+
+    if offline or 'face_source_images' not in inspector.get_table_names():
+        op.create_table(
+            'face_source_images',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('tenant_id', sa.Integer(),
+                      sa.ForeignKey('tenants.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('sha256', sa.String(length=64), nullable=False),
+            sa.Column('data', sa.LargeBinary().with_variant(mysql.MEDIUMBLOB(), 'mysql'),
+                      nullable=False),
+            sa.Column('byte_size', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.String(length=32),
+                      server_default=sa.func.current_timestamp()),
+            mysql_charset='utf8mb4',
+            mysql_collate='utf8mb4_0900_ai_ci',
+        )
+        op.create_index('idx_face_source_images_hash', 'face_source_images',
+                        ['tenant_id', 'sha256'], unique=True)
+
+    if offline or not any(
+        c['name'] == 'source_image_sha256' for c in inspector.get_columns('face_enrollments')
+    ):
+        op.add_column('face_enrollments',
+                      sa.Column('source_image_sha256', sa.String(length=64), nullable=True))
+    if offline or not any(
+        ix['name'] == 'idx_face_enroll_source_image'
+        for ix in inspect(bind).get_indexes('face_enrollments')
+    ):
+        op.create_index('idx_face_enroll_source_image', 'face_enrollments',
+                        ['tenant_id', 'source_image_sha256'])
+
+    if not offline:
+        _migrate_rows(bind)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if not context.is_offline_mode():
+        # 照片搬回旧列再删表，downgrade 不丢注册照片
+        rows = bind.execute(sa.text(
+            "SELECT e.id, i.data FROM face_enrollments e "
+            "JOIN face_source_images i ON i.tenant_id = e.tenant_id "
+            "AND i.sha256 = e.source_image_sha256"
+        )).fetchall()
+        for row_id, data in rows:
+            bind.execute(
+                sa.text("UPDATE face_enrollments SET source_image_b64 = :b64 WHERE id = :id"),
+                {"b64": base64.b64encode(bytes(data)).decode('ascii'), "id": row_id},
+            )
+    op.drop_index('idx_face_enroll_source_image', table_name='face_enrollments')
+    with op.batch_alter_table('face_enrollments') as batch_op:
+        batch_op.drop_column('source_image_sha256')
+    op.drop_index('idx_face_source_images_hash', table_name='face_source_images')
+    op.drop_table('face_source_images')
@@ -0,0 +1,41 @@
+"""batches (material_id, is_exhausted) index
+
+Revision ID: u0v1w2x3y4z5
+Revises: t9u0v1w2x3y4
+Create Date: 2026-10-19 12:00:00.000000
+
+「物料当前库存 = 未耗尽批次 sum(quantity)」是全库最常见的聚合（导入预览、
+库存列表、缺失 SKU 等），此前 batches 上只有 warehouse/tenant/批次号索引，
+SQLite 下每个物料都要全表扫一遍 batches，导入预览随行数呈平方增长。
+MySQL 的外键本来会隐式建 material_id 索引，新加的复合索引会接替它。
+
+幂等：legacy ``init_database()``（backend/database.py）同步建该索引，
+走 raw 路径建的库这里会发现已存在并跳过。
+"""
+from alembic import context, op
+from sqlalchemy import inspect
+
+revision = 'u0v1w2x3y4z5'
+down_revision = 't9u0v1w2x3y4'
+branch_labels = None
+depends_on = None
+
+
+def _indexes(table: str):
+    if context.is_offline_mode():
+        return set()
+    bind = op.get_bind()
+    return {ix['name'] for ix in inspect(bind).get_indexes(table)}
+
+
+def upgrade():
+    if 'idx_batches_material' not in _indexes('batches'):
+        op.create_index('idx_batches_material', 'batches', ['material_id', 'is_exhausted'])
+
+
+def downgrade():
+    # MySQL 已用它承载 batches.material_id 外键，直接删会报 1553；保留即可。
+    if op.get_bind().dialect.name == 'mysql':
+        return
+    if 'idx_batches_material' in _indexes('batches'):
+        op.drop_index('idx_batches_material', table_name='batches')
@@ -0,0 +1,49 @@
+"""batch_no_sequences: per-warehouse daily batch-number allocator
+
+Revision ID: v1w2x3y4z5a6
+Revises: u0v1w2x3y4z5
+Create Date: 2026-10-19 14:00:00.000000
+
+generate_batch_no 原先每次都把当天该仓所有 ``YYYYMMDD-%`` 批次号捞出来在
+Python 里取最大值，入库成本随当天批次数线性增长。改为每仓每天一行计数器，
+在写事务内原子自增（见 database.reserve_batch_nos）。
+
+不需要回填：某仓某天第一次分配时按旧规则扫一次当天批次定起点。
+
+幂等：raw ``init_database()``（backend/database.py）同步建该表，走 raw 路径
+建的库这里会发现已存在并跳过。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = 'v1w2x3y4z5a6'
+down_revision = 'u0v1w2x3y4z5'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if _has_table('batch_no_sequences'):
+        return
+    op.create_table(
+        'batch_no_sequences',
+        sa.Column('warehouse_id', sa.Integer(), nullable=False, autoincrement=False),
+        sa.Column('day', sa.String(8), nullable=False),
+        sa.Column('last_seq', sa.Integer(), nullable=False),
+        sa.Column('scanned_batch_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('warehouse_id', 'day', name=op.f('pk_batch_no_sequences')),
+        mysql_charset='utf8mb4',
+        mysql_collate='utf8mb4_0900_ai_ci',
+    )
+
+
+def downgrade():
+    if _has_table('batch_no_sequences'):
+        op.drop_table('batch_no_sequences')
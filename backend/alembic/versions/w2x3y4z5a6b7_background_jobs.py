@@ -0,0 +1,66 @@
+"""background_jobs: persistent job table for long-running admin operations
+
+Revision ID: w2x3y4z5a6b7
+Revises: v1w2x3y4z5a6
+Create Date: 2026-10-19 16:00:00.000000
+
+整库导入导出、Excel 导入确认、人脸批量补算、人脸下发、ERP 用户/仓库导入改为
+后台任务（见 backend/jobs.py）：任务状态、进度、结果持久化在这张表里，
+HTTP 请求只负责提交与轮询。
+
+幂等：raw ``init_database()``（backend/database.py）同步建该表，走 raw 路径
+建的库这里会发现已存在并跳过。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = 'w2x3y4z5a6b7'
+down_revision = 'v1w2x3y4z5a6'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if _has_table('background_jobs'):
+        return
+    op.create_table(
+        'background_jobs',
+        sa.Column('id', sa.String(32), nullable=False),
+        sa.Column('job_type', sa.String(64), nullable=False),
+        sa.Column('tenant_id', sa.Integer(), nullable=True),
+        sa.Column('created_by', sa.Integer(), nullable=True),
+        sa.Column('created_by_name', sa.String(64), nullable=True),
+        sa.Column('dedupe_key', sa.String(191), nullable=True),
+        sa.Column('status', sa.String(16), nullable=False, server_default='pending'),
+        sa.Column('progress_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('progress_total', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('artifact', sa.Text(), nullable=True),
+        sa.Column('cancel_requested', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('owner', sa.String(191), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_background_jobs')),
+        mysql_charset='utf8mb4',
+        mysql_collate='utf8mb4_0900_ai_ci',
+    )
+    op.create_index('idx_background_jobs_tenant', 'background_jobs', ['tenant_id', 'created_at'])
+    op.create_index('idx_background_jobs_active', 'background_jobs', ['status', 'job_type'])
+
+
+def downgrade():
+    if _has_table('background_jobs'):
+        op.drop_index('idx_background_jobs_active', table_name='background_jobs')
+        op.drop_index('idx_background_jobs_tenant', table_name='background_jobs')
+        op.drop_table('background_jobs')
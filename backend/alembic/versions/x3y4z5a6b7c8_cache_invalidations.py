@@ -0,0 +1,51 @@
+"""cache_invalidations: cross-worker cache invalidation events
+
+Revision ID: x3y4z5a6b7c8
+Revises: w2x3y4z5a6b7
+Create Date: 2026-10-19 18:00:00.000000
+
+多 worker 部署（``WORKERS`` > 1）时，写操作清本地缓存的同时把失效事件追加到
+这张表，其他 worker 按自增 id 轮询后清各自的缓存（见 backend/multiworker.py）。
+单 worker 部署不读写这张表。
+
+幂等：raw ``init_database()``（backend/database.py）同步建该表，走 raw 路径
+建的库这里会发现已存在并跳过。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = 'x3y4z5a6b7c8'
+down_revision = 'w2x3y4z5a6b7'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if _has_table('cache_invalidations'):
+        return
+    op.create_table(
+        'cache_invalidations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('topic', sa.String(64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('origin', sa.String(64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_cache_invalidations')),
+        sqlite_autoincrement=True,
+        mysql_charset='utf8mb4',
+        mysql_collate='utf8mb4_0900_ai_ci',
+    )
+    op.create_index('idx_cache_invalidations_created', 'cache_invalidations', ['created_at'])
+
+
+def downgrade():
+    if _has_table('cache_invalidations'):
+        op.drop_index('idx_cache_invalidations_created', table_name='cache_invalidations')
+        op.drop_table('cache_invalidations')
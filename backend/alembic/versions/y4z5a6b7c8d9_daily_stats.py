@@ -0,0 +1,75 @@
+"""daily_stats: per-day in/out rollup of inventory_records; records (material_id, created_at) index
+
+Revision ID: y4z5a6b7c8d9
+Revises: x3y4z5a6b7c8
+Create Date: 2026-10-19 20:00:00.000000
+
+每（租户, 仓库, 日, 类型）一行的出入库量汇总，写路径在同一事务里累加，
+仪表盘今日 / 昨日 / 近 7 天统计改读它（见 backend/daily_stats.py）。建表后
+从已有记录回填一次。今日量要扣掉禁用物料的当日记录，同时给 inventory_records
+补 (material_id, created_at) 索引，让这一步只按禁用物料取当天的记录。
+MySQL 的外键本来会隐式建 material_id 索引，新加的复合索引会接替它。
+
+幂等：raw ``init_database()``（backend/database.py）同步建该表并在表为空时
+回填，走 raw 路径建的库这里会发现已存在并跳过。
+"""
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision = 'y4z5a6b7c8d9'
+down_revision = 'x3y4z5a6b7c8'
+branch_labels = None
+depends_on = None
+
+# 与 backend/daily_stats.BACKFILL_SQL 相同；迁移不 import 应用代码
+_BACKFILL_SQL = """
+    INSERT INTO daily_stats (tenant_id, warehouse_id, day, type, quantity, record_count)
+    SELECT COALESCE(tenant_id, 0), COALESCE(warehouse_id, 0), DATE(created_at), type,
+           SUM(quantity), COUNT(*)
+    FROM inventory_records
+    WHERE created_at IS NOT NULL
+    GROUP BY COALESCE(tenant_id, 0), COALESCE(warehouse_id, 0), DATE(created_at), type
+"""
+
+
+def _has_table(name: str) -> bool:
+    if context.is_offline_mode():
+        return False
+    return inspect(op.get_bind()).has_table(name)
+
+
+def _indexes(table: str):
+    if context.is_offline_mode():
+        return set()
+    return {ix['name'] for ix in inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    if 'idx_records_material_created' not in _indexes('inventory_records'):
+        op.create_index('idx_records_material_created', 'inventory_records', ['material_id', 'created_at'])
+    if _has_table('daily_stats'):
+        return
+    op.create_table(
+        'daily_stats',
+        sa.Column('tenant_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('day', sa.String(10), nullable=False),
+        sa.Column('type', sa.String(8), nullable=False),
+        sa.Column('quantity', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('record_count', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('tenant_id', 'warehouse_id', 'day', 'type', name=op.f('pk_daily_stats')),
+        mysql_charset='utf8mb4',
+        mysql_collate='utf8mb4_0900_ai_ci',
+    )
+    op.execute(_BACKFILL_SQL)
+
+
+def downgrade():
+    if _has_table('daily_stats'):
+        op.drop_table('daily_stats')
+    # MySQL 已用它承载 inventory_records.material_id 外键，直接删会报 1553；保留即可。
+    if op.get_bind().dialect.name == 'mysql':
+        return
+    if 'idx_records_material_created' in _indexes('inventory_records'):
+        op.drop_index('idx_records_material_created', table_name='inventory_records')
@@ -6,6 +6,7 @@ import os
 import logging
 import secrets
 import sqlite3
+import zlib
 import httpx
 from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,7 +17,7 @@ from contextlib import contextmanager
 from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 from io import BytesIO
-from functools import wraps
+from functools import partial, wraps
 from enum import Enum, IntEnum
 
 # 速率限制
@@ -28,7 +29,7 @@ from database import (
     init_database, generate_mock_data, get_db_connection,
     has_admin_user, hash_password, verify_password,
     generate_session_token, generate_api_key, hash_api_key,
-    generate_batch_no, needs_password_rehash,
+    generate_batch_no, reserve_batch_nos, needs_password_rehash,
     validate_username, validate_password_strength,
     REASON_CATEGORIES, REASON_CATEGORY_LABELS,
     get_deploy_mode, get_face_enabled, _is_sqlite,
@@ -52,6 +53,7 @@ from models import (
     PaginatedContactsResponse,
     # Batch models
     BatchInfo, BatchConsumption, StockInResponse, StockOutResponse,
+    StockMovementBatchRequest, StockMovementLineResult, StockMovementBatchResponse,
     BatchMoveRequest, BatchMoveResponse,
     BatchDetailItem, BatchDetailResponse,
     # Operator model
@@ -72,9 +74,15 @@ from models import (
     RoleName, RecordType,
 )
 from fuzzy_match import FuzzyMatcher
-from sqlalchemy import select, and_, or_, insert, update, delete, case, text, false
+from xlsx_stream import MEDIA_TYPE as XLSX_MEDIA_TYPE, XlsxTooLarge, iter_xlsx, iter_xlsx_rows
+from sqlalchemy import select, and_, or_, insert, update, delete, case, text, false, type_coerce, String, bindparam, tuple_
 from sqlalchemy.exc import IntegrityError
 from db import get_engine
+import daily_stats
+import jobs
+import metrics
+import multiworker
+import slow_query
 from metadata import (
     warehouses as _t_warehouses,
     user_warehouses as _t_user_warehouses,
@@ -85,6 +93,7 @@ from metadata import (
     materials as _t_materials,
     batches as _t_batches,
     inventory_records as _t_inventory_records,
+    daily_stats as _t_daily_stats,
     batch_consumptions as _t_batch_consumptions,
     api_keys as _t_api_keys,
     system_settings as _t_system_settings,
@@ -100,7 +109,14 @@ import uuid
 # Excel处理
 
 # MCP进程管理
-from mcp_manager import MCPProcessManager, get_autostart_stagger_seconds
+from mcp_manager import (
+    MCP_COMMAND_TOPIC,
+    MCPProcessManager,
+    RemoteMCPManager,
+    RestoreProgress,
+    get_autostart_concurrency,
+    get_autostart_stagger_seconds,
+)
 
 # Shared dependencies (extracted from app.py — Phase 1 split, task #5).
 # Re-exported so existing route handlers in app.py continue to reference
@@ -146,6 +162,11 @@ FACTORY_API_BASE_URL = os.environ.get('FACTORY_API_BASE_URL', 'https://watcher-a
 # Excel上传限制
 MAX_UPLOAD_SIZE_MB = int(os.environ.get('MAX_UPLOAD_SIZE_MB', '10'))
 MAX_IMPORT_ROWS = int(os.environ.get('MAX_IMPORT_ROWS', '10000'))
+# 解压后体积上限（防 zip bomb；Excel 只读解析时常驻内存的主要是共享字符串表，
+# 也用于 gzip/zstd 压缩的数据库备份导入）
+MAX_IMPORT_UNZIPPED_MB = int(os.environ.get('MAX_IMPORT_UNZIPPED_MB', '200'))
+# 批量出入库单次最大行数
+MAX_STOCK_BATCH_LINES = int(os.environ.get('MAX_STOCK_BATCH_LINES', '500'))
 # 模糊匹配置信度阈值
 FUZZY_CONFIDENT_SCORE = float(os.environ.get('FUZZY_CONFIDENT_SCORE', '80'))
 FUZZY_CONFIDENT_GAP = float(os.environ.get('FUZZY_CONFIDENT_GAP', '10'))
@@ -175,6 +196,20 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """按路由的请求耗时 / SQL 统计（Prometheus 文本格式）。未开启 METRICS_ENABLED 时 404。"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="not found")
+    if metrics.METRICS_TOKEN and not secrets.compare_digest(
+        request.headers.get("authorization", "").encode(),
+        f"Bearer {metrics.METRICS_TOKEN}".encode(),
+    ):
+        raise HTTPException(status_code=401, detail="invalid metrics token")
+    return Response(metrics.registry.render(),
+                    media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Test-only: drain SQLAlchemy connection pool so eval framework can safely
 # overwrite the sqlite file (snapshot reset). Gated by EVAL_TEST_MODE=1.
 @app.post("/api/_test/drain_pool")
@@ -303,6 +338,11 @@ if os.environ.get('REQUEST_LOG', '1') != '0':
             )
             raise
 
+# 请求耗时 / SQL 统计（METRICS_ENABLED，见 metrics.py）。最后挂 = 最外层，计入全部中间件耗时
+# 慢查询日志（SLOW_QUERY_LOG）复用同一套钩子，须先登记观察者
+slow_query.install()
+metrics.install(app)
+
 # ============================================
 # 审计日志函数
 # ============================================
@@ -329,14 +369,24 @@ if os.environ.get('REQUEST_LOG', '1') != '0':
 def get_fuzzy_matcher() -> FuzzyMatcher:
     """获取或创建 FuzzyMatcher 实例"""
     if not hasattr(app.state, 'fuzzy_matcher'):
-        app.state.fuzzy_matcher = FuzzyMatcher(
+        matcher = FuzzyMatcher(
             get_db_connection,
             confident_score=FUZZY_CONFIDENT_SCORE,
             confident_gap=FUZZY_CONFIDENT_GAP,
         )
+        # 多 worker 部署：本 worker 的失效同步广播给其他 worker（单 worker 时为空操作）
+        matcher.on_invalidate = partial(multiworker.broadcast, "fuzzy")
+        app.state.fuzzy_matcher = matcher
     return app.state.fuzzy_matcher
 
 
+def _apply_remote_fuzzy_invalidation(payload: dict) -> None:
+    get_fuzzy_matcher().apply_invalidation(**payload)
+
+
+multiworker.subscribe("fuzzy", _apply_remote_fuzzy_invalidation)
+
+
 # 自定义异常处理（保持响应格式兼容）
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -575,6 +625,7 @@ def _audit_routes() -> None:
         "/openapi.json",
         "/redoc",
         "/health",
+        "/metrics",  # Prometheus 抓取：METRICS_ENABLED 门控 + 可选 METRICS_TOKEN，见 metrics.py
     )
     unguarded: List[str] = []
     for route in app.routes:
@@ -2045,9 +2096,10 @@ def _ensure_default_warehouse_for_tenant(cursor, tenant_id: int) -> int:
 
 
 def _export_rows_for_scope(cursor, table: str, tenant_id: Optional[int]):
+    """按租户范围查询 table，返回已执行的 cursor（调用方 fetchmany 分块取行）。"""
     if tenant_id is None:
         cursor.execute(f"SELECT * FROM {table}")
-        return cursor.fetchall()
+        return cursor
     if table == 'batch_consumptions':
         cursor.execute('''
             SELECT bc.*
@@ -2056,13 +2108,13 @@ def _export_rows_for_scope(cursor, table: str, tenant_id: Optional[int]):
             LEFT JOIN batches b ON bc.batch_id = b.id
             WHERE r.tenant_id = ? OR b.tenant_id = ?
         ''', (tenant_id, tenant_id))
-        return cursor.fetchall()
+        return cursor
     columns = _table_columns(cursor, table)
     if 'tenant_id' in columns:
         cursor.execute(f"SELECT * FROM {table} WHERE tenant_id = ?", (tenant_id,))
     else:
         cursor.execute(f"SELECT * FROM {table}")
-    return cursor.fetchall()
+    return cursor
 
 
 def _count_rows_for_scope(cursor, table: str, tenant_id: Optional[int]) -> int:
@@ -2092,7 +2144,9 @@ def _clear_database_scope(cursor, tenant_id: Optional[int]) -> dict:
     if tenant_id is None:
         cursor.execute('DELETE FROM batch_consumptions')
         cursor.execute('DELETE FROM inventory_records')
+        cursor.execute(daily_stats.CLEAR_SQL)
         cursor.execute('DELETE FROM batches')
+        cursor.execute('DELETE FROM batch_no_sequences')
         cursor.execute('DELETE FROM materials')
         cursor.execute('DELETE FROM contacts')
         cursor.execute('DELETE FROM user_warehouses')
@@ -2113,12 +2167,14 @@ def _clear_database_scope(cursor, tenant_id: Optional[int]) -> dict:
            OR batch_id IN (SELECT id FROM batches WHERE tenant_id = ?)
     ''', (tenant_id, tenant_id))
     cursor.execute('DELETE FROM inventory_records WHERE tenant_id = ?', (tenant_id,))
+    cursor.execute(daily_stats.CLEAR_TENANT_SQL, {'tenant_id': tenant_id})
     cursor.execute('DELETE FROM batches WHERE tenant_id = ?', (tenant_id,))
     cursor.execute('DELETE FROM materials WHERE tenant_id = ?', (tenant_id,))
     cursor.execute('DELETE FROM contacts WHERE tenant_id = ?', (tenant_id,))
     if wh_ids:
         placeholders = ','.join('?' for _ in wh_ids)
         cursor.execute(f'DELETE FROM user_warehouses WHERE warehouse_id IN ({placeholders})', wh_ids)
+        cursor.execute(f'DELETE FROM batch_no_sequences WHERE warehouse_id IN ({placeholders})', wh_ids)
         cursor.execute(f'UPDATE api_keys SET warehouse_id = NULL WHERE warehouse_id IN ({placeholders})', wh_ids)
         cursor.execute(f'UPDATE mcp_connections SET warehouse_id = NULL WHERE warehouse_id IN ({placeholders})', wh_ids)
     cursor.execute('DELETE FROM warehouses WHERE tenant_id = ?', (tenant_id,))
@@ -2158,7 +2214,104 @@ def _insert_row_with_overrides(cursor, table: str, row, target_columns: set, ove
     return cursor.lastrowid
 
 
-def _import_tenant_database(cursor, import_cursor, available_tables: set, tenant_id: int) -> dict:
+# 整库导入每批读取 / executemany 写入的行数
+DB_IMPORT_CHUNK = 2000
+
+
+def _next_table_id(cursor, table: str) -> int:
+    """下一个可用主键：AUTOINCREMENT 表取 max(sqlite_sequence, MAX(id)) + 1。
+
+    在导入事务内（已先执行过 DELETE，持有写锁）调用，预分配的 id 段不会被并发写入占用。
+    """
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS max_id FROM {table}")
+    max_id = cursor.fetchone()['max_id']
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    row = cursor.fetchone()
+    return max(max_id, row['seq'] if row else 0) + 1
+
+
+def _bulk_copy_table(cursor, import_cursor, table: str, target_columns: set, *,
+                     remap: dict, require: dict = None, clean: dict = None,
+                     id_map: dict = None, progress=None) -> int:
+    """把导入库的 table 分块拷进当前库，返回写入行数。
+
+    ``fetchmany(DB_IMPORT_CHUNK)`` 读一块，把整块转成列后逐列做过滤 / id 重映射
+    （``map`` 整列套映射函数，不逐行拼 dict），再 ``executemany`` 写入；内存只有一块行
+    + id 映射表。新行主键按 ``_next_table_id`` 连续预分配（不再逐行取 lastrowid），
+    ``id_map`` 记录旧 id → 新 id 供下游表重映射外键。
+
+    - ``remap``：{列: fn(源值) 或常量}，总是写入；源库缺该列时 fn 收到 None。
+    - ``require``：{源列: 映射表}，源值不在映射表里的行整行跳过（父行没导入）。
+    - ``clean``：{列: fn(源值)}，仅源库有该列时对拷贝值做清洗。
+    """
+    require = require or {}
+    clean = clean or {}
+    # 源行用普通 tuple（不要 sqlite3.Row），转置 / 取列都走 C 实现
+    source = import_cursor.connection.cursor()
+    source.row_factory = None
+    source.execute(f'SELECT * FROM {table}')
+    src_idx = {d[0]: i for i, d in enumerate(source.description)}
+
+    copied = [c for c in src_idx if c in target_columns and c != 'id' and c not in remap]
+    remapped = [c for c in remap if c in target_columns]
+    columns = ['id', *copied, *remapped]
+    sql = f"INSERT INTO {table} ({','.join(columns)}) VALUES ({','.join('?' for _ in columns)})"
+    required = [(src_idx[col], mapping) for col, mapping in require.items() if col in src_idx]
+    if len(required) < len(require):
+        return 0  # 缺外键列：没有一行能挂到已导入的父行上
+    old_id_idx = src_idx.get('id')
+
+    next_id = _next_table_id(cursor, table)
+    written = 0
+    while True:
+        rows = source.fetchmany(DB_IMPORT_CHUNK)
+        if not rows:
+            break
+        fetched = len(rows)
+        for i, mapping in required:
+            rows = [r for r in rows if r[i] in mapping]
+        if rows:
+            n = len(rows)
+            cols = list(zip(*rows))
+            out = []
+            for c in copied:
+                col = cols[src_idx[c]]
+                out.append(list(map(clean[c], col)) if c in clean else col)
+            for c in remapped:
+                fn = remap[c]
+                if not callable(fn):
+                    out.append((fn,) * n)
+                elif c in src_idx:
+                    out.append(list(map(fn, cols[src_idx[c]])))
+                else:
+                    out.append((fn(None),) * n)
+            new_ids = range(next_id, next_id + n)
+            cursor.executemany(sql, zip(new_ids, *out))
+            if id_map is not None and old_id_idx is not None:
+                id_map.update(zip(cols[old_id_idx], new_ids))
+            next_id += n
+            written += n
+        if progress:
+            progress(table, fetched)
+    return written
+
+
+def _clean_import_unit(raw_unit):
+    # 清洗 unit：导出库常把 Excel 公式残渣（=+VLOOKUP(...)）当作单位灌进来。
+    # 公式残渣清成 None 时落到默认单位“个”，避免写入 NULL（unit 在响应模型里是必填 str）；
+    # 原本就为空的保持原样（不臆造数据）。
+    cleaned_unit = _sanitize_import_text(raw_unit)
+    if cleaned_unit is None and raw_unit not in (None, ''):
+        cleaned_unit = '个'
+    return cleaned_unit
+
+
+def _import_tenant_database(cursor, import_cursor, available_tables: set, tenant_id: int, progress=None) -> dict:
+    """把导入库整体灌进 tenant_id（先清空该租户的仓库数据）。
+
+    调用方负责事务：全部写入在同一事务里，失败整体回滚。``progress(table, n)``
+    每读完一块源行回调一次（n = 本块行数）。
+    """
     details = {}
     _clear_database_scope(cursor, tenant_id)
 
@@ -2174,6 +2327,7 @@ def _import_tenant_database(cursor, import_cursor, available_tables: set, tenant
 
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+    # 仓库只有几行，且要逐个校验 slug 冲突：保持逐行插入
     if 'warehouses' in available_tables:
         import_cursor.execute('SELECT * FROM warehouses')
         wh_rows = import_cursor.fetchall()
@@ -2192,140 +2346,206 @@ def _import_tenant_database(cursor, import_cursor, available_tables: set, tenant
         )
         if old_id is not None:
             warehouse_map[old_id] = new_id
+    if progress and wh_rows:
+        progress('warehouses', len(wh_rows))
     if not warehouse_map:
         default_id = _ensure_default_warehouse_for_tenant(cursor, tenant_id)
     else:
         default_id = next(iter(warehouse_map.values()))
 
-    if 'contacts' in available_tables:
-        import_cursor.execute('SELECT * FROM contacts')
-        rows = import_cursor.fetchall()
-    else:
-        rows = []
-    for row in rows:
-        old_id = row['id'] if 'id' in row.keys() else None
-        old_wh = row['warehouse_id'] if 'warehouse_id' in row.keys() else None
-        new_id = _insert_row_with_overrides(
-            cursor, 'contacts', row, target_columns['contacts'],
-            {'tenant_id': tenant_id, 'warehouse_id': warehouse_map.get(old_wh, default_id)},
-            {'id'}
-        )
-        if old_id is not None:
-            contact_map[old_id] = new_id
-    details['contacts'] = len(rows)
+    def _warehouse(old_wh):
+        return warehouse_map.get(old_wh, default_id)
+
+    def _contact(old_contact):
+        return contact_map.get(old_contact) if old_contact else None
+
+    def _batch(old_batch):
+        return batch_map.get(old_batch) if old_batch else None
+
+    def _copy(table, **kwargs):
+        if table not in available_tables:
+            return 0
+        return _bulk_copy_table(cursor, import_cursor, table, target_columns[table],
+                                progress=progress, **kwargs)
+
+    details['contacts'] = _copy(
+        'contacts', remap={'tenant_id': tenant_id, 'warehouse_id': _warehouse}, id_map=contact_map)
+    details['materials'] = _copy(
+        'materials', remap={'tenant_id': tenant_id, 'warehouse_id': _warehouse},
+        clean={'unit': _clean_import_unit}, id_map=material_map)
+    details['batches'] = _copy(
+        'batches',
+        remap={'tenant_id': tenant_id, 'warehouse_id': _warehouse,
+               'material_id': material_map.get, 'contact_id': _contact},
+        require={'material_id': material_map}, id_map=batch_map)
+    details['inventory_records'] = _copy(
+        'inventory_records',
+        remap={'tenant_id': tenant_id, 'warehouse_id': _warehouse,
+               'material_id': material_map.get, 'contact_id': _contact, 'batch_id': _batch},
+        require={'material_id': material_map}, id_map=record_map)
+    details['batch_consumptions'] = _copy(
+        'batch_consumptions',
+        remap={'record_id': record_map.get, 'batch_id': batch_map.get,
+               'tenant_id': tenant_id, 'warehouse_id': _warehouse},
+        require={'record_id': record_map, 'batch_id': batch_map})
+    # 记录是原样搬进来的，没走写路径：该租户的日汇总重算（上面清库时已清空）
+    cursor.execute(daily_stats.BACKFILL_TENANT_SQL, {'tenant_id': tenant_id})
+    details['warehouses'] = len(warehouse_map) if warehouse_map else 1
+    return details
 
-    if 'materials' in available_tables:
-        import_cursor.execute('SELECT * FROM materials')
-        rows = import_cursor.fetchall()
-    else:
-        rows = []
-    for row in rows:
-        old_id = row['id'] if 'id' in row.keys() else None
-        old_wh = row['warehouse_id'] if 'warehouse_id' in row.keys() else None
-        mat_overrides = {'tenant_id': tenant_id, 'warehouse_id': warehouse_map.get(old_wh, default_id)}
-        # 清洗 unit：导出库常把 Excel 公式残渣（=+VLOOKUP(...)）当作单位灌进来。
-        # 公式残渣清成 None 时落到默认单位“个”，避免写入 NULL（unit 在响应模型里是必填 str）；
-        # 原本就为空的保持原样（不臆造数据）。
-        if 'unit' in row.keys():
-            raw_unit = row['unit']
-            cleaned_unit = _sanitize_import_text(raw_unit)
-            if cleaned_unit is None and raw_unit not in (None, ''):
-                cleaned_unit = '个'
-            mat_overrides['unit'] = cleaned_unit
-        new_id = _insert_row_with_overrides(
-            cursor, 'materials', row, target_columns['materials'],
-            mat_overrides,
-            {'id'}
-        )
-        if old_id is not None:
-            material_map[old_id] = new_id
-    details['materials'] = len(rows)
 
-    if 'batches' in available_tables:
-        import_cursor.execute('SELECT * FROM batches')
-        rows = import_cursor.fetchall()
-    else:
-        rows = []
-    for row in rows:
-        old_id = row['id'] if 'id' in row.keys() else None
-        old_mat = row['material_id'] if 'material_id' in row.keys() else None
-        if old_mat not in material_map:
-            continue
-        old_contact = row['contact_id'] if 'contact_id' in row.keys() else None
-        old_wh = row['warehouse_id'] if 'warehouse_id' in row.keys() else None
-        new_id = _insert_row_with_overrides(
-            cursor, 'batches', row, target_columns['batches'],
-            {
-                'tenant_id': tenant_id,
-                'warehouse_id': warehouse_map.get(old_wh, default_id),
-                'material_id': material_map[old_mat],
-                'contact_id': contact_map.get(old_contact) if old_contact else None,
-            },
-            {'id'}
-        )
-        if old_id is not None:
-            batch_map[old_id] = new_id
-    details['batches'] = len(batch_map)
+def _count_import_rows(import_cursor, available_tables: set) -> int:
+    """导入库里待处理的源行总数（进度分母）。"""
+    total = 0
+    for table in WAREHOUSE_TABLES:
+        if table in available_tables:
+            import_cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            total += import_cursor.fetchone()[0]
+    return total
 
-    if 'inventory_records' in available_tables:
-        import_cursor.execute('SELECT * FROM inventory_records')
-        rows = import_cursor.fetchall()
-    else:
-        rows = []
-    for row in rows:
-        old_id = row['id'] if 'id' in row.keys() else None
-        old_mat = row['material_id'] if 'material_id' in row.keys() else None
-        if old_mat not in material_map:
-            continue
-        old_contact = row['contact_id'] if 'contact_id' in row.keys() else None
-        old_batch = row['batch_id'] if 'batch_id' in row.keys() else None
-        old_wh = row['warehouse_id'] if 'warehouse_id' in row.keys() else None
-        new_id = _insert_row_with_overrides(
-            cursor, 'inventory_records', row, target_columns['inventory_records'],
-            {
-                'tenant_id': tenant_id,
-                'warehouse_id': warehouse_map.get(old_wh, default_id),
-                'material_id': material_map[old_mat],
-                'contact_id': contact_map.get(old_contact) if old_contact else None,
-                'batch_id': batch_map.get(old_batch) if old_batch else None,
-            },
-            {'id'}
-        )
-        if old_id is not None:
-            record_map[old_id] = new_id
-    details['inventory_records'] = len(record_map)
 
-    if 'batch_consumptions' in available_tables:
-        import_cursor.execute('SELECT * FROM batch_consumptions')
-        rows = import_cursor.fetchall()
-    else:
-        rows = []
-    imported_consumptions = 0
-    for row in rows:
-        old_record = row['record_id'] if 'record_id' in row.keys() else None
-        old_batch = row['batch_id'] if 'batch_id' in row.keys() else None
-        if old_record not in record_map or old_batch not in batch_map:
-            continue
-        old_wh = row['warehouse_id'] if 'warehouse_id' in row.keys() else None
-        _insert_row_with_overrides(
-            cursor, 'batch_consumptions', row, target_columns['batch_consumptions'],
-            {
-                'record_id': record_map[old_record],
-                'batch_id': batch_map[old_batch],
-                'tenant_id': tenant_id,
-                'warehouse_id': warehouse_map.get(old_wh, default_id) if old_wh is not None else default_id,
-            },
-            {'id'}
-        )
-        imported_consumptions += 1
-    details['batch_consumptions'] = imported_consumptions
-    details['warehouses'] = len(warehouse_map) if warehouse_map else 1
-    return details
+# 导出文件的可选压缩格式：格式 → (文件名后缀, media type)
+DB_EXPORT_COMPRESSIONS = {
+    'gzip': ('.gz', 'application/gzip'),
+    'zstd': ('.zst', 'application/zstd'),
+}
+DB_EXPORT_STREAM_CHUNK = 1024 * 1024
+
+
+def _db_stream_compressor(compression: Optional[str]):
+    """返回 (compress, flush)；不压缩返回 None。zstd 依赖可选包 zstandard。"""
+    if compression is None:
+        return None
+    if compression == 'gzip':
+        zobj = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → gzip 封装
+        return zobj.compress, zobj.flush
+    try:
+        import zstandard
+    except ImportError:
+        raise HTTPException(status_code=400, detail="服务器未安装 zstandard，无法导出 zstd 格式（可改用 gzip）")
+    zobj = zstandard.ZstdCompressor(level=3).compressobj()
+    return zobj.compress, zobj.flush
+
+
+def _stream_and_remove(path: str, compressor=None):
+    """分块读出临时文件（可边读边压缩），读完或客户端断开后删除文件。"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(DB_EXPORT_STREAM_CHUNK)
+                if not chunk:
+                    break
+                if compressor is not None:
+                    chunk = compressor[0](chunk)
+                    if not chunk:
+                        continue
+                yield chunk
+        if compressor is not None:
+            tail = compressor[1]()
+            if tail:
+                yield tail
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def _build_db_export(export_tenant_id: int, progress=None) -> str:
+    """按租户范围把仓库表拷进一个新的临时 SQLite 文件，返回路径（调用方负责删除）。
+
+    按块 ``fetchmany`` + ``executemany`` 构建，内存占用与租户数据量无关；
+    ``progress(n)`` 每写完一块回调一次。
+    """
+    import tempfile
+
+    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
+    os.close(temp_fd)
+
+    try:
+        # 创建新的临时数据库：一次性文件，不需要日志与 fsync
+        temp_conn = sqlite3.connect(temp_path)
+        temp_conn.execute('PRAGMA journal_mode=OFF')
+        temp_conn.execute('PRAGMA synchronous=OFF')
+        temp_cursor = temp_conn.cursor()
+
+        with get_db() as source_conn:
+            source_cursor = source_conn.cursor()
+
+            for table in WAREHOUSE_TABLES:
+                # 获取表结构
+                source_cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+                result = source_cursor.fetchone()
+                if result and result['sql']:
+                    # 创建表
+                    temp_cursor.execute(result['sql'])
+
+                    rows_cursor = _export_rows_for_scope(source_cursor, table, export_tenant_id)
+                    columns = [desc[0] for desc in rows_cursor.description]
+                    placeholders = ','.join(['?' for _ in columns])
+                    insert_sql = f"INSERT INTO {table} ({','.join(columns)}) VALUES ({placeholders})"
+                    while True:
+                        rows = rows_cursor.fetchmany(EXPORT_FETCH_SIZE)
+                        if not rows:
+                            break
+                        temp_cursor.executemany(insert_sql, (tuple(row) for row in rows))
+                        if progress:
+                            progress(len(rows))
+
+        temp_conn.commit()
+        temp_conn.close()
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return temp_path
+
+
+def _db_export_filename(compression: Optional[str]):
+    """(下载文件名, media type)"""
+    filename = f"warehouse_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    if compression is None:
+        return filename, "application/octet-stream"
+    suffix, media_type = DB_EXPORT_COMPRESSIONS[compression]
+    return filename + suffix, media_type
+
+
+def _database_export_job(ctx, export_tenant_id: int, compression: Optional[str], username: str) -> dict:
+    """后台整库导出（任务类型 db_export）：文件落盘作为任务产物，
+    ``GET /api/jobs/{id}/download`` 下载。"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        ctx.progress(0, sum(_count_rows_for_scope(cursor, t, export_tenant_id) for t in WAREHOUSE_TABLES))
+
+    def _progress(n):
+        ctx.advance(n)
+        ctx.check_cancelled()
+
+    path = _build_db_export(export_tenant_id, progress=_progress)
+    filename, media_type = _db_export_filename(compression)
+    if compression is not None:
+        compressed = path + DB_EXPORT_COMPRESSIONS[compression][0]
+        try:
+            with open(compressed, 'wb') as out:
+                for chunk in _stream_and_remove(path, _db_stream_compressor(compression)):
+                    out.write(chunk)
+        except BaseException:
+            if os.path.exists(compressed):
+                os.unlink(compressed)
+            raise
+        path = compressed
+    ctx.set_artifact(path, filename, media_type)
+    if ENABLE_AUDIT_LOG:
+        logger.info(f"[AUDIT] 用户 {username} 导出了数据库（后台任务 {ctx.job_id}）")
+    return {'filename': filename, 'size': os.path.getsize(path)}
+
+
+jobs.register_job_type('db_export', limit=2)
 
 
 @app.get("/api/database/export")
 def export_database(
     target_tenant_id: Optional[int] = None,
+    compression: Optional[str] = None,
+    background: bool = False,
     current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.ADMIN))
 ):
     """导出仓库数据为SQLite数据库文件（仅管理员）
@@ -2333,20 +2553,30 @@ def export_database(
     只导出仓库相关表：materials, inventory_records, batches, batch_consumptions, contacts
     不导出用户相关表：users, sessions, api_keys
 
+    ``compression``：可选 ``gzip`` / ``zstd``（后者需安装 zstandard），导入接口
+    按文件头自动识别解压。
+
+    临时库按块 ``fetchmany`` + ``executemany`` 构建，响应直接从磁盘分块读出，
+    内存占用与租户数据量无关。``background=true`` 时返回 202 + 后台任务，
+    完成后从 ``/api/jobs/{id}/download`` 下载。
+
     NOTE: This endpoint is sqlite-only by design — it streams a literal
     ``.db`` file built from ``sqlite_master`` DDL. On non-sqlite deployments
     (e.g. MySQL) it returns 400.
     """
-    import tempfile
-    import sqlite3
-    import shutil
-
     if get_engine().dialect.name != 'sqlite':
         raise HTTPException(
             status_code=400,
             detail="DB export is only available on the sqlite-backed deployment",
         )
 
+    if compression is not None and compression not in DB_EXPORT_COMPRESSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的压缩格式 {compression!r}，可选：{', '.join(DB_EXPORT_COMPRESSIONS)}",
+        )
+    compressor = _db_stream_compressor(compression)
+
     if current_user.tenant_id is None:
         if target_tenant_id is None:
             raise HTTPException(status_code=400, detail="全局管理员导出时必须通过 ?target_tenant_id= 指定目标租户")
@@ -2354,89 +2584,83 @@ def export_database(
     else:
         export_tenant_id = current_user.tenant_id
 
-    # 获取当前数据库路径 — 与 database.py / db.py / alembic env.py 保持一致，
-    # 默认锚定到项目根，避免 CWD 不同造成"两个 db" 的踩坑。
-    _default_db = os.path.join(
-        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-        'warehouse.db',
-    )
-    db_path = os.environ.get('DATABASE_PATH', _default_db)
-
-    # 创建临时文件
-    temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
-    os.close(temp_fd)
+    if background:
+        return jobs.submit_job_response(
+            'db_export', _database_export_job, export_tenant_id, compression,
+            current_user.username or 'unknown', tenant_id=export_tenant_id, user=current_user,
+        )
 
-    try:
-        # 创建新的临时数据库
-        temp_conn = sqlite3.connect(temp_path)
-        temp_cursor = temp_conn.cursor()
+    temp_path = _build_db_export(export_tenant_id)
 
-        with get_db() as source_conn:
-            source_cursor = source_conn.cursor()
+    filename, media_type = _db_export_filename(compression)
+    headers = {}
+    if compression is None:
+        headers["Content-Length"] = str(os.path.getsize(temp_path))
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
 
-            for table in WAREHOUSE_TABLES:
-                # 获取表结构
-                source_cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
-                result = source_cursor.fetchone()
-                if result and result['sql']:
-                    # 创建表
-                    temp_cursor.execute(result['sql'])
+    if ENABLE_AUDIT_LOG:
+        logger.info(f"[AUDIT] 用户 {current_user.username or 'unknown'} 导出了数据库")
 
-                    rows = _export_rows_for_scope(source_cursor, table, export_tenant_id)
-                    if rows:
-                        columns = [desc[0] for desc in source_cursor.description]
-                        placeholders = ','.join(['?' for _ in columns])
-                        insert_sql = f"INSERT INTO {table} ({','.join(columns)}) VALUES ({placeholders})"
-                        for row in rows:
-                            temp_cursor.execute(insert_sql, tuple(row[col] for col in columns))
+    # 临时文件由生成器在读完（或客户端断开、生成器被关闭）时删除
+    return StreamingResponse(
+        _stream_and_remove(temp_path, compressor),
+        media_type=media_type,
+        headers=headers,
+    )
 
-        temp_conn.commit()
-        temp_conn.close()
 
-        # 读取临时文件内容
-        with open(temp_path, 'rb') as f:
-            db_content = f.read()
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
 
-        # 创建 BytesIO 对象用于流式响应
-        output = BytesIO(db_content)
-        output.seek(0)
 
-        filename = f"warehouse_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+def _write_db_upload(out, contents: bytes) -> None:
+    """把上传内容写入 out；压缩格式边解压边写，解压后超过 MAX_IMPORT_UNZIPPED_MB 报 400。"""
+    if contents.startswith(_GZIP_MAGIC):
+        import gzip
+        reader = gzip.GzipFile(fileobj=BytesIO(contents))
+        corrupt = (OSError, EOFError, zlib.error)
+    elif contents.startswith(_ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=400, detail="服务器未安装 zstandard，无法导入 zstd 格式")
+        reader = zstandard.ZstdDecompressor().stream_reader(BytesIO(contents))
+        corrupt = (zstandard.ZstdError,)
+    else:
+        out.write(contents)
+        return
 
-        if ENABLE_AUDIT_LOG:
-            logger.info(f"[AUDIT] 用户 {current_user.username or 'unknown'} 导出了数据库")
+    # 按块读出，压缩炸弹在越过上限的那一块就停下，不会先整体解压进内存
+    limit = MAX_IMPORT_UNZIPPED_MB * 1024 * 1024
+    written = 0
+    try:
+        while True:
+            data = reader.read(DB_EXPORT_STREAM_CHUNK)
+            if not data:
+                break
+            written += len(data)
+            if written > limit:
+                raise HTTPException(status_code=400, detail=f"解压后超过 {MAX_IMPORT_UNZIPPED_MB}MB 上限")
+            out.write(data)
+    except corrupt as e:
+        raise HTTPException(status_code=400, detail=f"压缩文件损坏: {e}")
 
-        return StreamingResponse(
-            output,
-            media_type="application/octet-stream",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-    finally:
-        # 清理临时文件
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
 
+def _resolve_import_tenant(current_user: CurrentUser, target_tenant_id: Optional[int]) -> int:
+    if current_user.tenant_id is not None:
+        return current_user.tenant_id
+    # 全局 admin 必须显式指定目标租户，防止意外覆盖所有租户数据
+    if target_tenant_id is None:
+        raise HTTPException(status_code=400, detail="全局管理员导入时必须通过 ?target_tenant_id= 指定目标租户")
+    return target_tenant_id
 
-@app.post("/api/database/import", response_model=DatabaseOperationResponse)
-@limiter.limit("5/minute")
-async def import_database(
-    request: Request,
-    file: UploadFile = File(...),
-    target_tenant_id: Optional[int] = None,
-    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.ADMIN))
-):
-    """导入仓库数据（仅管理员）
 
-    从上传的SQLite数据库文件中导入仓库相关表的数据。
-    会清空现有仓库数据后再导入。
-    不影响用户相关表：users, sessions, api_keys
+async def _stage_db_upload(file: UploadFile):
+    """读取上传的 .db（可压缩）落到临时文件并校验，返回 (临时文件路径, 源库表名集合)。
 
-    NOTE: This endpoint is sqlite-only by design — it operates on a literal
-    ``.db`` upload using ``sqlite_master``. On non-sqlite deployments it
-    returns 400.
+    校验失败时删掉临时文件再抛 400；成功时由调用方负责删除。
     """
     import tempfile
-    import sqlite3
 
     if get_engine().dialect.name != 'sqlite':
         raise HTTPException(
@@ -2452,77 +2676,146 @@ async def import_database(
     if file_size_mb > MAX_UPLOAD_SIZE_MB:
         raise HTTPException(status_code=400, detail=f"文件过大，最大允许 {MAX_UPLOAD_SIZE_MB}MB")
 
-    # 保存到临时文件
+    # 保存到临时文件（gzip / zstd 压缩的导出文件按文件头识别并解压）
     temp_fd, temp_path = tempfile.mkstemp(suffix='.db')
     try:
-        os.write(temp_fd, contents)
-        os.close(temp_fd)
+        with os.fdopen(temp_fd, 'wb') as temp_file:
+            _write_db_upload(temp_file, contents)
+        del contents
 
         # 验证是否为有效的SQLite数据库
         try:
             import_conn = sqlite3.connect(temp_path)
-            import_conn.row_factory = sqlite3.Row
-            import_cursor = import_conn.cursor()
-
-            # 检查必要的表是否存在
-            import_cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            available_tables = {row[0] for row in import_cursor.fetchall()}
-
-            # 至少需要 materials 表
-            if 'materials' not in available_tables:
-                raise HTTPException(status_code=400, detail="无效的数据库文件：缺少 materials 表")
-
+            try:
+                # 检查必要的表是否存在
+                available_tables = {
+                    row[0] for row in import_conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                }
+            finally:
+                import_conn.close()
         except sqlite3.DatabaseError:
             raise HTTPException(status_code=400, detail="无效的数据库文件格式")
 
-        # 开始导入
-        details = {}
+        # 至少需要 materials 表
+        if 'materials' not in available_tables:
+            raise HTTPException(status_code=400, detail="无效的数据库文件：缺少 materials 表")
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, available_tables
+
 
+def _run_database_import(temp_path: str, available_tables: set, tenant_id: int, progress=None) -> dict:
+    """在一个事务里把临时文件导入 tenant_id，成功后让模糊匹配索引失效。失败整体回滚并抛出。"""
+    import_conn = sqlite3.connect(temp_path)
+    import_conn.row_factory = sqlite3.Row
+    try:
+        import_cursor = import_conn.cursor()
         with get_db() as conn:
             cursor = conn.cursor()
-
             try:
-                if current_user.tenant_id is not None:
-                    details = _import_tenant_database(cursor, import_cursor, available_tables, current_user.tenant_id)
-                else:
-                    # 全局 admin 必须显式指定目标租户，防止意外覆盖所有租户数据
-                    if target_tenant_id is None:
-                        raise HTTPException(status_code=400, detail="全局管理员导入时必须通过 ?target_tenant_id= 指定目标租户")
-                    details = _import_tenant_database(cursor, import_cursor, available_tables, target_tenant_id)
-
+                details = _import_tenant_database(
+                    cursor, import_cursor, available_tables, tenant_id, progress=progress)
                 conn.commit()
-
-            except Exception as e:
+            except Exception:
                 conn.rollback()
-                import traceback
-                logger.error(f"[ERROR] 数据库导入失败: {str(e)}")
-                logger.error(traceback.format_exc())
-                raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
-
+                raise
+    finally:
         import_conn.close()
 
-        # 整库导入写入了 materials/contacts/batches，必须让模糊匹配的常驻内存索引
-        # 失效，否则导入后的物料/联系方在 fuzzy=true 搜索（含智能体语音查询）里查不到，
-        # 直到进程重启才重建索引。与 Excel 导入路径（confirm_import_excel）保持一致。
-        get_fuzzy_matcher().invalidate_cache(entity_type="material")
-        get_fuzzy_matcher().invalidate_cache(entity_type="contact")
+    # 整库导入写入了 materials/contacts/batches，必须让模糊匹配的常驻内存索引
+    # 失效，否则导入后的物料/联系方在 fuzzy=true 搜索（含智能体语音查询）里查不到，
+    # 直到进程重启才重建索引。与 Excel 导入路径（confirm_import_excel）保持一致。
+    get_fuzzy_matcher().invalidate_cache(entity_type="material")
+    get_fuzzy_matcher().invalidate_cache(entity_type="contact")
+    return details
+
+
+def _database_import_message(details: dict) -> str:
+    wh_count = details.get('warehouses', 0)
+    wh_info = f"，{wh_count} 仓库" if wh_count else ""
+    return f"导入成功：{details.get('materials', 0)} 物料，{details.get('inventory_records', 0)} 记录，{details.get('batches', 0)} 批次，{details.get('contacts', 0)} 联系方{wh_info}"
+
+
+def _database_import_job(ctx, temp_path: str, available_tables: set, tenant_id: int,
+                         username: str) -> DatabaseOperationResponse:
+    """后台整库导入（任务类型 db_import）：进度按源行数汇报，每块检查取消（整单回滚）。"""
+    try:
+        import_conn = sqlite3.connect(temp_path)
+        try:
+            ctx.progress(0, _count_import_rows(import_conn.cursor(), available_tables))
+        finally:
+            import_conn.close()
+
+        def _progress(table, n):
+            ctx.advance(n, message=table)
+            ctx.check_cancelled()
+
+        details = _run_database_import(temp_path, available_tables, tenant_id, progress=_progress)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+    if ENABLE_AUDIT_LOG:
+        logger.info(f"[AUDIT] 用户 {username} 导入了数据库（后台任务 {ctx.job_id}）")
+    return DatabaseOperationResponse(success=True, message=_database_import_message(details), details=details)
+
+
+jobs.register_job_type('db_import', limit=1)
+
+
+@app.post("/api/database/import", response_model=DatabaseOperationResponse)
+@limiter.limit("5/minute")
+async def import_database(
+    request: Request,
+    file: UploadFile = File(...),
+    target_tenant_id: Optional[int] = None,
+    background: bool = False,
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.ADMIN))
+):
+    """导入仓库数据（仅管理员）
+
+    从上传的SQLite数据库文件中导入仓库相关表的数据。
+    会清空现有仓库数据后再导入。
+    不影响用户相关表：users, sessions, api_keys
+
+    ``background=true``：校验上传文件后立即返回 202 + 后台任务（``/api/jobs/{id}``
+    轮询进度 / 取消）；同一目标租户同时只能有一个导入任务（409）。
+
+    NOTE: This endpoint is sqlite-only by design — it operates on a literal
+    ``.db`` upload using ``sqlite_master``. On non-sqlite deployments it
+    returns 400.
+    """
+    temp_path, available_tables = await _stage_db_upload(file)
+    try:
+        tenant_id = _resolve_import_tenant(current_user, target_tenant_id)
+        if background:
+            resp = jobs.submit_job_response(
+                'db_import', _database_import_job, temp_path, available_tables, tenant_id,
+                current_user.username or 'unknown',
+                tenant_id=tenant_id, user=current_user, dedupe_key=f'tenant:{tenant_id}',
+            )
+            temp_path = None  # 临时文件交给任务清理
+            return resp
+        try:
+            details = await asyncio.to_thread(_run_database_import, temp_path, available_tables, tenant_id)
+        except Exception as e:
+            import traceback
+            logger.error(f"[ERROR] 数据库导入失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=f"导入失败: {str(e)}")
 
         if ENABLE_AUDIT_LOG:
             logger.info(f"[AUDIT] 用户 {current_user.username or 'unknown'} 导入了数据库")
 
-        wh_count = details.get('warehouses', 0)
-        wh_info = f"，{wh_count} 仓库" if wh_count else ""
-        message = f"导入成功：{details.get('materials', 0)} 物料，{details.get('inventory_records', 0)} 记录，{details.get('batches', 0)} 批次，{details.get('contacts', 0)} 联系方{wh_info}"
-
         return DatabaseOperationResponse(
             success=True,
-            message=message,
+            message=_database_import_message(details),
             details=details
         )
 
     finally:
         # 清理临时文件
-        if os.path.exists(temp_path):
+        if temp_path is not None and os.path.exists(temp_path):
             os.unlink(temp_path)
 
 
@@ -2865,10 +3158,12 @@ def get_dashboard_stats(
     wh_id = resolve_warehouse_id(current_user, warehouse_id)
     m_scope = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
     r_scope = list(build_authorized_scope_predicates(_t_inventory_records, current_user, wh_id))
+    s_scope = list(build_authorized_scope_predicates(_t_daily_stats, current_user, wh_id))
 
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_start_s = today_start.strftime('%Y-%m-%d %H:%M:%S')
-    yesterday_start_s = (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S')
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    today_start_s = f'{today} 00:00:00'
 
     # 单一真相源：active batches 聚合
     batch_sum = (
@@ -2890,27 +3185,26 @@ def get_dashboard_stats(
             .where(and_(_t_materials.c.is_disabled == 0, *m_scope))
         ).scalar() or 0
 
-        # 今日入库量
+        # 今日 / 昨日入出库量：读日汇总（O(天数 × 仓库数)，与记录总量无关）
+        daily = daily_stats.totals(sa_conn, s_scope, yesterday, today)
+        today_in = daily.get((today, RecordType.IN.value), 0)
+        today_out = daily.get((today, RecordType.OUT.value), 0)
+        # 今日量不计禁用物料：只扣禁用物料今天的记录（走 idx_records_material_created）
         j = _t_inventory_records.join(_t_materials, _t_inventory_records.c.material_id == _t_materials.c.id)
-        today_in = sa_conn.execute(
-            select(_sa_func.sum(_t_inventory_records.c.quantity)).select_from(j)
-            .where(and_(
-                _t_inventory_records.c.type == RecordType.IN.value,
-                _t_inventory_records.c.created_at >= today_start_s,
-                _t_materials.c.is_disabled == 0,
-                *r_scope,
-            ))
-        ).scalar() or 0
-
-        today_out = sa_conn.execute(
-            select(_sa_func.sum(_t_inventory_records.c.quantity)).select_from(j)
+        for rtype, qty in sa_conn.execute(
+            select(_t_inventory_records.c.type, _sa_func.sum(_t_inventory_records.c.quantity))
+            .select_from(j)
             .where(and_(
-                _t_inventory_records.c.type == RecordType.OUT.value,
+                _t_materials.c.is_disabled != 0,
                 _t_inventory_records.c.created_at >= today_start_s,
-                _t_materials.c.is_disabled == 0,
                 *r_scope,
             ))
-        ).scalar() or 0
+            .group_by(_t_inventory_records.c.type)
+        ).all():
+            if rtype == RecordType.IN.value:
+                today_in -= qty or 0
+            elif rtype == RecordType.OUT.value:
+                today_out -= qty or 0
 
         # 库存预警 — 比较 active batches sum 与 safe_stock
         j_low = _t_materials.outerjoin(batch_sum, batch_sum.c.material_id == _t_materials.c.id)
@@ -2930,26 +3224,9 @@ def get_dashboard_stats(
             .where(and_(_t_materials.c.is_disabled == 0, *m_scope))
         ).scalar() or 0
 
-        # 昨日入库
-        yesterday_in = sa_conn.execute(
-            select(_sa_func.sum(_t_inventory_records.c.quantity))
-            .where(and_(
-                _t_inventory_records.c.type == RecordType.IN.value,
-                _t_inventory_records.c.created_at >= yesterday_start_s,
-                _t_inventory_records.c.created_at < today_start_s,
-                *r_scope,
-            ))
-        ).scalar() or 1
-
-        yesterday_out = sa_conn.execute(
-            select(_sa_func.sum(_t_inventory_records.c.quantity))
-            .where(and_(
-                _t_inventory_records.c.type == RecordType.OUT.value,
-                _t_inventory_records.c.created_at >= yesterday_start_s,
-                _t_inventory_records.c.created_at < today_start_s,
-                *r_scope,
-            ))
-        ).scalar() or 1
+        # 昨日量含禁用物料；为 0 时按 1 计（避免除零，沿用旧口径）
+        yesterday_in = daily.get((yesterday, RecordType.IN.value), 0) or 1
+        yesterday_out = daily.get((yesterday, RecordType.OUT.value), 0) or 1
 
         in_change = round(((today_in - yesterday_in) / yesterday_in * 100), 1) if yesterday_in > 0 else 0
         out_change = round(((today_out - yesterday_out) / yesterday_out * 100), 1) if yesterday_out > 0 else 0
@@ -3005,41 +3282,16 @@ def get_weekly_trend(
 ):
     """获取近7天出入库趋势 — Phase 2e: SA Core read."""
     wh_id = resolve_warehouse_id(current_user, warehouse_id)
-    scope_preds = list(build_authorized_scope_predicates(_t_inventory_records, current_user, wh_id))
+    scope_preds = list(build_authorized_scope_predicates(_t_daily_stats, current_user, wh_id))
 
-    dates = []
-    in_data = []
-    out_data = []
+    days = [datetime.now() - timedelta(days=i) for i in range(6, -1, -1)]
+    keys = [d.strftime('%Y-%m-%d') for d in days]
     with get_engine().connect() as sa_conn:
-        for i in range(6, -1, -1):
-            date = datetime.now() - timedelta(days=i)
-            date_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-            date_end = date_start + timedelta(days=1)
-            ds = date_start.strftime('%Y-%m-%d %H:%M:%S')
-            de = date_end.strftime('%Y-%m-%d %H:%M:%S')
-
-            dates.append(date.strftime('%m-%d'))
-
-            in_preds = [
-                _t_inventory_records.c.type == RecordType.IN.value,
-                _t_inventory_records.c.created_at >= ds,
-                _t_inventory_records.c.created_at < de,
-            ] + scope_preds
-            in_total = sa_conn.execute(
-                select(_sa_func.sum(_t_inventory_records.c.quantity)).where(and_(*in_preds))
-            ).scalar() or 0
-            in_data.append(in_total)
-
-            out_preds = [
-                _t_inventory_records.c.type == RecordType.OUT.value,
-                _t_inventory_records.c.created_at >= ds,
-                _t_inventory_records.c.created_at < de,
-            ] + scope_preds
-            out_total = sa_conn.execute(
-                select(_sa_func.sum(_t_inventory_records.c.quantity)).where(and_(*out_preds))
-            ).scalar() or 0
-            out_data.append(out_total)
+        daily = daily_stats.totals(sa_conn, scope_preds, keys[0], keys[-1])
 
+    dates = [d.strftime('%m-%d') for d in days]
+    in_data = [daily.get((k, RecordType.IN.value), 0) for k in keys]
+    out_data = [daily.get((k, RecordType.OUT.value), 0) for k in keys]
     return WeeklyTrend(dates=dates, in_data=in_data, out_data=out_data)
 
 
@@ -3143,11 +3395,18 @@ def fuzzy_match_endpoint(
     # 仓库授权必须与 SQL 侧一致：否则本端点匹配得到的 entity_id，拿去
     # /api/materials/product-stats 回查会 404（两个端点结论相反）。
     wh_ids = resolve_authorized_warehouse_ids(current_user, wh_id)
+    return _fuzzy_match_response(q, entity_type, top_k, threshold,
+                                 tenant_id=current_user.tenant_id, warehouse_ids=wh_ids)
+
+
+def _fuzzy_match_response(q: str, entity_type: str, top_k: int, threshold: float,
+                          *, tenant_id, warehouse_ids) -> FuzzyMatchResponse:
+    """/api/fuzzy-match 的响应体（/api/materials/stock-lookup 复用）。"""
     matcher = get_fuzzy_matcher()
     result = matcher.resolve(q, entity_type=entity_type,
-                             tenant_id=current_user.tenant_id, warehouse_ids=wh_ids)
+                             tenant_id=tenant_id, warehouse_ids=warehouse_ids)
     candidates_raw = matcher.search(q, entity_type=entity_type, top_k=top_k, threshold=threshold,
-                                    tenant_id=current_user.tenant_id, warehouse_ids=wh_ids)
+                                    tenant_id=tenant_id, warehouse_ids=warehouse_ids)
 
     candidates = [FuzzyMatchCandidate(**c) for c in candidates_raw]
     best_match = FuzzyMatchCandidate(**result['best_match']) if result['best_match'] else None
@@ -3795,78 +4054,86 @@ def get_product_stats(
     wh_id = resolve_warehouse_id(current_user, warehouse_id)
     m_scope = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
 
-    today = datetime.now().strftime('%Y-%m-%d')
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-
     if material_id is not None:
         ident_pred = _t_materials.c.id == material_id
     else:
         ident_pred = or_(_t_materials.c.name == name, _t_materials.c.sku == name)
 
     with get_engine().connect() as sa_conn:
-        # 查询产品基本信息（支持 material_id 或 name/SKU）
-        m_stmt = select(
-            _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
-            # 注：保留 quantity 列只为兼容（过渡期 cache），库存以下方 batches 聚合为准
-            _t_materials.c.quantity, _t_materials.c.unit,
-            _t_materials.c.safe_stock, _t_materials.c.location,
-        ).where(and_(
-            ident_pred,
-            *m_scope,
-        ))
-        product = sa_conn.execute(m_stmt).fetchone()
-        if not product:
-            raise HTTPException(status_code=404, detail="产品不存在")
+        stats = _fetch_product_stats(sa_conn, ident_pred, m_scope)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="产品不存在")
+    return stats
 
-        material_id = product.id
-        # 单一真相源：从 active batches 聚合得到当前库存（不读 materials.quantity）。
-        # 这是 watcher 的入口，必须与 /api/materials/list 在有批次时的聚合行为一致。
-        current_stock = int(sa_conn.execute(
-            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-            .where(and_(
-                _t_batches.c.material_id == material_id,
-                _t_batches.c.is_exhausted == 0,
-            ))
-        ).scalar() or 0)
-        unit = product.unit
-        safe_stock = product.safe_stock
 
-        def _sum_records(rtype: str, date_str: Optional[str] = None) -> int:
-            preds = [
-                _t_inventory_records.c.material_id == material_id,
-                _t_inventory_records.c.type == rtype,
-            ]
-            if date_str is not None:
-                preds.append(_sa_func.date(_t_inventory_records.c.created_at) == date_str)
-            return sa_conn.execute(
-                select(_sa_func.coalesce(_sa_func.sum(_t_inventory_records.c.quantity), 0))
-                .where(and_(*preds))
-            ).scalar() or 0
+def _fetch_product_stats(sa_conn, ident_pred, m_scope) -> Optional[ProductStats]:
+    """按 ``ident_pred`` 取单个物料的库存与出入库统计；查不到返回 None。"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
 
-        today_in = _sum_records(RecordType.IN.value, today)
-        yesterday_in = _sum_records(RecordType.IN.value, yesterday)
-        today_out = _sum_records(RecordType.OUT.value, today)
-        yesterday_out = _sum_records(RecordType.OUT.value, yesterday)
-        total_in = _sum_records(RecordType.IN.value)
-        total_out = _sum_records(RecordType.OUT.value)
-
-        in_change = ((today_in - yesterday_in) / yesterday_in * 100) if yesterday_in > 0 else 0
-        out_change = ((today_out - yesterday_out) / yesterday_out * 100) if yesterday_out > 0 else 0
-
-        return ProductStats(
-            name=product.name,
-            sku=product.sku or "",
-            current_stock=current_stock,
-            unit=unit,
-            safe_stock=safe_stock,
-            location=product.location or "",
-            today_in=today_in,
-            today_out=today_out,
-            in_change=round(in_change, 1),
-            out_change=round(out_change, 1),
-            total_in=total_in,
-            total_out=total_out
-        )
+    # 查询产品基本信息（支持 material_id 或 name/SKU）
+    m_stmt = select(
+        _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
+        # 注：保留 quantity 列只为兼容（过渡期 cache），库存以下方 batches 聚合为准
+        _t_materials.c.quantity, _t_materials.c.unit,
+        _t_materials.c.safe_stock, _t_materials.c.location,
+    ).where(and_(
+        ident_pred,
+        *m_scope,
+    ))
+    product = sa_conn.execute(m_stmt).fetchone()
+    if not product:
+        return None
+
+    material_id = product.id
+    # 单一真相源：从 active batches 聚合得到当前库存（不读 materials.quantity）。
+    # 这是 watcher 的入口，必须与 /api/materials/list 在有批次时的聚合行为一致。
+    current_stock = int(sa_conn.execute(
+        select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
+        .where(and_(
+            _t_batches.c.material_id == material_id,
+            _t_batches.c.is_exhausted == 0,
+        ))
+    ).scalar() or 0)
+    unit = product.unit
+    safe_stock = product.safe_stock
+
+    def _sum_records(rtype: str, date_str: Optional[str] = None) -> int:
+        preds = [
+            _t_inventory_records.c.material_id == material_id,
+            _t_inventory_records.c.type == rtype,
+        ]
+        if date_str is not None:
+            preds.append(_sa_func.date(_t_inventory_records.c.created_at) == date_str)
+        return sa_conn.execute(
+            select(_sa_func.coalesce(_sa_func.sum(_t_inventory_records.c.quantity), 0))
+            .where(and_(*preds))
+        ).scalar() or 0
+
+    today_in = _sum_records(RecordType.IN.value, today)
+    yesterday_in = _sum_records(RecordType.IN.value, yesterday)
+    today_out = _sum_records(RecordType.OUT.value, today)
+    yesterday_out = _sum_records(RecordType.OUT.value, yesterday)
+    total_in = _sum_records(RecordType.IN.value)
+    total_out = _sum_records(RecordType.OUT.value)
+
+    in_change = ((today_in - yesterday_in) / yesterday_in * 100) if yesterday_in > 0 else 0
+    out_change = ((today_out - yesterday_out) / yesterday_out * 100) if yesterday_out > 0 else 0
+
+    return ProductStats(
+        name=product.name,
+        sku=product.sku or "",
+        current_stock=current_stock,
+        unit=unit,
+        safe_stock=safe_stock,
+        location=product.location or "",
+        today_in=today_in,
+        today_out=today_out,
+        in_change=round(in_change, 1),
+        out_change=round(out_change, 1),
+        total_in=total_in,
+        total_out=total_out
+    )
 
 
 @app.get("/api/materials/batches")
@@ -3890,24 +4157,32 @@ def get_material_batches(
     else:
         ident_pred = _t_materials.c.name == name
     with get_engine().connect() as sa_conn:
-        material = sa_conn.execute(
-            select(_t_materials.c.id).where(and_(ident_pred, *m_scope))
-        ).first()
-        if not material:
-            raise HTTPException(status_code=404, detail="产品不存在")
-        rows = sa_conn.execute(
-            select(
-                _t_batches.c.batch_no, _t_batches.c.quantity, _t_batches.c.location,
-                _t_batches.c.created_at, _t_batches.c.variant,
-                _t_contacts.c.name.label('contact_name'),
-            ).select_from(
-                _t_batches.outerjoin(_t_contacts, _t_batches.c.contact_id == _t_contacts.c.id)
-            ).where(and_(
-                _t_batches.c.material_id == material.id,
-                _t_batches.c.is_exhausted == 0,
-                *b_scope,
-            )).order_by(_t_batches.c.created_at.asc())
-        ).fetchall()
+        payload = _fetch_material_batches(sa_conn, ident_pred, m_scope, b_scope)
+    if payload is None:
+        raise HTTPException(status_code=404, detail="产品不存在")
+    return payload
+
+
+def _fetch_material_batches(sa_conn, ident_pred, m_scope, b_scope) -> Optional[dict]:
+    """/api/materials/batches 的响应体；物料不在范围内返回 None。"""
+    material = sa_conn.execute(
+        select(_t_materials.c.id).where(and_(ident_pred, *m_scope))
+    ).first()
+    if not material:
+        return None
+    rows = sa_conn.execute(
+        select(
+            _t_batches.c.batch_no, _t_batches.c.quantity, _t_batches.c.location,
+            _t_batches.c.created_at, _t_batches.c.variant,
+            _t_contacts.c.name.label('contact_name'),
+        ).select_from(
+            _t_batches.outerjoin(_t_contacts, _t_batches.c.contact_id == _t_contacts.c.id)
+        ).where(and_(
+            _t_batches.c.material_id == material.id,
+            _t_batches.c.is_exhausted == 0,
+            *b_scope,
+        )).order_by(_t_batches.c.created_at.asc())
+    ).fetchall()
 
     total_quantity = sum(b.quantity for b in rows)
     return {
@@ -3927,6 +4202,91 @@ def get_material_batches(
     }
 
 
+@app.get("/api/materials/stock-lookup")
+def stock_lookup(
+    q: str = Query(..., description="产品名称 / SKU（语音原话，可不精确）"),
+    warehouse_id: Optional[int] = Query(None, description="仓库ID"),
+    current_user: CurrentUser = Depends(require_permission(Resource.MATERIALS, Action.READ))
+):
+    """查库存一站式：精确查询 + 同名多义检测 + 模糊解析 + 统计 + 批次明细。
+
+    MCP 的 query_stock 以前要串行调 product-stats（按名）→ fuzzy-match（查同名）
+    → 未命中时再 fuzzy-match → product-stats（按解析出的 material_id）→
+    batches，一次语音查询四五个 HTTP 往返。这里一次请求、一个 DB 连接做完，
+    各部分沿用原端点的响应体（``stats`` 同 product-stats，``match`` 同
+    fuzzy-match，``batches`` 同 materials/batches），判定规则与
+    ``DefaultProvider.query_stock`` 原先在客户端做的一致：
+
+    * 精确命中（名称或 SKU）但候选里有多条同名且不 confident → ``ambiguous``；
+    * 精确未命中且模糊 confident → 按 best_match 的 entity_id 回查
+      （``resolved_from`` / ``resolved_name`` / ``resolved_variant``）；
+    * 都不行 → ``stats`` 为 null，由调用方拿 ``match.candidates`` 追问。
+    """
+    wh_id = resolve_warehouse_id(current_user, warehouse_id)
+    wh_ids = resolve_authorized_warehouse_ids(current_user, wh_id)
+    m_scope = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
+    b_scope = list(build_authorized_scope_predicates(_t_batches, current_user, wh_id))
+    match = _fuzzy_match_response(q, "material", 5, 50.0,
+                                  tenant_id=current_user.tenant_id, warehouse_ids=wh_ids)
+    out = {
+        "query": q,
+        "match": match,
+        "ambiguous": False,
+        "stats": None,
+        "stats_error": None,
+        "resolved_from": None,
+        "resolved_name": None,
+        "resolved_variant": None,
+        "material_id": None,
+        "batches": None,
+    }
+
+    with get_engine().connect() as sa_conn:
+        stats = _fetch_product_stats(
+            sa_conn, or_(_t_materials.c.name == q, _t_materials.c.sku == q), m_scope)
+        if stats is not None:
+            # 精确查询只返回第一条：候选里同名多条时需要用户澄清
+            exact_same = [c for c in match.candidates if c.name == q]
+            if not match.confident and len(exact_same) > 1:
+                out["ambiguous"] = True
+                return out
+            batch_pred = _t_materials.c.name == stats.name
+        elif match.confident and match.best_match is not None:
+            best = match.best_match
+            extra = best.extra or {}
+            variant = extra.get("variant")
+            name = extra.get("canonical_name")
+            # name+variant 组合匹配时，用原始物料名
+            if not name and variant:
+                name = best.name.replace(f" {variant}", "").strip()
+            elif not name:
+                name = best.name
+            out.update(resolved_from=q, resolved_name=name, resolved_variant=variant)
+            # entity_id 直接定位物料，避免同名多行时按名回查盲取错料
+            if best.entity_id:
+                out["material_id"] = best.entity_id
+                stats_pred = batch_pred = _t_materials.c.id == best.entity_id
+            else:
+                stats_pred = or_(_t_materials.c.name == name, _t_materials.c.sku == name)
+                batch_pred = _t_materials.c.name == name
+            stats = _fetch_product_stats(sa_conn, stats_pred, m_scope)
+            if stats is None:
+                out["stats_error"] = "产品不存在"
+                return out
+        else:
+            return out
+
+        out["stats"] = stats
+        # /api/materials/batches 指定仓库时要过仓库授权；不通过只是没有批次明细
+        try:
+            if wh_id is not None:
+                check_warehouse_access(sa_conn, current_user, wh_id)
+            out["batches"] = _fetch_material_batches(sa_conn, batch_pred, m_scope, b_scope)
+        except HTTPException:
+            pass
+    return out
+
+
 @app.get("/api/batches/by-no", response_model=BatchDetailResponse)
 def get_batch_by_no(
     batch_no: str = Query(..., description="批次号（精确匹配）"),
@@ -4469,12 +4829,39 @@ def _fmt_ambiguous_names(candidates) -> str:
     return '、'.join(parts)
 
 
+def _run_after_commit(callbacks) -> None:
+    for fn in callbacks:
+        fn()
+
+
 @app.post("/api/materials/stock-in", response_model=StockInResponse)
 async def stock_in(
     request: StockOperationRequest,
     current_user: CurrentUser = Depends(require_permission(Resource.INVENTORY, Action.WRITE))
 ):
     """入库操作（需要operate权限）- 自动创建批次，支持模糊匹配"""
+    after_commit = []
+    with get_engine().begin() as sa_conn:
+        resp = _stock_in_core(sa_conn, request, current_user, after_commit)
+    _run_after_commit(after_commit)
+    return resp
+
+
+def _insert_inventory_record(sa_conn, **values):
+    """插入一条出入库记录，并在同一事务里累加日汇总（见 daily_stats.py）。"""
+    result = sa_conn.execute(insert(_t_inventory_records).values(**values))
+    daily_stats.add(sa_conn, [values])
+    return result
+
+
+def _stock_in_core(sa_conn, request: StockOperationRequest, current_user: CurrentUser,
+                   after_commit: list, exact_rows=None) -> StockInResponse:
+    """stock_in 主体：解析与写入都走调用方事务里的 ``sa_conn``。
+
+    审计、模糊索引失效等提交后才该发生的副作用追加到 ``after_commit``，由调用方
+    提交后执行（批量接口里回滚的行随之丢弃）。``exact_rows`` 为批量接口预取的
+    精确匹配行，None 时自行查询。
+    """
     product_name = request.product_name
     quantity = request.quantity
     reason_category = request.reason_category
@@ -4508,7 +4895,7 @@ async def stock_in(
 
     # 查询产品（先精确匹配，按仓库过滤；排除已禁用物料）
     normalized_variant = None
-    with get_engine().connect() as sa_conn:
+    if exact_rows is None:
         exact_rows = sa_conn.execute(
             select(_t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
                    _t_materials.c.unit).where(
@@ -4550,19 +4937,18 @@ async def stock_in(
             extra = best.get('extra') or {}
             resolved_material_id = best.get('entity_id')
             product_name = extra.get('canonical_name') or best['name']
-            with get_engine().connect() as sa_conn:
-                row_preds = [_t_materials.c.is_disabled == 0, *m_scope]
-                if resolved_material_id is not None:
-                    row_preds.append(_t_materials.c.id == resolved_material_id)
-                else:
-                    row_preds.append(_t_materials.c.name == product_name)
-                row = sa_conn.execute(
-                    select(_t_materials.c.id, _t_materials.c.name, _t_materials.c.unit).where(
-                        and_(*row_preds)
-                    )
-                ).first()
-                if row:
-                    product_name = row.name
+            row_preds = [_t_materials.c.is_disabled == 0, *m_scope]
+            if resolved_material_id is not None:
+                row_preds.append(_t_materials.c.id == resolved_material_id)
+            else:
+                row_preds.append(_t_materials.c.name == product_name)
+            row = sa_conn.execute(
+                select(_t_materials.c.id, _t_materials.c.name, _t_materials.c.unit).where(
+                    and_(*row_preds)
+                )
+            ).first()
+            if row:
+                product_name = row.name
         elif result['candidates']:
             names = [c['name'] for c in result['candidates'][:5]]
             return StockInResponse(
@@ -4602,72 +4988,71 @@ async def stock_in(
 
     record_tenant_id = resolve_tenant_id_for_write(current_user, wh_id)
     user_supplied_batch_no = bool(request.batch_no and request.batch_no.strip())
-    batch_no = request.batch_no.strip() if user_supplied_batch_no else generate_batch_no(material_id, warehouse_id=wh_id)
     now_dt = datetime.now()
 
-    with get_engine().begin() as sa_conn:
-        # 单一真相源：从 active batches 聚合读取入库前库存（不再写 materials.quantity）。
-        old_quantity = int(sa_conn.execute(
-            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-            .where(and_(
-                _t_batches.c.material_id == material_id,
-                _t_batches.c.is_exhausted == 0,
-            ))
-        ).scalar() or 0)
-        new_quantity = old_quantity + quantity
-
-        # batch_no 撞 unique (batch_no, warehouse_id) 时：
-        # - 用户显式传入的 batch_no 直接 409，让前端报错（用户输错了）
-        # - 系统生成的 batch_no（同 date+wh 高并发可能撞）retry 最多 5 次（参考
-        #   move_batch_location 的同款保护）
-        batch_id = None
-        for _attempt in range(5):
-            try:
-                ins_batch = sa_conn.execute(
-                    insert(_t_batches).values(
-                        batch_no=batch_no, material_id=material_id, quantity=quantity,
-                        initial_quantity=quantity, contact_id=request.contact_id,
-                        location=request.location, variant=effective_variant,
-                        warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
-                    )
+    batch_no = (request.batch_no.strip() if user_supplied_batch_no
+                else generate_batch_no(material_id, warehouse_id=wh_id, conn=sa_conn))
+    # 单一真相源：从 active batches 聚合读取入库前库存（不再写 materials.quantity）。
+    old_quantity = int(sa_conn.execute(
+        select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
+        .where(and_(
+            _t_batches.c.material_id == material_id,
+            _t_batches.c.is_exhausted == 0,
+        ))
+    ).scalar() or 0)
+    new_quantity = old_quantity + quantity
+
+    # batch_no 撞 unique (batch_no, warehouse_id) 时：
+    # - 用户显式传入的 batch_no 直接 409，让前端报错（用户输错了）
+    # - 系统生成的 batch_no（撞上绕过分配器的手填号时）retry 最多 5 次（参考
+    #   move_batch_location 的同款保护）
+    batch_id = None
+    for _attempt in range(5):
+        try:
+            ins_batch = sa_conn.execute(
+                insert(_t_batches).values(
+                    batch_no=batch_no, material_id=material_id, quantity=quantity,
+                    initial_quantity=quantity, contact_id=request.contact_id,
+                    location=request.location, variant=effective_variant,
+                    warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
                 )
-                batch_id = ins_batch.inserted_primary_key[0]
-                break
-            except IntegrityError:
-                if user_supplied_batch_no:
-                    raise HTTPException(
-                        status_code=409,
-                        detail=f"批次号 '{batch_no}' 在该仓库已存在，请换一个"
-                    )
-                # 系统生成的：重新分配一个再试
-                batch_no = generate_batch_no(material_id, warehouse_id=wh_id)
-        if batch_id is None:
-            raise HTTPException(status_code=409, detail="批次号生成冲突，请重试")
-
-        sa_conn.execute(
-            insert(_t_inventory_records).values(
-                material_id=material_id, type=RecordType.IN.value, quantity=quantity,
-                operator=operator, operator_user_id=operator_user_id,
-                actual_operator=request.actual_operator,
-                reason_category=reason_category, reason_note=reason_note,
-                contact_id=request.contact_id, batch_id=batch_id,
-                warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
             )
-        )
+            batch_id = ins_batch.inserted_primary_key[0]
+            break
+        except IntegrityError:
+            if user_supplied_batch_no:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"批次号 '{batch_no}' 在该仓库已存在，请换一个"
+                )
+            # 系统生成的：重新分配一个再试
+            batch_no = generate_batch_no(material_id, warehouse_id=wh_id, conn=sa_conn)
+    if batch_id is None:
+        raise HTTPException(status_code=409, detail="批次号生成冲突，请重试")
+
+    _insert_inventory_record(
+        sa_conn,
+        material_id=material_id, type=RecordType.IN.value, quantity=quantity,
+        operator=operator, operator_user_id=operator_user_id,
+        actual_operator=request.actual_operator,
+        reason_category=reason_category, reason_note=reason_note,
+        contact_id=request.contact_id, batch_id=batch_id,
+        warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
+    )
 
     # R5: stock-in only affects material partition (name+variant entries)
-    get_fuzzy_matcher().invalidate_cache(
+    after_commit.append(partial(get_fuzzy_matcher().invalidate_cache,
         entity_type="material", tenant_id=record_tenant_id, warehouse_id=wh_id,
-    )
+    ))
 
-    audit_log("STOCK_IN", current_user.id, current_user.username, {
+    after_commit.append(partial(audit_log, "STOCK_IN", current_user.id, current_user.username, {
         "product": product_name,
         "quantity": quantity,
         "batch_no": batch_no,
         "old_qty": old_quantity,
         "new_qty": new_quantity,
         "resolved_from": resolved_from,
-    })
+    }))
 
     return StockInResponse(
         success=True,
@@ -4693,6 +5078,16 @@ async def stock_out(
     current_user: CurrentUser = Depends(require_permission(Resource.INVENTORY, Action.WRITE))
 ):
     """出库操作（需要operate权限）- FIFO批次消耗，支持模糊匹配、指定批次。"""
+    after_commit = []
+    with get_engine().begin() as sa_conn:
+        resp = _stock_out_core(sa_conn, stock_data, current_user, after_commit)
+    _run_after_commit(after_commit)
+    return resp
+
+
+def _stock_out_core(sa_conn, stock_data: StockOperationRequest, current_user: CurrentUser,
+                    after_commit: list, exact_rows=None) -> StockOutResponse:
+    """stock_out 主体，事务与副作用约定同 _stock_in_core。"""
     product_name = stock_data.product_name
     quantity = stock_data.quantity
     reason_category = stock_data.reason_category
@@ -4723,7 +5118,7 @@ async def stock_out(
     b_scope = build_authorized_scope_predicates(_t_batches, current_user, wh_id)
 
     normalized_variant = None
-    with get_engine().connect() as sa_conn:
+    if exact_rows is None:
         exact_rows = sa_conn.execute(
             select(
                 _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
@@ -4744,12 +5139,11 @@ async def stock_out(
                 exact_rows, wh_id, stock_data.variant)
         if row is None and stock_data.batch_no:
             # 带 batch_no 时批次已能唯一定位物料：批次归属恰是同名行之一 → 选定该行
-            with get_engine().connect() as sa_conn:
-                bn_row = sa_conn.execute(
-                    select(_t_batches.c.material_id).where(and_(
-                        _t_batches.c.batch_no == stock_data.batch_no, *b_scope,
-                    ))
-                ).first()
+            bn_row = sa_conn.execute(
+                select(_t_batches.c.material_id).where(and_(
+                    _t_batches.c.batch_no == stock_data.batch_no, *b_scope,
+                ))
+            ).first()
             if bn_row:
                 row = next((r for r in exact_rows if r.id == bn_row.material_id), None)
         if row is None:
@@ -4778,22 +5172,21 @@ async def stock_out(
             if resolved_variant:
                 resolved_name = resolved_name.replace(f" {resolved_variant}", "").strip()
             product_name = resolved_name
-            with get_engine().connect() as sa_conn:
-                row_preds = [_t_materials.c.is_disabled == 0, *m_scope]
-                if resolved_material_id is not None:
-                    row_preds.append(_t_materials.c.id == resolved_material_id)
-                else:
-                    row_preds.append(_t_materials.c.name == product_name)
-                row = sa_conn.execute(
-                    select(
-                        _t_materials.c.id, _t_materials.c.name,
-                        _t_materials.c.unit, _t_materials.c.safe_stock,
-                    ).where(
-                        and_(*row_preds)
-                    )
-                ).first()
-                if row:
-                    product_name = row.name
+            row_preds = [_t_materials.c.is_disabled == 0, *m_scope]
+            if resolved_material_id is not None:
+                row_preds.append(_t_materials.c.id == resolved_material_id)
+            else:
+                row_preds.append(_t_materials.c.name == product_name)
+            row = sa_conn.execute(
+                select(
+                    _t_materials.c.id, _t_materials.c.name,
+                    _t_materials.c.unit, _t_materials.c.safe_stock,
+                ).where(
+                    and_(*row_preds)
+                )
+            ).first()
+            if row:
+                product_name = row.name
         elif result['candidates']:
             names = [c['name'] for c in result['candidates'][:5]]
             return StockOutResponse(
@@ -4843,19 +5236,18 @@ async def stock_out(
                 candidates=loc_result['candidates'],
             )
         else:
-            with get_engine().connect() as sa_conn:
-                avail_rows = sa_conn.execute(
-                    select(_t_batches.c.location).where(
-                        and_(
-                            _t_batches.c.material_id == material_id,
-                            _t_batches.c.warehouse_id == wh_id,
-                            _t_batches.c.is_exhausted == 0,
-                            _t_batches.c.quantity > 0,
-                            _t_batches.c.location.is_not(None),
-                            _t_batches.c.location != '',
-                        )
-                    ).distinct()
-                ).all()
+            avail_rows = sa_conn.execute(
+                select(_t_batches.c.location).where(
+                    and_(
+                        _t_batches.c.material_id == material_id,
+                        _t_batches.c.warehouse_id == wh_id,
+                        _t_batches.c.is_exhausted == 0,
+                        _t_batches.c.quantity > 0,
+                        _t_batches.c.location.is_not(None),
+                        _t_batches.c.location != '',
+                    )
+                ).distinct()
+            ).all()
             avail = [r.location for r in avail_rows]
             return StockOutResponse(
                 success=False, error="location_not_found",
@@ -4868,278 +5260,275 @@ async def stock_out(
 
     # ─── 分支 A：指定批次精确扣减 ───
     if stock_data.batch_no:
-        with get_engine().begin() as sa_conn:
-            batch = sa_conn.execute(
-                select(
-                    _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
-                    _t_batches.c.location, _t_batches.c.variant,
-                    _t_batches.c.material_id, _t_batches.c.warehouse_id,
-                ).where(and_(_t_batches.c.batch_no == stock_data.batch_no, *b_scope))
-            ).first()
-            if not batch or batch.material_id != material_id:
-                return StockOutResponse(
-                    success=False, error="batch_not_found",
-                    message=f"批次 '{stock_data.batch_no}' 不存在或不属于当前产品/仓库")
+        batch = sa_conn.execute(
+            select(
+                _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
+                _t_batches.c.location, _t_batches.c.variant,
+                _t_batches.c.material_id, _t_batches.c.warehouse_id,
+            ).where(and_(_t_batches.c.batch_no == stock_data.batch_no, *b_scope))
+        ).first()
+        if not batch or batch.material_id != material_id:
+            return StockOutResponse(
+                success=False, error="batch_not_found",
+                message=f"批次 '{stock_data.batch_no}' 不存在或不属于当前产品/仓库")
 
-            if effective_location and effective_location != (batch.location or ''):
-                return StockOutResponse(
-                    success=False, error="batch_field_mismatch",
-                    message=f"批次 {batch.batch_no} 实际位于库位 "
-                            f"'{batch.location or '（未设置）'}'，与指定的 '{effective_location}' 不符")
-            if effective_variant and effective_variant != (batch.variant or ''):
-                return StockOutResponse(
-                    success=False, error="batch_field_mismatch",
-                    message=f"批次 {batch.batch_no} 实际变体 "
-                            f"'{batch.variant}'，与指定的 '{effective_variant}' 不符")
+        if effective_location and effective_location != (batch.location or ''):
+            return StockOutResponse(
+                success=False, error="batch_field_mismatch",
+                message=f"批次 {batch.batch_no} 实际位于库位 "
+                        f"'{batch.location or '（未设置）'}'，与指定的 '{effective_location}' 不符")
+        if effective_variant and effective_variant != (batch.variant or ''):
+            return StockOutResponse(
+                success=False, error="batch_field_mismatch",
+                message=f"批次 {batch.batch_no} 实际变体 "
+                        f"'{batch.variant}'，与指定的 '{effective_variant}' 不符")
+
+        # 单一真相源：从 active batches 聚合读取出库前库存（不再写 materials.quantity）。
+        old_quantity = int(sa_conn.execute(
+            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
+            .where(and_(
+                _t_batches.c.material_id == material_id,
+                _t_batches.c.is_exhausted == 0,
+            ))
+        ).scalar() or 0)
+        new_quantity = old_quantity - quantity
 
-            # 单一真相源：从 active batches 聚合读取出库前库存（不再写 materials.quantity）。
-            old_quantity = int(sa_conn.execute(
+        if batch.quantity < quantity:
+            shortfall = quantity - batch.quantity
+            # 其他批次合计可用（用于 can_fallback 判断和后续 FIFO）
+            # 必须带 *b_scope —— 否则在多租户/多仓场景下，
+            # 预检会把其他 scope 的批次数量算进 can_fallback，让 wrapper
+            # 生成"其他批次可补"的 speak_ask 骗用户答"是"，然后真扣时
+            # FIFO 的 *b_scope 又把那些批次拒之门外，导致 409 回滚。
+            # fallback 候选批次谓词：与分支 B precheck 同口径 —— 指定了
+            # variant / location 时补扣只能来自同规格/同库位的批次，
+            # 否则确认补扣会扣到其他规格/库位的库存。
+            fallback_preds = [
+                _t_batches.c.material_id == material_id,
+                _t_batches.c.id != batch.id,
+                _t_batches.c.is_exhausted == 0,
+                _t_batches.c.quantity > 0,
+                *b_scope,
+            ]
+            if effective_variant:
+                fallback_preds.append(_t_batches.c.variant == effective_variant)
+            if effective_location:
+                fallback_preds.append(_t_batches.c.location == effective_location)
+            other_avail = int(sa_conn.execute(
                 select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-                .where(and_(
-                    _t_batches.c.material_id == material_id,
-                    _t_batches.c.is_exhausted == 0,
-                ))
+                .where(and_(*fallback_preds))
             ).scalar() or 0)
-            new_quantity = old_quantity - quantity
-
-            if batch.quantity < quantity:
-                shortfall = quantity - batch.quantity
-                # 其他批次合计可用（用于 can_fallback 判断和后续 FIFO）
-                # 必须带 *b_scope —— 否则在多租户/多仓场景下，
-                # 预检会把其他 scope 的批次数量算进 can_fallback，让 wrapper
-                # 生成"其他批次可补"的 speak_ask 骗用户答"是"，然后真扣时
-                # FIFO 的 *b_scope 又把那些批次拒之门外，导致 409 回滚。
-                # fallback 候选批次谓词：与分支 B precheck 同口径 —— 指定了
-                # variant / location 时补扣只能来自同规格/同库位的批次，
-                # 否则确认补扣会扣到其他规格/库位的库存。
-                fallback_preds = [
-                    _t_batches.c.material_id == material_id,
-                    _t_batches.c.id != batch.id,
-                    _t_batches.c.is_exhausted == 0,
-                    _t_batches.c.quantity > 0,
-                    *b_scope,
-                ]
-                if effective_variant:
-                    fallback_preds.append(_t_batches.c.variant == effective_variant)
-                if effective_location:
-                    fallback_preds.append(_t_batches.c.location == effective_location)
-                other_avail = int(sa_conn.execute(
-                    select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-                    .where(and_(*fallback_preds))
-                ).scalar() or 0)
-                can_fallback = other_avail >= shortfall
-
-                if not stock_data.allow_partial_fallback:
-                    # 未授权 fallback：返回结构化失败，含 can_fallback 让 MCP 询问用户
-                    return StockOutResponse(
-                        success=False, error="batch_insufficient_stock",
-                        batch_no_requested=batch.batch_no,
-                        batch_available=batch.quantity,
-                        shortfall=shortfall,
-                        can_fallback=can_fallback,
-                        fallback_total_available=other_avail,
-                        message=(
-                            f"批次 {batch.batch_no} 余量 {batch.quantity} {unit}，"
-                            f"不足以出库 {quantity} {unit}，"
-                            f"还差 {shortfall} {unit}。"
-                            + (f"其他批次合计 {other_avail} {unit} 可补差额，是否确认？"
-                               if can_fallback else
-                               f"其他批次合计仅 {other_avail} {unit}，也不足补差额。")
-                        ),
-                    )
+            can_fallback = other_avail >= shortfall
 
-                # 已授权 fallback：同事务内"先扣指定批次全部 + FIFO 补差额"。
-                if not can_fallback:
-                    return StockOutResponse(
-                        success=False, error="batch_insufficient_stock",
-                        batch_no_requested=batch.batch_no,
-                        batch_available=batch.quantity,
-                        shortfall=shortfall,
-                        can_fallback=False,
-                        fallback_total_available=other_avail,
-                        message=f"无法补足：指定批次 {batch.batch_no} 仅 {batch.quantity} {unit}，"
-                                f"其他批次合计 {other_avail} {unit}，仍缺 {shortfall - other_avail} {unit}。",
-                    )
+            if not stock_data.allow_partial_fallback:
+                # 未授权 fallback：返回结构化失败，含 can_fallback 让 MCP 询问用户
+                return StockOutResponse(
+                    success=False, error="batch_insufficient_stock",
+                    batch_no_requested=batch.batch_no,
+                    batch_available=batch.quantity,
+                    shortfall=shortfall,
+                    can_fallback=can_fallback,
+                    fallback_total_available=other_avail,
+                    message=(
+                        f"批次 {batch.batch_no} 余量 {batch.quantity} {unit}，"
+                        f"不足以出库 {quantity} {unit}，"
+                        f"还差 {shortfall} {unit}。"
+                        + (f"其他批次合计 {other_avail} {unit} 可补差额，是否确认？"
+                           if can_fallback else
+                           f"其他批次合计仅 {other_avail} {unit}，也不足补差额。")
+                    ),
+                )
 
-                # 进入"先扣完指定批次 + FIFO 补差额"事务路径
-                ins_rec = sa_conn.execute(
-                    insert(_t_inventory_records).values(
-                        material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
-                        operator=operator, operator_user_id=operator_user_id,
-                        actual_operator=stock_data.actual_operator,
-                        reason_category=reason_category, reason_note=reason_note,
-                        contact_id=stock_data.contact_id, warehouse_id=wh_id,
-                        tenant_id=record_tenant_id, created_at=now_dt,
-                    )
+            # 已授权 fallback：同事务内"先扣指定批次全部 + FIFO 补差额"。
+            if not can_fallback:
+                return StockOutResponse(
+                    success=False, error="batch_insufficient_stock",
+                    batch_no_requested=batch.batch_no,
+                    batch_available=batch.quantity,
+                    shortfall=shortfall,
+                    can_fallback=False,
+                    fallback_total_available=other_avail,
+                    message=f"无法补足：指定批次 {batch.batch_no} 仅 {batch.quantity} {unit}，"
+                            f"其他批次合计 {other_avail} {unit}，仍缺 {shortfall - other_avail} {unit}。",
                 )
-                record_id = ins_rec.inserted_primary_key[0]
 
-                batch_consumptions = []
+            # 进入"先扣完指定批次 + FIFO 补差额"事务路径
+            ins_rec = _insert_inventory_record(
+                sa_conn,
+                material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
+                operator=operator, operator_user_id=operator_user_id,
+                actual_operator=stock_data.actual_operator,
+                reason_category=reason_category, reason_note=reason_note,
+                contact_id=stock_data.contact_id, warehouse_id=wh_id,
+                tenant_id=record_tenant_id, created_at=now_dt,
+            )
+            record_id = ins_rec.inserted_primary_key[0]
+
+            batch_consumptions = []
+
+            # ① 先把指定批次的余量全扣完
+            consumed_from_specified = batch.quantity
+            spec_upd = sa_conn.execute(
+                update(_t_batches)
+                .where(and_(
+                    _t_batches.c.id == batch.id,
+                    _t_batches.c.quantity >= consumed_from_specified,
+                    _t_batches.c.is_exhausted == 0,
+                ))
+                .values(quantity=0, is_exhausted=1)
+            )
+            if spec_upd.rowcount != 1:
+                raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
+            sa_conn.execute(
+                insert(_t_batch_consumptions).values(
+                    record_id=record_id, batch_id=batch.id,
+                    quantity=consumed_from_specified, created_at=now_dt,
+                )
+            )
+            batch_consumptions.append(BatchConsumption(
+                batch_no=batch.batch_no, batch_id=batch.id,
+                quantity=consumed_from_specified, remaining=0, variant=batch.variant,
+            ))
 
-                # ① 先把指定批次的余量全扣完
-                consumed_from_specified = batch.quantity
-                spec_upd = sa_conn.execute(
+            # ② FIFO 在其他批次（排除指定批次）中扣 shortfall
+            remaining_to_consume = shortfall
+            fifo_stmt = (
+                select(
+                    _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
+                    _t_batches.c.variant,
+                )
+                .where(and_(*fallback_preds))
+                .order_by(_t_batches.c.created_at.asc())
+                .with_for_update()
+            )
+            for fb in sa_conn.execute(fifo_stmt).all():
+                if remaining_to_consume <= 0:
+                    break
+                take = min(fb.quantity, remaining_to_consume)
+                upd = sa_conn.execute(
                     update(_t_batches)
                     .where(and_(
-                        _t_batches.c.id == batch.id,
-                        _t_batches.c.quantity >= consumed_from_specified,
+                        _t_batches.c.id == fb.id,
+                        _t_batches.c.quantity >= take,
                         _t_batches.c.is_exhausted == 0,
                     ))
-                    .values(quantity=0, is_exhausted=1)
+                    .values(
+                        quantity=_t_batches.c.quantity - take,
+                        is_exhausted=case(
+                            (_t_batches.c.quantity - take <= 0, 1),
+                            else_=0,
+                        ),
+                    )
                 )
-                if spec_upd.rowcount != 1:
+                if upd.rowcount != 1:
                     raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
                 sa_conn.execute(
                     insert(_t_batch_consumptions).values(
-                        record_id=record_id, batch_id=batch.id,
-                        quantity=consumed_from_specified, created_at=now_dt,
+                        record_id=record_id, batch_id=fb.id,
+                        quantity=take, created_at=now_dt,
                     )
                 )
                 batch_consumptions.append(BatchConsumption(
-                    batch_no=batch.batch_no, batch_id=batch.id,
-                    quantity=consumed_from_specified, remaining=0, variant=batch.variant,
+                    batch_no=fb.batch_no, batch_id=fb.id,
+                    quantity=take, remaining=max(fb.quantity - take, 0),
+                    variant=fb.variant,
                 ))
+                remaining_to_consume -= take
 
-                # ② FIFO 在其他批次（排除指定批次）中扣 shortfall
-                remaining_to_consume = shortfall
-                fifo_stmt = (
-                    select(
-                        _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
-                        _t_batches.c.variant,
-                    )
-                    .where(and_(*fallback_preds))
-                    .order_by(_t_batches.c.created_at.asc())
-                    .with_for_update()
+            if remaining_to_consume > 0:
+                # 事务内 raise，前面所有扣减回滚
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"出库失败：可用批次不足，仍缺 {remaining_to_consume} {unit}",
                 )
-                for fb in sa_conn.execute(fifo_stmt).all():
-                    if remaining_to_consume <= 0:
-                        break
-                    take = min(fb.quantity, remaining_to_consume)
-                    upd = sa_conn.execute(
-                        update(_t_batches)
-                        .where(and_(
-                            _t_batches.c.id == fb.id,
-                            _t_batches.c.quantity >= take,
-                            _t_batches.c.is_exhausted == 0,
-                        ))
-                        .values(
-                            quantity=_t_batches.c.quantity - take,
-                            is_exhausted=case(
-                                (_t_batches.c.quantity - take <= 0, 1),
-                                else_=0,
-                            ),
-                        )
-                    )
-                    if upd.rowcount != 1:
-                        raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
-                    sa_conn.execute(
-                        insert(_t_batch_consumptions).values(
-                            record_id=record_id, batch_id=fb.id,
-                            quantity=take, created_at=now_dt,
-                        )
-                    )
-                    batch_consumptions.append(BatchConsumption(
-                        batch_no=fb.batch_no, batch_id=fb.id,
-                        quantity=take, remaining=max(fb.quantity - take, 0),
-                        variant=fb.variant,
-                    ))
-                    remaining_to_consume -= take
 
-                if remaining_to_consume > 0:
-                    # 事务内 raise，前面所有扣减回滚
-                    raise HTTPException(
-                        status_code=409,
-                        detail=f"出库失败：可用批次不足，仍缺 {remaining_to_consume} {unit}",
-                    )
+            # 出库不改 materials.name / batches.variant，fuzzy material 索引
+            # 不需要失效（codex 复审 a6a98bcad2d766c5b 已确认，索引也不按
+            # is_exhausted 过滤所以 exhausted 也不影响命中）。
+
+            after_commit.append(partial(audit_log, "STOCK_OUT", current_user.id, current_user.username, {
+                "product": product_name, "quantity": quantity,
+                "old_qty": old_quantity, "new_qty": new_quantity,
+                "resolved_from": resolved_from,
+                "specified_batch": batch.batch_no,
+                "partial_fallback": True,
+                "batches": [bc.batch_no for bc in batch_consumptions],
+            }))
+
+            warning = ""
+            if safe_stock is not None and new_quantity < safe_stock:
+                if new_quantity < safe_stock * 0.5:
+                    warning = f"⚠️ 警告：库存告急！当前库存 {new_quantity} {unit}，低于安全库存 {safe_stock} {unit} 的50%"
+                else:
+                    warning = f"⚠️ 提醒：库存偏低，当前库存 {new_quantity} {unit}，低于安全库存 {safe_stock} {unit}"
 
-                # 出库不改 materials.name / batches.variant，fuzzy material 索引
-                # 不需要失效（codex 复审 a6a98bcad2d766c5b 已确认，索引也不按
-                # is_exhausted 过滤所以 exhausted 也不影响命中）。
-
-                audit_log("STOCK_OUT", current_user.id, current_user.username, {
-                    "product": product_name, "quantity": quantity,
-                    "old_qty": old_quantity, "new_qty": new_quantity,
-                    "resolved_from": resolved_from,
-                    "specified_batch": batch.batch_no,
-                    "partial_fallback": True,
-                    "batches": [bc.batch_no for bc in batch_consumptions],
-                })
+            details = "、".join(f"{bc.batch_no}×{bc.quantity}" for bc in batch_consumptions)
+            return StockOutResponse(
+                success=True, operation="stock_out",
+                product=StockOperationProduct(
+                    name=product_name, old_quantity=old_quantity,
+                    out_quantity=quantity, new_quantity=new_quantity,
+                    unit=unit, safe_stock=safe_stock,
+                ),
+                batch_consumptions=batch_consumptions,
+                message=f"出库成功（指定批次 {batch.batch_no} 不足，已从其他批次 FIFO 补足）："
+                        f"{product_name} 共出 {quantity} {unit}（{details}），"
+                        f"库存 {old_quantity}→{new_quantity} {unit}",
+                warning=warning if warning else None,
+                resolved_from=resolved_from,
+            )
 
-                warning = ""
-                if safe_stock is not None and new_quantity < safe_stock:
-                    if new_quantity < safe_stock * 0.5:
-                        warning = f"⚠️ 警告：库存告急！当前库存 {new_quantity} {unit}，低于安全库存 {safe_stock} {unit} 的50%"
-                    else:
-                        warning = f"⚠️ 提醒：库存偏低，当前库存 {new_quantity} {unit}，低于安全库存 {safe_stock} {unit}"
+        ins_rec = _insert_inventory_record(
+            sa_conn,
+            material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
+            operator=operator, operator_user_id=operator_user_id,
+            actual_operator=stock_data.actual_operator,
+            reason_category=reason_category, reason_note=reason_note,
+            contact_id=stock_data.contact_id, warehouse_id=wh_id,
+            tenant_id=record_tenant_id, created_at=now_dt,
+        )
+        record_id = ins_rec.inserted_primary_key[0]
 
-                details = "、".join(f"{bc.batch_no}×{bc.quantity}" for bc in batch_consumptions)
-                return StockOutResponse(
-                    success=True, operation="stock_out",
-                    product=StockOperationProduct(
-                        name=product_name, old_quantity=old_quantity,
-                        out_quantity=quantity, new_quantity=new_quantity,
-                        unit=unit, safe_stock=safe_stock,
+        consume_qty = quantity
+        batch_upd = sa_conn.execute(
+            update(_t_batches)
+                .where(and_(
+                    _t_batches.c.id == batch.id,
+                    _t_batches.c.quantity >= consume_qty,
+                    _t_batches.c.is_exhausted == 0,
+                ))
+                .values(
+                    quantity=_t_batches.c.quantity - consume_qty,
+                    is_exhausted=case(
+                        (_t_batches.c.quantity - consume_qty <= 0, 1),
+                        else_=0,
                     ),
-                    batch_consumptions=batch_consumptions,
-                    message=f"出库成功（指定批次 {batch.batch_no} 不足，已从其他批次 FIFO 补足）："
-                            f"{product_name} 共出 {quantity} {unit}（{details}），"
-                            f"库存 {old_quantity}→{new_quantity} {unit}",
-                    warning=warning if warning else None,
-                    resolved_from=resolved_from,
                 )
+        )
+        if batch_upd.rowcount != 1:
+            raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
 
-            ins_rec = sa_conn.execute(
-                insert(_t_inventory_records).values(
-                    material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
-                    operator=operator, operator_user_id=operator_user_id,
-                    actual_operator=stock_data.actual_operator,
-                    reason_category=reason_category, reason_note=reason_note,
-                    contact_id=stock_data.contact_id, warehouse_id=wh_id,
-                    tenant_id=record_tenant_id, created_at=now_dt,
-                )
+        sa_conn.execute(
+            insert(_t_batch_consumptions).values(
+                record_id=record_id, batch_id=batch.id,
+                quantity=consume_qty, created_at=now_dt,
             )
-            record_id = ins_rec.inserted_primary_key[0]
+        )
 
-            consume_qty = quantity
-            batch_upd = sa_conn.execute(
-                update(_t_batches)
-                    .where(and_(
-                        _t_batches.c.id == batch.id,
-                        _t_batches.c.quantity >= consume_qty,
-                        _t_batches.c.is_exhausted == 0,
-                    ))
-                    .values(
-                        quantity=_t_batches.c.quantity - consume_qty,
-                        is_exhausted=case(
-                            (_t_batches.c.quantity - consume_qty <= 0, 1),
-                            else_=0,
-                        ),
-                    )
-            )
-            if batch_upd.rowcount != 1:
-                raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
-
-            sa_conn.execute(
-                insert(_t_batch_consumptions).values(
-                    record_id=record_id, batch_id=batch.id,
-                    quantity=consume_qty, created_at=now_dt,
-                )
-            )
-
-            remaining_qty = max(batch.quantity - consume_qty, 0)
-            batch_consumptions = [BatchConsumption(
-                batch_no=batch.batch_no, batch_id=batch.id,
-                quantity=consume_qty, remaining=remaining_qty, variant=batch.variant,
-            )]
+        remaining_qty = max(batch.quantity - consume_qty, 0)
+        batch_consumptions = [BatchConsumption(
+            batch_no=batch.batch_no, batch_id=batch.id,
+            quantity=consume_qty, remaining=remaining_qty, variant=batch.variant,
+        )]
 
         # 出库不改索引（同上）。
 
-        audit_log("STOCK_OUT", current_user.id, current_user.username, {
+        after_commit.append(partial(audit_log, "STOCK_OUT", current_user.id, current_user.username, {
             "product": product_name, "quantity": quantity,
             "old_qty": old_quantity, "new_qty": new_quantity,
             "resolved_from": resolved_from,
             "specified_batch": batch.batch_no,
-        })
+        }))
 
         warning = ""
         if safe_stock is not None and new_quantity < safe_stock:
@@ -5163,7 +5552,7 @@ async def stock_out(
         )
 
     # ─── 分支 B：FIFO（支持 location / variant 过滤） ───
-    # 单一真相源：无条件前置 active batches 聚合校验，库存不足直接 409，不进事务。
+    # 单一真相源：无条件前置 active batches 聚合校验，库存不足直接返回，不做任何写入。
     precheck_preds = [
         _t_batches.c.material_id == material_id,
         _t_batches.c.is_exhausted == 0,
@@ -5174,11 +5563,10 @@ async def stock_out(
         precheck_preds.append(_t_batches.c.variant == effective_variant)
     if effective_location:
         precheck_preds.append(_t_batches.c.location == effective_location)
-    with get_engine().connect() as sa_conn:
-        avail_qty = int(sa_conn.execute(
-            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-                .where(and_(*precheck_preds))
-        ).scalar() or 0)
+    avail_qty = int(sa_conn.execute(
+        select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
+            .where(and_(*precheck_preds))
+    ).scalar() or 0)
     if avail_qty < quantity:
         scope = []
         if effective_location:
@@ -5191,104 +5579,102 @@ async def stock_out(
             message=f"出库失败：{product_name}{scope_msg} "
                     f"的可用库存为 {avail_qty} {unit}，需要出库 {quantity} {unit}")
 
-    with get_engine().begin() as sa_conn:
-        # old_quantity 取 material 总库存（不带 location/variant 过滤），与历史响应语义保持一致
-        old_quantity = int(sa_conn.execute(
-            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-            .where(and_(
-                _t_batches.c.material_id == material_id,
-                _t_batches.c.is_exhausted == 0,
-            ))
-        ).scalar() or 0)
-        new_quantity = old_quantity - quantity
-
-        ins_rec = sa_conn.execute(
-            insert(_t_inventory_records).values(
-                material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
-                operator=operator, operator_user_id=operator_user_id,
-                actual_operator=stock_data.actual_operator,
-                reason_category=reason_category, reason_note=reason_note,
-                contact_id=stock_data.contact_id, warehouse_id=wh_id,
-                tenant_id=record_tenant_id, created_at=now_dt,
-            )
-        )
-        record_id = ins_rec.inserted_primary_key[0]
-
-        batch_consumptions = []
-        remaining_to_consume = quantity
-        fifo_preds = [
+    # old_quantity 取 material 总库存（不带 location/variant 过滤），与历史响应语义保持一致
+    old_quantity = int(sa_conn.execute(
+        select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
+        .where(and_(
             _t_batches.c.material_id == material_id,
             _t_batches.c.is_exhausted == 0,
-            _t_batches.c.quantity > 0,
-            *b_scope,
-        ]
-        if effective_variant:
-            fifo_preds.append(_t_batches.c.variant == effective_variant)
-        if effective_location:
-            fifo_preds.append(_t_batches.c.location == effective_location)
-        fifo_stmt = (
-            select(
-                _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
-                _t_batches.c.variant, _t_batches.c.location,
-            )
-            .where(and_(*fifo_preds))
-            .order_by(_t_batches.c.created_at.asc())
-            .with_for_update()
+        ))
+    ).scalar() or 0)
+    new_quantity = old_quantity - quantity
+
+    ins_rec = _insert_inventory_record(
+        sa_conn,
+        material_id=material_id, type=RecordType.OUT.value, quantity=quantity,
+        operator=operator, operator_user_id=operator_user_id,
+        actual_operator=stock_data.actual_operator,
+        reason_category=reason_category, reason_note=reason_note,
+        contact_id=stock_data.contact_id, warehouse_id=wh_id,
+        tenant_id=record_tenant_id, created_at=now_dt,
+    )
+    record_id = ins_rec.inserted_primary_key[0]
+
+    batch_consumptions = []
+    remaining_to_consume = quantity
+    fifo_preds = [
+        _t_batches.c.material_id == material_id,
+        _t_batches.c.is_exhausted == 0,
+        _t_batches.c.quantity > 0,
+        *b_scope,
+    ]
+    if effective_variant:
+        fifo_preds.append(_t_batches.c.variant == effective_variant)
+    if effective_location:
+        fifo_preds.append(_t_batches.c.location == effective_location)
+    fifo_stmt = (
+        select(
+            _t_batches.c.id, _t_batches.c.batch_no, _t_batches.c.quantity,
+            _t_batches.c.variant, _t_batches.c.location,
         )
-        fifo_rows = sa_conn.execute(fifo_stmt).all()
+        .where(and_(*fifo_preds))
+        .order_by(_t_batches.c.created_at.asc())
+        .with_for_update()
+    )
+    fifo_rows = sa_conn.execute(fifo_stmt).all()
 
-        for b in fifo_rows:
-            if remaining_to_consume <= 0:
-                break
-            consume_qty = min(b.quantity, remaining_to_consume)
-            remaining_to_consume -= consume_qty
-            batch_upd = sa_conn.execute(
-                update(_t_batches)
-                    .where(and_(
-                        _t_batches.c.id == b.id,
-                        _t_batches.c.quantity >= consume_qty,
-                        _t_batches.c.is_exhausted == 0,
-                    ))
-                    .values(
-                        quantity=_t_batches.c.quantity - consume_qty,
-                        is_exhausted=case(
-                            (_t_batches.c.quantity - consume_qty <= 0, 1),
-                            else_=0,
-                        ),
-                    )
-            )
-            if batch_upd.rowcount != 1:
-                raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
-            sa_conn.execute(
-                insert(_t_batch_consumptions).values(
-                    record_id=record_id, batch_id=b.id,
-                    quantity=consume_qty, created_at=now_dt,
+    for b in fifo_rows:
+        if remaining_to_consume <= 0:
+            break
+        consume_qty = min(b.quantity, remaining_to_consume)
+        remaining_to_consume -= consume_qty
+        batch_upd = sa_conn.execute(
+            update(_t_batches)
+                .where(and_(
+                    _t_batches.c.id == b.id,
+                    _t_batches.c.quantity >= consume_qty,
+                    _t_batches.c.is_exhausted == 0,
+                ))
+                .values(
+                    quantity=_t_batches.c.quantity - consume_qty,
+                    is_exhausted=case(
+                        (_t_batches.c.quantity - consume_qty <= 0, 1),
+                        else_=0,
+                    ),
                 )
+        )
+        if batch_upd.rowcount != 1:
+            raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
+        sa_conn.execute(
+            insert(_t_batch_consumptions).values(
+                record_id=record_id, batch_id=b.id,
+                quantity=consume_qty, created_at=now_dt,
             )
-            remaining_qty = max(b.quantity - consume_qty, 0)
-            batch_consumptions.append(BatchConsumption(
-                batch_no=b.batch_no, batch_id=b.id,
-                quantity=consume_qty, remaining=remaining_qty, variant=b.variant,
-            ))
+        )
+        remaining_qty = max(b.quantity - consume_qty, 0)
+        batch_consumptions.append(BatchConsumption(
+            batch_no=b.batch_no, batch_id=b.id,
+            quantity=consume_qty, remaining=remaining_qty, variant=b.variant,
+        ))
 
-        if remaining_to_consume > 0:
-            # FIFO did not cover the requested quantity (e.g. batch table
-            # under-counts vs materials.quantity, or scope filtered too
-            # aggressively). Raise inside the txn so the materials decrement
-            # and inventory_records insert above are rolled back.
-            raise HTTPException(
-                status_code=409,
-                detail=f"出库失败：{product_name} 可用批次不足，仍缺 {remaining_to_consume} {unit}，请检查批次/库位/变体筛选条件",
-            )
+    if remaining_to_consume > 0:
+        # FIFO did not cover the requested quantity (e.g. batch table
+        # under-counts vs materials.quantity, or scope filtered too
+        # aggressively). Raise inside the txn so the materials decrement
+        # and inventory_records insert above are rolled back.
+        raise HTTPException(
+            status_code=409,
+            detail=f"出库失败：{product_name} 可用批次不足，仍缺 {remaining_to_consume} {unit}，请检查批次/库位/变体筛选条件",
+        )
 
     # 出库不改索引（同上）。
 
-    audit_log("STOCK_OUT", current_user.id, current_user.username, {
+    after_commit.append(partial(audit_log, "STOCK_OUT", current_user.id, current_user.username, {
         "product": product_name, "quantity": quantity,
         "old_qty": old_quantity, "new_qty": new_quantity,
         "resolved_from": resolved_from,
         "batches": [bc.batch_no for bc in batch_consumptions],
-    })
+    }))
 
     warning = ""
     if safe_stock is not None and new_quantity < safe_stock:
@@ -5317,6 +5703,146 @@ async def stock_out(
     )
 
 
+def _begin_savepoint_outer(sa_conn) -> None:
+    """在外层事务里按行开 SAVEPOINT 之前调用。
+
+    pysqlite 旧式事务只在 DML 前隐式 BEGIN：若第一条语句就是 SAVEPOINT，这个
+    savepoint 本身成了最外层事务，RELEASE 即提交，外层再回滚也撤不回来。
+    """
+    if sa_conn.dialect.name == 'sqlite':
+        sa_conn.exec_driver_sql('BEGIN')
+
+
+def _prefetch_exact_materials(sa_conn, current_user: CurrentUser, wh_id: int, names) -> dict:
+    """一次 IN 查询取回 names 的精确匹配行（名称或 SKU），供 _stock_*_core 的 exact_rows。"""
+    names = list(names)
+    by_name = {n: [] for n in names}
+    for chunk in _chunked(names):
+        for r in sa_conn.execute(
+            select(
+                _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
+                _t_materials.c.unit, _t_materials.c.safe_stock,
+            ).where(and_(
+                or_(_t_materials.c.name.in_(chunk), _t_materials.c.sku.in_(chunk)),
+                _t_materials.c.is_disabled == 0,
+                *build_authorized_scope_predicates(_t_materials, current_user, wh_id),
+            )).order_by(_t_materials.c.id)
+        ):
+            hits = {r.name, r.sku} & by_name.keys()
+            for n in hits:
+                by_name[n].append(r)
+    return by_name
+
+
+@app.post("/api/materials/stock-movements:batch", response_model=StockMovementBatchResponse)
+@limiter.limit("20/minute")
+async def stock_movements_batch(
+    request: Request,
+    batch: StockMovementBatchRequest,
+    current_user: CurrentUser = Depends(require_permission(Resource.INVENTORY, Action.WRITE))
+):
+    """批量出入库：一次请求提交 N 行入库/出库（扫码枪拣货单、外部系统对接）。
+
+    每行的解析、FIFO、variant 归一、指定批次不足时的 partial fallback 与单条
+    stock-in / stock-out 完全一致（同一份实现），行与行按提交顺序在同一事务里执行，
+    后行能看到前行的扣减。精确名称/SKU 匹配一次 IN 查询预取。
+
+    - ``atomic=False``（默认）：每行一个 SAVEPOINT，失败行单独回滚，其余照常提交；
+    - ``atomic=True``：任一行失败整批回滚。
+    """
+    lines = batch.lines
+    if len(lines) > MAX_STOCK_BATCH_LINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多 {MAX_STOCK_BATCH_LINES} 行（收到 {len(lines)} 行）",
+        )
+
+    def _failed(line, status_code, detail):
+        resp_cls = StockInResponse if line.direction == "in" else StockOutResponse
+        return resp_cls(success=False, error=str(detail), message=str(detail)), status_code
+
+    # 仓库解析与权限：按仓库去重，只做一次
+    outcomes = [None] * len(lines)   # 预检就失败的行：(response, status_code)
+    line_wh = [None] * len(lines)
+    wh_checked = {}
+    for idx, line in enumerate(lines):
+        try:
+            wh_id = require_warehouse_id(current_user, line.warehouse_id or batch.warehouse_id)
+            if wh_id not in wh_checked:
+                try:
+                    check_warehouse_access(None, current_user, wh_id)
+                    wh_checked[wh_id] = None
+                except HTTPException as e:
+                    wh_checked[wh_id] = e
+            if wh_checked[wh_id] is not None:
+                raise wh_checked[wh_id]
+            line_wh[idx] = wh_id
+        except HTTPException as e:
+            outcomes[idx] = _failed(line, e.status_code, e.detail)
+
+    results = []
+    after_commit = []
+    with get_engine().connect() as sa_conn:
+        trans = sa_conn.begin()
+        try:
+            _begin_savepoint_outer(sa_conn)
+            exact_by_wh = {}
+            for wh_id in {w for w in line_wh if w is not None}:
+                exact_by_wh[wh_id] = _prefetch_exact_materials(
+                    sa_conn, current_user, wh_id,
+                    {line.product_name for line, w in zip(lines, line_wh) if w == wh_id},
+                )
+
+            for idx, line in enumerate(lines):
+                line_effects = []
+                if outcomes[idx] is None:
+                    line_req = line.model_copy(update={"warehouse_id": line_wh[idx]})
+                    core = _stock_in_core if line.direction == "in" else _stock_out_core
+                    savepoint = sa_conn.begin_nested()
+                    try:
+                        resp = core(sa_conn, line_req, current_user, line_effects,
+                                    exact_rows=exact_by_wh[line_wh[idx]][line.product_name])
+                    except HTTPException as e:
+                        savepoint.rollback()
+                        outcomes[idx] = _failed(line, e.status_code, e.detail)
+                    else:
+                        if resp.success:
+                            savepoint.commit()
+                            after_commit.extend(line_effects)
+                        else:
+                            savepoint.rollback()
+                        outcomes[idx] = (resp, 200)
+                resp, status_code = outcomes[idx]
+                results.append(StockMovementLineResult(
+                    index=idx, direction=line.direction, applied=resp.success,
+                    status_code=status_code, result=resp,
+                ))
+
+            failed = sum(1 for r in results if not r.applied)
+            if batch.atomic and failed:
+                trans.rollback()
+                after_commit = []
+                for r in results:
+                    r.applied = False
+            else:
+                trans.commit()
+        except BaseException:
+            if trans.is_active:
+                trans.rollback()
+            raise
+
+    _run_after_commit(after_commit)
+    applied = sum(1 for r in results if r.applied)
+    if batch.atomic and failed:
+        message = f"{failed} 行失败，整批已回滚（共 {len(lines)} 行）"
+    else:
+        message = f"共 {len(lines)} 行：成功 {applied} 行" + (f"，失败 {failed} 行" if failed else "")
+    return StockMovementBatchResponse(
+        success=failed == 0, applied=applied, failed=failed,
+        results=results, message=message,
+    )
+
+
 @app.post("/api/materials/batches/move-location", response_model=BatchMoveResponse)
 async def move_batch_location(
     request: BatchMoveRequest,
@@ -5463,12 +5989,11 @@ async def move_batch_location(
             if upd.rowcount != 1:
                 raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
 
-            # generate_batch_no 走独立连接看不到未提交行，拆分 INSERT 撞 unique
-            # (batches.batch_no UNIQUE) 时重试，最多 5 次。
+            # 在本事务内分配批次号；撞 unique（绕过分配器的手填号）时重试，最多 5 次。
             target_batch_id = None
             target_batch_no = None
             for _attempt in range(5):
-                candidate_no = generate_batch_no(batch.material_id, warehouse_id=wh_id)
+                candidate_no = generate_batch_no(batch.material_id, warehouse_id=wh_id, conn=sa_conn)
                 try:
                     ins = sa_conn.execute(
                         insert(_t_batches).values(
@@ -5499,23 +6024,21 @@ async def move_batch_location(
         # reason_note 用 BATCH_RELOCATE 前缀标识本次是库内库位移动而非跨仓调拨。
         if not full_move:
             relocate_note = f"BATCH_RELOCATE: {cur_loc or '（未设置）'} -> {new_location}"
-            sa_conn.execute(
-                insert(_t_inventory_records).values(
-                    material_id=batch.material_id, type=RecordType.OUT.value,
-                    quantity=move_qty, operator=operator, operator_user_id=operator_user_id,
-                    reason_category='transfer_out', reason_note=relocate_note,
-                    contact_id=batch.contact_id, batch_id=batch.id,
-                    warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
-                )
+            _insert_inventory_record(
+                sa_conn,
+                material_id=batch.material_id, type=RecordType.OUT.value,
+                quantity=move_qty, operator=operator, operator_user_id=operator_user_id,
+                reason_category='transfer_out', reason_note=relocate_note,
+                contact_id=batch.contact_id, batch_id=batch.id,
+                warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
             )
-            sa_conn.execute(
-                insert(_t_inventory_records).values(
-                    material_id=batch.material_id, type=RecordType.IN.value,
-                    quantity=move_qty, operator=operator, operator_user_id=operator_user_id,
-                    reason_category='transfer_in', reason_note=relocate_note,
-                    contact_id=batch.contact_id, batch_id=target_batch_id,
-                    warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
-                )
+            _insert_inventory_record(
+                sa_conn,
+                material_id=batch.material_id, type=RecordType.IN.value,
+                quantity=move_qty, operator=operator, operator_user_id=operator_user_id,
+                reason_category='transfer_in', reason_note=relocate_note,
+                contact_id=batch.contact_id, batch_id=target_batch_id,
+                warehouse_id=wh_id, tenant_id=record_tenant_id, created_at=now_dt,
             )
 
     # 移位不动 materials 表（既不改 name 也不改 variant），fuzzy matcher 的
@@ -5561,6 +6084,18 @@ async def move_batch_location(
 
 # ============ Excel Import/Export APIs ============
 
+# 流式导出每批从游标取的行数（MySQL 走服务端游标，SQLite 本就惰性取数）
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+# Excel 导入预览 / 确认里批量 IN 查询每批参数个数（老版本 SQLite 单条语句上限 999 个变量）
+IMPORT_IN_CHUNK = 500
+
+
+def _chunked(seq, size=IMPORT_IN_CHUNK):
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
 @app.get("/api/materials/export-excel")
 def export_materials_excel(
     name: Optional[str] = Query(None, description="名称/SKU模糊搜索"),
@@ -5569,7 +6104,9 @@ def export_materials_excel(
     warehouse_id: Optional[int] = Query(None, description="仓库ID"),
     current_user: CurrentUser = Depends(require_permission(Resource.MATERIALS, Action.READ))
 ):
-    """导出库存数据为Excel — 一行一批次，含批次号、位置、联系方 — Phase 3f: SA Core read."""
+    """导出库存数据为Excel — 一行一批次，含批次号、位置、联系方 — Phase 3f: SA Core read.
+
+    流式导出：游标分批取数、边编码边发送（xlsx_stream），内存与行数无关。"""
     wh_id = resolve_warehouse_id(current_user, warehouse_id)
 
     # 解析状态筛选
@@ -5584,135 +6121,88 @@ def export_materials_excel(
     if category:
         preds.append(_t_materials.c.category == category)
 
-    mat_stmt = select(
-        _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
-        _t_materials.c.category,
-        _sa_func.coalesce(
-            select(_sa_func.sum(_t_batches.c.quantity))
-            .where(and_(
+    # 一条语句流式取「物料 × 活跃批次」：按物料分组连续到达，物料总库存在 Python 侧
+    # 对同组批次求和（等价原先的相关子查询），不再逐物料 N+1 查批次。
+    export_stmt = (
+        select(
+            _t_materials.c.id, _t_materials.c.name, _t_materials.c.sku,
+            _t_materials.c.category, _t_materials.c.unit,
+            _t_materials.c.safe_stock, _t_materials.c.location, _t_materials.c.is_disabled,
+            _t_batches.c.id.label('batch_id'),
+            _t_batches.c.batch_no, _t_batches.c.quantity.label('batch_quantity'),
+            _t_batches.c.location.label('batch_location'), _t_batches.c.variant,
+            _t_contacts.c.name.label('contact_name'),
+        )
+        .select_from(
+            _t_materials
+            .outerjoin(_t_batches, and_(
                 _t_batches.c.material_id == _t_materials.c.id,
                 _t_batches.c.is_exhausted == 0,
             ))
-            .scalar_subquery(),
-            0,
-        ).label('quantity'),
-        _t_materials.c.unit,
-        _t_materials.c.safe_stock, _t_materials.c.location, _t_materials.c.is_disabled,
-    ).order_by(_t_materials.c.name.asc())
+            .outerjoin(_t_contacts, _t_batches.c.contact_id == _t_contacts.c.id)
+        )
+        .order_by(_t_materials.c.name.asc(), _t_materials.c.id.asc(),
+                  _t_batches.c.created_at.asc(), _t_batches.c.id.asc())
+    )
     if preds:
-        mat_stmt = mat_stmt.where(and_(*preds))
-
-    with get_engine().connect() as sa_conn:
-        rows = sa_conn.execute(mat_stmt).fetchall()
+        export_stmt = export_stmt.where(and_(*preds))
 
-        # 构建导出行（一行一批次）
-        export_rows = []
-        for row in rows:
-            quantity = int(row.quantity or 0)
-            safe_stock = row.safe_stock
-            is_disabled = bool(row.is_disabled)
+    def _material_rows(group):
+        """一个物料的全部行 → 导出行（一行一批次；无活跃批次出一行 0 库存）。"""
+        first = group[0]
+        batches = [r for r in group if r.batch_id is not None]
+        quantity = int(sum(r.batch_quantity or 0 for r in batches))
+        safe_stock = first.safe_stock
 
-            # 计算状态
-            if is_disabled:
-                item_status = 'disabled'
-            elif safe_stock is not None:
-                if quantity >= safe_stock:
-                    item_status = 'normal'
-                elif quantity >= safe_stock * 0.5:
-                    item_status = 'warning'
-                else:
-                    item_status = 'danger'
-            else:
+        # 计算状态
+        if first.is_disabled:
+            item_status = 'disabled'
+        elif safe_stock is not None:
+            if quantity >= safe_stock:
                 item_status = 'normal'
-
-            # 状态筛选
-            if status_filter and item_status not in status_filter:
-                continue
-
-            material_base = {
-                'name': row.name,
-                'sku': row.sku,
-                'category': row.category,
-                'unit': row.unit,
-                'safe_stock': row.safe_stock,
-            }
-
-            # 查询活跃批次
-            batch_stmt = (
-                select(
-                    _t_batches.c.batch_no, _t_batches.c.quantity,
-                    _t_batches.c.location, _t_batches.c.variant,
-                    _t_contacts.c.name.label('contact_name'),
-                )
-                .select_from(
-                    _t_batches.outerjoin(_t_contacts, _t_batches.c.contact_id == _t_contacts.c.id)
-                )
-                .where(and_(
-                    _t_batches.c.material_id == row.id,
-                    _t_batches.c.is_exhausted == 0,
-                ))
-                .order_by(_t_batches.c.created_at.asc())
-            )
-            batches = sa_conn.execute(batch_stmt).fetchall()
-
-            if batches:
-                for batch in batches:
-                    export_rows.append({
-                        **material_base,
-                        'batch_no': batch.batch_no,
-                        'quantity': batch.quantity,
-                        'location': batch.location or '',
-                        'contact_name': batch.contact_name or '',
-                        'variant': batch.variant or '',
-                    })
+            elif quantity >= safe_stock * 0.5:
+                item_status = 'warning'
             else:
-                # 无活跃批次（库存为0的物料）
-                export_rows.append({
-                    **material_base,
-                    'batch_no': '',
-                    'quantity': 0,
-                    'location': row.location or '',
-                    'contact_name': '',
-                    'variant': '',
-                })
-
-    from openpyxl import Workbook
+                item_status = 'danger'
+        else:
+            item_status = 'normal'
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "库存数据"
+        # 状态筛选
+        if status_filter and item_status not in status_filter:
+            return
 
-    # 表头
-    headers = ['物料名称', '规格', '物料编码(SKU)', '分类', '单位', '安全库存', '批次号', '库存', '存放位置', '联系方']
-    for col, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col, value=header)
-
-    # 数据
-    for row_idx, item in enumerate(export_rows, 2):
-        ws.cell(row=row_idx, column=1, value=item['name'])
-        ws.cell(row=row_idx, column=2, value=item['variant'])
-        ws.cell(row=row_idx, column=3, value=item['sku'])
-        ws.cell(row=row_idx, column=4, value=item['category'])
-        ws.cell(row=row_idx, column=5, value=item['unit'])
-        ws.cell(row=row_idx, column=6, value=item['safe_stock'])
-        ws.cell(row=row_idx, column=7, value=item['batch_no'])
-        ws.cell(row=row_idx, column=8, value=item['quantity'])
-        ws.cell(row=row_idx, column=9, value=item['location'])
-        ws.cell(row=row_idx, column=10, value=item['contact_name'])
-
-    # 设置列宽
-    column_widths = [22, 10, 18, 14, 8, 12, 18, 10, 16, 16]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[chr(64 + i)].width = width
+        base = (first.name, first.sku, first.category, first.unit, safe_stock)
+        if not batches:
+            # 无活跃批次（库存为0的物料）
+            yield (base[0], '', base[1], base[2], base[3], base[4],
+                   '', 0, first.location or '', '')
+            return
+        for b in batches:
+            yield (base[0], b.variant or '', base[1], base[2], base[3], base[4],
+                   b.batch_no, b.batch_quantity, b.batch_location or '', b.contact_name or '')
 
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    def _export_rows():
+        with get_engine().connect() as sa_conn:
+            result = sa_conn.execution_options(yield_per=EXPORT_FETCH_SIZE).execute(export_stmt)
+            group = []
+            for row in result:
+                if group and row.id != group[0].id:
+                    yield from _material_rows(group)
+                    group = []
+                group.append(row)
+            if group:
+                yield from _material_rows(group)
 
     filename = f"inventory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        iter_xlsx(
+            _export_rows(),
+            headers=['物料名称', '规格', '物料编码(SKU)', '分类', '单位', '安全库存',
+                     '批次号', '库存', '存放位置', '联系方'],
+            sheet_title="库存数据",
+            column_widths=[22, 10, 18, 14, 8, 12, 18, 10, 16, 16],
+        ),
+        media_type=XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
@@ -5754,31 +6244,29 @@ async def preview_import_excel(
             success=False, preview=[], new_skus=[], total_in=0, total_out=0, total_new=0, message=msg
         )
 
-    # 文件大小检查
-    contents = await file.read()
-    file_size_mb = len(contents) / (1024 * 1024)
+    # 文件大小检查：UploadFile 底层是会落盘的 SpooledTemporaryFile，不整块读进内存
+    upload = file.file
+    upload.seek(0, os.SEEK_END)
+    file_size_mb = upload.tell() / (1024 * 1024)
+    upload.seek(0)
     if file_size_mb > MAX_UPLOAD_SIZE_MB:
         return _error_resp(f"文件大小 ({file_size_mb:.1f}MB) 超过限制 ({MAX_UPLOAD_SIZE_MB}MB)")
 
+    # 单遍流式解析（openpyxl read_only）：每行同时给出公式的缓存结果值和
+    # 「这格是公式」标记。取缓存值是必须的，否则拿到的是公式字符串本身
+    # （现场见过 '=+IFERROR(VLOOKUP(...),"临时库位")' 被当作库位写进 batches）；
+    # 公式标记用来区分「这格本来就空」和「这格是公式但没算过」。
+    sheet_rows = iter_xlsx_rows(upload, max_unzipped_bytes=MAX_IMPORT_UNZIPPED_MB * 1024 * 1024)
     try:
-        from openpyxl import load_workbook
-
-        # data_only=True 取公式的缓存结果值；否则 openpyxl 返回公式字符串本身
-        # （现场见过 '=+IFERROR(VLOOKUP(...),"临时库位")' 被当作库位写进 batches）。
-        wb = load_workbook(filename=BytesIO(contents), data_only=True)
-        ws = wb.active
-        # 再读一份公式视图，用来区分「这格本来就空」和「这格是公式但没算过」。
-        # 后者取不到缓存值会静默变空，必须在预览里说清楚，否则客户只会看到
-        # 库位莫名消失。失败不影响导入，只是拿不到告警。
-        try:
-            ws_formula = load_workbook(filename=BytesIO(contents), data_only=False).active
-        except Exception:
-            ws_formula = None
+        first_row = next(sheet_rows, None)
+    except XlsxTooLarge as e:
+        return _error_resp(f"文件内容过大：{e}")
     except Exception as e:
         return _error_resp(f"文件解析失败: {str(e)}")
 
     # 读取表头，自动识别列位置
-    header_row = [str(cell).strip() if cell else "" for cell in next(ws.iter_rows(min_row=1, max_row=1, values_only=True))]
+    header_values = first_row[1] if first_row is not None and first_row[0] == 1 else ()
+    header_row = [str(cell).strip() if cell else "" for cell in header_values]
     header_set = set(header_row)
     if {'记录类型', '操作人', '时间'}.issubset(header_set):
         return _error_resp("Excel格式错误：这是出入库记录导出文件，不能作为库存导入模板。请从“库存列表”导出 inventory_*.xlsx 后再导入。")
@@ -5822,19 +6310,6 @@ async def preview_import_excel(
     if col_mapping['quantity'] is None:
         return _error_resp("Excel格式错误：找不到库存/数量列")
 
-    data_rows = list(ws.iter_rows(min_row=2, values_only=True))
-    is_batch_mode = False
-    if col_mapping['batch_no'] is not None:
-        batch_idx = col_mapping['batch_no']
-        has_batch_values = any(
-            batch_idx < len(row) and row[batch_idx] not in (None, '')
-            for row in data_rows
-        )
-        # 旧版库存导出模板包含空的“批次号”和“变体”列，语义是整库快照；
-        # 普通批次模板只要有“批次号”列，即使单行为空，也表示导入为新批次。
-        is_legacy_empty_batch_snapshot = not has_batch_values and col_mapping['variant'] is not None
-        is_batch_mode = has_batch_values or not is_legacy_empty_batch_snapshot
-
     def _read_cell(row, key):
         ci = col_mapping[key]
         if ci is None or ci >= len(row) or row[ci] is None:
@@ -5847,82 +6322,46 @@ async def preview_import_excel(
             return default
         return int(row[ci])
 
-    def _collect_formula_warnings():
-        """找出「是公式、但取不到结果值」的单元格，按列汇总成人话。
-
-        两种都要报：
-        - 缓存值为空 → 该列导入后会变空（文件没被 Excel/WPS 计算保存过）
-        - 缓存值本身就是 '=' 开头 → 会被 _sanitize_import_text 丢掉
-        只看真正会落库的几列，行号按 Excel 的 1-based 给，方便客户直接跳过去看。
-        """
-        if ws_formula is None:
-            return []
-        watched = [('location', '存放位置'), ('contact_name', '联系方'), ('unit', '单位')]
-        out = []
-        for key, label in watched:
-            ci = col_mapping.get(key)
-            if ci is None:
-                continue
-            rows = []
-            for i, row in enumerate(data_rows):
-                excel_row = i + 2                      # 表头占第 1 行
-                cached = row[ci] if ci < len(row) else None
-                if cached is not None and not str(cached).strip().startswith('='):
-                    continue                            # 有正常值，不用管
-                raw = ws_formula.cell(excel_row, ci + 1).value
-                if isinstance(raw, str) and raw.startswith('='):
-                    rows.append(excel_row)
-            if rows:
-                shown = '、'.join(str(r) for r in rows[:5])
-                more = f" 等 {len(rows)} 行" if len(rows) > 5 else ""
-                out.append(
-                    f"「{label}」列有 {len(rows)} 个单元格是公式且没有可用的计算结果"
-                    f"（第 {shown} 行{more}），导入后这些格会是空值。"
-                    f"请在 Excel/WPS 里打开该文件、确认这列显示的是计算结果后另存，再重新导入。"
-                )
-        return out
-
-    formula_warnings = _collect_formula_warnings()
-
-    preview_items = []
-    new_skus = []
-    new_contacts_set = set()
-    seen_skus_simple = set()  # 简化模式下追踪已见SKU，检测同SKU多行
-    # {sku: 出现行数}，仅简化模式收集，用于预览告警
-    simple_sku_row_counts: dict = {}
-    sku_excel_names = {}  # SKU → [(preview_item_index, excel_name), ...] 用于后处理提取 variant
-    has_variant_col = col_mapping['variant'] is not None
-    total_in = 0
-    total_out = 0
-    total_new = 0
+    # 「是公式、但取不到结果值」的单元格，按列汇总成人话。两种都要报：
+    # - 缓存值为空 → 该列导入后会变空（文件没被 Excel/WPS 计算保存过）
+    # - 缓存值本身就是 '=' 开头 → 会被 _sanitize_import_text 丢掉
+    # 只看真正会落库的几列，行号按 Excel 的 1-based 给，方便客户直接跳过去看。
+    watched_formula_cols = [
+        (key, label, col_mapping[key])
+        for key, label in (('location', '存放位置'), ('contact_name', '联系方'), ('unit', '单位'))
+        if col_mapping[key] is not None
+    ]
+    formula_rows = {key: [] for key, _, _ in watched_formula_cols}   # 只留前 5 个行号
+    formula_counts = {key: 0 for key, _, _ in watched_formula_cols}
+
+    # 同一遍里解析、校验、去重，只缓存归一化后的字段（受 MAX_IMPORT_ROWS 约束）；
+    # 批次模式要看完全部行才能判定，所以匹配数据库放在读完之后。
+    sku_ci = col_mapping['sku']
+    batch_ci = col_mapping['batch_no']
+    has_batch_values = False
+    parsed_rows = []
     row_count = 0
     duplicate_rows = 0
     seen_import_rows = set()
-
-    with get_engine().connect() as sa_conn:
-
-        # 联系方为租户级（不绑定仓库），用 tenant 单独构造 scope
-        contact_tenant_id = resolve_tenant_id_for_write(current_user, wh_id) if wh_id is not None else current_user.tenant_id
-        contact_preds_base = list(build_scope_predicates(_t_contacts, contact_tenant_id, None))
-        mat_scope_preds = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
-
-        # 联系方解析辅助
-        def resolve_contact(name):
-            if not name:
-                return None, None
-            stmt = select(_t_contacts.c.id).where(and_(
-                _t_contacts.c.name == name,
-                _t_contacts.c.is_disabled == 0,
-                *contact_preds_base,
-            ))
-            r = sa_conn.execute(stmt).first()
-            if r:
-                return r.id, name
-            new_contacts_set.add(name)
-            return None, name
-
-        for idx, row in enumerate(data_rows, start=2):
-            if not row[col_mapping['sku']]:
+    try:
+        for idx, row, formula_cols in sheet_rows:
+            if idx == 1:
+                continue
+            if (batch_ci is not None and not has_batch_values
+                    and batch_ci < len(row) and row[batch_ci] not in (None, '')):
+                has_batch_values = True
+            if formula_cols:
+                for key, _label, ci in watched_formula_cols:
+                    if ci not in formula_cols:
+                        continue
+                    cached = row[ci] if ci < len(row) else None
+                    if cached is not None and not str(cached).strip().startswith('='):
+                        continue                        # 有正常值，不用管
+                    formula_counts[key] += 1
+                    if len(formula_rows[key]) < 5:
+                        formula_rows[key].append(idx)
+
+            if sku_ci >= len(row) or not row[sku_ci]:
                 continue
 
             row_count += 1
@@ -5949,7 +6388,6 @@ async def preview_import_excel(
                 return _error_resp(f"第 {idx} 行【安全库存】格式错误：需要整数，当前值为 '{row[col_mapping['safe_stock']]}'")
 
             variant_val = _read_cell(row, 'variant') or ""
-            contact_id, contact_name = resolve_contact(contact_name_val) if contact_name_val else (None, None)
             row_key = (
                 sku, name, category, unit, safe_stock, location,
                 batch_no_val, variant_val, contact_name_val, import_qty
@@ -5958,11 +6396,58 @@ async def preview_import_excel(
                 duplicate_rows += 1
                 continue
             seen_import_rows.add(row_key)
+            parsed_rows.append(row_key)
+    except XlsxTooLarge as e:
+        return _error_resp(f"文件内容过大：{e}")
+    except Exception as e:
+        return _error_resp(f"文件解析失败: {str(e)}")
+
+    is_batch_mode = False
+    if batch_ci is not None:
+        # 旧版库存导出模板包含空的“批次号”和“变体”列，语义是整库快照；
+        # 普通批次模板只要有“批次号”列，即使单行为空，也表示导入为新批次。
+        is_legacy_empty_batch_snapshot = not has_batch_values and col_mapping['variant'] is not None
+        is_batch_mode = has_batch_values or not is_legacy_empty_batch_snapshot
+
+    formula_warnings = []
+    for key, label, _ci in watched_formula_cols:
+        count = formula_counts[key]
+        if count:
+            shown = '、'.join(str(r) for r in formula_rows[key])
+            more = f" 等 {count} 行" if count > 5 else ""
+            formula_warnings.append(
+                f"「{label}」列有 {count} 个单元格是公式且没有可用的计算结果"
+                f"（第 {shown} 行{more}），导入后这些格会是空值。"
+                f"请在 Excel/WPS 里打开该文件、确认这列显示的是计算结果后另存，再重新导入。"
+            )
 
-            # 查询物料（按仓库过滤）— 单一真相源：quantity 来自 active batches sum
-            material = sa_conn.execute(
+    preview_items = []
+    new_skus = []
+    new_contacts_set = set()
+    seen_skus_simple = set()  # 简化模式下追踪已见SKU，检测同SKU多行
+    # {sku: 出现行数}，仅简化模式收集，用于预览告警
+    simple_sku_row_counts: dict = {}
+    sku_excel_names = {}  # SKU → [(preview_item_index, excel_name), ...] 用于后处理提取 variant
+    has_variant_col = col_mapping['variant'] is not None
+    total_in = 0
+    total_out = 0
+    total_new = 0
+
+    with get_engine().connect() as sa_conn:
+
+        # 联系方为租户级（不绑定仓库），用 tenant 单独构造 scope
+        contact_tenant_id = resolve_tenant_id_for_write(current_user, wh_id) if wh_id is not None else current_user.tenant_id
+        contact_preds_base = list(build_scope_predicates(_t_contacts, contact_tenant_id, None))
+        mat_scope_preds = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
+
+        # 批量 IN 查询取代逐行查询：物料（按仓库过滤；同 SKU 多条取 id 最小者）
+        # — 单一真相源：quantity 来自 active batches sum
+        materials_by_sku = {}
+        for chunk in _chunked({r[0] for r in parsed_rows}):
+            for m in sa_conn.execute(
                 select(
                     _t_materials.c.id,
+                    _t_materials.c.sku,
                     _t_materials.c.name,
                     _sa_func.coalesce(
                         select(_sa_func.sum(_t_batches.c.quantity))
@@ -5974,8 +6459,52 @@ async def preview_import_excel(
                         0,
                     ).label('quantity'),
                 )
-                .where(and_(_t_materials.c.sku == sku, *mat_scope_preds))
-            ).first()
+                .where(and_(_t_materials.c.sku.in_(chunk), *mat_scope_preds))
+                .order_by(_t_materials.c.id)
+            ):
+                materials_by_sku.setdefault(m.sku, m)
+
+        # 批次模式：(material_id, batch_no) → 已有批次当前库存
+        batch_qty_by_key = {}
+        if is_batch_mode:
+            batch_keys = {
+                (materials_by_sku[r[0]].id, r[6]) for r in parsed_rows
+                if r[6] and r[0] in materials_by_sku
+            }
+            for chunk in _chunked(batch_keys):
+                for material_id, batch_no, quantity in sa_conn.execute(
+                    select(_t_batches.c.material_id, _t_batches.c.batch_no, _t_batches.c.quantity)
+                    .where(tuple_(_t_batches.c.material_id, _t_batches.c.batch_no).in_(chunk))
+                    .order_by(_t_batches.c.id)
+                ):
+                    batch_qty_by_key.setdefault((material_id, batch_no), quantity)
+
+        contact_ids_by_name = {}
+        for chunk in _chunked({r[8] for r in parsed_rows if r[8]}):
+            for cid, cname in sa_conn.execute(
+                select(_t_contacts.c.id, _t_contacts.c.name)
+                .where(and_(
+                    _t_contacts.c.name.in_(chunk),
+                    _t_contacts.c.is_disabled == 0,
+                    *contact_preds_base,
+                ))
+                .order_by(_t_contacts.c.id)
+            ):
+                contact_ids_by_name.setdefault(cname, cid)
+
+        # 联系方解析辅助
+        def resolve_contact(name):
+            if not name:
+                return None, None
+            if name in contact_ids_by_name:
+                return contact_ids_by_name[name], name
+            new_contacts_set.add(name)
+            return None, name
+
+        for (sku, name, category, unit, safe_stock, location,
+             batch_no_val, variant_val, contact_name_val, import_qty) in parsed_rows:
+            contact_id, contact_name = resolve_contact(contact_name_val) if contact_name_val else (None, None)
+            material = materials_by_sku.get(sku)
 
             if is_batch_mode:
                 # === 批次模式：每行 = 一个批次 ===
@@ -5983,13 +6512,9 @@ async def preview_import_excel(
                     material_id = material.id
                     if batch_no_val:
                         # 查找已有批次
-                        batch = sa_conn.execute(
-                            select(_t_batches.c.id, _t_batches.c.quantity)
-                            .where(and_(_t_batches.c.batch_no == batch_no_val,
-                                        _t_batches.c.material_id == material_id))
-                        ).first()
-                        if batch:
-                            current_qty = batch.quantity
+                        batch_key = (material_id, batch_no_val)
+                        if batch_key in batch_qty_by_key:
+                            current_qty = batch_qty_by_key[batch_key]
                             difference = import_qty - current_qty
                             if difference > 0:
                                 operation = RecordType.IN.value
@@ -6197,12 +6722,99 @@ async def preview_import_excel(
     )
 
 
+class _PlannedRow:
+    """导入计划里的一行待插入数据，写库后 ``id`` 回填为真实主键。
+
+    ``values`` 引用其它待插入行（联系方 / 物料 / 批次）时直接放 _PlannedRow，
+    按 联系方 → 物料 → 批次 → 记录 的顺序写入，引用在写入时解析成主键。
+    """
+    __slots__ = ("values", "id")
+
+    def __init__(self, values):
+        self.values = values
+        self.id = None
+
+
+def _row_id(ref):
+    return ref.id if isinstance(ref, _PlannedRow) else ref
+
+
+class _ImportBatch:
+    """导入推演中的一个批次：已有批次记 ``orig_quantity`` 作并发守卫，新批次 ``ref`` 为 _PlannedRow。"""
+    __slots__ = ("ref", "batch_no", "quantity", "orig_quantity", "location", "variant",
+                 "in_scope", "overwritten", "relocated")
+
+    def __init__(self, ref, batch_no, quantity, location=None, variant=None, in_scope=True):
+        self.ref = ref
+        self.batch_no = batch_no
+        self.quantity = quantity
+        self.orig_quantity = quantity
+        self.location = location
+        self.variant = variant
+        self.in_scope = in_scope
+        self.overwritten = False  # 批次模式按 Excel 覆盖了数量
+        self.relocated = False    # 仅改了库位
+
+
+def _insert_planned_rows(sa_conn, table, planned):
+    """批量插入 ``planned`` 并按参数顺序回填主键。
+
+    方言支持 executemany + RETURNING（SQLite ≥ 3.35、MariaDB）时走多行
+    INSERT ... RETURNING。不用 ``sort_by_parameter_order``：SQLite 没有隐式
+    sentinel，SA 会退化成逐行执行；而同一条多行 INSERT 的自增 id 按 VALUES
+    顺序单调递增，返回的 id 排序后即与参数一一对应。
+    MySQL 没有 RETURNING，退回逐行 INSERT 取自增 id。
+    """
+    if not planned:
+        return
+    rows = [{k: _row_id(v) for k, v in p.values.items()} for p in planned]
+    if sa_conn.dialect.insert_executemany_returning:
+        ids = sorted(sa_conn.execute(insert(table).returning(table.c.id), rows).scalars().all())
+    else:
+        ids = [sa_conn.execute(insert(table).values(**row)).inserted_primary_key[0] for row in rows]
+    for p, new_id in zip(planned, ids):
+        p.id = new_id
+
+
+def _execute_many_rowcount(sa_conn, stmt, params):
+    """executemany 并返回命中行数；驱动不报告多行 rowcount 时逐条执行累加。"""
+    if not params:
+        return 0
+    if sa_conn.dialect.supports_sane_multi_rowcount:
+        return sa_conn.execute(stmt, params).rowcount
+    return sum(sa_conn.execute(stmt, p).rowcount for p in params)
+
+
+jobs.register_job_type('excel_import', limit=2)
+
+
 @app.post("/api/materials/import-excel/confirm", response_model=ExcelImportResponse)
 async def confirm_import_excel(
     request: ExcelImportConfirm,
+    background: bool = False,
     current_user: CurrentUser = Depends(require_permission(Resource.MATERIALS, Action.WRITE))
 ):
-    """确认导入，执行变更单（需要operate权限）— 统一创建批次"""
+    """确认导入，执行变更单（需要operate权限）— 统一创建批次
+
+    集合式执行：几条 IN 查询预加载涉及的物料 / 联系方 / 批次 → 在内存里按行序
+    推演全部变更（库存校验、FIFO 扣减、批次号分配）→ 按表 executemany 批量写入。
+    任一行校验失败都在写库之前返回；写锁只覆盖最后的批量写入阶段，
+    不再随行数逐行往返。
+
+    ``background=true``：返回 202 + 后台任务，结果（即本接口的响应体）在任务
+    ``result`` 里。
+    """
+    wh_id = require_warehouse_id(current_user, request.warehouse_id)
+    if background:
+        return jobs.submit_job_response(
+            'excel_import', _confirm_import_excel, request, current_user,
+            tenant_id=resolve_tenant_id_for_write(current_user, wh_id), user=current_user,
+        )
+    return _confirm_import_excel(None, request, current_user)
+
+
+def _confirm_import_excel(ctx, request: ExcelImportConfirm, current_user: CurrentUser) -> ExcelImportResponse:
+    """confirm_import_excel 的实现；``ctx`` 为后台任务句柄（同步调用时为 None）。"""
     wh_id = require_warehouse_id(current_user, request.warehouse_id)
     in_count = 0
     out_count = 0
@@ -6222,51 +6834,62 @@ async def confirm_import_excel(
     for cid in seen_contact_ids:
         ensure_contact_tenant(None, current_user, cid, target_tenant_for_contacts)
 
+    def _failed(message):
+        # 推演阶段发现的失败：此时尚未写库，直接返回即等价于原来的整单回滚
+        return ExcelImportResponse(
+            success=False, in_count=in_count, out_count=out_count,
+            new_count=new_count, records_created=records_created, message=message,
+        )
+
     with get_engine().begin() as sa_conn:
         # 收集导入文件中的所有SKU
         import_skus = set(item.sku for item in request.changes)
-
-        # 将不在导入文件中的SKU标记为禁用（需显式确认，仅限当前仓库）
         mat_scope_preds = list(build_authorized_scope_predicates(_t_materials, current_user, wh_id))
-        if import_skus:
-            if request.confirm_disable_missing_skus:
-                sa_conn.execute(
-                    update(_t_materials)
-                    .where(and_(_t_materials.c.sku.notin_(list(import_skus)), *mat_scope_preds))
-                    .values(is_disabled=1)
-                )
-            else:
-                warnings.append("已跳过禁用导入文件之外的SKU，如需禁用请勾选确认选项后重试。")
-            sa_conn.execute(
-                update(_t_materials)
-                .where(and_(_t_materials.c.sku.in_(list(import_skus)), *mat_scope_preds))
-                .values(is_disabled=0)
-            )
-
-        # 前置：创建新联系方（联系方为租户级，不绑定仓库）
         contact_tenant_id = resolve_tenant_id_for_write(current_user, wh_id)
         contact_scope_preds = list(build_scope_predicates(_t_contacts, contact_tenant_id, None))
+        wh_tenant_id = resolve_tenant_id_for_write(current_user, wh_id)
+
+        def _in_batch_scope(tenant_id, warehouse_id):
+            # build_scope_predicates(_t_batches, wh_tenant_id, wh_id) 的内存版
+            return ((wh_tenant_id is None or tenant_id == wh_tenant_id)
+                    and (wh_id is None or warehouse_id == wh_id))
+
+        # ===== 1. 预加载 =====
+        # sku → 物料 id（本次新建的物料为 _PlannedRow）；同 SKU 多条取 id 最小者
+        sku_to_material = {}
+        for chunk in _chunked(import_skus):
+            for mid, sku in sa_conn.execute(
+                select(_t_materials.c.id, _t_materials.c.sku)
+                .where(and_(_t_materials.c.sku.in_(chunk), *mat_scope_preds))
+                .order_by(_t_materials.c.id)
+            ):
+                sku_to_material.setdefault(sku, mid)
+
+        # 联系方为租户级，不绑定仓库；库里没有的名字按首次出现顺序新建
+        pending_contact_names = list(dict.fromkeys(
+            item.contact_name for item in request.changes
+            if item.contact_name and not item.contact_id
+        ))
         contact_name_to_id = {}
-        for item in request.changes:
-            if item.contact_name and not item.contact_id:
-                if item.contact_name not in contact_name_to_id:
-                    existing = sa_conn.execute(
-                        select(_t_contacts.c.id).where(and_(
-                            _t_contacts.c.name == item.contact_name,
-                            _t_contacts.c.is_disabled == 0,
-                            *contact_scope_preds,
-                        ))
-                    ).first()
-                    if existing:
-                        contact_name_to_id[item.contact_name] = existing.id
-                    else:
-                        ins_res = sa_conn.execute(
-                            insert(_t_contacts).values(
-                                name=item.contact_name, is_supplier=1, warehouse_id=None,
-                                tenant_id=contact_tenant_id, created_at=now_dt,
-                            )
-                        )
-                        contact_name_to_id[item.contact_name] = ins_res.inserted_primary_key[0]
+        for chunk in _chunked(pending_contact_names):
+            for cid, name in sa_conn.execute(
+                select(_t_contacts.c.id, _t_contacts.c.name)
+                .where(and_(
+                    _t_contacts.c.name.in_(chunk),
+                    _t_contacts.c.is_disabled == 0,
+                    *contact_scope_preds,
+                ))
+                .order_by(_t_contacts.c.id)
+            ):
+                contact_name_to_id.setdefault(name, cid)
+        new_contacts = []
+        for name in pending_contact_names:
+            if name not in contact_name_to_id:
+                contact_name_to_id[name] = _PlannedRow(dict(
+                    name=name, is_supplier=1, warehouse_id=None,
+                    tenant_id=contact_tenant_id, created_at=now_dt,
+                ))
+                new_contacts.append(contact_name_to_id[name])
 
         def _get_contact_id(item):
             if item.contact_id:
@@ -6275,50 +6898,105 @@ async def confirm_import_excel(
                 return contact_name_to_id[item.contact_name]
             return None
 
-        wh_tenant_id = resolve_tenant_id_for_write(current_user, wh_id)
-        batch_scope_preds = list(build_scope_predicates(_t_batches, wh_tenant_id, wh_id))
-
-        # In-session batch_no allocator. generate_batch_no(material_id) without a
-        # cursor only sees committed rows, so consecutive calls inside one txn
-        # would collide. Track allocated numbers in-memory and bump the suffix
-        # until unique.
-        today_prefix = datetime.now().strftime('%Y%m%d')
-        allocated_batch_nos = set()
-        _next_batch_seq = None  # lazily seeded from the committed max on first use
-
-        def _alloc_batch_no(material_id):
-            # Seed once: generate_batch_no opens its own connection, so calling it
-            # per row would re-scan today's batches N times and always return the
-            # same committed-max + 1 anyway.
-            nonlocal _next_batch_seq
-            if _next_batch_seq is None:
-                base = generate_batch_no(material_id, warehouse_id=wh_id)
-                try:
-                    _next_batch_seq = int(base.split('-')[-1])
-                except (ValueError, IndexError):
-                    _next_batch_seq = 1
-            while True:
-                candidate = f'{today_prefix}-{_next_batch_seq:03d}'
-                _next_batch_seq += 1
-                if candidate not in allocated_batch_nos:
-                    allocated_batch_nos.add(candidate)
-                    return candidate
-
-        def _create_batch(material_id, quantity, location, contact_id, variant=None, batch_no=None):
-            """创建新批次并返回 batch_id"""
-            bn = batch_no or _alloc_batch_no(material_id)
-            ins_res = sa_conn.execute(
-                insert(_t_batches).values(
-                    batch_no=bn, material_id=material_id, quantity=quantity,
-                    initial_quantity=quantity, contact_id=contact_id,
-                    location=location, variant=variant,
-                    warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
-                )
+        # FOR UPDATE 锁住涉及的批次行：Excel 导入是 overwrite quantity 语义，
+        # 两份并发 Excel 同时 import 同批次会丢更新；锁让它们串行化
+        # （codex audit adf4d1b463d92850e HIGH）。SQLite 无行锁，靠写入阶段的守卫 UPDATE 兜底。
+        batch_cols = (
+            _t_batches.c.id, _t_batches.c.material_id, _t_batches.c.batch_no,
+            _t_batches.c.quantity, _t_batches.c.location, _t_batches.c.variant,
+            _t_batches.c.tenant_id, _t_batches.c.warehouse_id,
+        )
+        # 批次模式：(material, batch_no) → 该键下全部批次（不限仓库，按 id 排序；新批次追加在后）
+        batches_by_key = {}
+        # 简化模式：material → 本仓可 FIFO 扣减的在库批次（按入库时间）；material → 在库总量
+        fifo_batches = {}
+        stock_by_material = {}
+        if request.is_batch_mode:
+            keys = list({
+                (sku_to_material[item.sku], item.batch_no) for item in request.changes
+                if item.batch_no and item.sku in sku_to_material
+            })
+            for chunk in _chunked(keys):
+                for bid, mid, bn, qty, loc, variant, b_tenant, b_wh in sa_conn.execute(
+                    select(*batch_cols)
+                    .where(tuple_(_t_batches.c.material_id, _t_batches.c.batch_no).in_(chunk))
+                    .order_by(_t_batches.c.id)
+                    .with_for_update()
+                ):
+                    batches_by_key.setdefault((mid, bn), []).append(
+                        _ImportBatch(bid, bn, qty, loc, variant, _in_batch_scope(b_tenant, b_wh))
+                    )
+        else:
+            for chunk in _chunked(set(sku_to_material.values())):
+                for bid, mid, bn, qty, loc, variant, b_tenant, b_wh in sa_conn.execute(
+                    select(*batch_cols)
+                    .where(and_(_t_batches.c.material_id.in_(chunk),
+                                _t_batches.c.is_exhausted == 0))
+                    .order_by(_t_batches.c.created_at.asc(), _t_batches.c.id.asc())
+                    .with_for_update()
+                ):
+                    # 单一真相源：当前库存 = active batches sum（不限仓库）；FIFO 只扣本仓
+                    stock_by_material[mid] = stock_by_material.get(mid, 0) + qty
+                    if qty > 0 and _in_batch_scope(b_tenant, b_wh):
+                        fifo_batches.setdefault(mid, []).append(
+                            _ImportBatch(bid, bn, qty, loc, variant)
+                        )
+
+        # ===== 2. 内存推演（逐行语义与原逐条 SQL 实现一致） =====
+        new_materials = []
+        new_batches = []
+        new_records = []
+        new_consumptions = []   # (record, batch, quantity)
+        material_updates = {}   # 简化模式：material → 基本信息（同一物料后行覆盖前行）
+        location_by_sku = {}    # 批次模式：sku → 最新库位
+
+        def _new_material(item):
+            row = _PlannedRow(dict(
+                name=item.name, sku=item.sku,
+                category=item.category or '未分类', quantity=0,
+                unit=item.unit or '个', safe_stock=item.safe_stock,
+                location=item.location or '',
+                warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
+            ))
+            new_materials.append(row)
+            sku_to_material[item.sku] = row
+            return row
+
+        def _create_batch(material, quantity, location, contact_id, variant=None, batch_no=None):
+            """计划新批次（数量随后续 FIFO 扣减在内存里更新，写入时取最终值）。
+
+            未指定批次号的留空，写入前从序号表整段预留后统一分配。
+            """
+            bn = batch_no or None
+            batch = _ImportBatch(
+                _PlannedRow(dict(
+                    batch_no=bn, material_id=material, initial_quantity=quantity,
+                    contact_id=contact_id, warehouse_id=wh_id, tenant_id=wh_tenant_id,
+                    created_at=now_dt,
+                )),
+                bn, quantity, location, variant,
             )
-            return ins_res.inserted_primary_key[0]
+            new_batches.append(batch)
+            if request.is_batch_mode:
+                batches_by_key.setdefault((material, bn), []).append(batch)
+            else:
+                fifo_batches.setdefault(material, []).append(batch)
+                stock_by_material[material] = stock_by_material.get(material, 0) + quantity
+            return batch
+
+        def _record_row(material, rec_type, quantity, category, note, batch=None, contact_id=None):
+            row = _PlannedRow(dict(
+                material_id=material, type=rec_type, quantity=quantity,
+                operator=operator, operator_user_id=operator_user_id,
+                reason_category=category, reason_note=note,
+                contact_id=contact_id, batch_id=batch.ref if batch is not None else None,
+                warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
+            ))
+            new_records.append(row)
+            return row
 
-        def _create_record(material_id, rec_type, quantity, item_reason_category, reason_suffix, batch_id=None, contact_id=None):
-            """创建出入库记录"""
+        def _create_record(material, rec_type, quantity, item_reason_category, reason_suffix, batch=None, contact_id=None):
+            """计划出入库记录"""
             # reason_category 从每行 item 读取，reason_note 从全局备注 + 后缀拼接
             category = item_reason_category or ('purchase' if rec_type == RecordType.IN.value else 'sell')
             note_parts = []
@@ -6327,82 +7005,42 @@ async def confirm_import_excel(
             if reason_suffix:
                 note_parts.append(reason_suffix.strip(' ()（）'))
             note = '; '.join(note_parts) if note_parts else None
-            ins_res = sa_conn.execute(
-                insert(_t_inventory_records).values(
-                    material_id=material_id, type=rec_type, quantity=quantity,
-                    operator=operator, operator_user_id=operator_user_id,
-                    reason_category=category, reason_note=note,
-                    contact_id=contact_id, batch_id=batch_id,
-                    warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
-                )
-            )
-            return ins_res.inserted_primary_key[0]
-
-        def _lookup_material_id(sku):
-            row = sa_conn.execute(
-                select(_t_materials.c.id).where(and_(_t_materials.c.sku == sku, *mat_scope_preds))
-            ).first()
-            return row.id if row else None
+            return _record_row(material, rec_type, quantity, category, note, batch, contact_id)
 
-        def _fifo_consume(material_id, quantity, record_id):
-            """Consume `quantity` from the oldest batches of `material_id` and
-            write batch_consumptions rows linked to `record_id`. Returns the
-            unfilled remainder (0 on success). Caller decides how to react to
-            a non-zero remainder (rollback / error response / raise).
+        def _fifo_consume(material, quantity, record):
+            """从 ``material`` 最早的本仓批次扣减 ``quantity`` 并计划 batch_consumptions。
+            返回未能满足的余量（0 = 成功），由调用方决定如何处理。
             """
             remaining = quantity
-            avail = sa_conn.execute(
-                select(_t_batches.c.id, _t_batches.c.quantity)
-                .where(and_(
-                    _t_batches.c.material_id == material_id,
-                    _t_batches.c.is_exhausted == 0,
-                    _t_batches.c.quantity > 0,
-                    *batch_scope_preds,
-                ))
-                .order_by(_t_batches.c.created_at.asc())
-                .with_for_update()
-            ).fetchall()
-            for batch in avail:
+            for batch in fifo_batches.get(material, ()):
                 if remaining <= 0:
                     break
+                if batch.quantity <= 0:
+                    continue
                 consume = min(batch.quantity, remaining)
-                new_batch_qty = batch.quantity - consume
+                batch.quantity -= consume
                 remaining -= consume
-                # 并发门控：rowcount=0 表示批次已被其它事务改动，回滚整个事务
-                upd_res = sa_conn.execute(
-                    update(_t_batches)
-                    .where(and_(
-                        _t_batches.c.id == batch.id,
-                        _t_batches.c.quantity >= consume,
-                        _t_batches.c.is_exhausted == 0,
-                    ))
-                    .values(quantity=new_batch_qty,
-                            is_exhausted=1 if new_batch_qty == 0 else 0)
-                )
-                if upd_res.rowcount != 1:
-                    raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
-                sa_conn.execute(
-                    insert(_t_batch_consumptions).values(
-                        record_id=record_id, batch_id=batch.id,
-                        quantity=consume, created_at=now_dt,
-                    )
-                )
+                stock_by_material[material] -= consume
+                new_consumptions.append((record, batch, consume))
             return remaining
 
+        def _shortfall_message(sku, wanted, remaining):
+            return (
+                f"出库失败：SKU {sku} 在可用批次中仅消耗到 "
+                f"{wanted - remaining}，仍缺 {remaining}，已终止导入。"
+            )
+
         if request.is_batch_mode:
             # === 批次模式 ===
             for item in request.changes:
                 if item.operation == 'none':
-                    # 无变动，仅更新 batch location
+                    # 无变动，仅更新 batch location（不限仓库，与按 batch_no+material 的 UPDATE 同义）
                     if item.batch_no and item.location:
-                        mid = _lookup_material_id(item.sku)
-                        if mid is not None:
-                            sa_conn.execute(
-                                update(_t_batches)
-                                .where(and_(_t_batches.c.batch_no == item.batch_no,
-                                            _t_batches.c.material_id == mid))
-                                .values(location=item.location)
-                            )
+                        material = sku_to_material.get(item.sku)
+                        if material is not None:
+                            for batch in batches_by_key.get((material, item.batch_no), ()):
+                                batch.location = item.location
+                                batch.relocated = True
                     continue
 
                 contact_id = _get_contact_id(item)
@@ -6411,90 +7049,53 @@ async def confirm_import_excel(
                     # 新SKU + 新批次
                     if not request.confirm_new_skus:
                         continue
-                    existing_id = _lookup_material_id(item.sku)
-                    if existing_id is None:
-                        ins_res = sa_conn.execute(
-                            insert(_t_materials).values(
-                                name=item.name, sku=item.sku,
-                                category=item.category or '未分类', quantity=0,
-                                unit=item.unit or '个', safe_stock=item.safe_stock,
-                                location=item.location or '',
-                                warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
-                            )
-                        )
-                        material_id = ins_res.inserted_primary_key[0]
+                    material = sku_to_material.get(item.sku)
+                    if material is None:
+                        material = _new_material(item)
                         new_count += 1
-                    else:
-                        material_id = existing_id
 
                     if item.import_quantity > 0:
-                        batch_id = _create_batch(material_id, item.import_quantity, item.location, contact_id, item.variant)
+                        batch = _create_batch(material, item.import_quantity, item.location, contact_id, item.variant)
                         # 单一真相源：不再写 materials.quantity，库存由 batches 派生。
-                        _create_record(material_id, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新建物料)', batch_id, contact_id)
+                        _create_record(material, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新建物料)', batch, contact_id)
                         in_count += 1
                         records_created += 1
                 elif item.is_batch_new:
                     # 已有SKU，新批次
-                    material_id = _lookup_material_id(item.sku)
-                    if material_id is None:
+                    material = sku_to_material.get(item.sku)
+                    if material is None:
                         continue
-                    batch_id = _create_batch(material_id, item.import_quantity, item.location, contact_id, item.variant, item.batch_no)
-                    # 单一真相源：不再写 materials.quantity
-                    _create_record(material_id, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新批次)', batch_id, contact_id)
+                    batch = _create_batch(material, item.import_quantity, item.location, contact_id, item.variant, item.batch_no)
+                    _create_record(material, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新批次)', batch, contact_id)
                     in_count += 1
                     records_created += 1
                 else:
                     # 已有批次有变动
-                    material_id = _lookup_material_id(item.sku)
-                    if material_id is None:
+                    material = sku_to_material.get(item.sku)
+                    if material is None:
                         continue
-                    # FOR UPDATE 锁批次行：Excel 导入是 overwrite quantity 语义，
-                    # 两份并发 Excel 同时 import 同批次会丢更新；锁让它们串行化
-                    # （codex audit adf4d1b463d92850e HIGH）。
-                    batch = sa_conn.execute(
-                        select(_t_batches.c.id, _t_batches.c.quantity)
-                        .where(and_(_t_batches.c.batch_no == item.batch_no,
-                                    _t_batches.c.material_id == material_id,
-                                    *batch_scope_preds))
-                        .with_for_update()
-                    ).first()
-                    if not batch:
+                    batch = next(
+                        (b for b in batches_by_key.get((material, item.batch_no), ()) if b.in_scope),
+                        None,
+                    )
+                    if batch is None:
                         continue
 
                     diff = item.difference
                     # 复活已耗尽批次：用户用 Excel 给历史 is_exhausted=1 的批次写回正数时，
                     # 必须同步清掉 is_exhausted 标记，否则所有 WHERE is_exhausted=0 的读端
-                    # 会无视这一行 → 库存静默丢失。反向：若新值 <= 0 则标记耗尽。
-                    upd_res = sa_conn.execute(
-                        update(_t_batches).where(and_(
-                            _t_batches.c.id == batch.id,
-                            _t_batches.c.quantity == batch.quantity,
-                        ))
-                        .values(quantity=item.import_quantity,
-                                location=item.location or '', variant=item.variant,
-                                is_exhausted=0 if item.import_quantity > 0 else 1)
-                    )
-                    if upd_res.rowcount != 1:
-                        # 行被并发其它事务改过（虽然 FOR UPDATE 应该兜底，但加这层
-                        # 校验避免任何 corner case 静默丢更新）
-                        raise HTTPException(status_code=409,
-                                            detail=f"批次 {item.batch_no} 在导入期间被其它操作修改，请重试")
-                    # 单一真相源：不再写 materials.quantity（batch 写入已是真相）
+                    # 会无视这一行 → 库存静默丢失。反向：若新值 <= 0 则标记耗尽（写入阶段按数量推导）。
+                    batch.quantity = item.import_quantity
+                    batch.location = item.location or ''
+                    batch.variant = item.variant
+                    batch.overwritten = True
 
                     rec_type = RecordType.IN.value if diff > 0 else RecordType.OUT.value
-                    new_record_id = _create_record(
-                        material_id, rec_type, abs(diff), item.reason_category,
-                        '', batch.id, contact_id,
-                    )
+                    record = _create_record(material, rec_type, abs(diff), item.reason_category, '', batch, contact_id)
                     if diff < 0:
                         # Pair the OUT inventory_record with a batch_consumptions
                         # row so per-batch SUM matches materials.quantity.
-                        sa_conn.execute(
-                            insert(_t_batch_consumptions).values(
-                                record_id=new_record_id, batch_id=batch.id,
-                                quantity=abs(diff), created_at=now_dt,
-                            )
-                        )
+                        new_consumptions.append((record, batch, abs(diff)))
                     if diff > 0:
                         in_count += 1
                     else:
@@ -6503,11 +7104,7 @@ async def confirm_import_excel(
 
                 # 更新 materials.location 为最新
                 if item.location:
-                    sa_conn.execute(
-                        update(_t_materials)
-                        .where(and_(_t_materials.c.sku == item.sku, *mat_scope_preds))
-                        .values(location=item.location)
-                    )
+                    location_by_sku[item.sku] = item.location
         else:
             # === 简化模式（统一创建批次）===
             for item in request.changes:
@@ -6517,95 +7114,53 @@ async def confirm_import_excel(
                     if not request.confirm_new_skus:
                         continue
 
-                    existing = sa_conn.execute(
-                        select(_t_materials.c.id).where(and_(_t_materials.c.sku == item.sku, *mat_scope_preds))
-                    ).first()
-
-                    if existing is not None:
+                    material = sku_to_material.get(item.sku)
+                    if material is not None:
                         # SKU已存在，按已有物料处理
                         # 单一真相源：当前库存读自 active batches sum
-                        material_id = existing.id
-                        current_qty = int(sa_conn.execute(
-                            select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-                            .where(and_(
-                                _t_batches.c.material_id == material_id,
-                                _t_batches.c.is_exhausted == 0,
-                            ))
-                        ).scalar() or 0)
+                        current_qty = stock_by_material.get(material, 0)
                         if item.import_quantity != current_qty:
                             diff = item.import_quantity - current_qty
-                            # 单一真相源：不再写 materials.quantity
                             rec_type = RecordType.IN.value if diff > 0 else RecordType.OUT.value
                             if diff > 0:
-                                batch_id = _create_batch(material_id, abs(diff), item.location, contact_id, item.variant)
-                                _create_record(material_id, rec_type, abs(diff), item.reason_category, ' (SKU已存在，调整库存)', batch_id, contact_id)
+                                batch = _create_batch(material, abs(diff), item.location, contact_id, item.variant)
+                                _create_record(material, rec_type, abs(diff), item.reason_category, ' (SKU已存在，调整库存)', batch, contact_id)
                             else:
                                 # Negative diff: route through FIFO so per-batch
                                 # totals stay consistent with materials.quantity
                                 # instead of writing a phantom OUT with no
                                 # batch_consumptions linkage.
-                                new_record_id = _create_record(
-                                    material_id, rec_type, abs(diff),
+                                record = _create_record(
+                                    material, rec_type, abs(diff),
                                     item.reason_category,
                                     ' (SKU已存在，调整库存)', None, contact_id,
                                 )
-                                remaining = _fifo_consume(material_id, abs(diff), new_record_id)
+                                remaining = _fifo_consume(material, abs(diff), record)
                                 if remaining > 0:
-                                    sa_conn.rollback()
-                                    return ExcelImportResponse(
-                                        success=False, in_count=in_count, out_count=out_count,
-                                        new_count=new_count, records_created=records_created,
-                                        message=(
-                                            f"出库失败：SKU {item.sku} 在可用批次中仅消耗到 "
-                                            f"{abs(diff) - remaining}，仍缺 {remaining}，已终止导入。"
-                                        ),
-                                    )
+                                    return _failed(_shortfall_message(item.sku, abs(diff), remaining))
                             records_created += 1
                         new_count += 1
                         continue
 
-                    ins_res = sa_conn.execute(
-                        insert(_t_materials).values(
-                            name=item.name, sku=item.sku,
-                            category=item.category or '未分类',
-                            quantity=0,
-                            unit=item.unit or '个', safe_stock=item.safe_stock,
-                            location=item.location or '',
-                            warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
-                        )
-                    )
-                    material_id = ins_res.inserted_primary_key[0]
+                    material = _new_material(item)
                     if item.import_quantity > 0:
-                        batch_id = _create_batch(material_id, item.import_quantity, item.location, contact_id)
-                        _create_record(material_id, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新建物料)', batch_id, contact_id)
+                        batch = _create_batch(material, item.import_quantity, item.location, contact_id)
+                        _create_record(material, RecordType.IN.value, item.import_quantity, item.reason_category, ' (新建物料)', batch, contact_id)
                         records_created += 1
                     new_count += 1
                 else:
-                    material = sa_conn.execute(
-                        select(_t_materials.c.id)
-                        .where(and_(_t_materials.c.sku == item.sku, *mat_scope_preds))
-                    ).first()
-                    if not material:
+                    material = sku_to_material.get(item.sku)
+                    if material is None:
                         continue
 
-                    material_id = material.id
                     # 单一真相源：当前库存读自 active batches sum
-                    current_qty = int(sa_conn.execute(
-                        select(_sa_func.coalesce(_sa_func.sum(_t_batches.c.quantity), 0))
-                        .where(and_(
-                            _t_batches.c.material_id == material_id,
-                            _t_batches.c.is_exhausted == 0,
-                        ))
-                    ).scalar() or 0)
+                    current_qty = stock_by_material.get(material, 0)
 
                     # 更新基本信息（含 variant 提取后可能变更的物料名称）
-                    sa_conn.execute(
-                        update(_t_materials).where(_t_materials.c.id == material_id)
-                        .values(
-                            name=item.name, safe_stock=item.safe_stock,
-                            category=item.category or '未分类',
-                            unit=item.unit or '个', location=item.location or '',
-                        )
+                    material_updates[material] = dict(
+                        name=item.name, safe_stock=item.safe_stock,
+                        category=item.category or '未分类',
+                        unit=item.unit or '个', location=item.location or '',
                     )
 
                     if item.operation == 'none':
@@ -6614,54 +7169,141 @@ async def confirm_import_excel(
                     abs_diff = abs(item.difference)
 
                     if item.operation == RecordType.IN.value:
-                        batch_id = _create_batch(material_id, abs_diff, item.location, contact_id, item.variant)
+                        batch = _create_batch(material, abs_diff, item.location, contact_id, item.variant)
                         # 单一真相源：不再写 materials.quantity
-                        _create_record(material_id, RecordType.IN.value, abs_diff, item.reason_category, '', batch_id, contact_id)
+                        _create_record(material, RecordType.IN.value, abs_diff, item.reason_category, '', batch, contact_id)
                         in_count += 1
                         records_created += 1
                     elif item.operation == RecordType.OUT.value:
                         if current_qty - abs_diff < 0:
-                            # Roll back partial mutations from this batch import
-                            # (preserves original sqlite get_db() semantics where
-                            # an early return without conn.commit() discarded
-                            # all in-progress writes).
-                            sa_conn.rollback()
-                            return ExcelImportResponse(
-                                success=False, in_count=in_count, out_count=out_count,
-                                new_count=new_count, records_created=records_created,
-                                message=f"出库失败：SKU {item.sku} 出库 {abs_diff} 超过当前库存 {current_qty}，已终止导入。"
-                            )
+                            return _failed(f"出库失败：SKU {item.sku} 出库 {abs_diff} 超过当前库存 {current_qty}，已终止导入。")
                         # 单一真相源：不再写 materials.quantity；FIFO 在 _fifo_consume 中扣 batches
-                        out_reason = item.reason_category or 'sell'
-                        out_ins = sa_conn.execute(
-                            insert(_t_inventory_records).values(
-                                material_id=material_id, type=RecordType.OUT.value, quantity=abs_diff,
-                                operator=operator, operator_user_id=operator_user_id,
-                                reason_category=out_reason, reason_note=request.reason_note,
-                                contact_id=contact_id,
-                                warehouse_id=wh_id, tenant_id=wh_tenant_id, created_at=now_dt,
-                            )
+                        record = _record_row(
+                            material, RecordType.OUT.value, abs_diff,
+                            item.reason_category or 'sell', request.reason_note,
+                            contact_id=contact_id,
                         )
-                        record_id = out_ins.inserted_primary_key[0]
-
-                        remaining = _fifo_consume(material_id, abs_diff, record_id)
+                        remaining = _fifo_consume(material, abs_diff, record)
                         if remaining > 0:
-                            # Materials.quantity says we have stock but no batch
-                            # rows back it (e.g. orphan adjustments). Roll back
-                            # the partial txn rather than commit a phantom OUT.
-                            sa_conn.rollback()
-                            return ExcelImportResponse(
-                                success=False, in_count=in_count, out_count=out_count,
-                                new_count=new_count, records_created=records_created,
-                                message=(
-                                    f"出库失败：SKU {item.sku} 在可用批次中仅消耗到 "
-                                    f"{abs_diff - remaining}，仍缺 {remaining}，已终止导入。"
-                                ),
-                            )
-
+                            # Stock sum says we have enough but no in-scope batch
+                            # rows back it (e.g. orphan adjustments): abort rather
+                            # than commit a phantom OUT.
+                            return _failed(_shortfall_message(item.sku, abs_diff, remaining))
                         out_count += 1
                         records_created += 1
 
+        # ===== 3. 批量写入 =====
+        if ctx is not None:
+            ctx.check_cancelled()
+            ctx.progress(len(request.changes), len(request.changes), message='写入')
+        # 将不在导入文件中的SKU标记为禁用（需显式确认，仅限当前仓库）
+        if import_skus:
+            if request.confirm_disable_missing_skus:
+                sa_conn.execute(
+                    update(_t_materials)
+                    .where(and_(_t_materials.c.sku.notin_(list(import_skus)), *mat_scope_preds))
+                    .values(is_disabled=1)
+                )
+            else:
+                warnings.append("已跳过禁用导入文件之外的SKU，如需禁用请勾选确认选项后重试。")
+            sa_conn.execute(
+                update(_t_materials)
+                .where(and_(_t_materials.c.sku.in_(list(import_skus)), *mat_scope_preds))
+                .values(is_disabled=0)
+            )
+
+        _insert_planned_rows(sa_conn, _t_contacts, new_contacts)
+        _insert_planned_rows(sa_conn, _t_materials, new_materials)
+        # 新批次直接以推演后的最终数量落库（initial_quantity 保留入库量）；
+        # 只有被扣减 / 覆盖到 0 的才标耗尽，与先插入再 UPDATE 的结果一致
+        # 自动批次号：一次预留一整段；跳过与本次导入手填批次号重复的号
+        explicit_batch_nos = {b.batch_no for b in new_batches if b.batch_no}
+        auto_batches = [b for b in new_batches if not b.batch_no]
+        while auto_batches:
+            free_nos = (bn for bn in reserve_batch_nos(wh_id, len(auto_batches), conn=sa_conn)
+                        if bn not in explicit_batch_nos)
+            for batch, bn in zip(list(auto_batches), free_nos):
+                batch.batch_no = bn
+                batch.ref.values['batch_no'] = bn
+            auto_batches = [b for b in auto_batches if not b.batch_no]
+        for batch in new_batches:
+            touched = batch.overwritten or batch.quantity != batch.orig_quantity
+            batch.ref.values.update(
+                quantity=batch.quantity, location=batch.location, variant=batch.variant,
+                is_exhausted=1 if touched and batch.quantity <= 0 else 0,
+            )
+        _insert_planned_rows(sa_conn, _t_batches, [b.ref for b in new_batches])
+
+        # 已有批次：守卫 UPDATE（数量仍等于预加载值才写），命中数不足说明被并发事务改过
+        existing = [b for bs in (batches_by_key.values() if request.is_batch_mode else fifo_batches.values())
+                    for b in bs if not isinstance(b.ref, _PlannedRow)]
+        guarded = [b for b in existing if b.overwritten or b.quantity != b.orig_quantity]
+        guard_stmt = (
+            update(_t_batches)
+            .where(and_(_t_batches.c.id == bindparam('b_id'),
+                        _t_batches.c.quantity == bindparam('b_orig_qty')))
+        )
+        if request.is_batch_mode:
+            guard_stmt = guard_stmt.values(
+                quantity=bindparam('b_qty'), location=bindparam('b_location'),
+                variant=bindparam('b_variant'), is_exhausted=bindparam('b_exhausted'),
+            )
+        else:
+            guard_stmt = guard_stmt.where(_t_batches.c.is_exhausted == 0).values(
+                quantity=bindparam('b_qty'), is_exhausted=bindparam('b_exhausted'),
+            )
+        hit = _execute_many_rowcount(sa_conn, guard_stmt, [
+            dict(b_id=b.ref, b_orig_qty=b.orig_quantity, b_qty=b.quantity,
+                 b_location=b.location, b_variant=b.variant,
+                 b_exhausted=0 if b.quantity > 0 else 1)
+            for b in guarded
+        ])
+        if hit != len(guarded):
+            if request.is_batch_mode:
+                # 找出第一个没写进去的批次报给用户（整单随异常回滚）
+                current = dict(sa_conn.execute(
+                    select(_t_batches.c.id, _t_batches.c.quantity)
+                    .where(_t_batches.c.id.in_([b.ref for b in guarded]))
+                ).all())
+                conflict = next((b for b in guarded if current.get(b.ref) != b.quantity), guarded[0])
+                raise HTTPException(status_code=409,
+                                    detail=f"批次 {conflict.batch_no} 在导入期间被其它操作修改，请重试")
+            # 并发门控：批次已被其它事务改动，回滚整个事务
+            raise HTTPException(status_code=409, detail="批次并发冲突，请重试")
+        relocated = [b for b in existing if b.relocated and not b.overwritten]
+        if relocated:
+            sa_conn.execute(
+                update(_t_batches).where(_t_batches.c.id == bindparam('b_id'))
+                .values(location=bindparam('b_location')),
+                [dict(b_id=b.ref, b_location=b.location) for b in relocated],
+            )
+
+        _insert_planned_rows(sa_conn, _t_inventory_records, new_records)
+        daily_stats.add(sa_conn, [r.values for r in new_records])
+        if new_consumptions:
+            sa_conn.execute(insert(_t_batch_consumptions), [
+                dict(record_id=record.id, batch_id=_row_id(batch.ref),
+                     quantity=qty, created_at=now_dt)
+                for record, batch, qty in new_consumptions
+            ])
+
+        if material_updates:
+            sa_conn.execute(
+                update(_t_materials).where(_t_materials.c.id == bindparam('m_id'))
+                .values(name=bindparam('m_name'), safe_stock=bindparam('m_safe_stock'),
+                        category=bindparam('m_category'), unit=bindparam('m_unit'),
+                        location=bindparam('m_location')),
+                [dict(m_id=_row_id(m), **{f'm_{k}': v for k, v in values.items()})
+                 for m, values in material_updates.items()],
+            )
+        if location_by_sku:
+            sa_conn.execute(
+                update(_t_materials)
+                .where(and_(_t_materials.c.sku == bindparam('m_sku'), *mat_scope_preds))
+                .values(location=bindparam('m_location')),
+                [dict(m_sku=sku, m_location=loc) for sku, loc in location_by_sku.items()],
+            )
+
     # R5: import only writes to materials/batches → material partition only
     get_fuzzy_matcher().invalidate_cache(entity_type="material")
 
@@ -6745,9 +7387,9 @@ def export_inventory_records(
     warehouse_id: Optional[int] = Query(None, description="仓库ID"),
     current_user: CurrentUser = Depends(require_permission(Resource.INVENTORY, Action.READ))
 ):
-    """导出出入库记录为Excel（支持筛选，含批次信息）— Phase 3f: SA Core read."""
-    from openpyxl import Workbook
+    """导出出入库记录为Excel（支持筛选，含批次信息）— Phase 3f: SA Core read.
 
+    流式导出：记录游标按 EXPORT_FETCH_SIZE 分批，每批补查出库批次消耗后立即编码发送。"""
     wh_id = resolve_warehouse_id(current_user, warehouse_id)
 
     preds = list(build_authorized_scope_predicates(_t_inventory_records, current_user, wh_id))
@@ -6773,7 +7415,8 @@ def export_inventory_records(
             _t_inventory_records.c.actual_operator,
             _t_inventory_records.c.reason_category,
             _t_inventory_records.c.reason_note,
-            _t_inventory_records.c.created_at,
+            # 原样取文本：SQLite 上省掉逐行 DateTime 解析再 strftime 回同一格式
+            type_coerce(_t_inventory_records.c.created_at, String).label('created_at'),
             _t_contacts.c.name.label('contact_name'),
             _t_inventory_records.c.batch_id,
             _t_batches.c.batch_no,
@@ -6793,92 +7436,84 @@ def export_inventory_records(
     if preds:
         rec_stmt = rec_stmt.where(and_(*preds))
 
-    with get_engine().connect() as sa_conn:
-        records = sa_conn.execute(rec_stmt).fetchall()
-
-        # 为出库记录获取批次消耗详情 + 规格（出库 batch_id 为 NULL，规格需从被消耗批次取）
-        batch_details_map = {}
-        out_variant_map = {}
-        out_record_ids = [r.id for r in records if r.type == RecordType.OUT.value]
-        if out_record_ids:
-            cons_stmt = (
-                select(
-                    _t_batch_consumptions.c.record_id,
-                    _t_batches.c.batch_no,
-                    _t_batch_consumptions.c.quantity,
-                    _t_batches.c.variant,
-                    _t_batches.c.created_at,
-                )
-                .select_from(
-                    _t_batch_consumptions.join(_t_batches, _t_batch_consumptions.c.batch_id == _t_batches.c.id)
-                )
-                .where(_t_batch_consumptions.c.record_id.in_(out_record_ids))
-                .order_by(_t_batch_consumptions.c.record_id, _t_batches.c.created_at.asc())
-            )
-            for cons in sa_conn.execute(cons_stmt).fetchall():
-                batch_details_map.setdefault(cons.record_id, []).append(
-                    f"{cons.batch_no}×{cons.quantity}"
-                )
-                # 取第一个非空规格（同一物料的批次规格通常一致）
-                if cons.variant and cons.record_id not in out_variant_map:
-                    out_variant_map[cons.record_id] = cons.variant
-            batch_details_map = {k: ', '.join(v) for k, v in batch_details_map.items()}
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "出入库记录"
-
-    headers = ['物料名称', '规格', '物料编码', '商品类型', '记录类型', '数量', '批次', '联系方', '账号', '操作人', '原因类别', '备注', '时间']
-    for col, header in enumerate(headers, 1):
-        ws.cell(row=1, column=col, value=header)
-
-    for row_idx, record in enumerate(records, 2):
-        # 批次信息：入库显示批次号，出库显示消耗详情
-        batch_info = ''
-        if record.type == RecordType.IN.value and record.batch_no:
-            batch_info = record.batch_no
-        elif record.type == RecordType.OUT.value:
-            batch_info = batch_details_map.get(record.id, '')
-
-        created_at_str = (record.created_at.strftime('%Y-%m-%d %H:%M:%S')
-                          if isinstance(record.created_at, datetime) else record.created_at)
-
-        # 规格：入库用 batch_id join 的 variant；出库从被消耗批次取（batch_id 为 NULL）
-        if record.type == RecordType.OUT.value:
-            variant_val = out_variant_map.get(record.id, '') or ''
-        else:
-            variant_val = record.variant or ''
-
-        ws.cell(row=row_idx, column=1, value=record.name)
-        ws.cell(row=row_idx, column=2, value=variant_val)
-        ws.cell(row=row_idx, column=3, value=record.sku)
-        ws.cell(row=row_idx, column=4, value=record.category)
-        ws.cell(row=row_idx, column=5, value='入库' if record.type == RecordType.IN.value else '出库')
-        ws.cell(row=row_idx, column=6, value=record.quantity)
-        ws.cell(row=row_idx, column=7, value=batch_info)
-        ws.cell(row=row_idx, column=8, value=record.contact_name or '')
-        # 账号（列9）：设备/登录账号，优先用户表显示名，回退 operator 字段
-        operator_name = record.operator_display_name or record.operator_username or record.operator
-        ws.cell(row=row_idx, column=9, value=operator_name)
-        # 操作人（列10）：实际执行操作的人（人脸识别姓名快照或手工填写）
-        ws.cell(row=row_idx, column=10, value=record.actual_operator or '')
-        ws.cell(row=row_idx, column=11, value=REASON_CATEGORY_LABELS.get(record.reason_category, record.reason_category or ''))
-        ws.cell(row=row_idx, column=12, value=record.reason_note or '')
-        ws.cell(row=row_idx, column=13, value=created_at_str)
-
-    # 设置列宽
-    column_widths = [22, 10, 18, 14, 12, 10, 28, 16, 14, 14, 14, 24, 22]
-    for i, width in enumerate(column_widths, 1):
-        ws.column_dimensions[chr(64 + i)].width = width
+    cons_base = (
+        select(
+            _t_batch_consumptions.c.record_id,
+            _t_batches.c.batch_no,
+            _t_batch_consumptions.c.quantity,
+            _t_batches.c.variant,
+            _t_batches.c.created_at,
+        )
+        .select_from(
+            _t_batch_consumptions.join(_t_batches, _t_batch_consumptions.c.batch_id == _t_batches.c.id)
+        )
+        .order_by(_t_batch_consumptions.c.record_id, _t_batches.c.created_at.asc())
+    )
 
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
+    def _export_rows():
+        # 主游标流式分批；每批出库记录的批次消耗另开连接按 IN 查（MySQL 流式游标
+        # 未读完前同一连接不能再发查询）。逐行热路径按位置解包、常量提到循环外。
+        type_in, type_out = RecordType.IN.value, RecordType.OUT.value
+        reason_labels = REASON_CATEGORY_LABELS
+        with get_engine().connect() as sa_conn, get_engine().connect() as lookup_conn:
+            result = sa_conn.execution_options(yield_per=EXPORT_FETCH_SIZE).execute(rec_stmt)
+            for records in result.partitions():
+                # 为出库记录获取批次消耗详情 + 规格（出库 batch_id 为 NULL，规格需从被消耗批次取）
+                batch_details_map = {}
+                out_variant_map = {}
+                out_record_ids = [r.id for r in records if r.type == type_out]
+                if out_record_ids:
+                    cons_stmt = cons_base.where(
+                        _t_batch_consumptions.c.record_id.in_(out_record_ids))
+                    for cons in lookup_conn.execute(cons_stmt):
+                        batch_details_map.setdefault(cons.record_id, []).append(
+                            f"{cons.batch_no}×{cons.quantity}"
+                        )
+                        # 取第一个非空规格（同一物料的批次规格通常一致）
+                        if cons.variant and cons.record_id not in out_variant_map:
+                            out_variant_map[cons.record_id] = cons.variant
+
+                for (rid, name, sku, category, rtype, quantity, operator, _operator_uid,
+                     actual_operator, reason_category, reason_note, created_at, contact_name,
+                     _batch_id, batch_no, variant, op_display, op_username) in records:
+                    if rtype == type_out:
+                        # 出库：显示批次消耗详情；规格从被消耗批次取（batch_id 为 NULL）
+                        batch_info = ', '.join(batch_details_map.get(rid, ()))
+                        variant_val = out_variant_map.get(rid, '') or ''
+                    else:
+                        # 入库：显示批次号；规格用 batch_id join 的 variant
+                        batch_info = (batch_no or '') if rtype == type_in else ''
+                        variant_val = variant or ''
+
+                    yield (
+                        name,
+                        variant_val,
+                        sku,
+                        category,
+                        '入库' if rtype == type_in else '出库',
+                        quantity,
+                        batch_info,
+                        contact_name or '',
+                        # 账号：设备/登录账号，优先用户表显示名，回退 operator 字段
+                        op_display or op_username or operator,
+                        # 操作人：实际执行操作的人（人脸识别姓名快照或手工填写）
+                        actual_operator or '',
+                        reason_labels.get(reason_category, reason_category or ''),
+                        reason_note or '',
+                        created_at.strftime('%Y-%m-%d %H:%M:%S')
+                        if isinstance(created_at, datetime) else created_at,
+                    )
 
     filename = f"inventory_records_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        iter_xlsx(
+            _export_rows(),
+            headers=['物料名称', '规格', '物料编码', '商品类型', '记录类型', '数量', '批次',
+                     '联系方', '账号', '操作人', '原因类别', '备注', '时间'],
+            sheet_title="出入库记录",
+            column_widths=[22, 10, 18, 14, 12, 10, 28, 16, 14, 14, 14, 24, 22],
+        ),
+        media_type=XLSX_MEDIA_TYPE,
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
@@ -7322,6 +7957,12 @@ async def _run_migrations():
     Also seeds mock data after the schema is in place when INIT_MOCK_DATA is
     enabled.
     """
+    # 多 worker 同时启动：迁移 + 补种串行执行，后来的 worker 看到已是 head 直接跳过
+    with multiworker.WorkerLock("migrate"):
+        _run_migrations_locked()
+
+
+def _run_migrations_locked():
     from alembic.config import Config as AlembicConfig
     from alembic import command as alembic_command
     cfg = AlembicConfig(os.path.join(os.path.dirname(__file__), "alembic.ini"))
@@ -7360,6 +8001,13 @@ async def _run_migrations():
     except Exception as e:  # noqa: BLE001
         logger.warning(f"_audit_routes() skipped: {e}")
 
+    # 后台任务表维护：上次进程崩溃遗留的 running 行标记失败，清理过期任务及其产物文件。
+    try:
+        jobs.recover_orphaned_jobs()
+        jobs.prune_finished_jobs()
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"background job maintenance skipped: {e}")
+
     if INIT_MOCK_DATA:
         try:
             generate_mock_data()
@@ -7367,78 +8015,170 @@ async def _run_migrations():
             logger.warning(f"generate_mock_data() skipped: {e}")
 
 
+MCP_AUTOSTART_READY_TIMEOUT = 30.0
+
+
+def _load_auto_start_mcp_connections() -> list:
+    """auto_start 连接按最近活跃时间排序：智能体 API key 的 last_used_at 优先，
+    其次连接行的 updated_at。最近在用的智能体先恢复。"""
+    with get_engine().connect() as sa_conn:
+        rows = sa_conn.execute(
+            select(
+                _t_mcp_connections.c.id,
+                _t_mcp_connections.c.name,
+                _t_mcp_connections.c.mcp_endpoint,
+                _t_mcp_connections.c.api_key,
+                _t_mcp_connections.c.debug_mode,
+                _t_mcp_connections.c.updated_at,
+            ).where(_t_mcp_connections.c.auto_start == 1)
+        ).all()
+        hashes = {row.id: hash_api_key(row.api_key) for row in rows if row.api_key}
+        last_used = dict(sa_conn.execute(
+            select(_t_api_keys.c.key_hash, _t_api_keys.c.last_used_at)
+            .where(_t_api_keys.c.key_hash.in_(set(hashes.values())))
+        ).all()) if hashes else {}
+
+    def _as_datetime(value):
+        if isinstance(value, datetime):
+            return value
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return datetime.min
+
+    def _priority(row):
+        return (_as_datetime(last_used.get(hashes.get(row.id))), _as_datetime(row.updated_at))
+
+    return sorted(rows, key=_priority, reverse=True)
+
+
 async def _restore_auto_start_mcp_connections(mcp_manager: MCPProcessManager):
-    """Restore MCP connections one at a time after HTTP startup completes."""
+    """Restore auto-start MCP connections after HTTP startup completes.
+
+    最多 ``MCP_AUTOSTART_CONCURRENCY`` 个连接同时握手：一个连接就绪（或超时）
+    即让出名额给队列里的下一个，不必等整批。并发为 1 时退化为原来的逐个
+    恢复 + ``MCP_AUTOSTART_STAGGER_SECONDS`` 间隔。进度记在
+    ``mcp_manager.restore_progress``。
+    """
     try:
-        with get_engine().connect() as sa_conn:
-            rows = sa_conn.execute(
-                select(
-                    _t_mcp_connections.c.id,
-                    _t_mcp_connections.c.name,
-                    _t_mcp_connections.c.mcp_endpoint,
-                    _t_mcp_connections.c.api_key,
-                    _t_mcp_connections.c.debug_mode,
-                ).where(_t_mcp_connections.c.auto_start == 1)
-            ).all()
+        rows = _load_auto_start_mcp_connections()
+        concurrency = get_autostart_concurrency()
+        stagger_seconds = get_autostart_stagger_seconds() if concurrency == 1 else 0.0
+        progress = RestoreProgress([row.id for row in rows], concurrency)
+        mcp_manager.restore_progress = progress
+        slots = asyncio.Semaphore(concurrency)
+        logger.info(
+            "Restoring %d MCP auto-start connection(s), %d handshake(s) in flight",
+            len(rows), concurrency,
+        )
 
-        stagger_seconds = get_autostart_stagger_seconds()
-        for index, row in enumerate(rows):
-            logger.info(f"Auto-starting MCP connection: {row.name}")
-            await mcp_manager.start_connection(
-                row.id, row.mcp_endpoint, row.api_key,
-                debug_mode=bool(row.debug_mode)
-            )
-            # 更新数据库状态（status 列为 String，updated_at 为 String(32) ISO 字符串）
-            status_info = mcp_manager.get_connection_status(row.id)
-            with get_engine().begin() as sa_conn:
-                sa_conn.execute(
-                    update(_t_mcp_connections)
-                    .where(_t_mcp_connections.c.id == row.id)
-                    .values(status=status_info['status'], updated_at=datetime.now().isoformat())
-                )
-            ready = await mcp_manager.wait_for_protocol_ready(row.id, timeout=30.0)
-            if not ready:
-                logger.warning(
-                    "MCP connection %s did not complete initialize within 30s; "
-                    "continuing sequential restore",
-                    row.id,
-                )
-            if stagger_seconds and index + 1 < len(rows):
-                logger.info(
-                    "Waiting %.1fs before the next MCP auto-start",
-                    stagger_seconds,
-                )
-                await asyncio.sleep(stagger_seconds)
+        async def restore_one(index: int, row) -> None:
+            async with slots:
+                progress.mark(row.id, 'starting')
+                logger.info(f"Auto-starting MCP connection: {row.name}")
+                try:
+                    await mcp_manager.start_connection(
+                        row.id, row.mcp_endpoint, row.api_key,
+                        debug_mode=bool(row.debug_mode)
+                    )
+                    # 更新数据库状态（status 列为 String，updated_at 为 String(32) ISO 字符串）
+                    status_info = mcp_manager.get_connection_status(row.id)
+                    with get_engine().begin() as sa_conn:
+                        sa_conn.execute(
+                            update(_t_mcp_connections)
+                            .where(_t_mcp_connections.c.id == row.id)
+                            .values(status=status_info['status'], updated_at=datetime.now().isoformat())
+                        )
+                    ready = await mcp_manager.wait_for_protocol_ready(
+                        row.id, timeout=MCP_AUTOSTART_READY_TIMEOUT)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:  # noqa: BLE001 — 单个连接失败不影响其余
+                    progress.mark(row.id, 'failed')
+                    logger.error(f"Failed to auto-start MCP connection {row.id}: {e}")
+                    return
+                progress.mark(row.id, 'ready' if ready else 'timeout')
+                if not ready:
+                    logger.warning(
+                        "MCP connection %s did not complete initialize within %.0fs; "
+                        "continuing restore",
+                        row.id, MCP_AUTOSTART_READY_TIMEOUT,
+                    )
+                if stagger_seconds and index + 1 < len(rows):
+                    logger.info(
+                        "Waiting %.1fs before the next MCP auto-start",
+                        stagger_seconds,
+                    )
+                    await asyncio.sleep(stagger_seconds)
+
+        # Semaphore 按等待先后放行，任务按优先级顺序创建即按优先级恢复
+        await asyncio.gather(*(restore_one(i, row) for i, row in enumerate(rows)))
+        progress.finish()
+        logger.info("MCP auto-start restore finished: %s", {
+            k: v for k, v in progress.snapshot().items() if k in RestoreProgress.STATES})
     except asyncio.CancelledError:
         raise
     except Exception as e:
         logger.error(f"Failed to restore MCP connections: {e}")
 
 
-@app.on_event("startup")
-async def startup_mcp_manager():
-    """Start MCP supervision and restore connections in the background."""
+# 多 worker 部署下 MCP 连接归属于持有该锁的 worker（见 multiworker.py）
+_mcp_owner_lock = multiworker.WorkerLock("mcp-owner")
+MCP_OWNER_RETRY_SECONDS = 5.0
+
+
+async def _become_mcp_owner():
+    """本 worker 接管 MCP 连接：拉起监控、恢复自启连接、接收其他 worker 转来的命令。"""
     mcp_manager = MCPProcessManager()
     app.state.mcp_manager = mcp_manager
     await mcp_manager.start_monitor()
     app.state.mcp_restore_task = asyncio.create_task(
         _restore_auto_start_mcp_connections(mcp_manager)
     )
+    multiworker.subscribe(
+        MCP_COMMAND_TOPIC,
+        lambda command: asyncio.get_running_loop().create_task(mcp_manager.apply_command(command)),
+    )
+
+
+async def _wait_for_mcp_ownership():
+    """非归属 worker：归属 worker 退出（锁随进程释放）后接管。"""
+    while not _mcp_owner_lock.try_acquire():
+        await asyncio.sleep(MCP_OWNER_RETRY_SECONDS)
+    logger.info(f"worker {multiworker.WORKER_ID} took over MCP connection ownership")
+    await _become_mcp_owner()
+
+
+@app.on_event("startup")
+async def startup_mcp_manager():
+    """Start MCP supervision and restore connections in the background.
+
+    多 worker 部署时只有拿到 ``mcp-owner`` 锁的 worker 这么做；其余 worker 用
+    ``RemoteMCPManager`` 把启停命令经失效总线转给它。
+    """
+    multiworker.start()
+    if multiworker.MULTI_WORKER and not _mcp_owner_lock.try_acquire():
+        app.state.mcp_manager = RemoteMCPManager()
+        app.state.mcp_owner_task = asyncio.create_task(_wait_for_mcp_ownership())
+        return
+    await _become_mcp_owner()
 
 
 @app.on_event("shutdown")
 async def shutdown_mcp_manager():
     """关闭时停止所有 MCP 连接"""
-    restore_task = getattr(app.state, "mcp_restore_task", None)
-    if restore_task is not None and not restore_task.done():
-        restore_task.cancel()
-        try:
-            await restore_task
-        except asyncio.CancelledError:
-            pass
+    for attr in ("mcp_owner_task", "mcp_restore_task"):
+        task = getattr(app.state, attr, None)
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
     mcp_manager = getattr(app.state, "mcp_manager", None)
     if mcp_manager is not None:
         await mcp_manager.stop_all()
+    await multiworker.stop()
 
 
 # MCP connection admin routes moved to backend/routers/mcp_admin.py
@@ -7455,6 +8195,10 @@ app.include_router(mcp_admin_router)
 from routers.erp import router as erp_router
 app.include_router(erp_router)
 
+# 后台任务查询 / 取消 / 下载（任务由各业务接口 ``?background=true`` 提交，见 jobs.py）
+from routers.jobs import router as jobs_router
+app.include_router(jobs_router)
+
 
 @app.get("/api/system/mode")
 async def get_system_mode():
@@ -7472,6 +8216,35 @@ async def get_system_mode():
     return {"mode": mode, "deploy_mode": get_deploy_mode(), "face_enabled": get_face_enabled()}
 
 
+@app.get("/api/system/slow-queries")
+async def get_slow_queries(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.ADMIN)),
+):
+    """按语句指纹汇总的 SQL 耗时 Top-N（总耗时降序，见 slow_query.py）。
+
+    统计跨租户，多租户模式下仅全局 admin 可看。
+    """
+    if get_deploy_mode() == "multi_tenant" and current_user.tenant_id is not None:
+        raise HTTPException(status_code=403, detail="仅全局 admin 可查看慢查询")
+    return {
+        "enabled": slow_query.SLOW_QUERY_LOG,
+        "threshold_ms": slow_query.SLOW_QUERY_MS,
+        "queries": slow_query.top(limit),
+    }
+
+
+@app.post("/api/system/slow-queries/reset")
+async def reset_slow_queries(
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.ADMIN)),
+):
+    """清空慢查询统计，重新开始一个统计窗口。"""
+    if get_deploy_mode() == "multi_tenant" and current_user.tenant_id is not None:
+        raise HTTPException(status_code=403, detail="仅全局 admin 可重置慢查询统计")
+    slow_query.reset()
+    return {"success": True}
+
+
 @app.put("/api/system/mode")
 async def set_system_mode(
     request: Request,
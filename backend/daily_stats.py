@@ -0,0 +1,137 @@
+"""出入库日汇总：按（租户, 仓库, 日, 类型）预聚合的 ``daily_stats`` 表。
+
+仪表盘与 MCP ``get_today_statistics``（走 /api/dashboard/stats）的今日 / 昨日
+入出库量、近 7 天趋势，以前每次请求都扫 ``inventory_records``（今日量还要 JOIN
+materials），成本随记录总量线性增长。改为读汇总表，只扫「天数 × 仓库数」行：
+
+* 写路径（入库、出库、批次移位、Excel 导入；新增记录走入库 / 出库）在**同一个
+  写事务**里调用 ``add()`` 累加，事务回滚时汇总一起回滚；
+* 绕过这些路径的批量操作（清库、删租户、整库导入、演示数据）在自己的事务里
+  执行 ``CLEAR_*_SQL`` / ``BACKFILL_*_SQL`` 按租户重算；
+* ``init_database`` 与 alembic 迁移在汇总表为空、记录非空时回填一次（升级）。
+
+日期取 ``created_at`` 的日期部分，与旧查询「created_at >= 'YYYY-MM-DD 00:00:00'」
+的字符串区间同义。tenant_id / warehouse_id 为 NULL 的历史记录记到 0，不会落入
+任何范围过滤（旧查询里它们同样匹配不上）。
+
+怀疑汇总漂移或手工改过库时重建::
+
+    cd backend && python daily_stats.py [--tenant-id N]
+"""
+from __future__ import annotations
+
+import argparse
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, select, text
+from sqlalchemy import func as _sa_func
+
+from metadata import daily_stats as _t_daily_stats
+
+# raw SQL：sqlite3 游标、database.py 的 MySQL shim 与 SQLAlchemy text() 都接受 :name 参数
+CLEAR_SQL = "DELETE FROM daily_stats"
+CLEAR_TENANT_SQL = "DELETE FROM daily_stats WHERE tenant_id = :tenant_id"
+_BACKFILL_SQL = """
+    INSERT INTO daily_stats (tenant_id, warehouse_id, day, type, quantity, record_count)
+    SELECT COALESCE(tenant_id, 0), COALESCE(warehouse_id, 0), DATE(created_at), type,
+           SUM(quantity), COUNT(*)
+    FROM inventory_records
+    WHERE created_at IS NOT NULL{tenant_filter}
+    GROUP BY COALESCE(tenant_id, 0), COALESCE(warehouse_id, 0), DATE(created_at), type
+"""
+BACKFILL_SQL = _BACKFILL_SQL.format(tenant_filter="")
+BACKFILL_TENANT_SQL = _BACKFILL_SQL.format(tenant_filter=" AND tenant_id = :tenant_id")
+
+
+def day_of(created_at) -> str:
+    """``created_at`` 所在日（``YYYY-MM-DD``）。"""
+    if isinstance(created_at, (datetime, date)):
+        return created_at.strftime('%Y-%m-%d')
+    return str(created_at)[:10]
+
+
+def _upsert(dialect_name: str):
+    """按主键累加的 upsert：MySQL 用 ON DUPLICATE KEY UPDATE，其余（SQLite）用 ON CONFLICT。"""
+    t = _t_daily_stats
+    if dialect_name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as _insert
+        stmt = _insert(t)
+        return stmt.on_duplicate_key_update(
+            quantity=t.c.quantity + stmt.inserted.quantity,
+            record_count=t.c.record_count + stmt.inserted.record_count,
+        )
+    from sqlalchemy.dialects.sqlite import insert as _insert
+    stmt = _insert(t)
+    return stmt.on_conflict_do_update(
+        index_elements=[t.c.tenant_id, t.c.warehouse_id, t.c.day, t.c.type],
+        set_=dict(quantity=t.c.quantity + stmt.excluded.quantity,
+                  record_count=t.c.record_count + stmt.excluded.record_count),
+    )
+
+
+def add(sa_conn, records: Iterable[dict]) -> None:
+    """把刚插入的出入库记录累加进汇总（须与插入在同一事务）。
+
+    ``records`` 是 inventory_records 的插入参数（需含 type / quantity /
+    tenant_id / warehouse_id / created_at）。按键合并后一条 upsert 写完，
+    语句数与记录数、当天是否已有汇总行都无关（导入的「语句数不随行数
+    增长」约束）；键排序后再写，并发事务按相同顺序加锁。
+    """
+    deltas: Dict[Tuple[int, int, str, str], Tuple[int, int]] = {}
+    for r in records:
+        key = (r.get('tenant_id') or 0, r.get('warehouse_id') or 0,
+               day_of(r.get('created_at') or datetime.now()), r['type'])
+        qty, count = deltas.get(key, (0, 0))
+        deltas[key] = (qty + r['quantity'], count + 1)
+    if not deltas:
+        return
+    sa_conn.execute(_upsert(sa_conn.dialect.name), [
+        dict(tenant_id=tenant_id, warehouse_id=warehouse_id, day=day, type=rtype,
+             quantity=qty, record_count=count)
+        for (tenant_id, warehouse_id, day, rtype), (qty, count) in sorted(deltas.items())
+    ])
+
+
+def totals(sa_conn, scope_preds, first_day: str, last_day: str) -> Dict[Tuple[str, str], int]:
+    """``[first_day, last_day]`` 内按（日, 类型）汇总的数量。
+
+    ``scope_preds`` 用 ``build_authorized_scope_predicates(daily_stats, ...)``
+    生成——汇总表有同名的 tenant_id / warehouse_id 列，范围语义与记录表一致。
+    """
+    t = _t_daily_stats
+    rows = sa_conn.execute(
+        select(t.c.day, t.c.type, _sa_func.sum(t.c.quantity))
+        .where(and_(t.c.day >= first_day, t.c.day <= last_day, *scope_preds))
+        .group_by(t.c.day, t.c.type)
+    ).all()
+    return {(day, rtype): int(qty or 0) for day, rtype, qty in rows}
+
+
+def rebuild(sa_conn, tenant_id: Optional[int] = None) -> int:
+    """从 inventory_records 重算汇总（``tenant_id`` 为 None 时重算全部），返回行数。"""
+    if tenant_id is None:
+        sa_conn.execute(text(CLEAR_SQL))
+        sa_conn.execute(text(BACKFILL_SQL))
+    else:
+        sa_conn.execute(text(CLEAR_TENANT_SQL), {"tenant_id": tenant_id})
+        sa_conn.execute(text(BACKFILL_TENANT_SQL), {"tenant_id": tenant_id})
+    count = select(_sa_func.count()).select_from(_t_daily_stats)
+    if tenant_id is not None:
+        count = count.where(_t_daily_stats.c.tenant_id == tenant_id)
+    return sa_conn.execute(count).scalar() or 0
+
+
+def main(argv: list[str] | None = None) -> None:
+    p = argparse.ArgumentParser(description="Rebuild the daily_stats rollup from inventory_records.")
+    p.add_argument("--tenant-id", type=int, default=None, help="只重算该租户（默认全部）")
+    args = p.parse_args(argv)
+    from db import get_engine
+    with get_engine().begin() as sa_conn:
+        rows = rebuild(sa_conn, args.tenant_id)
+    scope = f"tenant {args.tenant_id}" if args.tenant_id is not None else "all tenants"
+    print(f"daily_stats rebuilt for {scope}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 import random
 
+from metrics import sqlite_connection_factory
 from models import RecordType, RoleName
 
 logger = logging.getLogger('warehouse')
@@ -78,7 +79,8 @@ def get_db_connection():
     ``backend.db.get_engine()``。
     """
     if _is_sqlite():
-        conn = sqlite3.connect(DATABASE_PATH)
+        # 开启请求指标（METRICS_ENABLED）时用带计数的连接类，否则为原生 sqlite3.Connection
+        conn = sqlite3.connect(DATABASE_PATH, factory=sqlite_connection_factory())
         conn.row_factory = sqlite3.Row
 
         # 生产模式下启用优化配置
@@ -287,6 +289,54 @@ class _SAConnectionShim:
             self.rollback()
         self.close()
 
+def _migrate_face_source_images(cursor, batch_size: int = 200):
+    """把 face_enrollments.source_image_b64 中可无损解码的照片搬进 face_source_images。
+
+    按 id 分批游标推进（解不开的遗留值原样保留，不会反复扫到）；已迁移行的旧列
+    置 NULL。幂等：只处理 source_image_sha256 为空的行。
+    """
+    import base64
+    import binascii
+    import hashlib
+
+    last_id = 0
+    while True:
+        cursor.execute(
+            """
+            SELECT id, tenant_id, source_image_b64 FROM face_enrollments
+            WHERE id > ? AND source_image_sha256 IS NULL
+              AND source_image_b64 IS NOT NULL AND source_image_b64 != ''
+            ORDER BY id LIMIT ?
+            """,
+            (last_id, batch_size),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        for row_id, tenant_id, b64 in rows:
+            last_id = row_id
+            s = b64.strip()
+            if s.startswith('data:') and ',' in s:
+                s = s.split(',', 1)[1]
+            try:
+                data = base64.b64decode(''.join(s.split()), validate=True)
+            except (binascii.Error, ValueError):
+                continue
+            if not data:
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            cursor.execute(
+                'INSERT OR IGNORE INTO face_source_images (tenant_id, sha256, data, byte_size) '
+                'VALUES (?, ?, ?, ?)',
+                (tenant_id, digest, data, len(data)),
+            )
+            cursor.execute(
+                'UPDATE face_enrollments SET source_image_sha256 = ?, source_image_b64 = NULL '
+                'WHERE id = ?',
+                (digest, row_id),
+            )
+
+
 def init_database():
     """初始化数据库表结构（仅 SQLite）。
 
@@ -478,6 +528,69 @@ def init_database():
         )
     ''')
 
+    # 批次号序号分配器（每仓每天一行，见 reserve_batch_nos）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_no_sequences (
+            warehouse_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            last_seq INTEGER NOT NULL,
+            scanned_batch_id INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (warehouse_id, day)
+        )
+    ''')
+
+    # 出入库日汇总（每租户每仓每天每类型一行，见 daily_stats.py）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            tenant_id INTEGER NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            type TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            record_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, warehouse_id, day, type)
+        )
+    ''')
+
+    # 后台任务表（见 jobs.py）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            id TEXT PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            tenant_id INTEGER,
+            created_by INTEGER,
+            created_by_name TEXT,
+            dedupe_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            artifact TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            owner TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_background_jobs_tenant ON background_jobs(tenant_id, created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_background_jobs_active ON background_jobs(status, job_type)')
+
+    # 创建缓存失效事件表（多 worker 部署，见 multiworker.py）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            payload TEXT,
+            origin TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created ON cache_invalidations(created_at)')
+
     # 创建批次消耗记录表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS batch_consumptions (
@@ -694,6 +807,20 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_face_enroll ON face_enrollments(tenant_id, model_tag, is_active)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_face_enroll_subject ON face_enrollments(subject_id)')
 
+    # 注册照片内容寻址存储（face_enrollments.source_image_sha256 引用）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS face_source_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            data BLOB NOT NULL,
+            byte_size INTEGER NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(tenant_id) REFERENCES tenants(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_face_source_images_hash ON face_source_images(tenant_id, sha256)')
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS face_auth_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -787,6 +914,16 @@ def init_database():
     except sqlite3.OperationalError:
         cursor.execute("ALTER TABLE tenant_face_config ADD COLUMN greeting_enabled INTEGER NOT NULL DEFAULT 0")
 
+    # source_image_sha256：注册照片从 face_enrollments.source_image_b64 迁到
+    # face_source_images 按哈希引用。旧库补列后把能解码的 base64 搬成原始字节
+    # （与 alembic 迁移 t9u0v1w2x3y4 同规则）。
+    try:
+        cursor.execute('SELECT source_image_sha256 FROM face_enrollments LIMIT 1')
+    except sqlite3.OperationalError:
+        cursor.execute('ALTER TABLE face_enrollments ADD COLUMN source_image_sha256 TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_face_enroll_source_image ON face_enrollments(tenant_id, source_image_sha256)')
+    _migrate_face_source_images(cursor)
+
     # 检查并添加 warehouse_id 字段到各表（多仓库支持）
     for table in ('batches', 'inventory_records', 'api_keys', 'mcp_connections'):
         try:
@@ -915,11 +1052,21 @@ def init_database():
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_materials_tenant ON materials(tenant_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_batches_tenant ON batches(tenant_id)')
     cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_batches_no_wh ON batches(batch_no, warehouse_id)')
+    # 物料库存 = 未耗尽批次 sum(quantity)：按物料聚合批次的热点查询
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_batches_material ON batches(material_id, is_exhausted)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_tenant ON inventory_records(tenant_id)')
+    # 按物料查记录（物料流水、仪表盘扣除禁用物料当日量）
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_material_created ON inventory_records(material_id, created_at)')
     cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_erp_providers_name_tenant ON erp_providers(provider_name, tenant_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_bc_tenant ON batch_consumptions(tenant_id)')
     cursor.execute('CREATE INDEX IF NOT EXISTS idx_bc_warehouse ON batch_consumptions(warehouse_id)')
 
+    # 升级：日汇总表是新建的空表而记录非空时，从记录表回填一次
+    cursor.execute('SELECT COUNT(*) as cnt FROM daily_stats')
+    if cursor.fetchone()['cnt'] == 0:
+        from daily_stats import BACKFILL_SQL
+        cursor.execute(BACKFILL_SQL)
+
     # ============================================
     # DEPLOY_MODE 校验
     # ============================================
@@ -991,59 +1138,120 @@ def get_materials_quantity_map(material_ids):
         return {int(r.material_id): int(r.qty or 0) for r in conn.execute(stmt).fetchall()}
 
 
-def generate_batch_no(material_id: int, warehouse_id: int, cursor=None) -> str:
-    """生成批次号: YYYYMMDD-XXX (warehouse-scoped unique)
-
-    传入 cursor 可在同一事务内看到未提交的批次（避免批量创建时序号冲突）。
-    无 cursor 时：dialect-portable 路径走 SA Core。
-
-    序号取当天最大值 + 1，且**必须在 Python 侧按整数比较**：序号只补零到 3 位，
-    单日超过 999 之后就出现 4 位号（-1000），此时 SQL 的字符串排序会把
-    '20260807-999' 判为大于 '20260807-1000'，导致每次都重新生成已存在的
-    -1000，撞 (batch_no, warehouse_id) 唯一约束。
-
-    warehouse_id 是**必填**：批次号在迁移 a1b2c3d4e5f6 后改为
-    (batch_no, warehouse_id) 复合唯一，而 NULL 不参与复合唯一约束。
-    若调用者拿不到 warehouse_id（例如全局 admin 写入路径），上游应当先用
-    require_warehouse_id() 解析或显式拒绝，避免跨租户碰撞静默通过。
-    """
+def _require_batch_warehouse(warehouse_id) -> None:
     if not isinstance(warehouse_id, int) or warehouse_id <= 0:
         raise ValueError(
             f"generate_batch_no 需要正整数的 warehouse_id（收到 {warehouse_id!r}）："
             "(batch_no, warehouse_id) 是复合唯一约束，NULL/0/非整型会绕过 DB 层保护，"
             "可能导致跨租户批次号碰撞。请在调用前通过 require_warehouse_id() 解析。"
         )
-    today = datetime.now().strftime('%Y%m%d')
-    like_pat = f'{today}-%'
 
-    if cursor is not None:
-        cursor.execute(
-            "SELECT batch_no FROM batches WHERE batch_no LIKE ? AND warehouse_id = ?",
-            (like_pat, warehouse_id),
-        )
-        existing = [row['batch_no'] for row in cursor.fetchall()]
-    else:
-        from sqlalchemy import select, and_
-        from db import get_engine
-        from metadata import batches as _t_batches
-        with get_engine().connect() as conn:
-            existing = [
-                row[0] for row in conn.execute(
-                    select(_t_batches.c.batch_no)
-                    .where(and_(
-                        _t_batches.c.batch_no.like(like_pat),
-                        _t_batches.c.warehouse_id == warehouse_id,
-                    ))
-                ).fetchall()
-            ]
 
+def _max_batch_seq(conn, warehouse_id: int, day: str, after_id: Optional[int] = None) -> int:
+    """当天该仓批次号的最大序号（after_id 给定时只看 id 更大的批次）。
+
+    **必须在 Python 侧按整数比较**：序号只补零到 3 位，单日超过 999 之后就出现
+    4 位号（-1000），SQL 的字符串排序会把 '20260807-999' 判为大于
+    '20260807-1000'。后缀不是整数的（用户手填的杂号）忽略。
+    """
+    from sqlalchemy import select, and_
+    from metadata import batches as _t_batches
+    conds = [
+        _t_batches.c.batch_no.like(f'{day}-%'),
+        _t_batches.c.warehouse_id == warehouse_id,
+    ]
+    if after_id is not None:
+        conds.append(_t_batches.c.id > after_id)
     last_seq = 0
-    for batch_no in existing:
+    for (batch_no,) in conn.execute(select(_t_batches.c.batch_no).where(and_(*conds))):
         try:
             last_seq = max(last_seq, int(batch_no.split('-')[-1]))
         except (ValueError, IndexError):
             continue
-    return f'{today}-{last_seq + 1:03d}'
+    return last_seq
+
+
+def reserve_batch_nos(warehouse_id: int, count: int = 1, conn=None) -> list:
+    """为仓库预留当天 ``count`` 个连续批次号（YYYYMMDD-XXX），返回升序列表。
+
+    序号记在 ``batch_no_sequences``（每仓每天一行），在调用方的写事务里原子自增：
+    SQLite 用 ``UPDATE ... RETURNING``，MySQL 先 UPDATE 拿行锁再读回——同仓同日
+    的并发分配被这把行锁串行化，成本与当天已有批次数无关。传入 ``conn``
+    时随调用方事务提交/回滚；不传则开一个短事务立即提交（失败的写入留下空号，
+    批次号本来就允许不连续）。
+
+    兼容旧编号规则：
+    - 当天首次分配时按「当天最大序号 + 1」起步（一次性扫描当天批次）；
+    - 绕过分配器写入的批次号（用户手填、导库、直接 INSERT）靠 ``scanned_batch_id``
+      水位追上：每次只看水位之后新增的批次，发现更大的序号就从它之后继续，
+      所以仍然是「最大值 + 1」语义，不回填空号；
+    - 序号超过 999 自然变成 4 位，比较一律按整数。
+
+    并发事务里尚未提交的手填号对本次分配不可见，极端情况下仍可能撞唯一约束，
+    写入方需保留 IntegrityError 重试。
+    """
+    _require_batch_warehouse(warehouse_id)
+    if count < 1:
+        raise ValueError(f"count 必须 >= 1（收到 {count!r}）")
+    if conn is None:
+        from db import get_engine
+        with get_engine().begin() as own_conn:
+            return reserve_batch_nos(warehouse_id, count, conn=own_conn)
+
+    from sqlalchemy import select, update, insert, and_, func
+    from metadata import batches as _t_batches, batch_no_sequences as _t_seq
+
+    day = datetime.now().strftime('%Y%m%d')
+    key = and_(_t_seq.c.warehouse_id == warehouse_id, _t_seq.c.day == day)
+    bump = update(_t_seq).where(key).values(last_seq=_t_seq.c.last_seq + count)
+
+    while True:
+        if conn.dialect.update_returning:
+            row = conn.execute(bump.returning(_t_seq.c.last_seq, _t_seq.c.scanned_batch_id)).first()
+        elif conn.execute(bump).rowcount:
+            row = conn.execute(select(_t_seq.c.last_seq, _t_seq.c.scanned_batch_id).where(key)).first()
+        else:
+            row = None
+        if row is not None:
+            break
+        # 当天首次分配：按旧规则扫一次当天批次定起点；并发首分配由 IGNORE 兜底，
+        # 输掉的一方回到上面的 UPDATE。
+        conn.execute(
+            insert(_t_seq)
+            .prefix_with('OR IGNORE', dialect='sqlite')
+            .prefix_with('IGNORE', dialect='mysql')
+            .values(
+                warehouse_id=warehouse_id, day=day,
+                last_seq=_max_batch_seq(conn, warehouse_id, day),
+                scanned_batch_id=conn.execute(select(func.max(_t_batches.c.id))).scalar() or 0,
+            )
+        )
+
+    last_seq, scanned = row
+    first = last_seq - count + 1
+    top = conn.execute(select(func.max(_t_batches.c.id))).scalar() or 0
+    if top != scanned:
+        # 水位之后有新批次：看其中有没有绕过分配器、序号更大的。
+        # top < scanned 说明 batches 被清空/重建过（id 回退），退回全量扫描。
+        seen = _max_batch_seq(conn, warehouse_id, day, after_id=scanned if top > scanned else None)
+        if seen >= first:
+            first = seen + 1
+            last_seq = first + count - 1
+        conn.execute(update(_t_seq).where(key).values(last_seq=last_seq, scanned_batch_id=top))
+    return [f'{day}-{seq:03d}' for seq in range(first, last_seq + 1)]
+
+
+def generate_batch_no(material_id: int, warehouse_id: int, conn=None) -> str:
+    """生成批次号: YYYYMMDD-XXX (warehouse-scoped unique)
+
+    分配一个号，语义见 reserve_batch_nos；传入 ``conn`` 则在调用方写事务内分配。
+
+    warehouse_id 是**必填**：批次号在迁移 a1b2c3d4e5f6 后改为
+    (batch_no, warehouse_id) 复合唯一，而 NULL 不参与复合唯一约束。
+    若调用者拿不到 warehouse_id（例如全局 admin 写入路径），上游应当先用
+    require_warehouse_id() 解析或显式拒绝，避免跨租户碰撞静默通过。
+    """
+    return reserve_batch_nos(warehouse_id, 1, conn=conn)[0]
 
 
 def has_admin_user():
@@ -1350,6 +1558,11 @@ def generate_mock_data():
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (material_id, record_type, quantity, operator, reason_category, reason_note, record_time.strftime('%Y-%m-%d %H:%M:%S')))
 
+    # 上面的记录绕过了写路径，日汇总整体重算
+    from daily_stats import BACKFILL_SQL, CLEAR_SQL
+    cursor.execute(CLEAR_SQL)
+    cursor.execute(BACKFILL_SQL)
+
     conn.commit()
     conn.close()
 
@@ -30,6 +30,7 @@ from database import (
     get_deploy_mode,
 )
 from db import get_engine
+import metrics
 from metadata import (
     api_keys as _t_api_keys,
     contacts as _t_contacts,
@@ -324,6 +325,10 @@ def require_permission(resource: Resource, action: Action):
             raise HTTPException(status_code=403, detail="权限不足")
         if user_role < min_role:
             raise HTTPException(status_code=403, detail="权限不足")
+        # 慢查询日志 / 指标按租户归因（未开启统计时为 None）
+        stats = metrics.current_stats()
+        if stats is not None:
+            stats.tenant_id = current_user.tenant_id
         return current_user
 
     _dep.__perm_marker__ = True
@@ -21,8 +21,13 @@ correlates with face size).
 """
 from __future__ import annotations
 
+import asyncio
 import base64
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 import httpx
@@ -37,6 +42,11 @@ DEFAULT_TIMEOUT = 10.0
 # 与本模拟器同模型，routers/mcp_admin.py 的 DEVICE_FACE_MODEL_TAG 也须与此一致。
 LOCAL_MODEL_TAG = "we2-mfnr6-128-v1"
 
+# 本机推理（mode=local）并发度：专用线程池的线程数 = WE2 模拟器池的实例数。
+# 每个实例独占一对 TFLite 解释器，invoke 期间释放 GIL，N 路推理可真并行；
+# 线程比实例多只会在池队列上空等，所以两者取同一个值。
+LOCAL_INFER_WORKERS = max(1, int(os.environ.get("FACE_LOCAL_INFER_WORKERS", "2")))
+
 
 def _headers(auth_token: Optional[str]) -> dict:
     h = {"Content-Type": "application/json"}
@@ -52,10 +62,13 @@ class FaceEndpointError(Exception):
 def _infer_local(image_b64: str) -> dict:
     """In-process inference via the bundled WE2 simulator (mode=local).
 
-    No HTTP, no endpoint required. Decodes the base64 image, runs the
-    process-wide ``WE2Simulator`` singleton, and returns the same
+    No HTTP, no endpoint required. Decodes the base64 image, runs it on one
+    instance of the process-wide ``WE2SimulatorPool``, and returns the same
     ``{embedding: bytes, model_tag: str}`` shape as the HTTP path. Picks the
     highest ``det_score`` face to match the remote-endpoint selection rule.
+
+    Synchronous and CPU-bound — async callers must go through
+    :func:`infer_local`, never call this directly from a coroutine.
     """
     import base64 as _b64
     import io
@@ -74,13 +87,13 @@ def _infer_local(image_b64: str) -> dict:
         raise FaceEndpointError("infer_bad_image") from e
 
     try:
-        from face.we2 import get_simulator
+        from face.we2 import get_simulator_pool
     except Exception as e:  # we2-sim extra not installed
         logger.warning("local face simulator unavailable: %s", e)
         raise FaceEndpointError("local_simulator_unavailable") from e
 
     try:
-        result = get_simulator().infer(image)
+        result = get_simulator_pool(LOCAL_INFER_WORKERS).infer(image)
     except FileNotFoundError as e:
         raise FaceEndpointError("local_model_missing") from e
     except Exception as e:
@@ -98,6 +111,93 @@ def _infer_local(image_b64: str) -> dict:
     return {"embedding": emb_bytes, "model_tag": model_tag}
 
 
+# 专用执行器（不与 FastAPI 同步路由共用默认线程池）+ 排队/耗时统计。
+# 统计在执行器线程和事件循环线程两侧都会写，统一由 _local_stats_lock 保护。
+_local_executor: Optional[ThreadPoolExecutor] = None
+_local_executor_lock = threading.Lock()
+_local_stats_lock = threading.Lock()
+_local_stats: dict = {
+    "queued": 0, "running": 0, "completed": 0, "failed": 0,
+    "total_ms": 0.0, "max_ms": 0.0, "last_ms": None, "total_wait_ms": 0.0,
+}
+
+
+def _get_local_executor() -> ThreadPoolExecutor:
+    global _local_executor
+    if _local_executor is None:
+        with _local_executor_lock:
+            if _local_executor is None:
+                _local_executor = ThreadPoolExecutor(
+                    max_workers=LOCAL_INFER_WORKERS,
+                    thread_name_prefix="face-local-infer",
+                )
+    return _local_executor
+
+
+def _run_local_timed(image_b64: str, enqueued_at: float) -> dict:
+    """Executor-side wrapper: bookkeeping around one ``_infer_local`` call."""
+    started = time.perf_counter()
+    with _local_stats_lock:
+        _local_stats["queued"] -= 1
+        _local_stats["running"] += 1
+        _local_stats["total_wait_ms"] += (started - enqueued_at) * 1000.0
+    ok = False
+    try:
+        result = _infer_local(image_b64)
+        ok = True
+        return result
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        with _local_stats_lock:
+            _local_stats["running"] -= 1
+            _local_stats["completed" if ok else "failed"] += 1
+            _local_stats["total_ms"] += elapsed_ms
+            _local_stats["max_ms"] = max(_local_stats["max_ms"], elapsed_ms)
+            _local_stats["last_ms"] = elapsed_ms
+
+
+def _on_local_done(fut) -> None:
+    # 还没轮到执行就被取消（调用方协程被 cancel）→ _run_local_timed 从未运行，
+    # 在这里把排队计数还回去。
+    if fut.cancelled():
+        with _local_stats_lock:
+            _local_stats["queued"] -= 1
+
+
+async def infer_local(image_b64: str) -> dict:
+    """Async wrapper for :func:`_infer_local` — runs on the dedicated executor.
+
+    The event loop only awaits; decode + SCRFD + alignment + MFN happen on a
+    ``face-local-infer`` thread against a pooled simulator instance, so one
+    enrollment photo no longer stalls every other request on the loop.
+    """
+    with _local_stats_lock:
+        _local_stats["queued"] += 1
+    fut = _get_local_executor().submit(
+        _run_local_timed, image_b64, time.perf_counter())
+    fut.add_done_callback(_on_local_done)
+    return await asyncio.wrap_future(fut)
+
+
+def local_infer_stats() -> dict:
+    """Snapshot of the local inference executor: queue depth + latency."""
+    with _local_stats_lock:
+        st = dict(_local_stats)
+    finished = st["completed"] + st["failed"]
+    started = finished + st["running"]
+    return {
+        "workers": LOCAL_INFER_WORKERS,
+        "queued": st["queued"],
+        "running": st["running"],
+        "completed": st["completed"],
+        "failed": st["failed"],
+        "avg_ms": round(st["total_ms"] / finished, 3) if finished else None,
+        "max_ms": round(st["max_ms"], 3),
+        "last_ms": round(st["last_ms"], 3) if st["last_ms"] is not None else None,
+        "avg_wait_ms": round(st["total_wait_ms"] / started, 3) if started else None,
+    }
+
+
 def _parse_json_response(resp: "httpx.Response", prefix: str) -> dict:
     """协议校验统一收口：非 2xx、非法 JSON、非 dict 都归为 FaceEndpointError，
     避免解析异常逃出 FaceEndpointError 错误处理变 500。"""
@@ -123,7 +223,7 @@ async def infer(cfg: FaceConfig, image_b64: str) -> dict:
     endpoint per the face_rec_api contract.
     """
     if cfg.mode == "local":
-        return _infer_local(image_b64)
+        return await infer_local(image_b64)
     if not cfg.endpoint:
         raise FaceEndpointError("endpoint_not_configured")
     url = cfg.endpoint.rstrip("/") + "/infer"
@@ -4,17 +4,19 @@ from __future__ import annotations
 import json
 import logging
 import math
+import os
 import time
 from datetime import datetime
 from typing import List, Optional
 
 from sqlalchemy import select, and_
 
+import jobs
 from db import get_engine
 from database import get_face_enabled
 from metadata import tenant_face_config, tenant_face_operation_rules
 
-from . import endpoint_client
+from . import endpoint_client, source_images
 from .endpoint_client import FaceEndpointError
 from .matcher import topk_match
 from .models import Decision, FaceConfig, FaceRule
@@ -44,10 +46,19 @@ _reembed_inflight: set = set()
 # 秒级（100 人 × ~30ms 推理就是 3s+），超出部分靠配置变更触发的后台批量任务。
 LAZY_RECOMPUTE_PER_REQUEST = 3
 
-# 配置变更触发的后台批量补算任务：key=(tenant_id, mode, endpoint)（任务内才探得
-# model_tag），同 key 只跑一个（幂等可重入）；status 按 tenant 暴露给管理 API。
-_recompute_tasks: dict = {}
-_recompute_status: dict = {}
+# 批量补算的推理并发度：lan 端点同时在途的 /infer 数（本机模式用模拟器池大小
+# endpoint_client.LOCAL_INFER_WORKERS）。结果攒批写库：满 REEMBED_INSERT_CHUNK
+# 行或距上次提交超过 REEMBED_FLUSH_INTERVAL_S 秒就提交一批。
+ENDPOINT_REEMBED_CONCURRENCY = max(
+    1, int(os.environ.get("FACE_REEMBED_CONCURRENCY", "4")))
+REEMBED_INSERT_CHUNK = 32
+REEMBED_FLUSH_INTERVAL_S = 1.0
+
+# 配置变更触发的后台批量补算走后台任务框架（jobs.py，任务类型 face_recompute）：
+# dedupe_key=(tenant_id, mode, endpoint)（任务内才探得 model_tag），同 key 只跑一个
+# （幂等可重入）；进度 / model_tag 记在任务行上，按 tenant 暴露给管理 API。
+RECOMPUTE_JOB_TYPE = "face_recompute"
+jobs.register_job_type(RECOMPUTE_JOB_TYPE, limit=2)
 
 
 # ── data access helpers ──
@@ -247,12 +258,13 @@ def _log_decision(
 
 async def ensure_enrollments_for_model(
     conn, tenant_id: int, model_tag: str, infer_image,
-    *, limit: Optional[int] = None, progress=None,
+    *, limit: Optional[int] = None, progress=None, concurrency: int = 1,
 ) -> int:
     """懒重算核心（双向通用）：为缺 ``model_tag`` embedding 的 subject 补行。
 
     统一原则：enrollment 按 (subject, model_tag) 多行共存；任何模型缺行、且该
-    subject 存在任一带 ``source_image_b64`` 注册照片的 active enrollment，就用
+    subject 存在任一带注册照片（``source_image_sha256`` 引用 face_source_images，
+    或旧列 ``source_image_b64`` 遗留值）的 active enrollment，就用
     照片现算并缓存为新 enrollment（复制 applies_to_warehouse_ids，
     enrolled_by=NULL）。切换识别模式（local WE2 ↔ lan Hailo/Jetson）永不要求
     用户重录。两个调用方：
@@ -264,22 +276,25 @@ async def ensure_enrollments_for_model(
     ``infer_image``: async callable(image_b64) -> {"embedding": bytes,
     "model_tag": str}。
 
-    新行的 source_image_b64 置 NULL：原始照片保留在源 enrollment 上即可——本函数
-    扫描的是「任一带照片的 active enrollment」，未来再换模型仍能从源行重算；复制
-    base64 大字段只会成倍膨胀 DB，无信息增益。
+    新行不带照片引用：原始照片保留在源 enrollment 上即可——本函数扫描的是「任一
+    带照片的 active enrollment」，未来再换模型仍能从源行重算。
 
     失败（spoof / no_face / 端点错 / 模拟器缺失）warn 并跳过该 subject，同时记入
     进程内 ``_reembed_failed``，避免每次调用重复轰炸；进程重启自然重试。
     ``limit``：单次调用最多尝试补算的 subject 数（验证路径兜底限量用，防人数多时
     首次验证被拖到秒级）；None = 不限（后台批量 / push 下发）。
     ``progress``：可选 callable(done, total)，后台任务用来更新进度。
-    正在被其他协程补算的 (subject, model) 直接跳过（进行中去重，防并发验证
-    重复算同一 subject）。返回本次插入的行数。
+    ``concurrency``：同时在途的 ``infer_image`` 数（端点 / 模拟器池的并发上限），
+    默认 1 = 串行。结果攒批写入：每 ``REEMBED_INSERT_CHUNK`` 行或每
+    ``REEMBED_FLUSH_INTERVAL_S`` 秒提交一次，中途被杀最多丢最后一批未提交的。
+    本次要算的 (subject, model) 开工前整体登记为进行中，其他协程直接跳过（进行中
+    去重，防并发验证重复算同一 subject）。返回本次插入的行数。
     """
     cur = conn.cursor()
     cur.execute(
         """
         SELECT e.subject_id AS subject_id,
+               e.source_image_sha256 AS img_sha,
                e.source_image_b64 AS img,
                e.applies_to_warehouse_ids AS applies
         FROM face_enrollments e
@@ -287,7 +302,8 @@ async def ensure_enrollments_for_model(
         WHERE e.id IN (
             SELECT MAX(id) FROM face_enrollments
             WHERE tenant_id = ? AND is_active = 1
-              AND source_image_b64 IS NOT NULL AND source_image_b64 != ''
+              AND (source_image_sha256 IS NOT NULL
+                   OR (source_image_b64 IS NOT NULL AND source_image_b64 != ''))
             GROUP BY subject_id
         )
           AND s.is_active = 1
@@ -301,59 +317,109 @@ async def ensure_enrollments_for_model(
     rows = cur.fetchall()
     if not rows:
         return 0
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    inserted = 0
-    attempted = 0
     total = len(rows)
-    for i, row in enumerate(rows):
-        sid = int(row["subject_id"])
-        key = (sid, model_tag)
+    done = 0
+    todo = []
+    for row in rows:
+        key = (int(row["subject_id"]), model_tag)
         if key in _reembed_failed or key in _reembed_inflight:
-            if progress:
-                progress(i + 1, total)
-            continue
-        if limit is not None and attempted >= limit:
-            break  # 剩余交给后台批量任务
-        attempted += 1
-        _reembed_inflight.add(key)
-        try:
-            result = await infer_image(row["img"])
-        except FaceEndpointError as e:
-            logger.warning(
-                "lazy re-embed skipped: subject=%s target_model=%s reason=%s",
-                sid, model_tag, e,
-            )
-            _reembed_failed.add(key)
+            done += 1
             continue
-        finally:
-            _reembed_inflight.discard(key)
-        got_tag = result["model_tag"]
-        cur.execute(
+        if limit is not None and len(todo) >= limit:
+            continue  # 剩余交给后台批量任务
+        todo.append(row)
+    if progress and done:
+        progress(done, total)
+    if not todo:
+        return 0
+    keys = [(int(row["subject_id"]), model_tag) for row in todo]
+    _reembed_inflight.update(keys)
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    pending: list = []
+    last_flush = time.monotonic()
+    stats = {"inserted": 0, "attempted": 0}
+    rows_iter = iter(todo)
+
+    def _flush() -> None:
+        nonlocal last_flush
+        last_flush = time.monotonic()
+        if not pending:
+            return
+        cur.executemany(
             """
             INSERT INTO face_enrollments
                 (subject_id, tenant_id, model_tag, embedding, source_image_b64,
                  applies_to_warehouse_ids, is_active, enrolled_at, enrolled_by)
             VALUES (?, ?, ?, ?, NULL, ?, 1, ?, NULL)
             """,
-            (sid, tenant_id, got_tag, result["embedding"], row["applies"], now),
+            pending,
         )
-        conn.commit()  # 每条独立提交：后台任务中途被杀不丢已算好的行
-        inserted += 1
-        if got_tag != model_tag:
-            # 推理方返回的 model_tag 与请求侧不一致（端点又换了模型？）：插入的
-            # 数据本身有效，但对当前 target 仍缺 → 标失败避免每次调用死循环重算。
-            logger.warning(
-                "lazy re-embed model_tag mismatch: subject=%s want=%s got=%s",
-                sid, model_tag, got_tag,
-            )
-            _reembed_failed.add(key)
-        if progress:
-            progress(i + 1, total)
-        if attempted % 10 == 0:
-            logger.info(
-                "lazy re-embed progress: tenant=%s model=%s %d/%d",
-                tenant_id, model_tag, i + 1, total,
-            )
+        conn.commit()  # 按批提交：后台任务中途被杀不丢已提交批次
+        stats["inserted"] += len(pending)
+        pending.clear()
+
+    async def _worker() -> None:
+        nonlocal done
+        for row in rows_iter:
+            sid = int(row["subject_id"])
+            key = (sid, model_tag)
+            stats["attempted"] += 1
+            try:
+                # 照片按需逐张取（同时在内存的只有在途的几张）；旧列遗留值直接用
+                img = row["img"] or source_images.load_source_image_b64(
+                    conn, tenant_id, row["img_sha"])
+                if not img:
+                    raise FaceEndpointError("source_image_missing")
+                result = await infer_image(img)
+            except FaceEndpointError as e:
+                logger.warning(
+                    "lazy re-embed skipped: subject=%s target_model=%s reason=%s",
+                    sid, model_tag, e,
+                )
+                _reembed_failed.add(key)
+                result = None
+            if result is not None:
+                got_tag = result["model_tag"]
+                pending.append(
+                    (sid, tenant_id, got_tag, result["embedding"], row["applies"], now))
+                if got_tag != model_tag:
+                    # 推理方返回的 model_tag 与请求侧不一致（端点又换了模型？）：插入的
+                    # 数据本身有效，但对当前 target 仍缺 → 标失败避免每次调用死循环重算。
+                    logger.warning(
+                        "lazy re-embed model_tag mismatch: subject=%s want=%s got=%s",
+                        sid, model_tag, got_tag,
+                    )
+                    _reembed_failed.add(key)
+                if (len(pending) >= REEMBED_INSERT_CHUNK
+                        or time.monotonic() - last_flush >= REEMBED_FLUSH_INTERVAL_S):
+                    _flush()
+            done += 1
+            if progress:
+                progress(done, total)
+            if stats["attempted"] % 10 == 0:
+                logger.info(
+                    "lazy re-embed progress: tenant=%s model=%s %d/%d",
+                    tenant_id, model_tag, done, total,
+                )
+
+    import asyncio
+
+    workers = [
+        asyncio.ensure_future(_worker())
+        for _ in range(max(1, min(concurrency, len(todo))))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    finally:
+        _flush()
+        _reembed_inflight.difference_update(keys)
+    inserted = stats["inserted"]
     if inserted:
         logger.info(
             "lazy re-embed: tenant=%s model=%s inserted %d enrollment(s)",
@@ -375,13 +441,22 @@ async def _ensure_model_enrollments(conn, cfg: FaceConfig, tenant_id: int, model
     await ensure_enrollments_for_model(
         conn, tenant_id, model_tag, infer_image,
         limit=LAZY_RECOMPUTE_PER_REQUEST,
+        concurrency=min(LAZY_RECOMPUTE_PER_REQUEST, ENDPOINT_REEMBED_CONCURRENCY),
     )
 
 
 def get_recompute_status(tenant_id: int) -> Optional[dict]:
     """后台批量补算进度：{model_tag, done, total, running}；从未跑过 → None。"""
-    st = _recompute_status.get(tenant_id)
-    return dict(st) if st is not None else None
+    latest = jobs.list_jobs(tenant_id=tenant_id, job_type=RECOMPUTE_JOB_TYPE, limit=1)
+    if not latest:
+        return None
+    job = latest[0]
+    return {
+        "model_tag": job["message"],
+        "done": job["done"],
+        "total": job["total"],
+        "running": job["status"] in jobs.ACTIVE_STATUSES,
+    }
 
 
 def start_background_recompute(
@@ -389,83 +464,78 @@ def start_background_recompute(
     auth_token: Optional[str],
 ) -> bool:
     """配置变更（mode/endpoint 变化 → 生效 model_tag 可能变化）触发的后台批量
-    补算（主路径）。串行逐 subject 重算，不挤占在线验证的 NPU；同
-    (tenant, mode, endpoint) 只跑一个任务（幂等可重入）；进度写
-    ``_recompute_status``，每 10 个 subject 记一条 info 日志（核心函数内）。
+    补算（主路径）。推理并发有上限（本机 = 模拟器池大小，lan =
+    ENDPOINT_REEMBED_CONCURRENCY），结果按批提交，不把端点 NPU 打满；同
+    (tenant, mode, endpoint) 只跑一个任务（幂等可重入）；进度写在任务行上，
+    每 10 个 subject 记一条 info 日志（核心函数内）。
     返回是否真的启动了新任务。需在运行中的事件循环里调用（FastAPI handler）。
     """
-    import asyncio
-
-    key = (tenant_id, mode or "", endpoint or "")
-    existing = _recompute_tasks.get(key)
-    if existing is not None and not existing.done():
+    try:
+        jobs.submit_job(
+            RECOMPUTE_JOB_TYPE, _bg_recompute, tenant_id, mode, endpoint, auth_token,
+            tenant_id=tenant_id, dedupe_key=f"{tenant_id}|{mode or ''}|{endpoint or ''}",
+        )
+    except jobs.JobConflict:
         return False
-    task = asyncio.get_running_loop().create_task(
-        _bg_recompute(tenant_id, mode, endpoint, auth_token)
-    )
-    _recompute_tasks[key] = task
     return True
 
 
 async def _bg_recompute(
-    tenant_id: int, mode: Optional[str], endpoint: Optional[str],
+    ctx, tenant_id: int, mode: Optional[str], endpoint: Optional[str],
     auth_token: Optional[str],
-) -> None:
-    st = {"model_tag": None, "done": 0, "total": 0, "running": True}
-    _recompute_status[tenant_id] = st
-    try:
-        # 解析当前生效的 model_tag + 推理通道
-        if mode == "local":
-            model_tag = endpoint_client.LOCAL_MODEL_TAG
-
-            async def infer_image(img):
-                return endpoint_client._infer_local(img)
-        else:
-            if not endpoint:
-                return
-            try:
-                info = await endpoint_client.health(endpoint, auth_token)
-            except FaceEndpointError as e:
-                logger.warning(
-                    "bg re-embed aborted, health probe failed: tenant=%s ep=%s (%s)",
-                    tenant_id, endpoint, e,
-                )
-                return
-            model_tag = info.get("model_tag")
-            if not model_tag:
-                logger.warning(
-                    "bg re-embed aborted, endpoint reports no model_tag: %s", endpoint)
-                return
-            cfg = FaceConfig(
-                tenant_id=tenant_id, enabled=True, mode=mode,
-                endpoint=endpoint, auth_token=auth_token,
+) -> dict:
+    # 解析当前生效的 model_tag + 推理通道
+    if mode == "local":
+        model_tag = endpoint_client.LOCAL_MODEL_TAG
+        concurrency = endpoint_client.LOCAL_INFER_WORKERS
+
+        async def infer_image(img):
+            return await endpoint_client.infer_local(img)
+    else:
+        if not endpoint:
+            return {"inserted": 0}
+        try:
+            info = await endpoint_client.health(endpoint, auth_token)
+        except FaceEndpointError as e:
+            logger.warning(
+                "bg re-embed aborted, health probe failed: tenant=%s ep=%s (%s)",
+                tenant_id, endpoint, e,
             )
+            raise RuntimeError(f"人脸端点健康检查失败：{e}")
+        model_tag = info.get("model_tag")
+        if not model_tag:
+            logger.warning(
+                "bg re-embed aborted, endpoint reports no model_tag: %s", endpoint)
+            raise RuntimeError("人脸端点未返回 model_tag")
+        cfg = FaceConfig(
+            tenant_id=tenant_id, enabled=True, mode=mode,
+            endpoint=endpoint, auth_token=auth_token,
+        )
+        concurrency = ENDPOINT_REEMBED_CONCURRENCY
 
-            async def infer_image(img):
-                return await endpoint_client.infer(cfg, img)
+        async def infer_image(img):
+            return await endpoint_client.infer(cfg, img)
 
-        st["model_tag"] = model_tag
+    ctx.progress(0, message=model_tag)
 
-        def progress(done, total):
-            st["done"], st["total"] = done, total
+    def progress(done, total):
+        ctx.progress(done, total)
 
-        # 后台任务独立开自己的 sqlite 连接（不与请求 conn 共享线程）
-        import database
-        conn = database.get_db_connection()
-        try:
-            inserted = await ensure_enrollments_for_model(
-                conn, tenant_id, model_tag, infer_image, progress=progress,
-            )
-            logger.info(
-                "bg re-embed finished: tenant=%s model=%s inserted=%d (%d/%d)",
-                tenant_id, model_tag, inserted, st["done"], st["total"],
-            )
-        finally:
-            conn.close()
-    except Exception:
-        logger.exception("bg re-embed crashed: tenant=%s", tenant_id)
+    # 后台任务独立开自己的 sqlite 连接（不与请求 conn 共享线程）
+    import database
+    conn = database.get_db_connection()
+    try:
+        inserted = await ensure_enrollments_for_model(
+            conn, tenant_id, model_tag, infer_image, progress=progress,
+            concurrency=concurrency,
+        )
+        logger.info(
+            "bg re-embed finished: tenant=%s model=%s inserted=%d",
+            tenant_id, model_tag, inserted,
+        )
     finally:
-        st["running"] = False
+        conn.close()
+    return {"model_tag": model_tag, "inserted": inserted}
 
 
 # ── public API ──
@@ -527,15 +597,21 @@ async def enroll_face(
 
     for img in images_b64:
         result = await endpoint_client.infer(cfg, img)
+        # 注册照片存原始字节到 face_source_images，enrollment 只存哈希引用；
+        # 解不出字节的输入（非标准 base64）原样落旧列，懒重算照样能用。
+        img_bytes = source_images.decode_image_b64(img)
+        img_sha = (source_images.put_source_image(conn, tenant_id, img_bytes)
+                   if img_bytes is not None else None)
         cur.execute(
             """
             INSERT INTO face_enrollments
                 (subject_id, tenant_id, model_tag, embedding, source_image_b64,
-                 applies_to_warehouse_ids, is_active, enrolled_at, enrolled_by)
-            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+                 source_image_sha256, applies_to_warehouse_ids, is_active,
+                 enrolled_at, enrolled_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)
             """,
             (subject_id, tenant_id, result["model_tag"], result["embedding"],
-             img, applies_raw, now, enrolled_by),
+             None if img_sha else img, img_sha, applies_raw, now, enrolled_by),
         )
         inserted_ids.append(cur.lastrowid)
 
@@ -0,0 +1,88 @@
+"""Content-addressed store for enrollment source photos.
+
+注册照片以原始字节存 ``face_source_images``（主键语义 = (tenant_id, sha256)），
+``face_enrollments.source_image_sha256`` 只存引用。好处：
+
+* enrollment 行不再夹带几百 KB 的 base64 文本——SQLite 行内大字段会拖累
+  列表/人脸库等只读小列的扫描（记录要跨溢出页），MySQL 同理；
+* 同一张照片（重复注册 / 同租户多行）只存一份；字节比 base64 省 1/4。
+
+本模块函数接收 sqlite3 风格连接（``database.get_db_connection()`` 或其 MySQL
+shim），与 orchestrator 的写路径处于同一事务；只有孤儿清理走 SA Core（路由侧
+删除 enrollment / subject 的事务里调用）。
+
+无法无损解出字节的输入（非法 base64，测试桩 "photo:x" 之类）原样留在旧列
+``source_image_b64``，读路径兼容两种来源。
+"""
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+from typing import Optional
+
+from sqlalchemy import and_, delete, exists
+
+from metadata import face_enrollments, face_source_images
+
+
+def decode_image_b64(image_b64: Optional[str]) -> Optional[bytes]:
+    """base64（可带 ``data:image/...;base64,`` 前缀 / 换行）→ 原始字节；非法返回 None。"""
+    if not image_b64:
+        return None
+    s = image_b64.strip()
+    if s.startswith("data:") and "," in s:
+        s = s.split(",", 1)[1]
+    s = "".join(s.split())
+    try:
+        data = base64.b64decode(s, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return data or None
+
+
+def _is_sqlite(conn) -> bool:
+    return type(conn).__module__.startswith("sqlite3")
+
+
+def put_source_image(conn, tenant_id: int, data: bytes) -> str:
+    """写入（已存在则复用）一张照片，返回 sha256 引用。不提交事务。"""
+    digest = hashlib.sha256(data).hexdigest()
+    ignore_kw = "OR IGNORE" if _is_sqlite(conn) else "IGNORE"
+    conn.cursor().execute(
+        f"""
+        INSERT {ignore_kw} INTO face_source_images (tenant_id, sha256, data, byte_size)
+        VALUES (?, ?, ?, ?)
+        """,
+        (tenant_id, digest, data, len(data)),
+    )
+    return digest
+
+
+def load_source_image_b64(conn, tenant_id: int, digest: str) -> Optional[str]:
+    """按引用取照片，返回推理端点需要的 base64 文本；不存在返回 None。"""
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT data FROM face_source_images WHERE tenant_id = ? AND sha256 = ?",
+        (tenant_id, digest),
+    )
+    row = cur.fetchone()
+    if not row or row["data"] is None:
+        return None
+    return base64.b64encode(bytes(row["data"])).decode("ascii")
+
+
+def delete_orphan_source_images(sa_conn, tenant_id: int) -> int:
+    """删掉本租户不再被任何 enrollment 引用的照片（SA Core，调用方事务内）。"""
+    referenced = exists().where(and_(
+        face_enrollments.c.tenant_id == face_source_images.c.tenant_id,
+        face_enrollments.c.source_image_sha256 == face_source_images.c.sha256,
+    ))
+    res = sa_conn.execute(
+        delete(face_source_images).where(
+            face_source_images.c.tenant_id == tenant_id,
+            ~referenced,
+        )
+    )
+    return int(res.rowcount or 0)
+
@@ -4,9 +4,22 @@ A host-side, bit-exact mirror of the WE2 NPU pipeline used by the on-device
 face_rec_api. Enables face enrollment from a phone/desktop photo while still
 producing embeddings identical to what the WE2 device computes in production.
 
-See ``simulator.py`` for the pipeline and ``WE2Simulator`` singleton.
+See ``simulator.py`` for the pipeline, the ``WE2Simulator`` singleton and the
+``WE2SimulatorPool`` used for concurrent in-process inference.
 """
 
-from .simulator import WE2Simulator, MODEL_TAG, get_simulator
+from .simulator import (
+    MODEL_TAG,
+    WE2Simulator,
+    WE2SimulatorPool,
+    get_simulator,
+    get_simulator_pool,
+)
 
-__all__ = ["WE2Simulator", "MODEL_TAG", "get_simulator"]
+__all__ = [
+    "WE2Simulator",
+    "WE2SimulatorPool",
+    "MODEL_TAG",
+    "get_simulator",
+    "get_simulator_pool",
+]
@@ -22,11 +22,15 @@ This module deliberately:
     ``face_bench`` ``format=float32_le_b64``).
   * Loads models lazily on the first ``infer()`` call, behind a process-wide
     ``threading.Lock``; subsequent calls reuse the cached interpreters.
+  * Offers ``WE2SimulatorPool`` for concurrent callers: N independent
+    simulators (each with its own interpreter pair) handed out one per call.
 """
 
 from __future__ import annotations
 
+import queue
 import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, List, Optional
 
@@ -182,6 +186,88 @@ def _is_same_face_by_center(det_a, det_b, thresh_ratio) -> bool:
     return dist < ref_size * thresh_ratio
 
 
+@lru_cache(maxsize=None)
+def _anchor_centers(grid_h: int, grid_w: int, stride: int):
+    """Per-stride anchor centres in SCRFD row order (float32, read-only).
+
+    Row ``(h * grid_w + w) * SCRFD_NUM_ANCHORS + a`` sits at ``(w * stride,
+    h * stride)``. float32 so ``center + offset * stride`` promotes exactly like
+    the scalar ``int + np.float32`` arithmetic of the loop decoder.
+    """
+    ys, xs = np.mgrid[0:grid_h, 0:grid_w]
+    cx = np.repeat((xs * stride).reshape(-1), SCRFD_NUM_ANCHORS).astype(np.float32)
+    cy = np.repeat((ys * stride).reshape(-1), SCRFD_NUM_ANCHORS).astype(np.float32)
+    cx.flags.writeable = False
+    cy.flags.writeable = False
+    return cx, cy
+
+
+def _clamp_like_scalar(val: np.ndarray, is_py: np.ndarray, hi: float):
+    """``max(0.0, min(hi, v))`` element-wise, tracking the result's Python type.
+
+    The loop decoder clamps with builtin ``min``/``max``, which hand back the
+    *Python float* bound when they clamp and the untouched ``np.float32``
+    otherwise — and that type decides whether the next multiply runs in
+    float32 or float64. ``val`` holds every value exactly as float64;
+    ``is_py`` marks the ones that are Python floats.
+    """
+    above = ~(val < hi)
+    below = ~(val > 0.0) & ~above
+    out = np.where(above, hi, np.where(below, 0.0, val))
+    return out, is_py | above | below
+
+
+def _scale_coord(val: np.ndarray, is_py: np.ndarray, scale: float, img_limit: float):
+    """``max(0, min(img_limit, v * scale))`` with the loop decoder's dtypes:
+    float32 products for ``np.float32`` inputs, float64 for Python floats."""
+    f32 = (val.astype(np.float32) * np.float32(scale)).astype(np.float64)
+    f64 = val * scale
+    return _clamp_like_scalar(np.where(is_py, f64, f32), is_py, float(img_limit))
+
+
+def _span(a: np.ndarray, a_py: np.ndarray, b: np.ndarray, b_py: np.ndarray) -> np.ndarray:
+    """``float(b - a)``: float64 only when both operands are Python floats,
+    otherwise NumPy's weak-scalar rule computes it in float32."""
+    f32 = (b.astype(np.float32) - a.astype(np.float32)).astype(np.float64)
+    return np.where(a_py & b_py, b - a, f32)
+
+
+def _greedy_suppress(over: np.ndarray) -> np.ndarray:
+    """Greedy NMS keep-mask over a pre-sorted pairwise ``over[i, j]`` matrix:
+    each surviving ``i`` suppresses every later ``j`` it overlaps."""
+    n = over.shape[0]
+    keep = np.ones(n, dtype=bool)
+    for i in range(n - 1):
+        if keep[i]:
+            keep[i + 1:] &= ~over[i, i + 1:]
+    return keep
+
+
+def _pairwise_iou(boxes: np.ndarray) -> np.ndarray:
+    """``_compute_iou`` for every pair, same float64 operation order."""
+    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    x1 = np.maximum(x[:, None], x[None, :])
+    y1 = np.maximum(y[:, None], y[None, :])
+    x2 = np.minimum((x + w)[:, None], (x + w)[None, :])
+    y2 = np.minimum((y + h)[:, None], (y + h)[None, :])
+    inter = np.maximum(0.0, x2 - x1) * np.maximum(0.0, y2 - y1)
+    area = w * h
+    union = area[:, None] + area[None, :] - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+
+
+def _pairwise_same_center(boxes: np.ndarray, thresh_ratio: float) -> np.ndarray:
+    """``_is_same_face_by_center`` for every pair."""
+    x, y, w, h = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    cx = x + w / 2
+    cy = y + h / 2
+    dist = np.hypot(cx[:, None] - cx[None, :], cy[:, None] - cy[None, :])
+    side = np.minimum(w, h)
+    ref_size = np.minimum(side[:, None], side[None, :])
+    return dist < ref_size * thresh_ratio
+
+
 def _scrfd_decode_and_nms(
     score_tensors,
     bbox_tensors,
@@ -199,7 +285,140 @@ def _scrfd_decode_and_nms(
     score_thresh: float,
     nms_thresh: float,
 ) -> List[dict]:
-    """Exact replica of on-device scrfd_detect + NMS + cross-stride suppress."""
+    """Vectorized on-device scrfd_detect + NMS + cross-stride suppress.
+
+    Bit-identical to ``_scrfd_decode_and_nms_reference`` (the literal port of
+    the firmware loops, kept as the parity oracle): same float32/float64 mix
+    per value, same stable orderings, same greedy suppression order. Locked by
+    ``tests/test_we2_scrfd_decode.py`` against a golden fixture.
+    """
+    scale_x = img_w / input_w
+    scale_y = img_h / input_h
+
+    boxes_parts, score_parts, lm_parts, stride_parts = [], [], [], []
+
+    for s in range(SCRFD_NUM_STRIDES):
+        stride = STRIDES[s]
+        grid_h = input_h // stride
+        grid_w = input_w // stride
+        cx, cy = _anchor_centers(grid_h, grid_w, stride)
+
+        score_f = _dequantize_int8(
+            score_tensors[s], score_scales[s], score_zps[s]
+        ).reshape(-1)
+        score = np.minimum(1.0, np.maximum(0.0, score_f.astype(np.float64)))
+        # score > 0: zero-score anchors never reach NMS (nor the output)
+        rows = np.flatnonzero((score >= score_thresh) & (score > 0))
+        if rows.size == 0:
+            continue
+
+        bbox_f = _dequantize_int8(
+            bbox_tensors[s], bbox_scales[s], bbox_zps[s]
+        ).reshape(-1, 4)[rows]
+        kps_f = _dequantize_int8(
+            kps_tensors[s], kps_scales[s], kps_zps[s]
+        ).reshape(-1, 10)[rows]
+        acx, acy = cx[rows], cy[rows]
+
+        coords = (
+            acx - bbox_f[:, 0] * stride,
+            acy - bbox_f[:, 1] * stride,
+            acx + bbox_f[:, 2] * stride,
+            acy + bbox_f[:, 3] * stride,
+        )
+        limits = (
+            (input_w, scale_x, img_w),
+            (input_h, scale_y, img_h),
+            (input_w, scale_x, img_w),
+            (input_h, scale_y, img_h),
+        )
+        scaled = []
+        no_py = np.zeros(rows.size, dtype=bool)
+        for c, (in_lim, sc, img_lim) in zip(coords, limits):
+            v, py = _clamp_like_scalar(c.astype(np.float64), no_py, float(in_lim))
+            scaled.append(_scale_coord(v, py, sc, img_lim))
+        (x1, x1_py), (y1, y1_py), (x2, x2_py), (y2, y2_py) = scaled
+
+        boxes_parts.append(np.stack(
+            [x1, y1, _span(x1, x1_py, x2, x2_py), _span(y1, y1_py, y2, y2_py)],
+            axis=1,
+        ))
+        lm = np.empty((rows.size, SCRFD_NUM_LANDMARKS * 2), dtype=np.float64)
+        lm[:, 0::2] = (acx[:, None] + kps_f[:, 0::2] * stride) * scale_x
+        lm[:, 1::2] = (acy[:, None] + kps_f[:, 1::2] * stride) * scale_y
+        lm_parts.append(lm)
+        score_parts.append(score[rows])
+        stride_parts.append(np.full(rows.size, s, dtype=np.int64))
+
+    if not boxes_parts:
+        return []
+
+    boxes = np.concatenate(boxes_parts)
+    scores = np.concatenate(score_parts)
+    landmarks = np.concatenate(lm_parts)
+    stride_idx = np.concatenate(stride_parts)
+
+    # Intra-stride NMS (score desc, stable), then restore decode order
+    keep = np.zeros(boxes.shape[0], dtype=bool)
+    for s in range(SCRFD_NUM_STRIDES):
+        members = np.flatnonzero(stride_idx == s)
+        if members.size == 0:
+            continue
+        order = members[np.argsort(-scores[members], kind="stable")]
+        keep[order] = _greedy_suppress(_pairwise_iou(boxes[order]) > nms_thresh)
+    survivors = np.flatnonzero(keep)
+
+    # Cross-stride center suppression (area asc, stable)
+    if survivors.size > 1:
+        area = boxes[survivors, 2] * boxes[survivors, 3]
+        survivors = survivors[np.argsort(area, kind="stable")]
+        same = _pairwise_same_center(boxes[survivors], CENTER_DIST_THRESH_RATIO)
+        survivors = survivors[_greedy_suppress(same)]
+
+    # Filter oversized faces
+    max_w = img_w * MAX_FACE_RATIO
+    max_h = img_h * MAX_FACE_RATIO
+    survivors = survivors[
+        (boxes[survivors, 2] <= max_w) & (boxes[survivors, 3] <= max_h)
+    ]
+
+    box_list = boxes[survivors].tolist()
+    lm_list = landmarks[survivors].tolist()
+    score_list = scores[survivors].tolist()
+    stride_list = stride_idx[survivors].tolist()
+    return [
+        {
+            "bbox": tuple(box_list[k]),
+            "score": score_list[k],
+            "landmarks": list(zip(lm_list[k][0::2], lm_list[k][1::2])),
+            "stride_idx": stride_list[k],
+        }
+        for k in range(len(box_list))
+    ]
+
+
+def _scrfd_decode_and_nms_reference(
+    score_tensors,
+    bbox_tensors,
+    kps_tensors,
+    score_scales,
+    score_zps,
+    bbox_scales,
+    bbox_zps,
+    kps_scales,
+    kps_zps,
+    input_w: int,
+    input_h: int,
+    img_w: int,
+    img_h: int,
+    score_thresh: float,
+    nms_thresh: float,
+) -> List[dict]:
+    """Exact replica of on-device scrfd_detect + NMS + cross-stride suppress.
+
+    Literal loop port of the firmware — kept as the parity oracle for the
+    vectorized ``_scrfd_decode_and_nms`` that ``infer()`` actually runs.
+    """
     scale_x = img_w / input_w
     scale_y = img_h / input_h
 
@@ -781,3 +1000,49 @@ def get_simulator() -> WE2Simulator:
             if _singleton is None:
                 _singleton = WE2Simulator()
     return _singleton
+
+
+# ---------------------------------------------------------------------------
+# Interpreter pool — N independent simulators for concurrent callers
+# ---------------------------------------------------------------------------
+
+DEFAULT_POOL_SIZE = 2
+
+
+class WE2SimulatorPool:
+    """Fixed-size pool of independent ``WE2Simulator`` instances.
+
+    A single simulator serializes every invoke behind ``_invoke_lock``; the
+    pool instead owns ``size`` simulators, each with its own SCRFD / MFN
+    interpreters, so up to ``size`` callers run the pipeline in parallel
+    (TFLite releases the GIL inside ``invoke``). A caller borrows one instance
+    for the whole ``infer()``; when all are busy it blocks until one is
+    returned. Instances still load their models lazily on first use.
+    """
+
+    def __init__(self, size: int = DEFAULT_POOL_SIZE, factory=WE2Simulator):
+        self.size = max(1, int(size))
+        self._idle: "queue.Queue[WE2Simulator]" = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(factory())
+
+    def infer(self, image: Image.Image) -> dict:
+        sim = self._idle.get()
+        try:
+            return sim.infer(image)
+        finally:
+            self._idle.put(sim)
+
+
+_pool: Optional[WE2SimulatorPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_simulator_pool(size: int = DEFAULT_POOL_SIZE) -> WE2SimulatorPool:
+    """Return the process-wide simulator pool (sized by the first caller)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WE2SimulatorPool(size)
+    return _pool
@@ -70,6 +70,11 @@ class FuzzyMatcher:
         # 可重入锁：search 调用 _ensure_index → _build_partition → 仍持有锁
         self._lock = threading.RLock()
 
+        # 失效回调：invalidate_cache 清完本实例后以同样的参数调用（多 worker 部署下
+        # 用来把失效广播给其他 worker，见 multiworker.py）。对端用 apply_invalidation
+        # 落地，不再回调，避免来回广播。
+        self.on_invalidate = None
+
     # ---- helpers --------------------------------------------------------
 
     @staticmethod
@@ -288,6 +293,16 @@ class FuzzyMatcher:
         - entity_type + tenant_id [+ warehouse_id]：只丢该 scope 下的条目，下次重建时整分区刷新
         - entity_type + entity_id：精准移除单实体的所有索引条目，分区不重建
         """
+        self.apply_invalidation(entity_type, tenant_id, warehouse_id, entity_id)
+        if self.on_invalidate is not None:
+            self.on_invalidate(entity_type=entity_type, tenant_id=tenant_id,
+                               warehouse_id=warehouse_id, entity_id=entity_id)
+
+    def apply_invalidation(self, entity_type: str | None = None,
+                           tenant_id: int | None = None,
+                           warehouse_id: int | None = None,
+                           entity_id: int | None = None):
+        """只清本实例（不触发 ``on_invalidate``）；语义同 invalidate_cache。"""
         with self._lock:
             if entity_type is None:
                 # 全失效
@@ -0,0 +1,644 @@
+"""后台任务（job）子系统：持久化任务表 + 按类型限流的工作池 + 进度轮询 / 取消。
+
+整库导入导出、Excel 导入确认、人脸批量补算 / 下发、ERP 用户 / 仓库导入这类
+重活不再占着 HTTP 请求（也不再各自维护一个进度 dict）：处理函数校验完参数后
+``submit_job`` 提交，立即返回任务描述；前端用 ``/api/jobs/{id}`` 轮询。
+
+* **持久化**：每个任务一行 ``background_jobs``（状态、进度、结果 JSON、下载产物），
+  多 worker 部署下任一 worker 都能查到；进程重启时本机遗留的 pending/running
+  行标记为 failed（``recover_orphaned_jobs``）。
+* **执行**：同步函数在 daemon 线程里跑（总数受 ``JOB_WORKERS`` 限制，与
+  routers/erp.py 探测线程同理：卡死的第三方代码不会挂住进程退出）；``async def``
+  函数作为 task 跑在提交时的事件循环上（共享 httpx 客户端、推理执行器等循环内资源），
+  不占线程名额。两者都受 ``register_job_type`` 声明的单类型并发上限约束，
+  超出的排队，按提交顺序调度。
+* **进度 / 取消**：任务函数第一个参数是 ``JobContext``：``progress()`` 更新进度
+  （内存实时，落库节流且不等锁——SQLite 上导入任务自己就持有写锁）；
+  ``check_cancelled()`` 在收到取消请求时抛 ``JobCancelled``，事务随异常回滚。
+  async 任务取消时直接 cancel 对应 task。
+
+任务函数返回值（dict / pydantic 模型）序列化后存入 ``result``；抛出
+``HTTPException`` 时以其 detail 作为失败原因，语义与同步接口的错误响应一致。
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from sqlalchemy import and_, delete, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import get_engine
+from metadata import background_jobs as _t_jobs
+
+logger = logging.getLogger("warehouse.jobs")
+
+# 同步任务线程总数上限（async 任务跑在事件循环上，不计入）
+JOB_WORKERS = max(1, int(os.environ.get("JOB_WORKERS", "4")))
+# 已结束任务（及其下载产物）保留天数
+JOB_RETENTION_DAYS = int(os.environ.get("JOB_RETENTION_DAYS", "7"))
+# 进度落库 / 跨 worker 取消标记检查的最小间隔（秒）
+PROGRESS_PERSIST_INTERVAL = 2.0
+CANCEL_POLL_INTERVAL = 2.0
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (PENDING, RUNNING)
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobCancelled(Exception):
+    """任务收到取消请求（``JobContext.check_cancelled`` 抛出）。"""
+
+
+class JobConflict(Exception):
+    """同类型、同 dedupe_key 的任务仍在排队或执行。``job`` 为已有任务的描述。"""
+
+    def __init__(self, job: dict):
+        super().__init__(f"job {job['job_id']} is still {job['status']}")
+        self.job = job
+
+
+# 任务类型 → 并发上限
+_job_types: Dict[str, int] = {}
+
+
+def register_job_type(job_type: str, limit: int = 1) -> None:
+    """声明任务类型及其并发上限（同类型同时执行的任务数）。重复注册以最后一次为准。"""
+    _job_types[job_type] = max(1, int(limit))
+
+
+class _Job:
+    __slots__ = (
+        "id", "job_type", "tenant_id", "created_by", "created_by_name", "dedupe_key",
+        "status", "done", "total", "message", "result", "error", "artifact",
+        "cancel_requested", "created_at", "started_at", "finished_at",
+        "fn", "args", "kwargs", "loop", "is_async", "task", "finished",
+        "last_persist", "last_cancel_poll",
+    )
+
+    def __init__(self, job_type, fn, args, kwargs, *, tenant_id, created_by,
+                 created_by_name, dedupe_key, loop):
+        self.id = uuid.uuid4().hex
+        self.job_type = job_type
+        self.tenant_id = tenant_id
+        self.created_by = created_by
+        self.created_by_name = created_by_name
+        self.dedupe_key = dedupe_key
+        self.status = PENDING
+        self.done = 0
+        self.total = 0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.artifact = None
+        self.cancel_requested = False
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.loop = loop
+        self.is_async = inspect.iscoroutinefunction(fn)
+        self.task = None
+        self.finished = threading.Event()
+        self.last_persist = 0.0
+        self.last_cancel_poll = 0.0
+
+    def view(self) -> dict:
+        return _make_view(
+            job_id=self.id, job_type=self.job_type, tenant_id=self.tenant_id,
+            created_by=self.created_by, created_by_name=self.created_by_name,
+            status=self.status, done=self.done, total=self.total, message=self.message,
+            result=self.result, error=self.error, artifact=self.artifact,
+            cancel_requested=self.cancel_requested, created_at=self.created_at,
+            started_at=self.started_at, finished_at=self.finished_at,
+        )
+
+
+def _fmt_ts(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+def _make_view(*, job_id, job_type, tenant_id, created_by, created_by_name, status,
+               done, total, message, result, error, artifact, cancel_requested,
+               created_at, started_at, finished_at) -> dict:
+    if total:
+        percent = round(min(done, total) * 100 / total, 1)
+    else:
+        percent = 100.0 if status == SUCCEEDED else 0.0
+    return {
+        "job_id": job_id,
+        "job_type": job_type,
+        "tenant_id": tenant_id,
+        "created_by": created_by,
+        "created_by_name": created_by_name,
+        "status": status,
+        "done": done,
+        "total": total,
+        "percent": percent,
+        "message": message,
+        "result": result,
+        "error": error,
+        "download": bool(artifact) and status == SUCCEEDED,
+        "cancel_requested": bool(cancel_requested),
+        "created_at": _fmt_ts(created_at),
+        "started_at": _fmt_ts(started_at),
+        "finished_at": _fmt_ts(finished_at),
+    }
+
+
+def _row_view(row) -> dict:
+    return _make_view(
+        job_id=row.id, job_type=row.job_type, tenant_id=row.tenant_id,
+        created_by=row.created_by, created_by_name=row.created_by_name,
+        status=row.status, done=row.progress_done, total=row.progress_total,
+        message=row.message, result=json.loads(row.result) if row.result else None,
+        error=row.error, artifact=row.artifact, cancel_requested=row.cancel_requested,
+        created_at=row.created_at, started_at=row.started_at, finished_at=row.finished_at,
+    )
+
+
+class JobContext:
+    """传给任务函数的句柄：汇报进度、响应取消、登记下载产物。"""
+
+    def __init__(self, job: _Job):
+        self._job = job
+
+    @property
+    def job_id(self) -> str:
+        return self._job.id
+
+    @property
+    def tenant_id(self) -> Optional[int]:
+        return self._job.tenant_id
+
+    @property
+    def cancelled(self) -> bool:
+        job = self._job
+        if job.cancel_requested:
+            return True
+        # 取消请求可能落在别的 worker 上：节流回读表里的标记
+        now = time.monotonic()
+        if now - job.last_cancel_poll >= CANCEL_POLL_INTERVAL:
+            job.last_cancel_poll = now
+            try:
+                with get_engine().connect() as c:
+                    flag = c.execute(
+                        select(_t_jobs.c.cancel_requested).where(_t_jobs.c.id == job.id)
+                    ).scalar()
+                job.cancel_requested = bool(flag)
+            except SQLAlchemyError:
+                logger.debug("job %s: cancel flag poll failed", job.id, exc_info=True)
+        return job.cancel_requested
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, done: int, total: Optional[int] = None,
+                 message: Optional[str] = None) -> None:
+        job = self._job
+        job.done = done
+        if total is not None:
+            job.total = total
+        if message is not None:
+            job.message = message
+        now = time.monotonic()
+        if now - job.last_persist >= PROGRESS_PERSIST_INTERVAL:
+            job.last_persist = now
+            _persist_progress(job)
+
+    def advance(self, n: int = 1, message: Optional[str] = None) -> None:
+        self.progress(self._job.done + n, message=message)
+
+    def set_artifact(self, path: str, filename: str, media_type: str) -> None:
+        """登记任务产出的文件（``GET /api/jobs/{id}/download`` 下载）。
+        文件随任务记录一起过期删除（``JOB_RETENTION_DAYS``）。"""
+        self._job.artifact = json.dumps(
+            {"path": path, "filename": filename, "media_type": media_type},
+            ensure_ascii=False)
+
+
+# ---------------------------------------------------------------------------
+# 调度
+# ---------------------------------------------------------------------------
+
+_lock = threading.Lock()
+_jobs: Dict[str, _Job] = {}           # 本进程提交、尚未结束（或结束状态未落库）的任务
+_pending: Deque[_Job] = deque()
+_running_by_type: Counter = Counter()
+_running_threads = 0
+
+
+def _persist(job_id: str, **values) -> None:
+    values["updated_at"] = datetime.now()
+    with get_engine().begin() as c:
+        c.execute(update(_t_jobs).where(_t_jobs.c.id == job_id).values(**values))
+
+
+def _persist_progress(job: _Job) -> None:
+    """进度落库：尽力而为、不等锁（SQLite 上可能正被任务自己的写事务占着）。"""
+    try:
+        with get_engine().connect() as c:
+            if c.dialect.name == "sqlite":
+                c.exec_driver_sql("PRAGMA busy_timeout = 0")
+            c.execute(
+                update(_t_jobs).where(_t_jobs.c.id == job.id).values(
+                    progress_done=job.done, progress_total=job.total,
+                    message=job.message, updated_at=datetime.now())
+            )
+            c.commit()
+    except SQLAlchemyError:
+        logger.debug("job %s: progress persist skipped", job.id, exc_info=True)
+
+
+def _to_jsonable(value):
+    if value is None:
+        return None
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return value
+
+
+def _error_text(exc: BaseException) -> str:
+    detail = getattr(exc, "detail", None)
+    if detail is not None and getattr(exc, "status_code", None) is not None:
+        return detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False)
+    return str(exc) or type(exc).__name__
+
+
+def submit_job(job_type: str, fn: Callable, *args, tenant_id: Optional[int] = None,
+               user=None, dedupe_key: Optional[str] = None, **kwargs) -> dict:
+    """提交任务，立即返回任务描述（``job_id`` / ``status`` …）。
+
+    ``fn(ctx, *args, **kwargs)``：同步或 ``async def`` 均可。``user`` 为发起人
+    （CurrentUser，可空：系统触发的任务）。``dedupe_key`` 非空时，同类型同 key 的
+    任务仍未结束则抛 ``JobConflict``（跨 worker 以任务表为准）。
+    """
+    if job_type not in _job_types:
+        raise ValueError(f"unregistered job type: {job_type}")
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    job = _Job(
+        job_type, fn, args, kwargs, tenant_id=tenant_id,
+        created_by=getattr(user, "id", None),
+        created_by_name=(getattr(user, "username", None) or None),
+        dedupe_key=dedupe_key, loop=loop,
+    )
+    with _lock:
+        if dedupe_key is not None:
+            for other in _jobs.values():
+                if (other.job_type == job_type and other.dedupe_key == dedupe_key
+                        and other.status in ACTIVE_STATUSES):
+                    raise JobConflict(other.view())
+            with get_engine().begin() as c:
+                row = c.execute(
+                    select(_t_jobs).where(and_(
+                        _t_jobs.c.job_type == job_type,
+                        _t_jobs.c.dedupe_key == dedupe_key,
+                        _t_jobs.c.status.in_(ACTIVE_STATUSES),
+                    )).limit(1)
+                ).first()
+                if row is not None:
+                    raise JobConflict(_row_view(row))
+                c.execute(insert(_t_jobs).values(**_insert_values(job)))
+        else:
+            with get_engine().begin() as c:
+                c.execute(insert(_t_jobs).values(**_insert_values(job)))
+        _jobs[job.id] = job
+        _pending.append(job)
+        started = _take_runnable_locked()
+    _start(started)
+    return job.view()
+
+
+def _insert_values(job: _Job) -> dict:
+    return dict(
+        id=job.id, job_type=job.job_type, tenant_id=job.tenant_id,
+        created_by=job.created_by, created_by_name=job.created_by_name,
+        dedupe_key=job.dedupe_key, status=PENDING, owner=_OWNER,
+        created_at=job.created_at, updated_at=job.created_at,
+    )
+
+
+def _take_runnable_locked() -> List[_Job]:
+    """按提交顺序取出当前能开跑的任务（类型上限、线程上限都有空位）。调用方持有 _lock。"""
+    global _running_threads
+    started = []
+    for job in list(_pending):
+        if _running_by_type[job.job_type] >= _job_types.get(job.job_type, 1):
+            continue
+        if not job.is_async and _running_threads >= JOB_WORKERS:
+            continue
+        _pending.remove(job)
+        _running_by_type[job.job_type] += 1
+        if not job.is_async:
+            _running_threads += 1
+        job.status = RUNNING
+        started.append(job)
+    return started
+
+
+def _start(jobs: List[_Job]) -> None:
+    for job in jobs:
+        if not job.is_async:
+            threading.Thread(target=_run_sync, args=(job,),
+                             name=f"job-{job.job_type}-{job.id[:8]}", daemon=True).start()
+        elif job.loop is not None and not job.loop.is_closed():
+            try:
+                job.loop.call_soon_threadsafe(_start_task, job)
+                continue
+            except RuntimeError:  # 循环已关闭（进程退出中）
+                pass
+            _run_async_in_thread(job)
+        else:
+            _run_async_in_thread(job)
+
+
+def _run_async_in_thread(job: _Job) -> None:
+    # 提交方不在事件循环里（或循环已关）：单开线程 asyncio.run
+    threading.Thread(target=lambda: asyncio.run(_run_async(job)),
+                     name=f"job-{job.job_type}-{job.id[:8]}", daemon=True).start()
+
+
+def _start_task(job: _Job) -> None:
+    job.task = asyncio.get_running_loop().create_task(_run_async(job))
+
+
+def _mark_running(job: _Job) -> bool:
+    """pending → running（条件更新：已被别处取消则返回 False）。"""
+    job.started_at = datetime.now()
+    with get_engine().begin() as c:
+        n = c.execute(
+            update(_t_jobs).where(and_(_t_jobs.c.id == job.id, _t_jobs.c.status == PENDING))
+            .values(status=RUNNING, started_at=job.started_at, owner=_OWNER,
+                    updated_at=job.started_at)
+        ).rowcount
+    return n == 1
+
+
+def _run_sync(job: _Job) -> None:
+    ctx = JobContext(job)
+    try:
+        if not _mark_running(job):
+            raise JobCancelled()
+        ctx.check_cancelled()
+        result = job.fn(ctx, *job.args, **job.kwargs)
+    except JobCancelled:
+        _finish(job, CANCELLED)
+    except Exception as e:
+        logger.exception("job %s (%s) failed", job.id, job.job_type)
+        _finish(job, FAILED, error=_error_text(e))
+    else:
+        _finish(job, SUCCEEDED, result=result)
+
+
+async def _run_async(job: _Job) -> None:
+    ctx = JobContext(job)
+    try:
+        if not _mark_running(job):
+            raise JobCancelled()
+        ctx.check_cancelled()
+        result = await job.fn(ctx, *job.args, **job.kwargs)
+    except (JobCancelled, asyncio.CancelledError):
+        _finish(job, CANCELLED)
+    except Exception as e:
+        logger.exception("job %s (%s) failed", job.id, job.job_type)
+        _finish(job, FAILED, error=_error_text(e))
+    else:
+        _finish(job, SUCCEEDED, result=result)
+
+
+def _finish(job: _Job, status: str, *, result=None, error: Optional[str] = None) -> None:
+    global _running_threads
+    job.status = status
+    job.result = _to_jsonable(result)
+    job.error = error
+    job.finished_at = datetime.now()
+    if status == SUCCEEDED and job.total and job.done < job.total:
+        job.done = job.total
+    persisted = True
+    try:
+        _persist(
+            job.id, status=status, progress_done=job.done, progress_total=job.total,
+            message=job.message, error=error, artifact=job.artifact,
+            result=json.dumps(job.result, ensure_ascii=False, default=str)
+            if job.result is not None else None,
+            finished_at=job.finished_at,
+        )
+    except SQLAlchemyError:
+        # 落库失败：保留内存里的终态，本进程内的查询仍然准确
+        persisted = False
+        logger.exception("job %s: failed to persist final status %s", job.id, status)
+    with _lock:
+        _running_by_type[job.job_type] -= 1
+        if not job.is_async:
+            _running_threads -= 1
+        if persisted:
+            _jobs.pop(job.id, None)
+        started = _take_runnable_locked()
+    job.finished.set()
+    _start(started)
+
+
+# ---------------------------------------------------------------------------
+# 查询 / 取消
+# ---------------------------------------------------------------------------
+
+def get_job(job_id: str) -> Optional[dict]:
+    job = _jobs.get(job_id)
+    if job is not None:
+        return job.view()
+    with get_engine().connect() as c:
+        row = c.execute(select(_t_jobs).where(_t_jobs.c.id == job_id)).first()
+    return _row_view(row) if row is not None else None
+
+
+def list_jobs(*, tenant_id: Any = ..., job_type: Optional[str] = None,
+              status: Optional[str] = None, created_by: Optional[int] = None,
+              limit: int = 50) -> List[dict]:
+    """按提交时间倒序列出任务。``tenant_id`` 缺省不过滤（全局 admin）。"""
+    preds = []
+    if tenant_id is not ...:
+        preds.append(_t_jobs.c.tenant_id.is_(None) if tenant_id is None
+                     else _t_jobs.c.tenant_id == tenant_id)
+    if job_type:
+        preds.append(_t_jobs.c.job_type == job_type)
+    if status:
+        preds.append(_t_jobs.c.status == status)
+    if created_by is not None:
+        preds.append(_t_jobs.c.created_by == created_by)
+    with get_engine().connect() as c:
+        rows = c.execute(
+            select(_t_jobs).where(and_(*preds))
+            .order_by(_t_jobs.c.created_at.desc(), _t_jobs.c.id).limit(limit)
+        ).all()
+    # 本进程里还在跑的任务：用内存里的实时进度
+    return [_jobs[r.id].view() if r.id in _jobs else _row_view(r) for r in rows]
+
+
+def cancel_job(job_id: str) -> Optional[dict]:
+    """请求取消。排队中的立即取消；执行中的置取消标记（协作式），async 任务直接 cancel。
+    已结束的任务原样返回。任务不存在返回 None。"""
+    job = _jobs.get(job_id)
+    if job is not None:
+        with _lock:
+            queued = job in _pending
+            if queued:
+                _pending.remove(job)
+        if queued:
+            job.cancel_requested = True
+            job.finished_at = datetime.now()
+            job.status = CANCELLED
+            _persist(job.id, status=CANCELLED, cancel_requested=1, finished_at=job.finished_at)
+            with _lock:
+                _jobs.pop(job.id, None)
+            job.finished.set()
+            return job.view()
+        if job.status == RUNNING:
+            job.cancel_requested = True
+            _persist(job.id, cancel_requested=1)
+            if job.task is not None and job.loop is not None and not job.loop.is_closed():
+                job.loop.call_soon_threadsafe(job.task.cancel)
+        return job.view()
+
+    # 别的 worker 上的任务：pending 直接改终态（对方开跑前会条件检查），running 置标记
+    now = datetime.now()
+    with get_engine().begin() as c:
+        c.execute(
+            update(_t_jobs).where(and_(_t_jobs.c.id == job_id, _t_jobs.c.status == PENDING))
+            .values(status=CANCELLED, cancel_requested=1, finished_at=now, updated_at=now)
+        )
+        c.execute(
+            update(_t_jobs).where(and_(_t_jobs.c.id == job_id, _t_jobs.c.status == RUNNING))
+            .values(cancel_requested=1, updated_at=now)
+        )
+    return get_job(job_id)
+
+
+def get_artifact(job_id: str) -> Optional[dict]:
+    """已成功任务的下载产物 {path, filename, media_type}；没有或文件已删除返回 None。"""
+    with get_engine().connect() as c:
+        row = c.execute(
+            select(_t_jobs.c.artifact, _t_jobs.c.status).where(_t_jobs.c.id == job_id)
+        ).first()
+    if row is None or row.status != SUCCEEDED or not row.artifact:
+        return None
+    artifact = json.loads(row.artifact)
+    return artifact if os.path.exists(artifact["path"]) else None
+
+
+def wait_job(job_id: str, timeout: Optional[float] = None) -> Optional[dict]:
+    """阻塞等待本进程内的任务结束（测试 / 脚本用），返回最终描述。"""
+    job = _jobs.get(job_id)
+    if job is not None:
+        job.finished.wait(timeout)
+    return get_job(job_id)
+
+
+async def await_job(job_id: str, poll: float = 0.01) -> Optional[dict]:
+    """事件循环内等待本进程内的任务结束。"""
+    job = _jobs.get(job_id)
+    while job is not None and not job.finished.is_set():
+        await asyncio.sleep(poll)
+    return get_job(job_id)
+
+
+# ---------------------------------------------------------------------------
+# 启动维护
+# ---------------------------------------------------------------------------
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def recover_orphaned_jobs() -> int:
+    """启动时把本机已退出进程遗留的 pending/running 任务标记为 failed。
+
+    只处理 owner 主机名与本机相同、且进程已不存在（或 pid 就是本进程——容器
+    重启后 pid 复用，此时内存里不可能有它）的任务；别的主机 / 仍存活的 worker
+    上的任务不动。返回处理的条数。
+    """
+    host = socket.gethostname()
+    orphaned = []
+    with get_engine().connect() as c:
+        for job_id, owner in c.execute(
+            select(_t_jobs.c.id, _t_jobs.c.owner).where(_t_jobs.c.status.in_(ACTIVE_STATUSES))
+        ):
+            owner_host, _, pid = (owner or "").rpartition(":")
+            if owner_host != host or not pid.isdigit() or job_id in _jobs:
+                continue
+            if int(pid) == os.getpid() or not _pid_alive(int(pid)):
+                orphaned.append(job_id)
+    if orphaned:
+        now = datetime.now()
+        with get_engine().begin() as c:
+            c.execute(
+                update(_t_jobs).where(and_(_t_jobs.c.id.in_(orphaned),
+                                           _t_jobs.c.status.in_(ACTIVE_STATUSES)))
+                .values(status=FAILED, error="服务重启，任务中断", finished_at=now, updated_at=now)
+            )
+        logger.warning("marked %d orphaned background job(s) as failed", len(orphaned))
+    return len(orphaned)
+
+
+def prune_finished_jobs(retention_days: int = None) -> int:
+    """删除超过保留期的已结束任务及其下载产物，返回删除条数。"""
+    days = JOB_RETENTION_DAYS if retention_days is None else retention_days
+    cutoff = datetime.now() - timedelta(days=days)
+    cond = and_(_t_jobs.c.status.in_(FINISHED_STATUSES), _t_jobs.c.finished_at < cutoff)
+    with get_engine().begin() as c:
+        rows = c.execute(select(_t_jobs.c.id, _t_jobs.c.artifact).where(cond)).all()
+        for _, artifact in rows:
+            if artifact:
+                path = json.loads(artifact).get("path")
+                if path and os.path.exists(path):
+                    os.unlink(path)
+        if rows:
+            c.execute(delete(_t_jobs).where(_t_jobs.c.id.in_([r.id for r in rows])))
+    return len(rows)
+
+
+def submit_job_response(job_type: str, fn: Callable, *args, **kwargs):
+    """处理函数 ``?background=true`` 分支的统一出口：提交任务，返回 202 + 任务描述；
+    同类型同 dedupe_key 的任务未结束时返回 409（detail 里带已有任务的 job_id）。"""
+    from fastapi import HTTPException
+    from fastapi.responses import JSONResponse
+
+    try:
+        job = submit_job(job_type, fn, *args, **kwargs)
+    except JobConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "已有同类任务在执行", "job_id": e.job["job_id"]},
+        )
+    return JSONResponse(status_code=202, content=job)
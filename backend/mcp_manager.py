@@ -9,9 +9,9 @@ import signal
 import sys
 import logging
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
 from datetime import datetime
-from collections import deque
+from collections import Counter, deque
 
 logger = logging.getLogger('warehouse.mcp')
 
@@ -20,6 +20,8 @@ MONITOR_INTERVAL = 30  # seconds
 MAX_LOG_LINES = 200
 DEFAULT_AUTOSTART_STAGGER_SECONDS = 3.0
 MAX_AUTOSTART_STAGGER_SECONDS = 30.0
+DEFAULT_AUTOSTART_CONCURRENCY = 8
+MAX_AUTOSTART_CONCURRENCY = 32
 
 
 def get_autostart_stagger_seconds() -> float:
@@ -46,6 +48,71 @@ def get_autostart_stagger_seconds() -> float:
     return max(0.0, min(value, MAX_AUTOSTART_STAGGER_SECONDS))
 
 
+def get_autostart_concurrency() -> int:
+    """Return how many boot-time MCP handshakes may be in flight at once.
+
+    The shared runtime imports FastMCP once for all connections, so several
+    handshakes can overlap (default 8). Legacy per-process mode keeps the
+    sequential restore (default 1), where ``MCP_AUTOSTART_STAGGER_SECONDS``
+    still spaces out the FastMCP imports.
+    """
+    shared = os.environ.get('MCP_SHARED_RUNTIME', '1') != '0'
+    default = DEFAULT_AUTOSTART_CONCURRENCY if shared else 1
+    raw_value = os.environ.get('MCP_AUTOSTART_CONCURRENCY')
+    if not raw_value:
+        return default
+    try:
+        value = int(raw_value)
+    except (TypeError, ValueError):
+        logger.warning(
+            "Invalid MCP_AUTOSTART_CONCURRENCY=%r; using %d",
+            raw_value,
+            default,
+        )
+        return default
+    return max(1, min(value, MAX_AUTOSTART_CONCURRENCY))
+
+
+class RestoreProgress:
+    """开机恢复 auto_start 连接的进度（``GET /api/mcp/restore-status`` 读取）。
+
+    每个连接的状态：queued → starting → ready / timeout / failed。
+    ``states`` 保持恢复顺序（即优先级顺序）。
+    """
+
+    STATES = ('queued', 'starting', 'ready', 'timeout', 'failed')
+
+    def __init__(self, conn_ids: Iterable[str], concurrency: int):
+        self.concurrency = concurrency
+        self.states: Dict[str, str] = {conn_id: 'queued' for conn_id in conn_ids}
+        self.started_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+
+    def mark(self, conn_id: str, state: str) -> None:
+        self.states[conn_id] = state
+
+    def finish(self) -> None:
+        self.finished_at = datetime.now()
+
+    def snapshot(self, conn_ids: Optional[Iterable[str]] = None) -> dict:
+        """进度摘要；``conn_ids`` 给定时只统计这些连接（按租户过滤用）。"""
+        if conn_ids is None:
+            states = dict(self.states)
+        else:
+            visible = set(conn_ids)
+            states = {k: v for k, v in self.states.items() if k in visible}
+        counts = Counter(states.values())
+        return {
+            'running': self.finished_at is None,
+            'concurrency': self.concurrency,
+            'total': len(states),
+            **{state: counts.get(state, 0) for state in self.STATES},
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'connections': [{'id': k, 'state': v} for k, v in states.items()],
+        }
+
+
 @dataclass
 class MCPProcess:
     """单个MCP连接进程的状态"""
@@ -82,6 +149,8 @@ class MCPProcessManager:
         # /start + /stop 把 self.connections[conn_id] 改成不一致状态
         # （codex audit ad0265a253981469c HIGH）。
         self._locks: Dict[str, asyncio.Lock] = {}
+        # 开机恢复进度（app.py _restore_auto_start_mcp_connections 填入）
+        self.restore_progress: Optional[RestoreProgress] = None
         atexit.register(self._cleanup_on_exit)
         # Kill any orphan mcp_pipe.py from a previous backend run before we
         # spawn fresh ones. Without this, uvicorn reload / backend crash
@@ -312,6 +381,8 @@ class MCPProcessManager:
                 debug=debug_mode,
                 external_tenant_id=external_scope.get('external_tenant_id'),
                 external_warehouse_id=external_scope.get('external_warehouse_id'),
+                connection_id=conn_id,
+                tenant_id=log_context.get('tenant_id'),
             )
             mcp_proc = MCPProcess(
                 conn_id=conn_id,
@@ -651,6 +722,13 @@ class MCPProcessManager:
             'uptime_seconds': uptime
         }
 
+    def tool_stats(self) -> Optional[dict]:
+        """共享运行时的工具线程池统计；子进程模式下各进程自管，返回 None。"""
+        if self._shared_runtime is None:
+            return None
+        from mcp_shared_runtime import tool_stats
+        return tool_stats()
+
     def get_logs(self, conn_id: str, lines: int = 50) -> list:
         """获取连接的最近日志"""
         if conn_id not in self.connections:
@@ -673,6 +751,43 @@ class MCPProcessManager:
                 return False
             await asyncio.sleep(min(0.2, remaining))
 
+    async def apply_command(self, command: dict) -> None:
+        """执行其他 worker 经总线转来的启停命令（``RemoteMCPManager`` 发出）。
+
+        命令里只有 conn_id / op（不带 api_key），endpoint 等从库里现读；执行完
+        把状态写回 mcp_connections，发命令的 worker 靠它回显状态。
+        """
+        conn_id, op = command.get('conn_id'), command.get('op')
+        if op in ('stop', 'remove'):
+            await self.stop_connection(conn_id)
+            if op == 'remove':
+                self.remove_connection(conn_id)
+            return
+        from db import get_engine
+        from metadata import mcp_connections as _t_mcp
+        from sqlalchemy import select as _sa_select
+        with get_engine().connect() as conn:
+            row = conn.execute(
+                _sa_select(_t_mcp.c.mcp_endpoint, _t_mcp.c.api_key, _t_mcp.c.debug_mode)
+                .where(_t_mcp.c.id == conn_id)
+            ).first()
+        if row is None:
+            return
+        if op == 'start':
+            await self.start_connection(conn_id, row.mcp_endpoint, row.api_key,
+                                        debug_mode=bool(row.debug_mode))
+        elif op == 'restart':
+            await self.restart_connection(conn_id, row.mcp_endpoint, row.api_key)
+        elif op == 'debug':
+            await self.toggle_debug(conn_id, row.mcp_endpoint, row.api_key,
+                                    bool(command.get('enable')))
+        else:
+            logger.warning(f"Unknown MCP command {op!r} for '{conn_id}'")
+            return
+        status_info = self.get_connection_status(conn_id)
+        self._update_db_status(conn_id, status_info['status'],
+                               status_info.get('error_message'), 0)
+
     async def stop_all(self):
         """停止所有连接"""
         for conn_id in list(self.connections.keys()):
@@ -863,3 +978,96 @@ class MCPProcessManager:
                 )
         except Exception as e:
             logger.error(f"Failed to update DB status for '{conn_id}': {e}")
+
+
+MCP_COMMAND_TOPIC = 'mcp'
+
+
+class RemoteMCPManager:
+    """多 worker 部署下非归属 worker 上的 MCP 管理器替身。
+
+    mcp_pipe 子进程只能由一个 worker 持有（见 multiworker.WorkerLock 与
+    app.py 的 startup 钩子）：否则每个 worker 各拉一份，云端看到同一身份的多个
+    客户端。这里的启停操作只经总线转发给归属 worker 并乐观返回成功；状态
+    从 mcp_connections 表读（归属 worker 执行完命令后写回）。不要在这里构造
+    MCPProcessManager——它的构造函数会杀掉本机所有 mcp_pipe 进程。
+    """
+
+    def __init__(self):
+        self.connections: Dict[str, MCPProcess] = {}
+        # 恢复在归属 worker 上进行，这里看不到进度
+        self.restore_progress: Optional[RestoreProgress] = None
+
+    @staticmethod
+    def _send(conn_id: str, op: str, **extra) -> None:
+        from multiworker import broadcast
+        broadcast(MCP_COMMAND_TOPIC, conn_id=conn_id, op=op, **extra)
+
+    async def start_monitor(self):
+        pass
+
+    async def stop_monitor(self):
+        pass
+
+    async def stop_all(self):
+        pass
+
+    async def start_connection(self, conn_id: str, endpoint: str, api_key: str,
+                               auto_start: bool = True, debug_mode: bool = False,
+                               log_context: Optional[dict] = None) -> bool:
+        self._send(conn_id, 'start')
+        return True
+
+    async def stop_connection(self, conn_id: str) -> bool:
+        self._send(conn_id, 'stop')
+        return True
+
+    async def restart_connection(self, conn_id: str, endpoint: str = None,
+                                 api_key: str = None,
+                                 log_context: Optional[dict] = None) -> bool:
+        self._send(conn_id, 'restart')
+        return True
+
+    async def toggle_debug(self, conn_id: str, endpoint: str, api_key: str, enable: bool) -> bool:
+        self._send(conn_id, 'debug', enable=enable)
+        return True
+
+    def remove_connection(self, conn_id: str):
+        self._send(conn_id, 'remove')
+
+    def get_connection_status(self, conn_id: str) -> dict:
+        from db import get_engine
+        from metadata import mcp_connections as _t_mcp
+        from sqlalchemy import select as _sa_select
+        with get_engine().connect() as conn:
+            row = conn.execute(
+                _sa_select(_t_mcp.c.status, _t_mcp.c.error_message, _t_mcp.c.restart_count)
+                .where(_t_mcp.c.id == conn_id)
+            ).first()
+        if row is None:
+            return {'status': 'stopped', 'pid': None}
+        return {
+            'status': row.status or 'stopped',
+            'websocket_status': None,
+            'websocket_error': None,
+            'pid': None,
+            'error_message': row.error_message,
+            'restart_count': row.restart_count or 0,
+            'uptime_seconds': None,
+        }
+
+    def tool_stats(self) -> Optional[dict]:
+        # 工具线程池在归属 worker 里
+        return None
+
+    def get_logs(self, conn_id: str, lines: int = 50) -> list:
+        # 日志只在归属 worker 的内存里
+        return []
+
+    async def wait_for_protocol_ready(self, conn_id: str, timeout: float = 30.0) -> bool:
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            if self.get_connection_status(conn_id)['status'] == 'running':
+                return True
+            await asyncio.sleep(0.5)
+        return False
@@ -2,6 +2,12 @@
 
 Each WebSocket gets an independent MCP session and a ContextVar-backed tenant
 configuration, while the FastMCP/Pydantic runtime is imported only once.
+
+Tool-call deadlines are per request: each inbound request arms a
+``loop.call_later`` timer (the event loop's timer heap is shared by all
+sessions), so idle sessions cost no wakeups. An expired request gets a
+JSON-RPC error and a ``notifications/cancelled`` to FastMCP; the session
+itself stays connected.
 """
 
 import asyncio
@@ -10,7 +16,6 @@ import logging
 import os
 import random
 import sys
-import time
 from logging.handlers import RotatingFileHandler
 from typing import Callable, Optional
 
@@ -64,29 +69,85 @@ def _safe_label(value, limit=160):
     return text.replace('\n', ' ').replace('\r', ' ').strip()[:limit]
 
 
-def _classify_json_rpc(parsed):
-    if not isinstance(parsed, dict):
-        return None, None
-    if 'method' in parsed:
-        return ('request', parsed.get('id')) if 'id' in parsed else ('notification', None)
-    if 'id' in parsed and ('result' in parsed or 'error' in parsed):
-        return 'response', parsed['id']
-    return None, None
+def _describe_message(message):
+    """Classify a validated ``JSONRPCMessage`` without re-parsing its JSON.
+
+    Returns ``(kind, request_id, label)`` where label is the method for
+    requests/notifications and ``result``/``error`` for responses.
+    """
+    root = message.root
+    if isinstance(root, types.JSONRPCRequest):
+        return 'request', root.id, root.method
+    if isinstance(root, types.JSONRPCNotification):
+        return 'notification', None, root.method
+    if isinstance(root, types.JSONRPCResponse):
+        return 'response', root.id, 'result'
+    if isinstance(root, types.JSONRPCError):
+        return 'response', root.id, 'error'
+    return None, None, None
 
 
-def _json_rpc_summary(parsed, byte_count):
-    kind, request_id = _classify_json_rpc(parsed)
+def _json_rpc_summary(description, byte_count):
+    kind, request_id, label = description
     if kind in ('request', 'notification'):
-        method = _safe_label(parsed.get('method'), 100) or '?'
+        method = _safe_label(label, 100) or '?'
         return f"{kind} method={method} id={_safe_label(request_id)} bytes={byte_count}"
     if kind == 'response':
-        outcome = 'error' if 'error' in parsed else 'result'
-        return f"response id={_safe_label(request_id)} outcome={outcome} bytes={byte_count}"
+        return f"response id={_safe_label(request_id)} outcome={label} bytes={byte_count}"
     return f"non-json-rpc bytes={byte_count}"
 
 
-class MCPToolTimeout(RuntimeError):
-    pass
+def _utf8_len(raw_message) -> int:
+    if isinstance(raw_message, bytes):
+        return len(raw_message)
+    return len(raw_message.encode('utf-8'))
+
+
+def _timeout_error(request_id) -> str:
+    return json.dumps({
+        'jsonrpc': '2.0',
+        'id': request_id,
+        'error': {
+            'code': -32001,
+            'message': (
+                f"工具调用超时（>{int(TOOL_CALL_TIMEOUT)}s），"
+                "后端服务可能暂时繁忙。请稍后重试。"
+            ),
+        },
+    }, ensure_ascii=False)
+
+
+def tool_stats() -> Optional[dict]:
+    """MCP 工具线程池的排队 / 执行统计（运行时未加载时为 None）。"""
+    module = sys.modules.get('tool_executor')
+    return module.executor.snapshot() if module is not None else None
+
+
+_TOOL_COUNTERS = (
+    ('calls', 'mcp_tool_calls_total', 'MCP tool calls by tool name.'),
+    ('errors', 'mcp_tool_errors_total', 'MCP tool calls that raised.'),
+    ('queue_wait_seconds_total', 'mcp_tool_queue_wait_seconds_total',
+     'Time MCP tool calls spent queued for an executor slot.'),
+    ('exec_seconds_total', 'mcp_tool_exec_seconds_total',
+     'Time MCP tool calls spent executing.'),
+)
+
+
+def _render_tool_metrics() -> list:
+    """metrics.py 的采集器：工具线程池指标（Prometheus 文本行）。"""
+    import metrics  # noqa: PLC0415
+
+    stats = tool_stats()
+    if stats is None:
+        return []
+    lines = []
+    for key, name, help_text in _TOOL_COUNTERS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for tool, values in stats['tools'].items():
+            lines.append(f'{name}{{tool="{metrics.escape_label(tool)}"}} {values[key]}')
+    for key, name in (('running', 'mcp_tool_running'), ('queued', 'mcp_tool_queued')):
+        lines += [f"# TYPE {name} gauge", f"{name} {stats[key]}"]
+    return lines
 
 
 class SharedMCPRuntime:
@@ -119,6 +180,8 @@ class SharedMCPRuntime:
             )
             self._lifespan_cm = self._warehouse_mcp.mcp._lifespan_manager()
             await self._lifespan_cm.__aenter__()
+            import metrics  # noqa: PLC0415
+            metrics.add_collector(_render_tool_metrics)
             self._started = True
             logger.info("Shared FastMCP runtime started")
 
@@ -140,6 +203,8 @@ class SharedMCPRuntime:
         debug: bool = False,
         external_tenant_id: Optional[str] = None,
         external_warehouse_id: Optional[str] = None,
+        connection_id: Optional[str] = None,
+        tenant_id: Optional[int] = None,
     ) -> dict:
         if self._warehouse_mcp is None:
             raise RuntimeError("Shared MCP runtime has not started")
@@ -149,6 +214,8 @@ class SharedMCPRuntime:
             debug=debug,
             external_tenant_id=external_tenant_id,
             external_warehouse_id=external_warehouse_id,
+            connection_id=connection_id,
+            tenant_id=tenant_id,
         )
 
     async def run_connection(
@@ -215,43 +282,65 @@ class SharedMCPRuntime:
 
             incoming_send, incoming_receive = anyio.create_memory_object_stream(0)
             outgoing_send, outgoing_receive = anyio.create_memory_object_stream(0)
+            loop = asyncio.get_running_loop()
+            # request id -> 截止定时器；已回过超时错误的 id 记在 timed_out，
+            # FastMCP 随后为它发出的（取消或迟到的）响应直接丢弃
             pending_requests = {}
+            timed_out = set()
+            expiry_tasks = set()
+            # 只存 (kind, id, label, 原始帧)，出错时才格式化成摘要；原始帧用于按需算字节数
             protocol_trace = {'last_cloud': None, 'last_server': None}
 
+            def trace_summary(entry):
+                if entry is None:
+                    return 'none'
+                description, raw_message = entry
+                return _json_rpc_summary(description, _utf8_len(raw_message))
+
             async def websocket_to_mcp():
                 async with incoming_send:
                     async for raw_message in websocket:
-                        if isinstance(raw_message, bytes):
-                            raw_message = raw_message.decode('utf-8')
-                        parsed = json.loads(raw_message)
-                        kind, request_id = _classify_json_rpc(parsed)
-                        summary = _json_rpc_summary(
-                            parsed, len(raw_message.encode('utf-8'))
-                        )
-                        protocol_trace['last_cloud'] = summary
-                        self._emit(log_target, event_callback, 'protocol', f"RPC cloud->server {summary}")
-                        if kind == 'request':
-                            pending_requests[request_id] = time.monotonic()
+                        # 一次解析：pydantic 直接校验 str / bytes，分类读校验后的模型
                         message = types.JSONRPCMessage.model_validate_json(raw_message)
+                        description = _describe_message(message)
+                        kind, request_id, _ = description
+                        protocol_trace['last_cloud'] = (description, raw_message)
+                        if session_state.get('debug'):
+                            summary = _json_rpc_summary(description, _utf8_len(raw_message))
+                            self._emit(log_target, event_callback, 'protocol', f"RPC cloud->server {summary}")
+                        if kind == 'request':
+                            previous = pending_requests.pop(request_id, None)
+                            if previous is not None:
+                                previous.cancel()
+                            pending_requests[request_id] = loop.call_later(
+                                TOOL_CALL_TIMEOUT, on_deadline, request_id,
+                            )
                         await incoming_send.send(SessionMessage(message))
 
             async def mcp_to_websocket():
                 async with outgoing_receive:
                     async for session_message in outgoing_receive:
+                        # 大结果（搜索列表、批次列表）只序列化这一次
                         raw_message = session_message.message.model_dump_json(
                             by_alias=True,
                             exclude_none=True,
                         )
-                        parsed = json.loads(raw_message)
-                        kind, request_id = _classify_json_rpc(parsed)
-                        summary = _json_rpc_summary(
-                            parsed, len(raw_message.encode('utf-8'))
-                        )
-                        protocol_trace['last_server'] = summary
-                        self._emit(log_target, event_callback, 'protocol', f"RPC server->cloud {summary}")
+                        description = _describe_message(session_message.message)
+                        kind, request_id, outcome = description
+                        protocol_trace['last_server'] = (description, raw_message)
+                        # 非调试连接不逐条记协议日志，只留握手完成与错误响应
+                        if session_state.get('debug') or outcome == 'error':
+                            summary = _json_rpc_summary(description, _utf8_len(raw_message))
+                            self._emit(log_target, event_callback, 'protocol', f"RPC server->cloud {summary}")
                         if kind == 'response':
-                            pending_requests.pop(request_id, None)
-                            if request_id == 0 and 'error' not in parsed:
+                            deadline = pending_requests.pop(request_id, None)
+                            if deadline is not None:
+                                deadline.cancel()
+                            elif request_id in timed_out:
+                                timed_out.discard(request_id)
+                                continue
+                            if request_id == 0 and outcome != 'error':
+                                summary = _json_rpc_summary(description, _utf8_len(raw_message))
                                 self._emit(
                                     log_target,
                                     event_callback,
@@ -260,63 +349,76 @@ class SharedMCPRuntime:
                                 )
                         await websocket.send(raw_message)
 
-            async def timeout_watchdog():
-                while True:
-                    await asyncio.sleep(0.2)
-                    if not pending_requests:
-                        continue
-                    request_id = min(
-                        pending_requests,
-                        key=lambda item: pending_requests[item],
-                    )
-                    age = time.monotonic() - pending_requests[request_id]
-                    if age < TOOL_CALL_TIMEOUT:
-                        continue
-                    error_response = json.dumps({
-                        'jsonrpc': '2.0',
-                        'id': request_id,
-                        'error': {
-                            'code': -32001,
-                            'message': (
-                                f"工具调用超时（>{int(TOOL_CALL_TIMEOUT)}s），"
-                                "后端服务可能暂时繁忙。请稍后重试。"
-                            ),
-                        },
-                    }, ensure_ascii=False)
-                    await websocket.send(error_response)
-                    raise MCPToolTimeout(
-                        f"No response for request id={request_id} after {age:.0f}s"
-                    )
+            def on_deadline(request_id):
+                if pending_requests.pop(request_id, None) is None:
+                    return
+                timed_out.add(request_id)
+                task = loop.create_task(expire_request(request_id))
+                expiry_tasks.add(task)
+                task.add_done_callback(expiry_tasks.discard)
 
-            with self._warehouse_mcp.runtime_context(session_state):
-                tasks = [
-                    asyncio.create_task(websocket_to_mcp()),
-                    asyncio.create_task(mcp_to_websocket()),
-                    asyncio.create_task(timeout_watchdog()),
-                    asyncio.create_task(self._server.run(
-                        incoming_receive,
-                        outgoing_send,
-                        self._initialization_options,
-                    )),
-                ]
-                done, pending = await asyncio.wait(
-                    tasks,
-                    return_when=asyncio.FIRST_COMPLETED,
-                )
-                for task in pending:
-                    task.cancel()
-                if pending:
-                    await asyncio.gather(*pending, return_exceptions=True)
-                for task in done:
-                    exception = task.exception()
-                    if exception is not None:
-                        raise exception
-
-                trace = (
-                    f"last_cloud={protocol_trace['last_cloud'] or 'none'}; "
-                    f"last_server={protocol_trace['last_server'] or 'none'}"
+            async def expire_request(request_id):
+                self._emit(
+                    log_target,
+                    event_callback,
+                    'protocol',
+                    f"RPC request id={_safe_label(request_id)} timed out after "
+                    f"{TOOL_CALL_TIMEOUT:.0f}s",
+                    warning=True,
                 )
-                raise RuntimeError(f"MCP session stream ended; {trace}")
+                try:
+                    await websocket.send(_timeout_error(request_id))
+                    # 让 FastMCP 撤掉该请求的处理（线程里的同步工具停不下来，但不再挂着会话）
+                    await incoming_send.send(SessionMessage(types.JSONRPCMessage(
+                        types.JSONRPCNotification(
+                            jsonrpc='2.0',
+                            method='notifications/cancelled',
+                            params={'requestId': request_id, 'reason': 'timeout'},
+                        )
+                    )))
+                except (anyio.ClosedResourceError, anyio.BrokenResourceError,
+                        websockets.ConnectionClosed):
+                    pass
+
+            with self._warehouse_mcp.runtime_context(session_state):
+                tasks = []
+                try:
+                    tasks = [
+                        asyncio.create_task(websocket_to_mcp()),
+                        asyncio.create_task(mcp_to_websocket()),
+                        asyncio.create_task(self._server.run(
+                            incoming_receive,
+                            outgoing_send,
+                            self._initialization_options,
+                        )),
+                    ]
+                    done, pending = await asyncio.wait(
+                        tasks,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    for task in pending:
+                        task.cancel()
+                    if pending:
+                        await asyncio.gather(*pending, return_exceptions=True)
+                    for task in done:
+                        exception = task.exception()
+                        if exception is not None:
+                            raise exception
+
+                    trace = (
+                        f"last_cloud={trace_summary(protocol_trace['last_cloud'])}; "
+                        f"last_server={trace_summary(protocol_trace['last_server'])}"
+                    )
+                    raise RuntimeError(f"MCP session stream ended; {trace}")
+                finally:
+                    # 外部取消本会话时 asyncio.wait 不会取消子任务，这里统一收尾
+                    for task in tasks:
+                        task.cancel()
+                    for deadline in pending_requests.values():
+                        deadline.cancel()
+                    pending_requests.clear()
+                    for task in list(expiry_tasks):
+                        task.cancel()
 
     @staticmethod
     def _emit(
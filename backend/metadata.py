@@ -41,6 +41,7 @@ from sqlalchemy import (
     UniqueConstraint,
     func,
 )
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
 
 
 # Stable constraint names so Alembic autogenerate produces deterministic output.
@@ -233,6 +234,22 @@ batches = Table(
     Index("idx_batches_warehouse", "warehouse_id"),
     Index("idx_batches_tenant", "tenant_id"),
     Index("idx_batches_no_wh", "batch_no", "warehouse_id", unique=True),
+    Index("idx_batches_material", "material_id", "is_exhausted"),
+    **MYSQL_TABLE_KW,
+)
+
+
+# 批次号序号分配器：每仓每天一行，last_seq 为当天已分配的最大序号。
+# scanned_batch_id 是「已核对过的 batches.id 水位」，用于追上绕过分配器
+# 写入的批次号（用户手填、直接导库），详见 database.reserve_batch_nos。
+# 不挂 warehouses 外键：清库时随批次一起删，本身只是计数器。
+batch_no_sequences = Table(
+    "batch_no_sequences",
+    metadata,
+    Column("warehouse_id", Integer, primary_key=True, autoincrement=False),
+    Column("day", String(8), primary_key=True),
+    Column("last_seq", Integer, nullable=False),
+    Column("scanned_batch_id", Integer, nullable=False, server_default="0"),
     **MYSQL_TABLE_KW,
 )
 
@@ -263,6 +280,23 @@ inventory_records = Table(
     Column("tenant_id", Integer, ForeignKey("tenants.id"), server_default="1"),
     Index("idx_records_warehouse", "warehouse_id"),
     Index("idx_records_tenant", "tenant_id"),
+    Index("idx_records_material_created", "material_id", "created_at"),
+    **MYSQL_TABLE_KW,
+)
+
+
+# 出入库日汇总：每（租户, 仓库, 日, 类型）一行，随记录写入在同一事务里累加，
+# 仪表盘的今日 / 昨日 / 近 7 天数字直接读它（见 backend/daily_stats.py）。
+# 不挂外键：NULL 租户 / 仓库的历史记录记到 0，整张表可随时从记录表重算。
+daily_stats = Table(
+    "daily_stats",
+    metadata,
+    Column("tenant_id", Integer, primary_key=True, autoincrement=False),
+    Column("warehouse_id", Integer, primary_key=True, autoincrement=False),
+    Column("day", String(10), primary_key=True),
+    Column("type", String(8), primary_key=True),
+    Column("quantity", Integer, nullable=False, server_default="0"),
+    Column("record_count", Integer, nullable=False, server_default="0"),
     **MYSQL_TABLE_KW,
 )
 
@@ -537,13 +571,37 @@ face_enrollments = Table(
     ),
     Column("model_tag", String(64), nullable=False),
     Column("embedding", LargeBinary, nullable=False),
+    # 旧列：历史上整张注册照片以 base64 存这里；现已迁到 face_source_images，
+    # 只剩无法解码的遗留值。新写入一律走 source_image_sha256。
     Column("source_image_b64", Text),
     Column("applies_to_warehouse_ids", JSON),
     Column("is_active", Boolean, nullable=False, server_default="1"),
     Column("enrolled_at", String(32), server_default=func.current_timestamp()),
     Column("enrolled_by", Integer),
+    Column("source_image_sha256", String(64)),
     Index("idx_face_enroll", "tenant_id", "model_tag", "is_active"),
     Index("idx_face_enroll_subject", "subject_id"),
+    Index("idx_face_enroll_source_image", "tenant_id", "source_image_sha256"),
+    **MYSQL_TABLE_KW,
+)
+
+
+# 注册照片内容寻址存储：原始字节 + sha256，同租户同图只存一份。
+face_source_images = Table(
+    "face_source_images",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column(
+        "tenant_id",
+        Integer,
+        ForeignKey("tenants.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    Column("sha256", String(64), nullable=False),
+    Column("data", LargeBinary().with_variant(MEDIUMBLOB(), "mysql"), nullable=False),
+    Column("byte_size", Integer, nullable=False),
+    Column("created_at", String(32), server_default=func.current_timestamp()),
+    Index("idx_face_source_images_hash", "tenant_id", "sha256", unique=True),
     **MYSQL_TABLE_KW,
 )
 
@@ -571,6 +629,57 @@ face_auth_logs = Table(
 )
 
 
+# ---------------------------------------------------------------------------
+# background_jobs：后台任务（整库导入导出、Excel 导入确认、人脸批量补算等），
+# 见 backend/jobs.py。id 为 uuid hex；result / artifact 为 JSON 文本。
+# ---------------------------------------------------------------------------
+background_jobs = Table(
+    "background_jobs",
+    metadata,
+    Column("id", String(32), primary_key=True),
+    Column("job_type", String(64), nullable=False),
+    Column("tenant_id", Integer),
+    Column("created_by", Integer),
+    Column("created_by_name", String(64)),
+    Column("dedupe_key", String(191)),
+    Column("status", String(16), nullable=False, server_default="pending"),
+    Column("progress_done", Integer, nullable=False, server_default="0"),
+    Column("progress_total", Integer, nullable=False, server_default="0"),
+    Column("message", Text),
+    Column("result", Text),
+    Column("error", Text),
+    Column("artifact", Text),
+    Column("cancel_requested", Integer, nullable=False, server_default="0"),
+    Column("owner", String(191)),
+    Column("created_at", DateTime, server_default=func.current_timestamp()),
+    Column("started_at", DateTime),
+    Column("finished_at", DateTime),
+    Column("updated_at", DateTime),
+    Index("idx_background_jobs_tenant", "tenant_id", "created_at"),
+    Index("idx_background_jobs_active", "status", "job_type"),
+    **MYSQL_TABLE_KW,
+)
+
+
+# ---------------------------------------------------------------------------
+# cache_invalidations：多 worker 部署下的缓存失效事件（见 backend/multiworker.py），
+# 各 worker 按 id 增量轮询；只保留最近几分钟。AUTOINCREMENT 防止清空后 id 复用，
+# 否则轮询位置停在旧 id 上的 worker 会漏事件。
+# ---------------------------------------------------------------------------
+cache_invalidations = Table(
+    "cache_invalidations",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("topic", String(64), nullable=False),
+    Column("payload", Text),
+    Column("origin", String(64)),
+    Column("created_at", DateTime, server_default=func.current_timestamp()),
+    Index("idx_cache_invalidations_created", "created_at"),
+    sqlite_autoincrement=True,
+    **MYSQL_TABLE_KW,
+)
+
+
 # ---------------------------------------------------------------------------
 # batch_consumptions (declared last; FKs to inventory_records and batches)
 # ---------------------------------------------------------------------------
@@ -609,6 +718,7 @@ __all__ = [
     "contacts",
     "batches",
     "inventory_records",
+    "daily_stats",
     "sessions",
     "api_keys",
     "system_settings",
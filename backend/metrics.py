@@ -0,0 +1,347 @@
+"""请求级性能指标：按路由的耗时直方图、SQL 语句数与 SQL 耗时，Prometheus 文本格式导出。
+
+``METRICS_ENABLED=true`` 或 ``SERVER_TIMING=true`` 时 ``install(app)`` 挂上：
+
+* 纯 ASGI 中间件（不走 BaseHTTPMiddleware，免一次请求体转发）：按**路由模板**
+  （``/api/jobs/{job_id}`` 而非实际路径，避免标签基数爆炸）记录请求数、耗时直方图、
+  SQL 语句数与耗时；``SERVER_TIMING=true`` 时在响应头加 ``Server-Timing: app;dur=…, sql;dur=…``。
+* SQLAlchemy ``before_cursor_execute`` / ``after_cursor_execute`` 钩子（挂在 Engine
+  类上，覆盖所有引擎）；raw sqlite3 路径（``database.get_db_connection``）改用
+  ``InstrumentedConnection`` 建连接，同样计入。
+
+统计挂在 contextvar 上：同步路由跑在线程池里，Starlette 调度时会复制上下文，
+线程里的累加对中间件可见。请求之外（后台任务、启动迁移）的 SQL 不计入。
+
+关闭时（默认）既不挂中间件也不挂钩子，sqlite3 连接用原生类，开销为零。
+指标按进程统计；多 worker 部署时每次抓取落到其中一个 worker。
+
+同一套钩子也给逐条语句的观察者用（``add_sql_observer``，如 slow_query.py 的慢查询
+日志）：有观察者时即使 ``METRICS_ENABLED=false`` 也挂钩子和中间件（中间件只负责
+提供路由 / 租户上下文，不记 Prometheus 指标）。单开 ``SERVER_TIMING`` 同理：只加响应头。
+"""
+from __future__ import annotations
+
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "false").lower() == "true"
+# 响应头附带 Server-Timing（浏览器开发者工具可直接看到 app / sql 耗时）
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "false").lower() == "true"
+# 非空时 /metrics 需要 ``Authorization: Bearer <token>``
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# 耗时直方图桶（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 没匹配到 API 路由的请求（静态文件、SPA 回退、404）统一归到这个标签
+OTHER_ROUTE = "<other>"
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_time", "scope", "tenant_id")
+
+    def __init__(self, scope=None):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.scope = scope
+        # 鉴权依赖解析出用户后填入（deps.require_permission）
+        self.tenant_id: Optional[int] = None
+
+    @property
+    def route(self) -> Optional[str]:
+        """``GET /api/jobs/{job_id}`` 形式的路由模板（路由匹配前为 None）。"""
+        if self.scope is None:
+            return None
+        path = getattr(self.scope.get("route"), "path", None)
+        return f"{self.scope.get('method')} {path}" if path else None
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """当前请求的统计（请求之外为 None）。"""
+    return _current.get()
+
+
+# 逐条语句观察者：fn(statement, elapsed, rowcount, stats, explain)
+#   rowcount 为驱动报告的行数（SQLite 的 SELECT 为 -1）；stats 请求之外为 None；
+#   explain 为 None（executemany）或可调用对象，调用后返回该语句的执行计划行。
+SqlObserver = Callable[[str, float, int, Optional[RequestStats], Optional[Callable[[], list]]], None]
+_sql_observers: List[SqlObserver] = []
+
+
+def add_sql_observer(fn: SqlObserver) -> None:
+    """登记逐条 SQL 观察者（须在 ``install`` 之前调用；重复登记无副作用）。"""
+    if fn not in _sql_observers:
+        _sql_observers.append(fn)
+
+
+def tracking_enabled() -> bool:
+    """是否需要挂钩子：开了指标或 Server-Timing，或有逐条语句观察者。"""
+    return METRICS_ENABLED or SERVER_TIMING or bool(_sql_observers)
+
+
+def record_sql(elapsed: float, statement: Optional[str] = None, rowcount: int = -1,
+               explain: Optional[Callable[[], list]] = None) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_time += elapsed
+    if statement is None:
+        return
+    for fn in _sql_observers:
+        try:
+            fn(statement, elapsed, rowcount, stats, explain)
+        except Exception:  # noqa: BLE001 — 观察者出错不能连累业务查询
+            pass
+
+
+class _Series:
+    __slots__ = ("count", "total", "buckets", "sql_count", "sql_time")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+
+class Registry:
+    """进程内指标表：(method, route) → 耗时直方图 + SQL 累计；(method, route, status) → 请求数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._status: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status: int, elapsed: float,
+                stats: RequestStats) -> None:
+        with self._lock:
+            s = self._series.get((method, route))
+            if s is None:
+                s = self._series[(method, route)] = _Series()
+            s.count += 1
+            s.total += elapsed
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    s.buckets[i] += 1
+                    break
+            s.sql_count += stats.sql_count
+            s.sql_time += stats.sql_time
+            key = (method, route, status)
+            self._status[key] = self._status.get(key, 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._status.clear()
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4。"""
+        with self._lock:
+            series = sorted(self._series.items())
+            status = sorted(self._status.items())
+            lines = [
+                "# HELP http_requests_total Total HTTP requests by route and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, code), n in status:
+                lines.append(f'http_requests_total{{{_labels(method, route)},status="{code}"}} {n}')
+            lines += [
+                "# HELP http_request_duration_seconds HTTP request latency by route.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route), s in series:
+                lbl = _labels(method, route)
+                cumulative = 0
+                for bound, n in zip(BUCKETS, s.buckets):
+                    cumulative += n
+                    lines.append(f'http_request_duration_seconds_bucket{{{lbl},le="{bound}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_bucket{{{lbl},le="+Inf"}} {s.count}')
+                lines.append(f"http_request_duration_seconds_sum{{{lbl}}} {s.total:.6f}")
+                lines.append(f"http_request_duration_seconds_count{{{lbl}}} {s.count}")
+            lines += [
+                "# HELP http_request_sql_statements_total SQL statements executed while serving the route.",
+                "# TYPE http_request_sql_statements_total counter",
+            ]
+            for (method, route), s in series:
+                lines.append(f"http_request_sql_statements_total{{{_labels(method, route)}}} {s.sql_count}")
+            lines += [
+                "# HELP http_request_sql_seconds_total Time spent in SQL while serving the route.",
+                "# TYPE http_request_sql_seconds_total counter",
+            ]
+            for (method, route), s in series:
+                lines.append(f"http_request_sql_seconds_total{{{_labels(method, route)}}} {s.sql_time:.6f}")
+        for collector in list(_collectors):
+            try:
+                lines.extend(collector())
+            except Exception:  # noqa: BLE001 — 单个采集器出错不影响其余指标
+                pass
+        return "\n".join(lines) + "\n"
+
+
+# 额外指标采集器：返回 Prometheus 文本行（含 HELP/TYPE），抓取时调用
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def add_collector(fn: Callable[[], List[str]]) -> None:
+    """登记额外指标（如 MCP 工具线程池，见 mcp_shared_runtime.py）；重复登记无副作用。"""
+    if fn not in _collectors:
+        _collectors.append(fn)
+
+
+def escape_label(value: str) -> str:
+    """Prometheus 标签值转义（``add_collector`` 的采集器也用它）。"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(method: str, route: str) -> str:
+    return f'method="{method}",route="{escape_label(route)}"'
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：计时 + 汇总当前请求的 SQL 统计。"""
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        t0 = time.perf_counter()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    app_ms = (time.perf_counter() - t0) * 1000
+                    value = (f"app;dur={app_ms:.1f}, sql;dur={stats.sql_time * 1000:.1f};"
+                             f"desc=\"{stats.sql_count} queries\"")
+                    message["headers"] = list(message.get("headers", ())) + [
+                        (b"server-timing", value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current.reset(token)
+            if METRICS_ENABLED:
+                route = getattr(scope.get("route"), "path", None) or OTHER_ROUTE
+                registry.observe(scope["method"], route, status, time.perf_counter() - t0, stats)
+
+
+# ---------------------------------------------------------------------------
+# SQL 钩子
+# ---------------------------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_t0", []).append(time.perf_counter())
+
+
+_EXPLAIN_PREFIX = {"sqlite": "EXPLAIN QUERY PLAN ", "mysql": "EXPLAIN "}
+
+
+def _explainable(statement: str) -> bool:
+    head = statement.lstrip()[:6].upper()
+    return head.startswith("SELECT") or head.startswith("WITH")
+
+
+def _explain_with(cursor_factory, prefix: str, statement: str, parameters) -> list:
+    cur = cursor_factory()
+    try:
+        cur.execute(prefix + statement, parameters)
+        return [tuple(row) for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("_metrics_t0")
+    if starts:
+        explain = None
+        prefix = _EXPLAIN_PREFIX.get(conn.dialect.name)
+        if _sql_observers and prefix and not executemany and _explainable(statement):
+            # 直接走 DBAPI 游标，不会再触发本钩子
+            explain = lambda: _explain_with(  # noqa: E731
+                conn.connection.cursor, prefix, statement, parameters)
+        record_sql(time.perf_counter() - starts.pop(), statement,
+                   getattr(cursor, "rowcount", -1), explain)
+
+
+def _handle_error(exception_context):
+    # 语句失败时 after_cursor_execute 不会触发：同样计入，并弹掉对应的起始时间
+    conn = exception_context.connection
+    starts = conn.info.get("_metrics_t0") if conn is not None else None
+    if starts:
+        record_sql(time.perf_counter() - starts.pop(), exception_context.statement)
+
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            explain = None
+            if _sql_observers and _explainable(sql):
+                # 原生游标类：不会递归计入
+                explain = lambda: _explain_with(  # noqa: E731
+                    lambda: sqlite3.Cursor(self.connection), "EXPLAIN QUERY PLAN ", sql, parameters)
+            record_sql(time.perf_counter() - t0, sql, self.rowcount, explain)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_sql(time.perf_counter() - t0, sql, self.rowcount)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """raw sqlite3 连接：``conn.execute`` / ``cursor().execute`` 计入当前请求的 SQL 统计。"""
+
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def sqlite_connection_factory():
+    """``sqlite3.connect(factory=...)`` 用的连接类：不需要统计时为原生类。"""
+    return InstrumentedConnection if tracking_enabled() else sqlite3.Connection
+
+
+def install(app) -> None:
+    """挂中间件与 SQLAlchemy 钩子（仅 ``tracking_enabled()`` 时；重复调用无副作用）。"""
+    if not tracking_enabled():
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    for name, fn in (("before_cursor_execute", _before_cursor_execute),
+                     ("after_cursor_execute", _after_cursor_execute),
+                     ("handle_error", _handle_error)):
+        if not event.contains(Engine, name, fn):
+            event.listen(Engine, name, fn)
+    if not any(m.cls is MetricsMiddleware for m in app.user_middleware):
+        app.add_middleware(MetricsMiddleware, server_timing=SERVER_TIMING)
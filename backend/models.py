@@ -3,7 +3,7 @@ Pydantic models for API request/response validation
 """
 from enum import Enum
 from pydantic import BaseModel
-from typing import List, Optional, Generic, TypeVar
+from typing import List, Literal, Optional, Generic, TypeVar, Union
 
 T = TypeVar('T')
 
@@ -659,6 +659,37 @@ class StockOutResponse(BaseModel):
     fallback_total_available: Optional[int] = None  # 其他批次合计可用
 
 
+class StockMovementLine(StockOperationRequest):
+    """批量出入库中的一行：除 direction 外与单条入库/出库请求相同"""
+    direction: Literal["in", "out"]
+
+
+class StockMovementBatchRequest(BaseModel):
+    """批量出入库请求（扫码枪拣货单、外部系统对接）"""
+    lines: List[StockMovementLine]
+    warehouse_id: Optional[int] = None  # 行内未填 warehouse_id 时使用
+    # True：任一行失败整批回滚；False：每行独立 SAVEPOINT，只回滚失败行
+    atomic: bool = False
+
+
+class StockMovementLineResult(BaseModel):
+    """批量出入库单行结果，result 与单条接口的响应一致"""
+    index: int
+    direction: str
+    applied: bool  # 是否已落库（atomic 整批回滚时成功行也为 False）
+    status_code: int = 200  # 行内的 HTTP 错误（如 409 批次并发冲突）按单条接口的状态码给出
+    result: Union[StockInResponse, StockOutResponse]
+
+
+class StockMovementBatchResponse(BaseModel):
+    """批量出入库响应"""
+    success: bool
+    applied: int
+    failed: int
+    results: List[StockMovementLineResult]
+    message: str
+
+
 class BatchMoveRequest(BaseModel):
     """批次库位移动请求
 
@@ -0,0 +1,295 @@
+"""多 worker 部署支持：跨进程缓存失效总线 + 进程间互斥锁。
+
+``run_backend.py`` 按 ``WORKERS`` 起多个 Uvicorn worker 时，每个 worker 都有
+自己的进程内缓存（FuzzyMatcher 分区索引等）。一个 worker 写库后调用的
+``invalidate_cache`` 只清得到自己，其他 worker 会继续拿旧索引匹配。
+
+* **失效总线**：写路径在清本地缓存的同时 ``broadcast(topic, **payload)``；
+  其他 worker 的轮询任务（``start`` 启动）拉到事件后分发给 ``subscribe``
+  登记的处理函数。后端可插拔（``INVALIDATION_BUS`` / ``register_backend``）：
+
+  - ``local``：单 worker 默认，broadcast 为空操作，零开销；
+  - ``table``：多 worker 默认，事件追加到 ``cache_invalidations`` 表，各 worker
+    按自增 id 增量轮询（主键范围查询，空转时只是一次索引探测）。
+
+  broadcast 只进内存发件箱，由轮询任务批量落库——调用方可能正持有 SQLite
+  写事务，同步插入会和自己抢锁。跨 worker 的可见延迟因此最多约两个
+  ``INVALIDATION_POLL_MS``。
+* **互斥锁**：``WorkerLock`` 基于 ``fcntl.flock``，同一数据库的所有 worker 共用
+  锁文件。用于启动迁移串行化和 MCP 连接归属（只有持锁 worker 拉起
+  mcp_pipe 子进程，其余 worker 把启停命令经总线转给它，见 mcp_manager.py）。
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select
+
+from db import get_engine
+from metadata import cache_invalidations as _t_events
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发机：只支持单 worker
+    fcntl = None
+
+logger = logging.getLogger("warehouse.multiworker")
+
+# Uvicorn worker 数（run_backend.py 读同一个变量，子进程继承环境）
+WORKERS = max(1, int(os.environ.get("WORKERS", "1")))
+MULTI_WORKER = WORKERS > 1
+# 失效总线后端：local / table，缺省按 worker 数选
+INVALIDATION_BUS = os.environ.get("INVALIDATION_BUS") or ("table" if MULTI_WORKER else "local")
+# 总线轮询间隔（毫秒）
+INVALIDATION_POLL_MS = int(os.environ.get("INVALIDATION_POLL_MS", "500"))
+# 总线事件保留时长（秒），超过的由任一 worker 顺手清理
+_EVENT_RETENTION_SECONDS = 600
+_PRUNE_INTERVAL = 60.0
+_POLL_BATCH = 1000
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+Event = Tuple[str, dict]
+
+
+class InvalidationBus(abc.ABC):
+    """总线后端接口。``exchange`` 在线程里调用：发出本进程攒下的事件，
+    返回其他 worker 发来的新事件。
+
+    两个方法都是抽象的：缺实现的后端在创建时就报错，而不是等到工作线程里
+    第一次 broadcast 才失败。"""
+
+    @abc.abstractmethod
+    def broadcast(self, topic: str, payload: dict) -> None:
+        """登记一条要发给其他 worker 的事件。"""
+
+    @abc.abstractmethod
+    def exchange(self) -> List[Event]:
+        """发出已登记的事件，返回其他 worker 的新事件。"""
+
+
+class LocalBus(InvalidationBus):
+    """单 worker：没有别的进程要通知。"""
+
+    def broadcast(self, topic: str, payload: dict) -> None:
+        pass
+
+    def exchange(self) -> List[Event]:
+        return []
+
+
+class TableBus(InvalidationBus):
+    """基于 ``cache_invalidations`` 表的总线（SQLite / MySQL 通用）。
+
+    MySQL 上并发插入的自增 id 可能乱序提交（id 12 先于 11 可见），所以每次
+    回看最近 ``_LOOKBACK`` 个 id，用已见集合去重，而不是只取 ``id > 上次最大值``。
+    """
+
+    _LOOKBACK = 200
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self._worker_id = worker_id
+        self._outbox: Deque[Event] = deque()
+        self._high: Optional[int] = None
+        self._seen: set = set()
+        self._last_prune = time.monotonic()
+
+    def broadcast(self, topic: str, payload: dict) -> None:
+        self._outbox.append((topic, payload))
+
+    def _flush(self, conn) -> None:
+        batch = []
+        while self._outbox:
+            topic, payload = self._outbox.popleft()
+            batch.append({"topic": topic, "origin": self._worker_id,
+                          "payload": json.dumps(payload, ensure_ascii=False)})
+        if batch:
+            conn.execute(insert(_t_events), batch)
+
+    def exchange(self) -> List[Event]:
+        engine = get_engine()
+        if self._high is None:
+            # 启动前的事件与本进程无关（缓存都是空的），从当前位置开始
+            with engine.connect() as c:
+                self._high = c.execute(select(func.max(_t_events.c.id))).scalar() or 0
+                self._seen = set(c.execute(
+                    select(_t_events.c.id).where(_t_events.c.id > self._high - self._LOOKBACK)
+                ).scalars())
+        if self._outbox:
+            with engine.begin() as c:
+                self._flush(c)
+        low = self._high - self._LOOKBACK
+        with engine.connect() as c:
+            rows = c.execute(
+                select(_t_events.c.id, _t_events.c.topic, _t_events.c.payload,
+                       _t_events.c.origin)
+                .where(_t_events.c.id > low)
+                .order_by(_t_events.c.id).limit(_POLL_BATCH + self._LOOKBACK)
+            ).all()
+        fresh = [r for r in rows if r.id not in self._seen and r.id > low]
+        if fresh:
+            self._high = max(self._high, fresh[-1].id)
+            self._seen.update(r.id for r in fresh)
+            floor = self._high - self._LOOKBACK
+            self._seen = {i for i in self._seen if i > floor}
+        now = time.monotonic()
+        if now - self._last_prune >= _PRUNE_INTERVAL:
+            self._last_prune = now
+            cutoff = datetime.now() - timedelta(seconds=_EVENT_RETENTION_SECONDS)
+            with engine.begin() as c:
+                c.execute(delete(_t_events).where(_t_events.c.created_at < cutoff))
+        return [(r.topic, json.loads(r.payload or "{}")) for r in fresh if r.origin != self._worker_id]
+
+
+_BACKENDS: Dict[str, Callable[[], InvalidationBus]] = {
+    "local": LocalBus,
+    "table": TableBus,
+}
+
+
+def register_backend(name: str, factory: Callable[[], InvalidationBus]) -> None:
+    """登记额外的总线后端（如 Redis pub/sub），``INVALIDATION_BUS=<name>`` 启用。"""
+    _BACKENDS[name] = factory
+
+
+_bus: Optional[InvalidationBus] = None
+_handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+_poll_task: Optional[asyncio.Task] = None
+
+
+def get_bus() -> InvalidationBus:
+    global _bus
+    if _bus is None:
+        factory = _BACKENDS.get(INVALIDATION_BUS)
+        if factory is None:
+            logger.warning("unknown INVALIDATION_BUS=%r; falling back to local", INVALIDATION_BUS)
+            factory = LocalBus
+        _bus = factory()
+    return _bus
+
+
+def subscribe(topic: str, handler: Callable[[dict], None]) -> None:
+    """登记其他 worker 发来的 ``topic`` 事件的处理函数（在事件循环线程上调用）。"""
+    if handler not in _handlers[topic]:
+        _handlers[topic].append(handler)
+
+
+def broadcast(topic: str, **payload) -> None:
+    """通知**其他** worker。本进程的缓存由调用方自己清（已经清过了）。"""
+    get_bus().broadcast(topic, payload)
+
+
+def dispatch(events: List[Event]) -> None:
+    for topic, payload in events:
+        for handler in list(_handlers.get(topic, ())):
+            try:
+                handler(payload)
+            except Exception:  # noqa: BLE001
+                logger.exception("invalidation handler for %r failed", topic)
+
+
+async def _poll_loop() -> None:
+    bus = get_bus()
+    interval = INVALIDATION_POLL_MS / 1000
+    while True:
+        try:
+            dispatch(await asyncio.to_thread(bus.exchange))
+        except asyncio.CancelledError:
+            raise
+        except Exception:  # noqa: BLE001
+            logger.warning("invalidation bus poll failed", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def start() -> None:
+    """启动总线轮询（startup 钩子里调用）。local 后端不需要轮询。"""
+    global _poll_task
+    if isinstance(get_bus(), LocalBus):
+        return
+    if _poll_task is None or _poll_task.done():
+        _poll_task = asyncio.get_running_loop().create_task(_poll_loop())
+        logger.info("invalidation bus %s started (worker %s)", INVALIDATION_BUS, WORKER_ID)
+
+
+async def stop() -> None:
+    global _poll_task
+    task, _poll_task = _poll_task, None
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    # 退出前把发件箱里剩下的事件送出去
+    bus = get_bus()
+    if not isinstance(bus, LocalBus):
+        try:
+            await asyncio.to_thread(bus.exchange)
+        except Exception:  # noqa: BLE001
+            logger.warning("final invalidation flush failed", exc_info=True)
+
+
+# ---------------------------------------------------------------------------
+# 进程间互斥锁
+# ---------------------------------------------------------------------------
+
+def _lock_path(name: str) -> str:
+    lock_dir = os.environ.get("WORKER_LOCK_DIR") or tempfile.gettempdir()
+    digest = hashlib.sha1(str(get_engine().url).encode()).hexdigest()[:12]
+    return os.path.join(lock_dir, f"warehouse-{digest}-{name}.lock")
+
+
+class WorkerLock:
+    """同一数据库的 worker 之间互斥的文件锁（进程退出时内核自动释放）。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def _acquire(self, blocking: bool) -> bool:
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            if MULTI_WORKER:
+                logger.warning("fcntl unavailable; WorkerLock(%s) is a no-op", self.name)
+            self._fd = -1
+            return True
+        fd = os.open(_lock_path(self.name), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def try_acquire(self) -> bool:
+        return self._acquire(blocking=False)
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        if fd is not None and fd >= 0:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def __enter__(self):
+        self._acquire(blocking=True)
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -22,6 +22,7 @@ from pydantic import BaseModel, Field
 from sqlalchemy import and_, delete, insert, select, update
 from sqlalchemy.exc import IntegrityError
 
+import jobs as _jobs
 from db import get_engine
 from deps import (
     Action,
@@ -610,9 +611,13 @@ def _resolve_import_tenant(current_user: CurrentUser, tenant_id: Optional[int])
     return _resolve_probe_tenant(current_user, tenant_id)
 
 
+_jobs.register_job_type("erp_import", limit=2)
+
+
 @router.post("/api/erp/external/import/users")
 async def import_external_users(
     request: _ImportUsersRequest,
+    background: bool = False,
     current_user: CurrentUser = Depends(require_permission(Resource.USERS, Action.ADMIN)),
 ):
     """把外部系统的账号导入为我方用户（幂等，按 external_user_id 增量同步）。
@@ -620,9 +625,10 @@ async def import_external_users(
     - 已存在同 external_user_id 的用户 → 更新 username/display_name/role，**不动密码**
     - 不存在 → 新建，用 default_password 作为初始密码
     - 同租户下 username 撞车但 external_user_id 不同 → 跳过并回报，不静默覆盖
-    """
-    from database import hash_password
 
+    ``background=true``：返回 202 + 后台任务（bcrypt + 逐条 SAVEPOINT，上千人
+    要跑一阵），上面的响应体在任务 ``result`` 里。
+    """
     # 批级 tenant_id 的越权检查必须在这里做一次，不能只靠 _tenant_of。
     # _tenant_of 里 `want = item.tenant_id or request.tenant_id`——只要**每一条**都
     # 自带 tenant_id，批级那个非法值就永远参与不到比较，403 静默失效：请求里明明
@@ -634,13 +640,26 @@ async def import_external_users(
         and request.tenant_id != current_user.tenant_id
     ):
         raise HTTPException(status_code=403, detail="无权将用户导入其他租户")
+    if request.users and len(request.default_password) < 4:
+        raise HTTPException(status_code=400, detail="初始密码长度至少 4 位")
+
+    if background:
+        job_tid = current_user.tenant_id if current_user.tenant_id is not None else request.tenant_id
+        return _jobs.submit_job_response(
+            "erp_import", _import_external_users, request, current_user,
+            tenant_id=job_tid, user=current_user,
+        )
+    return _import_external_users(None, request, current_user)
+
+
+def _import_external_users(ctx, request: _ImportUsersRequest, current_user: CurrentUser) -> dict:
+    """import_external_users 的实现；``ctx`` 为后台任务句柄（同步调用时为 None）。"""
+    from database import hash_password
 
     if not request.users:
         return {"created": 0, "updated": 0, "granted": 0,
                 "unmatched_warehouses": [], "skipped": [],
                 "message": "没有要导入的用户"}
-    if len(request.default_password) < 4:
-        raise HTTPException(status_code=400, detail="初始密码长度至少 4 位")
 
     def _tenant_of(item: "_ImportUserItem") -> int:
         """逐条确定目标租户。
@@ -721,8 +740,13 @@ async def import_external_users(
                 user_id=user_id, warehouse_id=wid))
         return len(set(ids))
 
+    if ctx is not None:
+        ctx.progress(0, len(request.users))
     with get_engine().begin() as sa_conn:
         for item in request.users:
+            if ctx is not None:
+                ctx.check_cancelled()
+                ctx.advance()
             tid = _tenant_of(item)
             ext_id = (item.external_user_id or "").strip()
             username = (item.username or "").strip()
@@ -841,6 +865,7 @@ async def import_external_users(
 @router.post("/api/erp/external/import/warehouses")
 async def import_external_warehouses(
     request: _ImportWarehousesRequest,
+    background: bool = False,
     current_user: CurrentUser = Depends(require_permission(Resource.WAREHOUSES, Action.ADMIN)),
 ):
     """把外部仓库导入为本地仓库行，**仅作权限锚点**。
@@ -848,16 +873,34 @@ async def import_external_warehouses(
     只在对方系统没有租户概念时才需要：那时仓库是唯一的作用域维度，
     而 user_warehouses 必须绑本地 warehouse_id。导入的行不承载任何库存数据，
     库存仍全部在对方。幂等：按 (tenant_id, external_warehouse_id) 增量同步。
+
+    ``background=true``：返回 202 + 后台任务，响应体在任务 ``result`` 里。
     """
     tid = _resolve_import_tenant(current_user, request.tenant_id)
+    if background:
+        return _jobs.submit_job_response(
+            "erp_import", _import_external_warehouses, request, tid, current_user,
+            tenant_id=tid, user=current_user,
+        )
+    return _import_external_warehouses(None, request, tid, current_user)
+
+
+def _import_external_warehouses(ctx, request: _ImportWarehousesRequest, tid: int,
+                                current_user: CurrentUser) -> dict:
+    """import_external_warehouses 的实现；``ctx`` 为后台任务句柄（同步调用时为 None）。"""
     if not request.warehouses:
         return {"created": 0, "updated": 0, "skipped": [], "message": "没有要导入的仓库"}
 
     created = updated = 0
     skipped: list[dict] = []
 
+    if ctx is not None:
+        ctx.progress(0, len(request.warehouses))
     with get_engine().begin() as sa_conn:
         for item in request.warehouses:
+            if ctx is not None:
+                ctx.check_cancelled()
+                ctx.advance()
             ext_id = (item.external_warehouse_id or "").strip()
             name = (item.name or "").strip()
             if not ext_id or not name:
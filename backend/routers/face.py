@@ -376,7 +376,9 @@ async def face_list_enrollments(
     tenant_id: Optional[int] = None,
     current_user: 'CurrentUser' = Depends(require_permission(Resource.FACE, Action.ADMIN)),
 ):
-    """List face enrollments. Big columns (embedding/source_image_b64) are stripped by default. — Phase 2f: SA Core read."""
+    """List face enrollments. Big columns (embedding, source photo refs) are stripped by default. — Phase 2f: SA Core read.
+
+    Source photos live in ``face_source_images``; this query never joins it."""
     tid = _face_resolve_tenant(current_user, tenant_id)
     preds = [_t_face_enrollments.c.tenant_id == tid]
     if subject_id is not None:
@@ -560,6 +562,8 @@ async def face_delete_enrollment(
         sa_conn.execute(
             delete(_t_face_enrollments).where(_t_face_enrollments.c.id == enrollment_id)
         )
+        from face.source_images import delete_orphan_source_images
+        delete_orphan_source_images(sa_conn, tid)
     return {"success": True}
 
 
@@ -576,6 +580,15 @@ async def face_test_connection(
         return {"success": False, "error": str(e)}
 
 
+@router.get("/api/face/local-infer/stats")
+async def face_local_infer_stats(
+    current_user: 'CurrentUser' = Depends(require_permission(Resource.FACE, Action.ADMIN)),
+):
+    """本机 WE2 推理执行器状态（进程级）：排队深度、在跑数、平均/最大耗时。"""
+    from face.endpoint_client import local_infer_stats
+    return local_infer_stats()
+
+
 @router.get("/api/face/logs")
 async def face_list_logs(
     user_id: Optional[int] = None,
@@ -967,4 +980,7 @@ async def face_delete_subject(
         sa_conn.execute(
             delete(_t_face_subjects).where(_t_face_subjects.c.id == subject_id)
         )
+        # 级联删掉的 enrollment 可能是某些注册照片的最后引用
+        from face.source_images import delete_orphan_source_images
+        delete_orphan_source_images(sa_conn, int(tid))
         return {"success": True}
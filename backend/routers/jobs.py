@@ -0,0 +1,92 @@
+"""Background job polling / cancellation routes (see ``backend/jobs.py``).
+
+Jobs are submitted by the owning endpoints (``?background=true`` on the DB
+import/export, Excel import confirm, face push and ERP import routes; the
+face re-embed is always a job). These routes only read, cancel and download.
+
+Visibility: a job belongs to the tenant it writes to. Tenant admins see all
+of their tenant's jobs, the global admin sees every job, and other roles
+only see the ones they submitted. A non-admin caller without a user (an API
+key not bound to a user) has submitted nothing and sees no jobs; otherwise
+system jobs (``created_by`` NULL) would match its NULL user id.
+"""
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
+
+import jobs
+from deps import Action, CurrentUser, Resource, require_permission
+
+router = APIRouter()
+
+
+def _visible(job: dict, current_user: CurrentUser) -> bool:
+    if current_user.tenant_id is not None and job["tenant_id"] != current_user.tenant_id:
+        return False
+    if current_user.role == "admin":
+        return True
+    return current_user.id is not None and job["created_by"] == current_user.id
+
+
+def _load_visible_job(job_id: str, current_user: CurrentUser) -> dict:
+    job = jobs.get_job(job_id)
+    if job is None or not _visible(job, current_user):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.get("/api/jobs")
+async def list_background_jobs(
+    job_type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.READ)),
+):
+    """按提交时间倒序列出当前用户可见的后台任务。"""
+    if current_user.role == "admin":
+        created_by = None
+    elif current_user.id is None:
+        return {"jobs": []}
+    else:
+        created_by = current_user.id
+    scope = {} if current_user.tenant_id is None else {"tenant_id": current_user.tenant_id}
+    return {"jobs": jobs.list_jobs(
+        job_type=job_type, status=status, created_by=created_by, limit=limit, **scope)}
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_background_job(
+    job_id: str,
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.READ)),
+):
+    """任务状态：status（pending/running/succeeded/failed/cancelled）、进度、结果 / 错误。"""
+    return _load_visible_job(job_id, current_user)
+
+
+@router.post("/api/jobs/{job_id}/cancel")
+async def cancel_background_job(
+    job_id: str,
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.WRITE)),
+):
+    """取消任务：排队中的立即取消，执行中的在下一个检查点停止并回滚。"""
+    _load_visible_job(job_id, current_user)
+    return jobs.cancel_job(job_id)
+
+
+@router.get("/api/jobs/{job_id}/download")
+async def download_background_job_artifact(
+    job_id: str,
+    current_user: CurrentUser = Depends(require_permission(Resource.SYSTEM, Action.READ)),
+):
+    """下载任务产出的文件（如后台导出的数据库备份）。"""
+    _load_visible_job(job_id, current_user)
+    artifact = jobs.get_artifact(job_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="任务没有可下载的文件（未完成或已过期）")
+    return FileResponse(
+        artifact["path"],
+        media_type=artifact["media_type"],
+        filename=artifact["filename"] or os.path.basename(artifact["path"]),
+    )
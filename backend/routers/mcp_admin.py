@@ -25,7 +25,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy import and_, delete, insert, or_, select, update
 from sqlalchemy.exc import IntegrityError
 
-from database import generate_api_key, hash_api_key
+from database import generate_api_key, get_deploy_mode, hash_api_key
+import jobs
 from db import get_engine
 from deps import (
     Action,
@@ -194,6 +195,47 @@ async def list_mcp_connections(
     return items
 
 
+@router.get("/api/mcp/restore-status")
+async def get_mcp_restore_status(
+    current_user: CurrentUser = Depends(require_permission(Resource.MCP, Action.ADMIN)),
+    mcp_manager = Depends(get_mcp_manager),
+):
+    """开机恢复 auto_start 连接的进度（排队 / 握手中 / 就绪 / 超时 / 失败）。
+
+    租户 admin 只看到本租户的连接。多 worker 部署下非归属 worker 看不到进度，
+    返回 ``available: false``。
+    """
+    progress = getattr(mcp_manager, 'restore_progress', None)
+    if progress is None:
+        return {"available": False, "running": False}
+    conn_ids = None
+    preds = list(build_scope_predicates(_t_mcp_connections, current_user.tenant_id, None))
+    if preds:
+        with get_engine().connect() as sa_conn:
+            conn_ids = sa_conn.execute(
+                select(_t_mcp_connections.c.id).where(and_(*preds))
+            ).scalars().all()
+    return {"available": True, **progress.snapshot(conn_ids)}
+
+
+@router.get("/api/mcp/tool-stats")
+async def get_mcp_tool_stats(
+    current_user: CurrentUser = Depends(require_permission(Resource.MCP, Action.ADMIN)),
+    mcp_manager = Depends(get_mcp_manager),
+):
+    """MCP 工具线程池：按工具名的排队等待 / 执行耗时，及当前执行中、排队数。
+
+    统计跨租户，多租户模式下仅全局 admin 可看。子进程模式下各连接自有线程池，
+    返回 ``available: false``。
+    """
+    if get_deploy_mode() == "multi_tenant" and current_user.tenant_id is not None:
+        raise HTTPException(status_code=403, detail="仅全局 admin 可查看工具调用统计")
+    stats = mcp_manager.tool_stats()
+    if stats is None:
+        return {"available": False}
+    return {"available": True, **stats}
+
+
 @router.post("/api/mcp/connections", response_model=MCPConnectionResponse)
 async def create_mcp_connection(
     request: CreateMCPConnectionRequest,
@@ -658,7 +700,7 @@ async def toggle_mcp_debug(
         )
 
     # 如果进程正在运行，重启以应用新设置
-    if conn_id in mcp_manager.connections and mcp_manager.connections[conn_id].status == 'running':
+    if mcp_manager.get_connection_status(conn_id).get('status') == 'running':
         success = await mcp_manager.toggle_debug(conn_id, row['mcp_endpoint'], row['api_key'], enable)
     else:
         success = True
@@ -1183,10 +1225,14 @@ def _ensure_tenant_auth_token(tid: int, current: "str | None") -> str:
     return token
 
 
+jobs.register_job_type("face_push", limit=4)
+
+
 @router.post("/api/mcp/connections/{conn_id}/devices/{dev_id}/push-faces")
 async def push_faces_to_device(
     conn_id: str,
     dev_id: int,
+    background: bool = False,
     current_user: CurrentUser = Depends(require_permission(Resource.MCP, Action.ADMIN)),
 ):
     """把本租户人脸库（按固定模型标签过滤）下发到该物理设备。
@@ -1194,6 +1240,9 @@ async def push_faces_to_device(
     配置类错误（缺 IP）返回 4xx；人脸库超过设备上限返回 success:false；设备侧网络错误
     （不可达 / 超时 / 4xx-5xx）以 ``{"success": false, "error": ...}`` 返回
     200，让前端能展示失败原因而不是静默成功。
+
+    ``background=true``：校验设备后返回 202 + 后台任务（下发前的懒重算可能要
+    几十秒），上面的响应体在任务 ``result`` 里；同一设备同时只下发一次（409）。
     """
     conn_row = _assert_conn_in_tenant(conn_id, current_user)
     dev = dict(_load_device_or_404(conn_id, dev_id)._mapping)
@@ -1201,13 +1250,23 @@ async def push_faces_to_device(
     # face_enabled gate 已移除：任何有 IP 的设备都可手动下发。
     # 重新过一遍 IP 校验（SSRF 防线）：存量数据可能早于写入时校验。
     ip, _ = _validate_device_fields(dev.get("ip"), None)
+    tid = conn_row.tenant_id if hasattr(conn_row, "tenant_id") else dict(conn_row._mapping).get("tenant_id")
+    if background:
+        return jobs.submit_job_response(
+            "face_push", _push_faces, tid, dev, ip,
+            tenant_id=tid, user=current_user, dedupe_key=f"device:{dev['id']}",
+        )
+    return await _push_faces(None, tid, dev, ip)
+
+
+async def _push_faces(ctx, tid: int, dev: dict, ip: str) -> dict:
+    """push_faces_to_device 的实现；``ctx`` 为后台任务句柄（同步调用时为 None）。"""
     port = DEVICE_HTTP_PORT  # 固件写死 80，不读 device.port
     # 固定模型标签：全设备同模型，不读 mcp_agent_devices.model_tag。
     model_tag = DEVICE_FACE_MODEL_TAG
 
     # 取本租户人脸库并按固定 model_tag 过滤（复用 face 路由的 library 逻辑）。
     from routers.face import build_face_library
-    tid = conn_row.tenant_id if hasattr(conn_row, "tenant_id") else dict(conn_row._mapping).get("tenant_id")
 
     # 下发前置懒重算（反方向）：lan 模式注册的 subject 只有远端模型（如 Hailo
     # 512D）的 enrollment + 注册照片，切回本机模式下发时设备需要 WE2 128D
@@ -1219,11 +1278,15 @@ async def push_faces_to_device(
     from face import endpoint_client as _face_ec
 
     async def _local_infer(image_b64):
-        return _face_ec._infer_local(image_b64)
+        return await _face_ec.infer_local(image_b64)
 
     try:
         with get_db() as _lazy_conn:
-            await ensure_enrollments_for_model(_lazy_conn, tid, model_tag, _local_infer)
+            await ensure_enrollments_for_model(
+                _lazy_conn, tid, model_tag, _local_infer,
+                concurrency=_face_ec.LOCAL_INFER_WORKERS,
+                progress=ctx.progress if ctx is not None else None,
+            )
     except Exception:
         import logging
         logging.getLogger("warehouse.face").exception(
@@ -0,0 +1,171 @@
+"""慢查询日志：按语句指纹聚合 SQL 耗时，滚动保留总耗时 Top-N。
+
+app.py 里的 SQLAlchemy Core 查询大多是动态拼出来的，多秒请求时很难看出是哪条
+语句慢。``SLOW_QUERY_LOG=true`` 时 ``install()`` 往 metrics.py 的 SQL 钩子上挂一个
+观察者（SQLAlchemy 引擎 + raw sqlite3 连接都覆盖）：
+
+* 每条语句先做**指纹**：字符串 / 数字字面量、各种占位符（``?`` / ``%s`` /
+  ``%(name)s`` / ``:name``）统一成 ``?``，``IN (?, ?, …)`` 与多行 ``VALUES`` 折叠，
+  空白归一——同一形状、不同参数的语句落到同一行；参数本身从不记录。
+* 按指纹累计次数、总耗时、最大耗时、行数（驱动报告的值，SQLite 的 SELECT 不可知），
+  以及最近一次慢执行的路由与租户。总耗时排序即"最值得优化的语句"——单次不慢、
+  但调用极多的语句也会浮上来。
+* 超过 ``SLOW_QUERY_MS`` 的执行打 warning 日志；``SLOW_QUERY_EXPLAIN=true`` 时
+  对 SELECT 抓一次执行计划（SQLite ``EXPLAIN QUERY PLAN`` / MySQL ``EXPLAIN``），
+  每个指纹只抓一次。
+* 指纹表有上限（``_MAX_FINGERPRINTS``），满了淘汰总耗时最小的一批；
+  ``reset()``（``POST /api/system/slow-queries/reset``）清零重新开始一个窗口。
+
+统计按进程；多 worker 部署时管理端点只看到处理该请求的 worker。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import metrics
+
+logger = logging.getLogger("warehouse.slow_query")
+
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "false").lower() == "true"
+# 慢查询阈值（毫秒）：超过的执行打日志、计入 slow_count
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+# 管理端点默认返回的条数
+SLOW_QUERY_TOP_N = int(os.environ.get("SLOW_QUERY_TOP_N", "50"))
+# 对慢 SELECT 抓一次执行计划
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+
+_MAX_FINGERPRINTS = 2000
+_MAX_PLAN_ROWS = 50
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):\w+|\?")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_ROW = r"\(\s*\?(?:\s*,\s*\?)*\s*\)"
+_VALUES_ROWS = re.compile(rf"({_ROW})(?:\s*,\s*{_ROW})+")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """参数无关的语句形状：``SELECT * FROM t WHERE id = 3`` → ``SELECT * FROM t WHERE id = ?``。"""
+    fp = _STRING.sub("?", statement)
+    fp = _PLACEHOLDER.sub("?", fp)
+    fp = _NUMBER.sub("?", fp)
+    fp = _SPACE.sub(" ", fp).strip()
+    fp = _IN_LIST.sub("IN (?+)", fp)
+    return _VALUES_ROWS.sub(r"\1, ...", fp)
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "count", "slow_count", "total_ms", "max_ms", "rows",
+                 "last_route", "last_tenant_id", "last_slow_at", "plan")
+
+    def __init__(self, fp: str):
+        self.fingerprint = fp
+        self.count = 0
+        self.slow_count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.last_route: Optional[str] = None
+        self.last_tenant_id: Optional[int] = None
+        self.last_slow_at: Optional[float] = None
+        self.plan: Optional[List[str]] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "slow_count": self.slow_count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "last_route": self.last_route,
+            "last_tenant_id": self.last_tenant_id,
+            "last_slow_at": self.last_slow_at,
+            "plan": self.plan,
+        }
+
+
+_lock = threading.Lock()
+_entries: Dict[str, _Entry] = {}
+
+
+def _evict_locked() -> None:
+    # 淘汰总耗时最小的 1/10，避免每条新指纹都排序一次
+    drop = sorted(_entries.values(), key=lambda e: e.total_ms)[:max(1, _MAX_FINGERPRINTS // 10)]
+    for e in drop:
+        del _entries[e.fingerprint]
+
+
+def _format_plan(rows: list) -> List[str]:
+    return [" | ".join("" if v is None else str(v) for v in row) for row in rows[:_MAX_PLAN_ROWS]]
+
+
+def observe(statement: str, elapsed: float, rowcount: int,
+            stats: Optional[metrics.RequestStats],
+            explain: Optional[Callable[[], list]] = None) -> None:
+    """metrics.py 的 SQL 观察者：每条语句执行后调用。"""
+    fp = fingerprint(statement)
+    ms = elapsed * 1000
+    slow = ms >= SLOW_QUERY_MS
+    need_plan = False
+    with _lock:
+        entry = _entries.get(fp)
+        if entry is None:
+            if len(_entries) >= _MAX_FINGERPRINTS:
+                _evict_locked()
+            entry = _entries[fp] = _Entry(fp)
+        entry.count += 1
+        entry.total_ms += ms
+        entry.max_ms = max(entry.max_ms, ms)
+        if rowcount > 0:
+            entry.rows += rowcount
+        if slow:
+            entry.slow_count += 1
+            entry.last_slow_at = time.time()
+            if stats is not None:
+                entry.last_route = stats.route
+                entry.last_tenant_id = stats.tenant_id
+            if SLOW_QUERY_EXPLAIN and explain is not None and entry.plan is None:
+                entry.plan = []  # 占位：并发的同指纹慢查询不重复 EXPLAIN
+                need_plan = True
+    if not slow:
+        return
+    route = stats.route if stats is not None else None
+    tenant_id = stats.tenant_id if stats is not None else None
+    logger.warning("slow query %.1fms rows=%s route=%s tenant=%s: %s",
+                   ms, rowcount, route, tenant_id, fp)
+    if need_plan:
+        try:
+            plan = _format_plan(explain())
+        except Exception as exc:  # noqa: BLE001
+            plan = [f"EXPLAIN failed: {exc}"]
+        with _lock:
+            entry.plan = plan
+
+
+def top(n: Optional[int] = None) -> List[dict]:
+    """按总耗时降序的前 n 个指纹。"""
+    with _lock:
+        entries = sorted(_entries.values(), key=lambda e: e.total_ms, reverse=True)
+        return [e.to_dict() for e in entries[:n or SLOW_QUERY_TOP_N]]
+
+
+def reset() -> None:
+    with _lock:
+        _entries.clear()
+
+
+def install() -> None:
+    """``SLOW_QUERY_LOG`` 开启时登记观察者（须在 ``metrics.install(app)`` 之前调用）。"""
+    if SLOW_QUERY_LOG:
+        metrics.add_sql_observer(observe)
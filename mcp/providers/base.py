@@ -71,7 +71,11 @@ class BaseProvider(ABC):
     # ── 通用 HTTP ──
 
     def http_get(self, endpoint: str, params: dict = None) -> dict:
-        """GET 请求，自动拼接 base_url、注入 auth headers、处理错误。"""
+        """GET 请求，自动拼接 base_url、注入 auth headers、处理错误。
+
+        收到了响应的错误带 ``status_code``，调用方可据此区分「端点不存在」与其它失败。
+        """
+        response = None
         try:
             headers = self.get_auth_headers()
             response = requests.get(
@@ -86,6 +90,7 @@ class BaseProvider(ABC):
                     "success": False,
                     "error": data.get("detail", str(data)),
                     "message": f"API 返回错误 ({response.status_code})",
+                    "status_code": response.status_code,
                 }
             return data
         except requests.exceptions.ConnectionError:
@@ -95,11 +100,14 @@ class BaseProvider(ABC):
                 "message": f"请确保后端服务已启动: {self.base_url}",
             }
         except Exception as e:
-            return {
+            err = {
                 "success": False,
                 "error": str(e),
                 "message": f"API 请求失败: {e}",
             }
+            if response is not None:  # 响应体不是 JSON
+                err["status_code"] = response.status_code
+            return err
 
     def http_post(self, endpoint: str, data: dict = None) -> dict:
         """POST 请求，自动拼接 base_url、注入 auth headers、处理错误。"""
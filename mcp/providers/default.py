@@ -140,6 +140,73 @@ class DefaultProvider(BaseProvider):
     def resolve_name(self, text, entity_type="all"):
         return self.http_get("/fuzzy-match", params={"q": text, "entity_type": entity_type})
 
+    def _stock_lookup(self, product_name):
+        """一次往返取齐 query_stock 要的数据（后端 /materials/stock-lookup）。
+
+        对端没有该端点（旧版后端）时回落到逐个调原端点、拼出同样的结构。超时、
+        连不上、5xx、401/403 不回落 —— 原样返回错误，不让已经吃力的后端再多挨
+        三个请求、语音用户多等三倍超时。
+        """
+        bundle = self.http_get("/materials/stock-lookup", params={"q": product_name})
+        if not isinstance(bundle, dict):
+            return self._stock_lookup_legacy(product_name)
+        if "error" not in bundle:
+            return bundle
+        # 200 却不是 JSON：all-in-one 部署里旧版后端的 SPA 兜底路由返回了 index.html
+        if bundle.get("status_code") in (404, 405, 200):
+            return self._stock_lookup_legacy(product_name)
+        return bundle
+
+    def _stock_lookup_legacy(self, product_name):
+        """逐个调用 product-stats / fuzzy-match / batches，判定规则与后端
+        ``stock_lookup`` 一致。"""
+        out = {"match": {}, "ambiguous": False, "stats": None, "stats_error": None,
+               "resolved_from": None, "resolved_name": None, "resolved_variant": None,
+               "material_id": None, "batches": None}
+        data = self.http_get("/materials/product-stats", params={"name": product_name})
+        # 精确命中也要模糊匹配一次：精确查询只返回第一条，需检查是否同名多条
+        match = self.http_get(
+            "/fuzzy-match", params={"q": product_name, "entity_type": "material"}
+        )
+        out["match"] = match
+        if "error" not in data:
+            exact_same = [c for c in match.get("candidates", []) if c.get("name") == product_name]
+            if not match.get("confident") and len(exact_same) > 1:
+                out["ambiguous"] = True
+                return out
+            batch_params = {"name": data["name"]}
+        elif match.get("confident") and match.get("best_match"):
+            best = match["best_match"]
+            extra = best.get("extra", {})
+            resolved_variant = extra.get("variant")
+            resolved_name = extra.get("canonical_name")
+            # name+variant 组合匹配时，用原始物料名查询
+            if not resolved_name and resolved_variant:
+                resolved_name = best["name"].replace(f" {resolved_variant}", "").strip()
+            elif not resolved_name:
+                resolved_name = best["name"]
+            out.update(resolved_from=product_name, resolved_name=resolved_name,
+                       resolved_variant=resolved_variant)
+            # entity_id 可直接精确定位物料，避免同名多行时按 name 回查盲取错料
+            material_id = best.get("entity_id")
+            if material_id:
+                out["material_id"] = material_id
+                stats_params = batch_params = {"material_id": material_id}
+            else:
+                stats_params = batch_params = {"name": resolved_name}
+            data = self.http_get("/materials/product-stats", params=stats_params)
+            if "error" in data:
+                out["stats_error"] = data["error"]
+                return out
+        else:
+            return out
+
+        out["stats"] = data
+        batches = self.http_get("/materials/batches", params=batch_params)
+        if isinstance(batches, dict) and "error" not in batches:
+            out["batches"] = batches
+        return out
+
     def query_stock(self, product_name, show_batches=False, _routing_fallback=False):
         def _batch_fallback(original_resp):
             if _routing_fallback or not _BATCH_NO_RE.fullmatch(str(product_name or "").strip()):
@@ -149,9 +216,11 @@ class DefaultProvider(BaseProvider):
                 return batch_resp
             return original_resp
 
-        # 先尝试精确查询，同时做多义检测
-        resolved_material_id = None
-        data = self.http_get("/materials/product-stats", params={"name": product_name})
+        # 精确查询 + 多义检测 + 模糊解析 + 统计 + 批次，一次往返
+        bundle = self._stock_lookup(product_name)
+        if "error" in bundle:
+            return bundle
+        resolve_result = bundle.get("match") or {}
 
         def _spec_of(c):
             """候选的规格描述：单值 variant 优先，其次 variants 列表用 / 连接。"""
@@ -165,96 +234,62 @@ class DefaultProvider(BaseProvider):
             sku = (c.get("extra") or {}).get("sku", "")
             return f"{c['name']}（SKU: {sku}）" if sku else c["name"]
 
-        # 精确查询成功时，仍需检查是否存在同名多条（精确匹配只返回第一条）
-        if "error" not in data:
-            resolve_result = self.http_get(
-                "/fuzzy-match", params={"q": product_name, "entity_type": "material"}
-            )
+        # 精确查询成功但存在同名多条（精确匹配只返回第一条）→ 需要用户澄清
+        if bundle.get("ambiguous"):
             candidates = resolve_result.get("candidates", [])
-            # 同名多条：所有候选都与查询词完全一致 → 需要用户澄清
             exact_same = [c for c in candidates if c.get("name") == product_name]
-            if not resolve_result.get("confident") and len(exact_same) > 1:
-                items = "、".join(_fmt(c) for c in exact_same[:6])
-                return {
-                    "success": False,
-                    "error": f"找到 {len(exact_same)} 个同名产品",
-                    "candidates": exact_same[:6],
-                    "message": (
-                        f"'{product_name}' 在系统中有 {len(exact_same)} 个同名产品：{items}。"
-                        "请告知需要查询哪个（可指定规格或 SKU）"
-                    ),
-                }
+            items = "、".join(_fmt(c) for c in exact_same[:6])
+            return {
+                "success": False,
+                "error": f"找到 {len(exact_same)} 个同名产品",
+                "candidates": exact_same[:6],
+                "message": (
+                    f"'{product_name}' 在系统中有 {len(exact_same)} 个同名产品：{items}。"
+                    "请告知需要查询哪个（可指定规格或 SKU）"
+                ),
+            }
 
-        # 精确查询失败时，自动走模糊匹配
-        if "error" in data:
-            resolve_result = self.http_get(
-                "/fuzzy-match", params={"q": product_name, "entity_type": "material"}
-            )
-
-            if resolve_result.get("confident") and resolve_result.get("best_match"):
-                best = resolve_result["best_match"]
-                extra = best.get("extra", {})
-                resolved_variant = extra.get("variant")
-                resolved_name = extra.get("canonical_name")
-                # name+variant 组合匹配时，用原始物料名查询
-                if not resolved_name and resolved_variant:
-                    resolved_name = best["name"].replace(f" {resolved_variant}", "").strip()
-                elif not resolved_name:
-                    resolved_name = best["name"]
-                # entity_id 可直接精确定位物料，避免同名多行时按 name 回查盲取错料
-                resolved_material_id = best.get("entity_id")
-                if resolved_material_id:
-                    stats_params = {"material_id": resolved_material_id}
-                else:
-                    stats_params = {"name": resolved_name}
-                data = self.http_get("/materials/product-stats", params=stats_params)
-                if "error" in data:
-                    return _batch_fallback({
-                        "success": False,
-                        "error": data["error"],
-                        "message": f"产品 '{resolved_name}' 查询失败",
-                    })
-                # 标记名称经过了模糊解析
-                data["resolved_from"] = product_name
-                if resolved_variant:
-                    data["resolved_variant"] = resolved_variant
-            else:
-                # 模糊匹配也无法确定，返回候选列表（带 SKU 方便区分同名项）
-                candidates = resolve_result.get("candidates", [])
-                if candidates:
-                    def _fmt_candidate(c):
-                        spec = _spec_of(c)
-                        score = c["score"]
-                        if spec:
-                            return f"{c['name']}（{spec}，{score}分）"
-                        sku = c.get("extra", {}).get("sku", "")
-                        return f"{c['name']}（SKU: {sku}，{score}分）" if sku else f"{c['name']}（{score}分）"
-                    ranked = [_fmt_candidate(c) for c in candidates[:5]]
-                    return {
-                        "success": False,
-                        "error": f"名称 '{product_name}' 不够明确",
-                        "candidates": candidates[:5],
-                        "message": f"找到以下候选产品：{', '.join(ranked)}。请告知是哪个（可指定规格或 SKU）",
-                    }
+        data = bundle.get("stats")
+        if data is None:
+            resolved_name = bundle.get("resolved_name")
+            if resolved_name:
+                # 模糊解析出了物料，但回查统计失败
                 return _batch_fallback({
                     "success": False,
-                    "error": f"未找到与 '{product_name}' 匹配的产品",
-                    "message": f"系统中没有与 '{product_name}' 相似的产品",
+                    "error": bundle.get("stats_error"),
+                    "message": f"产品 '{resolved_name}' 查询失败",
                 })
-
+            # 模糊匹配也无法确定，返回候选列表（带 SKU 方便区分同名项）
+            candidates = resolve_result.get("candidates", [])
+            if candidates:
+                def _fmt_candidate(c):
+                    spec = _spec_of(c)
+                    score = c["score"]
+                    if spec:
+                        return f"{c['name']}（{spec}，{score}分）"
+                    sku = c.get("extra", {}).get("sku", "")
+                    return f"{c['name']}（SKU: {sku}，{score}分）" if sku else f"{c['name']}（{score}分）"
+                ranked = [_fmt_candidate(c) for c in candidates[:5]]
+                return {
+                    "success": False,
+                    "error": f"名称 '{product_name}' 不够明确",
+                    "candidates": candidates[:5],
+                    "message": f"找到以下候选产品：{', '.join(ranked)}。请告知是哪个（可指定规格或 SKU）",
+                }
+            return _batch_fallback({
+                "success": False,
+                "error": f"未找到与 '{product_name}' 匹配的产品",
+                "message": f"系统中没有与 '{product_name}' 相似的产品",
+            })
+
+        data = dict(data)
+        if bundle.get("resolved_from"):
+            # 标记名称经过了模糊解析
+            data["resolved_from"] = bundle["resolved_from"]
         unit = data["unit"]
         quantity = data["current_stock"]
-        resolved_variant = data.pop("resolved_variant", None)
-
-        # 始终获取批次明细（用于多位置/多变体展示）
-        if resolved_material_id:
-            batch_params = {"material_id": resolved_material_id}
-        else:
-            batch_params = {"name": data["name"]}
-        batches_data = self.http_get("/materials/batches", params=batch_params)
-        batches_list = []
-        if isinstance(batches_data, dict) and "error" not in batches_data:
-            batches_list = batches_data.get("batches", [])
+        resolved_variant = bundle.get("resolved_variant")
+        batches_list = (bundle.get("batches") or {}).get("batches", [])
 
         # 按 variant 过滤批次并重算库存
         # variant_filtered 记录「过滤是否真的发生」：批次接口报错或该料无批次时
@@ -26,6 +26,8 @@ Provider 只需要回答两个问题：**去哪拉数据**、**哪个字段是
 用例抓到。
 """
 
+import bisect
+import contextvars
 import hashlib
 import logging
 import re
@@ -33,10 +35,12 @@ import threading
 import time
 from collections import OrderedDict
 
+import numpy as np
 from pypinyin import Style, lazy_pinyin
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 
 from .normalize import cn_digits_to_arabic
+from .shared_cache import get_shared_store
 
 logger = logging.getLogger("WarehouseMCP")
 
@@ -148,14 +152,28 @@ _DEFAULT_CACHE_TTL = 60.0
 # 一轮对话里 5 次工具调用就是 5 次全量拉取，对方 ERP 会被打爆。
 _REFRESH_DEBOUNCE = 5.0
 
+# 预刷新点（CACHE_TTL 的比例）。缓存年龄过了这个点的命中照常返回缓存，同时
+# 在后台线程里提前刷新 —— 对话持续进行时缓存永远不会真正过期，语音用户不用
+# 在工具调用里干等一次慢 ERP 的全量拉取。0 表示关闭，只在到期时同步刷新。
+_DEFAULT_REFRESH_AHEAD = 0.8
+
+# 支持增量拉取（``_fetch_items_since``）的 Provider 也要隔一段时间做一次全量：
+# 增量接口漏报的删除、改编码这类变更只有全量能纠正。
+_DEFAULT_FULL_REFRESH_INTERVAL = 600.0
+
 
 class _CacheEntry:
-    __slots__ = ("items", "indexed", "fetched_at", "last_refresh_attempt")
+    __slots__ = ("items", "indexed", "fetched_at", "last_refresh_attempt",
+                 "synced_at", "full_at")
 
     def __init__(self, items, indexed, fetched_at):
         self.items = items
         self.indexed = indexed
         self.fetched_at = fetched_at
+        # 增量拉取的起点：上次成功同步**开始**时的墙钟时间（对方 ERP 的
+        # 更新时间戳是墙钟，monotonic 对不上）；全量时间点决定何时必须全量。
+        self.synced_at = None
+        self.full_at = fetched_at
         # 初始值要让「首次强制刷新」立刻可用。若设成 fetched_at，刚建好缓存
         # 的 _REFRESH_DEBOUNCE 秒内就不许强制刷新 —— 而「用户新增物料后立刻
         # 查询」恰好落在这个窗口里，正是最需要刷新的时刻。
@@ -196,42 +214,76 @@ class _ItemCache:
 
     def __init__(self):
         self._data: dict = {}
+        self._refreshing: set = set()
+        self._refresh_started: dict = {}
         self._lock = threading.RLock()
 
     def get(self, key):
         with self._lock:
             return self._data.get(key)
 
-    def put(self, key, items, indexed, now, refreshed=False):
+    def put(self, key, items, indexed, now, refreshed=False, synced_at=None, full=True):
         """写入缓存。
 
         ``refreshed=True`` 表示这次是「未命中触发的强制刷新」，要把防抖
         时间戳设成现在 —— 否则新建的 _CacheEntry 会把刚打上的标记冲掉，
         防抖形同虚设（实测连问 5 个不存在的词会拉 5 次全量）。
         普通的 TTL 到期刷新不占用防抖额度。
+
+        ``full=False`` 表示这次是增量合并，沿用上一条的全量时间点。
         """
         with self._lock:
             old = self._data.get(key)
             e = _CacheEntry(items, indexed, now)
+            e.synced_at = synced_at
             if refreshed:
                 e.last_refresh_attempt = now
             elif old is not None:
                 e.last_refresh_attempt = old.last_refresh_attempt
+            if not full and old is not None:
+                e.full_at = old.full_at
             self._data[key] = e
             return e
 
+    def claim_refresh(self, key, now) -> bool:
+        """登记一次后台预刷新。同 key 已有一个在跑、或距上次发起不到
+        ``_REFRESH_DEBOUNCE`` 时返回 False —— 对方接口持续失败时缓存一直
+        停在预刷新区间里，不防抖就是每次命中都去打一次。"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            if now - self._refresh_started.get(key, now - _REFRESH_DEBOUNCE) < _REFRESH_DEBOUNCE:
+                return False
+            self._refreshing.add(key)
+            self._refresh_started[key] = now
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
     def invalidate(self, key=None):
         with self._lock:
             if key is None:
                 self._data.clear()
+                self._refresh_started.clear()
             else:
                 self._data.pop(key, None)
+                self._refresh_started.pop(key, None)
 
 
 
 _item_cache = _ItemCache()
 
 
+def _fingerprint(raw: dict, field_map: dict) -> tuple:
+    """记录里参与匹配的字段值 —— ``_Indexed`` 的预计算只取决于它。
+
+    归一化和分词对假值（None / "" / 0）都给空串，这里同样折叠成空串。
+    """
+    return tuple(str(raw.get(key)) if raw.get(key) else "" for key in field_map.values() if key)
+
+
 class _Indexed:
     """一条记录的预计算结果。
 
@@ -239,10 +291,11 @@ class _Indexed:
     重算快 3.5 倍（10000 条：300ms → 85ms）。
     """
 
-    __slots__ = ("raw", "fields")
+    __slots__ = ("raw", "fields", "fp")
 
     def __init__(self, raw: dict, field_map: dict):
         self.raw = raw
+        self.fp = _fingerprint(raw, field_map)
         self.fields = {}
         for role, key in field_map.items():
             if not key:
@@ -251,6 +304,148 @@ class _Indexed:
             n = norm_for_match(v)
             self.fields[role] = (n, tokenize_for_match(v), _pinyin(n))
 
+    @classmethod
+    def _restore(cls, raw: dict, fields: dict, field_map: dict) -> "_Indexed":
+        """从共享快照恢复（JSON 里的三元组是 list，换回 tuple）。"""
+        e = cls.__new__(cls)
+        e.raw, e.fp = raw, _fingerprint(raw, field_map)
+        e.fields = {role: tuple(v) for role, v in fields.items()}
+        return e
+
+    @classmethod
+    def _reuse(cls, raw: dict, prev: "_Indexed") -> "_Indexed":
+        """匹配字段没变、只是库存等其它字段变了：换上新记录，预计算照搬。"""
+        e = cls.__new__(cls)
+        e.raw, e.fields, e.fp = raw, prev.fields, prev.fp
+        return e
+
+
+def _index_items(items: list, field_map: dict, previous=()) -> tuple:
+    """给一轮拉取结果建索引，返回 ``(indexed, rebuilt)``。
+
+    按指纹复用上一轮的 ``_Indexed``：原样没变的记录直接复用对象，只有库存
+    之类非匹配字段变了的换上新记录、复用预计算；只有匹配字段变了或新增的
+    记录才重新归一化 / 分词 / 算拼音。ERP 全量里绝大多数记录两次拉取间不
+    变，刷新的 CPU 成本从「全部重建」降到「只算变了的」。
+    """
+    reusable = {e.fp: e for e in previous}
+    out = []
+    rebuilt = 0
+    for raw in items:
+        prev = reusable.get(_fingerprint(raw, field_map))
+        if prev is None:
+            out.append(_Indexed(raw, field_map))
+            rebuilt += 1
+        elif prev.raw is raw or prev.raw == raw:
+            out.append(prev)
+        else:
+            out.append(_Indexed._reuse(raw, prev))
+    out = _IndexedList(out)
+    out.columns()         # 在取数路径（常在后台预刷新线程）建好，不让首个查询等
+    return out, rebuilt
+
+
+class _IndexedList(list):
+    """缓存里的 ``_Indexed`` 列表，顺带挂着列式索引（``_index_items`` 时建好，
+    其它途径构造的按需建）。
+
+    列式索引跟着列表走：缓存条目换新（刷新 / 增量 / 采用快照）就是换了一个
+    列表，旧列式索引随旧列表一起释放，不会和记录错位。
+    """
+
+    __slots__ = ("_columns",)
+
+    def columns(self) -> "_Columns":
+        cols = getattr(self, "_columns", None)
+        if cols is None:
+            # 并发首次打分可能各建一份，结果相同，后写的覆盖即可
+            cols = self._columns = _Columns(self)
+        return cols
+
+
+class _RoleColumn:
+    """一个角色（name/code/spec）在全部记录上的 归一化 / 分词 / 拼音 列。"""
+
+    __slots__ = ("norms", "tokens", "pinyins", "lengths", "present", "has_tokens",
+                 "by_norm", "joined", "starts")
+
+    def __init__(self, fields: list):
+        self.norms = [f[0] for f in fields]
+        self.tokens = [f[1] for f in fields]
+        self.pinyins = [f[2] for f in fields]
+        self.lengths = np.fromiter((len(n) for n in self.norms), np.int64, len(fields))
+        self.present = self.lengths > 0
+        self.has_tokens = np.fromiter((bool(t) for t in self.tokens), bool, len(fields))
+        # 精确相等与「字段是查询词的子串」都按值查表
+        self.by_norm: dict = {}
+        for i, n in enumerate(self.norms):
+            if n:
+                self.by_norm.setdefault(n, []).append(i)
+        # 「查询词是字段的子串」：在 \0 连起来的大串里 find，按起点二分回行号
+        self.joined = "\0".join(self.norms)
+        starts, pos = [], 0
+        for n in self.norms:
+            starts.append(pos)
+            pos += len(n) + 1
+        self.starts = starts
+
+    def containing(self, q: str) -> set:
+        """``q in norm`` 的行号。"""
+        rows = set()
+        pos = self.joined.find(q)
+        while pos >= 0:
+            row = bisect.bisect_right(self.starts, pos) - 1
+            rows.add(row)
+            nxt = row + 1
+            if nxt >= len(self.starts):
+                break
+            pos = self.joined.find(q, self.starts[nxt])
+        return rows
+
+    def contained_in(self, q: str) -> set:
+        """``norm in q`` 的行号（枚举查询词的子串查表，查询词很短）。"""
+        rows = set()
+        for i in range(len(q)):
+            for j in range(i + 1, len(q) + 1):
+                rows.update(self.by_norm.get(q[i:j], ()))
+        return rows
+
+
+class _Columns:
+    """``_Indexed`` 列表的列式视图，供 ``_rank`` 整列打分。
+
+    逐条调 ``_score_indexed`` 时每条记录每个角色要 5~6 次 rapidfuzz 调用，
+    全是 Python 层开销；按列喂给 ``process.cdist`` 一次算完整列，循环在
+    C++ 里跑、可多线程（``workers=-1``）。
+    """
+
+    __slots__ = ("raws", "roles", "concat")
+
+    def __init__(self, indexed: list):
+        self.raws = [e.raw for e in indexed]
+        self.roles = {}
+        for role in ("name", "code", "spec"):
+            if any(role in e.fields for e in indexed):
+                self.roles[role] = _RoleColumn(
+                    [e.fields.get(role, ("", "", "")) for e in indexed])
+        # 「名称+规格」连读两种顺序
+        self.concat: dict = {}
+        for i, e in enumerate(indexed):
+            name = e.fields.get("name", ("",))[0]
+            spec = e.fields.get("spec", ("",))[0]
+            if name and spec:
+                self.concat.setdefault(name + spec, []).append(i)
+                self.concat.setdefault(spec + name, []).append(i)
+
+    def __len__(self):
+        return len(self.raws)
+
+
+def _cdist(query: str, choices: list, scorer):
+    """单个查询对整列打分。float64 与逐条调用 ``scorer`` 的结果逐位相同。"""
+    return process.cdist([query], choices, scorer=scorer, dtype=np.float64,
+                         workers=-1)[0]
+
 
 class _Query:
     """一次查询的预计算结果，避免对每条记录重复算归一化和拼音。"""
@@ -274,6 +469,7 @@ class LocalMatchMixin:
 
     子类可选覆盖：
 
+    * ``_fetch_items_since(since)``：增量拉取，刷新时只取变化的记录
     * ``_as_candidate(score, item)``：候选项的对外结构，默认按 fields 映射
     * ``_not_found(query)`` / ``_ambiguous(query, candidates)``：错误响应文案
 
@@ -404,6 +600,58 @@ class LocalMatchMixin:
 
         return min(best, 1.0)
 
+    def _score_columns(self, q: "_Query", cols: "_Columns"):
+        """``_score_indexed`` 的整列版本，返回与 ``cols.raws`` 对齐的分数数组。
+
+        每一步与逐条公式一一对应（rapidfuzz 分数取 float64，运算顺序不变，
+        结果逐位相同，见 test_provider_matching 的一致性用例）：
+
+        * 精确相等 / 名称+规格连读：查表，命中行最后置 1.0；
+        * 子串包含：按值查表 + 大串 find 找出行，只对这些行算长度比例分；
+        * 文本分 / token_set / 拼音：整列 ``cdist``，拼音只算过门槛的行。
+        """
+        n = len(cols)
+        best = np.zeros(n)
+        if not q.norm or not n:
+            return best
+
+        exact = set(cols.concat.get(q.norm, ()))
+        for role in ("name", "code", "spec"):
+            c = cols.roles.get(role)
+            if c is None:
+                continue
+            exact.update(c.by_norm.get(q.norm, ()))
+            weight = self.MATCH.weights.get(role, 1.0)
+
+            rows = c.containing(q.norm) | c.contained_in(q.norm)
+            if rows:
+                rows = np.fromiter(rows, np.int64, len(rows))
+                rows = rows[c.present[rows]]
+                lq, lf = len(q.norm), c.lengths[rows]
+                ratio = np.minimum(lq, lf) / np.maximum(lq, lf)
+                best[rows] = np.maximum(best[rows], weight * (0.72 + 0.28 * ratio))
+
+            text = (_cdist(q.norm, c.norms, fuzz.ratio) * 0.4
+                    + _cdist(q.norm, c.norms, fuzz.partial_ratio) * 0.6)
+            if q.tokens:
+                text = np.where(c.has_tokens,
+                                np.maximum(text, _cdist(q.tokens, c.tokens, fuzz.token_set_ratio) * 0.95),
+                                text)
+
+            gated = np.flatnonzero(c.present & (text >= _PINYIN_TEXT_GATE))
+            if gated.size:
+                pinyins = [c.pinyins[i] for i in gated]
+                text[gated] = np.maximum(
+                    text[gated],
+                    np.maximum(_cdist(q.pinyin, pinyins, fuzz.ratio) * 0.85,
+                               _cdist(q.pinyin, pinyins, fuzz.token_sort_ratio) * 0.8))
+
+            best = np.where(c.present, np.maximum(best, weight * text / 100.0), best)
+
+        if exact:
+            best[list(exact)] = 1.0
+        return np.minimum(best, 1.0)
+
     def _uses_custom_score(self) -> bool:
         """子类是否覆盖了 ``_score``。
 
@@ -416,11 +664,20 @@ class LocalMatchMixin:
         """按分降序返回 [(score, item), ...]，已滤掉低于 candidate_floor 的噪声。
 
         ``items`` 既可以是原始 dict 列表，也可以是 ``_Indexed`` 列表；后者
-        走预计算快路径。子类覆盖了 ``_score`` 时一律走 dict 慢路径。
+        走列式索引整列打分（``_score_columns``）。子类覆盖了 ``_score`` 时
+        一律走 dict 慢路径。
         """
         q = _Query(query)
         if items and isinstance(items[0], _Indexed) and not self._uses_custom_score():
-            scored = [(self._score_indexed(q, e), e.raw) for e in items]
+            if "\0" in q.norm:
+                # 列式索引用 \0 拼接字段做子串查找，查询词里带 \0 会跨字段误配
+                scored = [(self._score_indexed(q, e), e.raw) for e in items]
+            else:
+                cols = items.columns() if isinstance(items, _IndexedList) else _Columns(items)
+                scores = self._score_columns(q, cols)
+                floor = self.MATCH.candidate_floor
+                scored = [(float(scores[i]), cols.raws[i])
+                          for i in np.flatnonzero(scores >= floor)]
         else:
             plain = [e.raw if isinstance(e, _Indexed) else e for e in items]
             scored = [(self._score(q, it), it) for it in plain]
@@ -494,6 +751,8 @@ class LocalMatchMixin:
     # ── 缓存 ──
 
     CACHE_TTL: float = _DEFAULT_CACHE_TTL
+    REFRESH_AHEAD: float = _DEFAULT_REFRESH_AHEAD
+    FULL_REFRESH_INTERVAL: float = _DEFAULT_FULL_REFRESH_INTERVAL
 
     def _cache_key(self):
         """缓存隔离键。
@@ -535,6 +794,8 @@ class LocalMatchMixin:
         entry = _item_cache.get(key)
 
         if not force and entry is not None and (now - entry.fetched_at) < self.CACHE_TTL:
+            if self.REFRESH_AHEAD and (now - entry.fetched_at) >= self.CACHE_TTL * self.REFRESH_AHEAD:
+                self._refresh_ahead(key)
             return entry.indexed, None, True
 
         # single-flight：同 key 的并发取数串行化。等锁期间别的线程可能已经拉好，
@@ -554,10 +815,159 @@ class LocalMatchMixin:
                     return cur.indexed, None, True
             return self._do_fetch(key, force)
 
+    def _refresh_ahead(self, key):
+        """快到期的缓存在后台线程里提前刷新，本次调用照常用缓存返回。
+
+        同 key 同时只跑一个且有防抖；前台正在拉（持有取数锁）就不再凑热闹。线程里
+        跑的是调用方 context 的副本 —— Provider 可能从 contextvars 取租户 /
+        连接状态（warehouse_mcp 的 runtime_context）。
+        """
+        if not _item_cache.claim_refresh(key, time.monotonic()):
+            return
+        ctx = contextvars.copy_context()
+
+        def run():
+            lock = _fetch_locks.for_key(key)
+            try:
+                if not lock.acquire(blocking=False):
+                    return
+                try:
+                    cur = _item_cache.get(key)
+                    age = time.monotonic() - cur.fetched_at if cur is not None else None
+                    if age is None or age >= self.CACHE_TTL * self.REFRESH_AHEAD:
+                        self._do_fetch(key, force=False)
+                finally:
+                    lock.release()
+            except Exception:
+                logger.exception("后台预刷新失败 (%s)", type(self).__name__)
+            finally:
+                _item_cache.release_refresh(key)
+
+        threading.Thread(target=ctx.run, args=(run,), name="item-cache-refresh",
+                         daemon=True).start()
+
+    def _supports_delta(self) -> bool:
+        """子类实现了增量拉取，且有编码字段可以按它合并。"""
+        return (callable(getattr(self, "_fetch_items_since", None))
+                and bool(self.MATCH.fields.get("code")))
+
+    def _do_delta_fetch(self, key, entry, force: bool):
+        """增量拉取并合并进 ``entry``；拿不到可靠的增量时返回 None，由调用方
+        退回全量。调用方必须已持有该 key 的取数锁。"""
+        started = time.time()
+        try:
+            changed, removed, err = self._fetch_items_since(entry.synced_at)
+        except Exception:
+            logger.exception("增量拉取异常，改做全量 (%s)", type(self).__name__)
+            return None
+        if err:
+            logger.warning("增量拉取失败，改做全量: %s", (err or {}).get("message", err))
+            return None
+
+        code_key = self.MATCH.fields["code"]
+        updates = {}
+        for it in changed or ():
+            code = it.get(code_key)
+            if not code:
+                # 没有编码就没法与旧记录对位，合并不可靠
+                return None
+            updates[str(code)] = it
+        gone = {str(c) for c in removed or ()}
+
+        items = []
+        for it in entry.items:
+            code = it.get(code_key)
+            code = str(code) if code else None
+            if code in updates:
+                items.append(updates.pop(code))
+            elif code is None or code not in gone:
+                items.append(it)
+        items.extend(updates.values())
+
+        indexed, rebuilt = _index_items(items, self.MATCH.fields, entry.indexed)
+        _item_cache.put(key, items, indexed, time.monotonic(), refreshed=force,
+                        synced_at=started, full=False)
+        logger.info("增量刷新: %d 条变化, %d 条删除, 重建索引 %d 条 (%s)",
+                    len(changed or ()), len(gone), rebuilt, type(self).__name__)
+        return indexed, None, False
+
     def _do_fetch(self, key, force: bool):
-        """真正发起一次拉取并回填缓存。调用方必须已持有该 key 的取数锁。"""
+        """真正发起一次拉取并回填缓存。调用方必须已持有该 key 的取数锁。
+
+        配了跨进程共享快照（``MCP_ITEM_CACHE_DIR``，见 shared_cache.py）时，
+        先看兄弟进程有没有发布更新的快照，有就直接用；没有再拿跨进程锁，
+        锁内复查一次后才真正去拉，拉完发布给其它进程。
+        """
+        store = get_shared_store()
+        if store is None:
+            return self._fetch_now(key, force)
+
+        started = time.time()
+        if not force:
+            adopted = self._adopt_snapshot(store, key, force, started)
+            if adopted is not None:
+                return adopted
+        with store.lock(key):
+            adopted = self._adopt_snapshot(store, key, force, started)
+            if adopted is not None:
+                return adopted
+            result = self._fetch_now(key, force)
+            entry = _item_cache.get(key)
+            if result[1] is None and not result[2] and entry is not None:
+                age = time.monotonic() - entry.full_at
+                store.publish(key, self.MATCH.fields, entry.items,
+                              [e.fields for e in entry.indexed],
+                              entry.synced_at, time.time() - age)
+            return result
+
+    def _adopt_snapshot(self, store, key, force: bool, started: float):
+        """兄弟进程发布的快照可用就装进本进程缓存，返回 ``_load_items`` 的三元组；
+        否则返回 None。
+
+        可用 = 未过 TTL 且比本地缓存新；强制刷新还要求是本次请求开始之后
+        发布的 —— 更早的快照和本地缓存一样可能缺刚新增的物料。强制刷新采用
+        的快照等同于刚拉取（``from_cache=False``），其余视作缓存命中。
+        """
+        snap = store.load(key, self.MATCH.fields)
+        if snap is None or snap.synced_at is None:
+            return None
+        age = time.time() - snap.written_at
+        if age >= self.CACHE_TTL:
+            return None
+        if force and snap.written_at < started:
+            return None
+        entry = _item_cache.get(key)
+        if entry is not None and entry.synced_at is not None and snap.synced_at <= entry.synced_at:
+            return None
+        payload = snap.load_payload()
+        if payload is None:
+            return None
+        items, index = payload
+        indexed = _IndexedList(_Indexed._restore(raw, fields, self.MATCH.fields)
+                               for raw, fields in zip(items, index))
+        indexed.columns()
+        now = time.monotonic()
+        e = _item_cache.put(key, items, indexed, now - age, refreshed=force,
+                            synced_at=snap.synced_at)
+        e.full_at = now - (time.time() - snap.full_at)
+        logger.info("采用共享快照: %d 条，%.0fs 前发布 (%s)", len(indexed), age, type(self).__name__)
+        return indexed, None, not force
+
+    def _fetch_now(self, key, force: bool):
+        """向对方接口拉取并回填本进程缓存。
+
+        上次同步过、子类支持增量且距上次全量不到 ``FULL_REFRESH_INTERVAL``
+        时先走增量；增量失败或不可靠再退回全量。
+        """
         now = time.monotonic()
         entry = _item_cache.get(key)
+        if (entry is not None and entry.synced_at is not None and self._supports_delta()
+                and (now - entry.full_at) < self.FULL_REFRESH_INTERVAL):
+            result = self._do_delta_fetch(key, entry, force)
+            if result is not None:
+                return result
+
+        started = time.time()
         items, err = self._fetch_items()
         if err:
             # 拉取失败时宁可用过期数据也不要直接失败 —— 对方 ERP 抖一下不该
@@ -569,14 +979,24 @@ class LocalMatchMixin:
                 return entry.indexed, None, True
             return None, err, False
 
-        indexed = [_Indexed(it, self.MATCH.fields) for it in (items or [])]
-        _item_cache.put(key, items, indexed, now, refreshed=force)
-        logger.info("全量列表已刷新: %d 条 (%s)", len(indexed), type(self).__name__)
+        items = items or []
+        indexed, rebuilt = _index_items(items, self.MATCH.fields,
+                                        entry.indexed if entry is not None else ())
+        _item_cache.put(key, items, indexed, time.monotonic(), refreshed=force, synced_at=started)
+        logger.info("全量列表已刷新: %d 条，重建索引 %d 条 (%s)",
+                    len(indexed), rebuilt, type(self).__name__)
         return indexed, None, False
 
     def invalidate_cache(self):
-        """丢弃本 Provider 的缓存。写操作改变了物料主数据时调用。"""
-        _item_cache.invalidate(self._cache_key())
+        """丢弃本 Provider 的缓存。写操作改变了物料主数据时调用。
+
+        共享快照一并删掉，否则下一次取数会把写之前的快照原样装回来。
+        """
+        key = self._cache_key()
+        _item_cache.invalidate(key)
+        store = get_shared_store()
+        if store is not None:
+            store.discard(key)
 
     def _may_force_refresh(self) -> bool:
         """距上次强制刷新是否已超过防抖间隔。"""
@@ -689,3 +1109,16 @@ class LocalMatchMixin:
         raise NotImplementedError(
             f"{type(self).__name__} 必须实现 _fetch_items()"
         )
+
+    # ── 子类可选实现 ──
+
+    # 增量拉取：``_fetch_items_since(since) -> (changed_items, removed_codes, error_response)``。
+    #
+    # ``since`` 是上次成功同步开始时的 Unix 时间戳（秒）。``changed_items`` 是
+    # 此后新增或修改的完整记录，``removed_codes`` 是此后删除的记录的编码
+    # （``MATCH.fields["code"]`` 的值）。合并按编码对位，所以只有编码唯一的
+    # 数据源才该实现它 —— 像 parts_wms 那样同一编码返回多行的不行。
+    #
+    # 对方接口的时间戳有误差时宁可把 ``since`` 往前多取一点：重复返回的记录
+    # 会被原样替换，漏掉的只能等下一次全量。不支持增量的 Provider 保持 None。
+    _fetch_items_since = None
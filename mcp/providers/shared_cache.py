@@ -0,0 +1,174 @@
+"""LocalMatchMixin 全量列表的跨进程共享快照。
+
+子进程模式（``mcp_pipe.py`` 每个连接起一个 ``warehouse_mcp.py``）下
+``matching._item_cache`` 是进程级的：十个智能体绑同一个 ERP 仓库，就是十次
+全量拉取、十份索引，对方 ERP 的压力和本机内存都乘十。
+
+设置 ``MCP_ITEM_CACHE_DIR`` 后，同一 ``_cache_key()`` 的进程共用一份磁盘快照：
+
+* **发布**：拉取成功的进程把「原始记录 + 预计算索引」写进临时文件，
+  ``os.replace`` 原子换名 —— 读者要么看到旧快照要么看到新快照，不会读到半截；
+* **single-flight**：拉取前对同名 ``.lock`` 文件加 ``flock``，等锁的进程拿到锁后
+  先看快照是不是在自己等待期间刚发布的，是就直接用，不再打对方接口；
+* **读取**：文件第一行是头部（格式版本、字段映射、同步时间），mmap 后先只
+  解析这一行，快照不比本地缓存新就不碰后面的正文。
+
+Python 对象没法放进共享内存，每个进程仍各自持有一份反序列化后的列表；省下
+的是拉取和建索引（归一化 / 分词 / 拼音），这两步才是大头。
+
+凭据不落盘：key 里只有凭据指纹（见 ``LocalMatchMixin._cache_key``），文件名
+再取一次哈希。
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发机：没有跨进程锁，退化为各进程各拉各的
+    fcntl = None
+
+logger = logging.getLogger("WarehouseMCP")
+
+__all__ = ["MCP_ITEM_CACHE_DIR", "SharedItemStore", "get_shared_store"]
+
+# 快照目录；留空不共享（共享运行时模式本来就是一个进程，不需要）
+MCP_ITEM_CACHE_DIR = os.environ.get("MCP_ITEM_CACHE_DIR", "")
+
+# 等别的进程拉取的上限（秒）。超时就自己拉 —— 宁可多打一次对方接口，也不能
+# 让工具调用卡在一个挂住的兄弟进程上。
+_LOCK_TIMEOUT = 30.0
+_LOCK_POLL = 0.05
+
+_FORMAT = 1
+
+
+class Snapshot:
+    """快照头部；``load_payload()`` 才解析正文。"""
+
+    __slots__ = ("path", "written_at", "synced_at", "full_at", "count")
+
+    def __init__(self, path, header):
+        self.path = path
+        self.written_at = header["written_at"]
+        self.synced_at = header["synced_at"]
+        self.full_at = header["full_at"]
+        self.count = header["count"]
+
+    def load_payload(self):
+        """返回 ``(items, index)``；文件在头部读取后被换掉时返回 None。"""
+        try:
+            with open(self.path, "rb") as f:
+                f.readline()
+                payload = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if payload.get("written_at") != self.written_at:
+            return None
+        return payload["items"], payload["index"]
+
+
+class SharedItemStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        digest = hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"items-{digest}")
+
+    def load(self, key, field_map: dict):
+        """读快照头部；没有、格式不符或字段映射不同时返回 None。"""
+        path = self._path(key) + ".json"
+        try:
+            with open(path, "rb") as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header = json.loads(mm.readline())
+        except (OSError, ValueError):
+            return None
+        if header.get("format") != _FORMAT or header.get("fields") != field_map:
+            return None
+        return Snapshot(path, header)
+
+    def publish(self, key, field_map: dict, items: list, index: list,
+                synced_at, full_at) -> None:
+        """原子发布一份快照。写失败只记日志 —— 共享是优化，不能让查询失败。"""
+        path = self._path(key) + ".json"
+        written_at = time.time()
+        header = {"format": _FORMAT, "fields": field_map, "written_at": written_at,
+                  "synced_at": synced_at, "full_at": full_at, "count": len(items)}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".items-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(header, ensure_ascii=False))
+                f.write("\n")
+                json.dump({"written_at": written_at, "items": items, "index": index},
+                          f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("共享快照写入失败: %s", e)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def discard(self, key) -> None:
+        try:
+            os.unlink(self._path(key) + ".json")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("共享快照删除失败: %s", e)
+
+    @contextmanager
+    def lock(self, key, timeout: float = _LOCK_TIMEOUT):
+        """跨进程取数锁；拿到返回 True，超时或平台不支持返回 False（照常往下走）。"""
+        if fcntl is None:
+            yield False
+            return
+        fd = os.open(self._path(key) + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        acquired = False
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    acquired = True
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        logger.warning("等待共享取数锁超时 %.0fs，自行拉取", timeout)
+                        break
+                    time.sleep(_LOCK_POLL)
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+_stores: dict = {}
+_stores_lock = threading.Lock()
+
+
+def get_shared_store():
+    """按 ``MCP_ITEM_CACHE_DIR`` 返回共享快照存储；未配置或目录不可用时返回 None。"""
+    directory = MCP_ITEM_CACHE_DIR
+    if not directory:
+        return None
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            try:
+                store = _stores[directory] = SharedItemStore(directory)
+            except OSError as e:
+                logger.warning("共享快照目录不可用 %s: %s", directory, e)
+                return None
+        return store
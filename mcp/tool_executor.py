@@ -0,0 +1,235 @@
+"""MCP 工具调用专用线程池：按连接 / 租户限流 + 公平排队 + 按工具名统计。
+
+工具函数是同步的（Provider 走 HTTP 调回本服务），以前一律 ``asyncio.to_thread``
+丢进事件循环的默认线程池。共享运行时模式下所有智能体连接都在后端进程里，
+和其他 ``to_thread`` 调用抢同一个池：一个智能体刷一波调用就能把线程占满。
+
+这里改为：
+
+* 独立的定长线程池（``MCP_TOOL_WORKERS``），和 HTTP 路由的线程池隔离；
+* 每个连接最多 ``MCP_TOOL_PER_CONNECTION`` 个调用同时执行，每个租户最多
+  ``MCP_TOOL_PER_TENANT`` 个，超出的排队；
+* 有空位时按连接**轮转**取队头——刷屏的连接只会让自己的队变长，不会
+  挡住其他连接的第一个调用；
+* 按工具名记录排队等待与执行耗时（``snapshot()``，后端 /metrics 与
+  ``GET /api/mcp/tool-stats`` 读取）。
+
+调用方协程被取消（如请求超时）时：还在排队的直接出队；已在线程里执行的
+停不下来，名额等线程真正结束才释放，计数不会虚空。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+MCP_TOOL_WORKERS = max(1, int(os.environ.get('MCP_TOOL_WORKERS', '16')))
+MCP_TOOL_PER_CONNECTION = max(1, int(os.environ.get('MCP_TOOL_PER_CONNECTION', '4')))
+MCP_TOOL_PER_TENANT = max(1, int(os.environ.get('MCP_TOOL_PER_TENANT', '8')))
+
+
+class _Call:
+    __slots__ = ('connection', 'tenant', 'tool', 'future', 'loop', 'enqueued_at',
+                 'granted', 'granted_at')
+
+    def __init__(self, connection, tenant, tool, loop):
+        self.connection = connection
+        self.tenant = tenant
+        self.tool = tool
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        self.granted_at = 0.0
+
+
+class _ToolStats:
+    __slots__ = ('calls', 'errors', 'wait_total', 'wait_max', 'exec_total', 'exec_max')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ToolExecutor:
+    """带连接 / 租户上限和轮转公平队列的工具线程池。"""
+
+    def __init__(self, max_workers: int = MCP_TOOL_WORKERS,
+                 per_connection: int = MCP_TOOL_PER_CONNECTION,
+                 per_tenant: int = MCP_TOOL_PER_TENANT):
+        self.max_workers = max_workers
+        self.per_connection = per_connection
+        self.per_tenant = per_tenant
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # 连接 → 排队的调用；OrderedDict 的顺序即轮转顺序
+        self._queues: 'OrderedDict[Hashable, Deque[_Call]]' = OrderedDict()
+        self._running = 0
+        self._by_connection: Dict[Hashable, int] = {}
+        self._by_tenant: Dict[Hashable, int] = {}
+        self._stats: Dict[str, _ToolStats] = {}
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='mcp-tool')
+            return self._pool
+
+    # -- 排队与放行（都在 self._lock 下） ----------------------------------
+
+    def _admissible(self, call: _Call) -> bool:
+        return (self._by_connection.get(call.connection, 0) < self.per_connection
+                and self._by_tenant.get(call.tenant, 0) < self.per_tenant)
+
+    def _grant_locked(self, call: _Call) -> None:
+        call.granted = True
+        call.granted_at = time.perf_counter()
+        self._running += 1
+        self._by_connection[call.connection] = self._by_connection.get(call.connection, 0) + 1
+        self._by_tenant[call.tenant] = self._by_tenant.get(call.tenant, 0) + 1
+
+    def _dispatch_locked(self) -> None:
+        while self._running < self.max_workers and self._queues:
+            for connection in list(self._queues):
+                queue = self._queues[connection]
+                if self._admissible(queue[0]):
+                    call = queue.popleft()
+                    # 轮转：刚放行的连接挪到队尾
+                    del self._queues[connection]
+                    if queue:
+                        self._queues[connection] = queue
+                    self._grant_locked(call)
+                    try:
+                        call.loop.call_soon_threadsafe(_wake, call.future)
+                    except RuntimeError:  # 调用方的事件循环已关闭，放弃这次调用
+                        self._ungrant_locked(call)
+                    break
+            else:
+                return  # 剩下的都卡在连接 / 租户上限上
+
+    def _ungrant_locked(self, call: _Call) -> None:
+        self._running -= 1
+        for counts, key in ((self._by_connection, call.connection),
+                            (self._by_tenant, call.tenant)):
+            left = counts[key] - 1
+            if left:
+                counts[key] = left
+            else:
+                del counts[key]
+
+    def _release(self, call: _Call) -> None:
+        with self._lock:
+            self._ungrant_locked(call)
+            self._dispatch_locked()
+
+    def _dequeue_locked(self, call: _Call) -> None:
+        queue = self._queues.get(call.connection)
+        if queue is not None and call in queue:
+            queue.remove(call)
+            if not queue:
+                del self._queues[call.connection]
+
+    def _record(self, call: _Call, exec_seconds: float, failed: bool) -> None:
+        wait = call.granted_at - call.enqueued_at
+        with self._lock:
+            stats = self._stats.get(call.tool)
+            if stats is None:
+                stats = self._stats[call.tool] = _ToolStats()
+            stats.calls += 1
+            stats.errors += failed
+            stats.wait_total += wait
+            stats.wait_max = max(stats.wait_max, wait)
+            stats.exec_total += exec_seconds
+            stats.exec_max = max(stats.exec_max, exec_seconds)
+
+    # -- 对外接口 -----------------------------------------------------------
+
+    async def run(self, func: Callable[[], object], *, tool: str,
+                  connection: Hashable = None, tenant: Hashable = None):
+        """在工具线程池里执行 ``func()``（复制当前 ContextVar，租户运行时状态随行）。"""
+        loop = asyncio.get_running_loop()
+        call = _Call(connection, tenant, tool, loop)
+        with self._lock:
+            if not self._queues and self._running < self.max_workers and self._admissible(call):
+                self._grant_locked(call)
+                call.future.set_result(None)
+            else:
+                self._queues.setdefault(connection, deque()).append(call)
+                # 已有的排队可能都卡在各自连接 / 租户上限上，空闲名额要立即放给新来的
+                self._dispatch_locked()
+        try:
+            await call.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = call.granted
+                if not granted:
+                    self._dequeue_locked(call)
+            if granted:
+                self._release(call)
+            raise
+
+        ctx = contextvars.copy_context()
+
+        def execute():
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = ctx.run(func)
+                failed = False
+                return result
+            finally:
+                self._record(call, time.perf_counter() - started, failed)
+                self._release(call)
+
+        try:
+            work = self._get_pool().submit(execute)
+        except BaseException:
+            self._release(call)
+            raise
+        # shield：调用方被取消时不去 cancel 线程池里的 future，名额由 execute 自己释放
+        return await asyncio.shield(asyncio.wrap_future(work))
+
+    def snapshot(self) -> dict:
+        """按工具名的排队 / 执行耗时统计与当前占用。"""
+        with self._lock:
+            tools = {
+                name: {
+                    'calls': s.calls,
+                    'errors': s.errors,
+                    'queue_wait_seconds_total': round(s.wait_total, 6),
+                    'queue_wait_seconds_max': round(s.wait_max, 6),
+                    'exec_seconds_total': round(s.exec_total, 6),
+                    'exec_seconds_max': round(s.exec_max, 6),
+                }
+                for name, s in sorted(self._stats.items())
+            }
+            return {
+                'workers': self.max_workers,
+                'per_connection': self.per_connection,
+                'per_tenant': self.per_tenant,
+                'running': self._running,
+                'queued': sum(len(q) for q in self._queues.values()),
+                'tools': tools,
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+executor = ToolExecutor()
@@ -16,7 +16,6 @@
 """
 
 from fastmcp import FastMCP
-import asyncio
 import sys
 import os
 import logging
@@ -26,6 +25,8 @@ import inspect
 import json
 import re
 import threading
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
 from contextvars import ContextVar
 from copy import deepcopy
@@ -61,9 +62,13 @@ def log_mcp_call(func):
 
         # FastMCP 2.13 calls synchronous tools directly on its event loop.
         # Providers call this same Uvicorn service over HTTP, so direct execution
-        # deadlocks the event loop until requests times out. asyncio.to_thread
-        # also copies ContextVars, preserving per-session tenant credentials.
-        return await asyncio.to_thread(invoke)
+        # deadlocks the event loop until requests times out. The dedicated tool
+        # executor copies ContextVars (per-session tenant credentials) and caps
+        # concurrency per connection / tenant, see tool_executor.py.
+        connection, tenant = _executor_keys()
+        return await _tool_executor.run(
+            invoke, tool=func.__name__, connection=connection, tenant=tenant,
+        )
     return wrapper
 
 # 修复 Windows 控制台 UTF-8 编码
@@ -124,6 +129,7 @@ _config = load_config()
 sys.path.insert(0, os.path.dirname(__file__))
 from providers import load_provider  # noqa: E402
 from providers.normalize import normalize_query  # noqa: E402
+from tool_executor import executor as _tool_executor  # noqa: E402
 
 
 def _load_provider_from_db_or_default(default_config: dict):
@@ -244,12 +250,17 @@ def create_runtime_state(
     provider: str | None = None,
     external_tenant_id: str | None = None,
     external_warehouse_id: str | None = None,
+    connection_id: str | None = None,
+    tenant_id: int | None = None,
 ) -> dict:
     """Create isolated configuration and provider cache for one MCP session.
 
     external_tenant_id / external_warehouse_id 是本连接绑定的**对方系统**的
     租户与仓库编码（外部 ERP 模式）。runtime state 每连接一份、Provider 实例
     也缓存在各自的 state 里，所以多个智能体各自绑不同的外部仓库时天然隔离。
+
+    connection_id / tenant_id 是本系统的连接与租户，用于工具线程池的限流分组和
+    只读工具结果缓存的失效分组（见 ``_session_cache``）。
     """
     config = deepcopy(_config)
     config['api_base_url'] = api_base_url.rstrip('/')
@@ -270,6 +281,10 @@ def create_runtime_state(
         'provider': None,
         'provider_lock': threading.Lock(),
         'debug': bool(debug),
+        'connection_id': connection_id,
+        'tenant_id': tenant_id,
+        'read_cache': OrderedDict(),
+        'read_cache_lock': threading.Lock(),
     }
 
 
@@ -288,6 +303,16 @@ def _get_config() -> dict:
     return state['config'] if state is not None else _config
 
 
+def _executor_keys() -> tuple:
+    """(连接, 租户) 限流分组键；子进程模式下整个进程就是一个连接。"""
+    state = _runtime_state.get()
+    if state is None:
+        return None, None
+    connection = state.get('connection_id') or id(state)
+    tenant = state.get('tenant_id')
+    return connection, (tenant if tenant is not None else connection)
+
+
 def _debug_enabled() -> bool:
     state = _runtime_state.get()
     return bool(state['debug']) if state is not None else _MCP_DEBUG
@@ -487,6 +512,10 @@ def _enforce_face(
             "error": f"face_auth_denied:{reason}",
             "message": _face_deny_message(reason),
         }, None
+    if decision.get("status") == "pass":
+        # 本次调用做过真实人脸核验：结果不能进只读缓存，否则 TTL 内的重复
+        # 查询会绕过按规则要求的逐次核验（见 _session_cache）。
+        _face_verified.set(True)
     face_name = decision.get("matched_subject_name")
     return None, (face_name if isinstance(face_name, str) and face_name else None)
 
@@ -1094,6 +1123,113 @@ def _tool_error(op: str, e: Exception) -> dict:
     }
 
 
+# ============================================================================
+# 只读工具的会话级结果缓存
+# ============================================================================
+# 语音对话里同一个读操作常被连着问两遍（"M3螺丝还有多少"→ 追问 → 再查一次），
+# 每次都要走人脸闸门、Provider HTTP、模糊匹配和后端聚合。MCP_READ_CACHE_TTL > 0
+# 时，只读工具的结果按「工具名 + 归一化后的参数」在**本会话**内缓存这么多秒。
+#
+# * 只缓存 success=True 的结果；失败、传输错误、人脸拒绝都不缓存。
+# * 本次调用若做过真实人脸核验（status=pass，说明租户给查询配置了人脸规则），
+#   不缓存——规则要求逐次核验，缓存命中会绕过它。
+# * 写工具（_WRITE_OPS）执行后递增所在租户的写代数；缓存条目记的是读开始时的
+#   代数，代数变了即失效。同租户其他会话的写同样生效（共享运行时同进程）。
+#   网页端或别的进程的写不可见，只能靠 TTL 兜底，所以默认关闭、TTL 宜短。
+MCP_READ_CACHE_TTL = float(os.environ.get('MCP_READ_CACHE_TTL', '0'))
+_READ_CACHE_MAX_ENTRIES = 64
+
+_face_verified: ContextVar[bool] = ContextVar('warehouse_mcp_face_verified', default=False)
+# 子进程模式：整个进程就是一个会话
+_process_read_cache: OrderedDict = OrderedDict()
+_process_read_cache_lock = threading.Lock()
+# 租户 → 写代数
+_write_generations: dict = {}
+_write_generations_lock = threading.Lock()
+
+
+def _read_cache_scope() -> tuple:
+    """(缓存字典, 锁, 写代数分组键)。"""
+    state = _runtime_state.get()
+    _connection, tenant = _executor_keys()
+    if state is None:
+        return _process_read_cache, _process_read_cache_lock, tenant
+    return state['read_cache'], state['read_cache_lock'], tenant
+
+
+def _write_generation(tenant) -> int:
+    with _write_generations_lock:
+        return _write_generations.get(tenant, 0)
+
+
+def _bump_write_generation(tenant) -> None:
+    with _write_generations_lock:
+        _write_generations[tenant] = _write_generations.get(tenant, 0) + 1
+
+
+def _session_cache(operation: str):
+    """装饰器：只读工具走会话级 TTL 缓存，写工具执行后让同租户缓存失效。
+
+    位置在 ``_antihallucination`` 之下：键用已归一化的参数（"型号M3螺丝" 与
+    "M3螺丝" 命中同一条），缓存的是 Provider 原始响应，对外包装照常每次做；
+    参数绑定失败、工具抛异常都原样交给 ``_antihallucination`` 处理。
+    """
+    def deco(fn):
+        if operation in _WRITE_OPS:
+            @functools.wraps(fn)
+            def write_wrapper(*args, **kwargs):
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    # 成功失败都失效：部分出库之类的失败也可能已经改了库存
+                    _bump_write_generation(_read_cache_scope()[2])
+            return write_wrapper
+
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if MCP_READ_CACHE_TTL <= 0:
+                return fn(*args, **kwargs)
+            try:
+                bound = sig.bind(*args, **kwargs)
+            except TypeError:
+                return fn(*args, **kwargs)
+            bound.apply_defaults()
+            key = (operation, json.dumps(bound.arguments, sort_keys=True,
+                                         ensure_ascii=False, default=str))
+            cache, lock, tenant = _read_cache_scope()
+            generation = _write_generation(tenant)
+            now = time.monotonic()
+            with lock:
+                hit = cache.get(key)
+                if hit is not None:
+                    expires_at, hit_generation, result = hit
+                    if expires_at > now and hit_generation == generation:
+                        cache.move_to_end(key)
+                        logger.debug(f"read cache hit [{operation}]")
+                        return deepcopy(result)
+                    del cache[key]
+
+            token = _face_verified.set(False)
+            try:
+                result = fn(*args, **kwargs)
+                verified = _face_verified.get()
+            finally:
+                _face_verified.reset(token)
+            if verified or not isinstance(result, dict) or result.get("success") is not True:
+                return result
+            with lock:
+                cache[key] = (now + MCP_READ_CACHE_TTL, generation, deepcopy(result))
+                cache.move_to_end(key)
+                while len(cache) > _READ_CACHE_MAX_ENTRIES:
+                    cache.popitem(last=False)
+            return result
+
+        return wrapper
+    return deco
+
+
 # 创建 MCP 服务器
 # instructions 字段会在 MCP initialize 响应里下发给客户端（xiaozhi 会注入到系统 prompt），
 # 比塞进每个 tool 的 docstring 高效得多（避免 ListTools 响应过大触发 WS 1009 message too big）。
@@ -1104,6 +1240,7 @@ mcp = FastMCP("Warehouse System", instructions=_RULES_FOOTER.strip())
 @log_mcp_call
 @_normalize_query_args("text")
 @_antihallucination("resolve_name")
+@_session_cache("resolve_name")
 def resolve_name(text: str, entity_type: str = "all") -> dict:
     """仅"先确认实体再下一步"时用；查库存/批次/出入库已内建模糊匹配，请直接调对应工具。"""
     try:
@@ -1116,6 +1253,7 @@ def resolve_name(text: str, entity_type: str = "all") -> dict:
 @log_mcp_call
 @_normalize_query_args("product_name")
 @_antihallucination("query_stock")
+@_session_cache("query_stock")
 def query_stock(product_name: str) -> dict:
     """按产品名或物料编码/SKU 查库存数量和存放位置（"X还有多少/放在哪/在哪个库位"）。
 
@@ -1142,6 +1280,7 @@ def query_stock(product_name: str) -> dict:
 @log_mcp_call
 @_normalize_query_args("batch_no")
 @_antihallucination("query_batch")
+@_session_cache("query_batch")
 def query_batch(batch_no: str) -> dict:
     """按批次号查批次。"""
     blocked, _ = _enforce_face("query")
@@ -1163,6 +1302,7 @@ def query_batch(batch_no: str) -> dict:
 @log_mcp_call
 @_normalize_query_args("product_name")
 @_antihallucination("stock_in")
+@_session_cache("stock_in")
 def stock_in(product_name: str, quantity: int,
              reason_category: str = "purchase", reason_note: str = "",
              operator: str = "MCP系统",
@@ -1200,6 +1340,7 @@ def stock_in(product_name: str, quantity: int,
 @log_mcp_call
 @_normalize_query_args("product_name")
 @_antihallucination("stock_out")
+@_session_cache("stock_out")
 def stock_out(product_name: str, quantity: int,
               reason_category: str, reason_note: str = "",
               operator: str = "MCP系统",
@@ -1233,6 +1374,7 @@ def stock_out(product_name: str, quantity: int,
 @log_mcp_call
 @_normalize_query_args("query")
 @_antihallucination("search")
+@_session_cache("search")
 def search(query: str = None, entity_type: str = "material",
            category: str = None, status: str = None,
            contact_type: str = None, include_batches: bool = False,
@@ -1256,6 +1398,7 @@ def search(query: str = None, entity_type: str = "material",
 @log_mcp_call
 @_normalize_query_args("batch_no", "new_location")
 @_antihallucination("move_batch_location")
+@_session_cache("move_batch_location")
 def move_batch_location(batch_no: str, new_location: str,
                          quantity: int = None,
                          operator: str = "MCP系统",
@@ -1288,6 +1431,7 @@ def move_batch_location(batch_no: str, new_location: str,
 @mcp.tool()
 @log_mcp_call
 @_antihallucination("get_today_statistics")
+@_session_cache("get_today_statistics")
 def get_today_statistics() -> dict:
     """今日入出库与库存概览。"""
     blocked, _ = _enforce_face("query")
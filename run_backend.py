@@ -15,9 +15,14 @@ sys.path.insert(0, backend_dir)
 # 更改工作目录到 backend
 os.chdir(backend_dir)
 
-# 导入 FastAPI 应用
-from app import app
-
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 2124))
-    uvicorn.run(app, host='0.0.0.0', port=port)
+    # WORKERS > 1：多进程模式。各 worker 的进程内缓存经失效总线同步，
+    # MCP 连接只由其中一个 worker 持有（见 backend/multiworker.py）。
+    workers = max(1, int(os.environ.get('WORKERS', 1)))
+    if workers > 1:
+        # 多 worker 时 uvicorn 需要按导入字符串在每个子进程里各自加载应用
+        uvicorn.run('app:app', host='0.0.0.0', port=port, workers=workers)
+    else:
+        from app import app
+        uvicorn.run(app, host='0.0.0.0', port=port)
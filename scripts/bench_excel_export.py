@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Benchmark: streaming vs. in-memory inventory-records Excel export.
+
+Builds a throwaway SQLite DB with N inventory records (default 1,000,000;
+half of them stock-outs with a batch consumption each), then runs each export
+mode in a fresh subprocess and reports time-to-first-byte, total time, peak
+RSS and output size:
+
+* ``stream`` — the real ``GET /api/inventory/export-excel`` handler
+  (``app.export_inventory_records``), consuming its StreamingResponse body.
+* ``legacy`` — the previous implementation's shape: ``fetchall()`` the same
+  join, build an ``openpyxl.Workbook`` in memory, ``wb.save(BytesIO)``.
+
+    uv run python scripts/bench_excel_export.py               # 1M rows, both modes
+    uv run python scripts/bench_excel_export.py --rows 200000 --modes stream
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = REPO_ROOT / "backend"
+
+
+def _build_db(path: str, rows: int) -> None:
+    os.environ["DATABASE_PATH"] = path
+    sys.path.insert(0, str(BACKEND_DIR))
+    import database
+
+    database.init_database()
+    conn = database.get_db_connection()
+    cur = conn.cursor()
+    rng = random.Random(42)
+    n_mat = 2000
+    cur.executemany(
+        "INSERT INTO materials (name, sku, category, quantity, unit, tenant_id, warehouse_id) "
+        "VALUES (?, ?, ?, 0, '个', 1, 1)",
+        [(f"物料-{i:05d}", f"SKU-{i:05d}", f"分类{i % 20}") for i in range(n_mat)],
+    )
+    mat_ids = [r[0] for r in cur.execute("SELECT id FROM materials ORDER BY id")]
+    cur.executemany(
+        "INSERT INTO batches (batch_no, material_id, quantity, initial_quantity, is_exhausted, "
+        "tenant_id, warehouse_id, variant) VALUES (?, ?, 100, 100, 0, 1, 1, ?)",
+        [(f"B-{m}", m, "红" if m % 3 else None) for m in mat_ids],
+    )
+    batch_of = {m: b for b, m in cur.execute("SELECT id, material_id FROM batches")}
+    chunk = 50_000
+    next_id = 1
+    while next_id <= rows:
+        recs, cons = [], []
+        for rid in range(next_id, min(rows, next_id + chunk - 1) + 1):
+            m = mat_ids[rng.randrange(n_mat)]
+            is_out = rid % 2 == 0
+            recs.append((
+                rid, m, "out" if is_out else "in", rng.randint(1, 50),
+                "admin", "sell" if is_out else "purchase",
+                None if is_out else batch_of[m],
+                f"2025-{rid % 12 + 1:02d}-{rid % 28 + 1:02d} 10:00:00",
+            ))
+            if is_out:
+                cons.append((rid, batch_of[m], rng.randint(1, 50)))
+        cur.executemany(
+            "INSERT INTO inventory_records (id, material_id, type, quantity, operator, "
+            "reason_category, batch_id, created_at, tenant_id, warehouse_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, 1)", recs)
+        cur.executemany(
+            "INSERT INTO batch_consumptions (record_id, batch_id, quantity) VALUES (?, ?, ?)", cons)
+        conn.commit()
+        next_id += chunk
+    conn.close()
+
+
+def _run_stream() -> dict:
+    sys.path.insert(0, str(BACKEND_DIR))
+    import asyncio
+
+    import app as app_module
+    from deps import CurrentUser
+
+    user = CurrentUser(user_id=1, username="admin", role="admin", is_guest=False,
+                       source="session", tenant_id=1)
+    t0 = time.perf_counter()
+    resp = app_module.export_inventory_records(
+        start_date=None, end_date=None, product_name=None, record_type=None,
+        warehouse_id=None, current_user=user,
+    )
+    out = {"ttfb_s": None, "bytes": 0}
+
+    async def _consume():
+        async for chunk in resp.body_iterator:
+            if out["ttfb_s"] is None:
+                out["ttfb_s"] = time.perf_counter() - t0
+            out["bytes"] += len(chunk)
+
+    asyncio.run(_consume())
+    out["total_s"] = time.perf_counter() - t0
+    return out
+
+
+def _run_legacy() -> dict:
+    import sqlite3
+    from io import BytesIO
+
+    from openpyxl import Workbook
+
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(os.environ["DATABASE_PATH"])
+    records = conn.execute(
+        "SELECT r.id, m.name, m.sku, m.category, r.type, r.quantity, r.operator, "
+        "r.actual_operator, r.reason_category, r.reason_note, r.created_at, c.name, "
+        "b.batch_no, b.variant FROM inventory_records r "
+        "JOIN materials m ON r.material_id = m.id "
+        "LEFT JOIN contacts c ON r.contact_id = c.id "
+        "LEFT JOIN batches b ON r.batch_id = b.id ORDER BY r.created_at DESC"
+    ).fetchall()
+    details = {}
+    for rid, batch_no, qty in conn.execute(
+        "SELECT bc.record_id, b.batch_no, bc.quantity FROM batch_consumptions bc "
+        "JOIN batches b ON bc.batch_id = b.id ORDER BY bc.record_id"
+    ):
+        details.setdefault(rid, []).append(f"{batch_no}×{qty}")
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["物料名称", "规格", "物料编码", "商品类型", "记录类型", "数量", "批次",
+               "联系方", "账号", "操作人", "原因类别", "备注", "时间"])
+    for r in records:
+        batch_info = r[12] if r[4] == "in" else ", ".join(details.get(r[0], ()))
+        ws.append([r[1], r[13] or "", r[2], r[3], "入库" if r[4] == "in" else "出库", r[5],
+                   batch_info, r[11] or "", r[6], r[7] or "", r[8], r[9] or "", r[10]])
+    buf = BytesIO()
+    wb.save(buf)
+    total = time.perf_counter() - t0
+    return {"ttfb_s": total, "total_s": total, "bytes": buf.tell()}
+
+
+def _child(mode: str, rows: int) -> None:
+    if mode == "build":
+        _build_db(os.environ["DATABASE_PATH"], rows)
+        return
+    result = _run_stream() if mode == "stream" else _run_legacy()
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--modes", default="stream,legacy")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.child, args.rows)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, __file__, "--child", "build", "--rows", str(args.rows)],
+                       check=True, env={**os.environ, "DATABASE_PATH": db})
+        print(f"seeded {args.rows:,} records in {time.perf_counter() - t0:.1f}s")
+        env = {**os.environ, "DATABASE_PATH": db, "INIT_MOCK_DATA": "false",
+               "DEPLOY_MODE": "single_tenant"}
+        for mode in args.modes.split(","):
+            out = subprocess.run([sys.executable, __file__, "--child", mode],
+                                 check=True, env=env, capture_output=True, text=True)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mode:>7}: first byte {r['ttfb_s']:.2f}s  total {r['total_s']:.1f}s  "
+                  f"peak RSS {r['peak_rss_mb']:.0f} MB  size {r['bytes'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark: column-wise vs. per-item scoring in ``LocalMatchMixin._rank``.
+
+Builds a random part catalogue of N items (default 10,000), indexes it the way
+the fetch path does (``_index_items``), then times a fixed set of queries
+through each scorer and reports the best of several rounds:
+
+* ``columnar`` — ``_rank`` as shipped (``_score_columns`` + ``process.cdist``).
+* ``per-item`` — the previous fast path: ``_score_indexed`` on every item.
+
+Both scorers must produce identical scores and ordering; that is covered by
+``tests/test_provider_matching.py::TestColumnarRanking``, not here.
+
+    uv run python scripts/bench_provider_rank.py                  # 10k items
+    uv run python scripts/bench_provider_rank.py --items 50000 --rounds 5
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "mcp"))
+
+from providers.matching import LocalMatchMixin, MatchConfig, _index_items, _Query  # noqa: E402
+
+WORDS = ["上钳口", "下钳口", "电极帽", "撬具", "扳手", "螺丝", "银色", "M3",
+         "液压", "油缸", "铣刀", "钨钢", "垫片", "轴承", "密封圈", "前口"]
+SPECS = ["4IO-2.0-3.2-12-A", "LH-815", "银色", "M8 不锈钢", "3.2", "", None]
+QUERIES = ["上钳口", "电级帽", "M3螺丝 银色", "A00012"]
+
+
+class _Provider(LocalMatchMixin):
+    MATCH = MatchConfig(fields={"name": "partName", "code": "partNo", "spec": "partType"})
+
+
+def _catalogue(n: int, seed: int) -> list[dict]:
+    rnd = random.Random(seed)
+    return [{
+        "partName": "".join(rnd.sample(WORDS, rnd.randint(1, 3))) if rnd.random() > 0.05 else "",
+        "partNo": f"{rnd.choice('ABLV')}{rnd.randint(0, 99999):05d}" if rnd.random() > 0.1 else None,
+        "partType": rnd.choice(SPECS),
+    } for _ in range(n)]
+
+
+def _rank_per_item(p: LocalMatchMixin, query: str, indexed) -> list:
+    q = _Query(query)
+    scored = [(p._score_indexed(q, e), e.raw) for e in indexed]
+    scored = [x for x in scored if x[0] >= p.MATCH.candidate_floor]
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored
+
+
+def _best_of(fn, queries: list[str], rounds: int) -> float:
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for q in queries:
+            fn(q)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--items", type=int, default=10_000)
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    p = _Provider()
+    t0 = time.perf_counter()
+    indexed, _ = _index_items(_catalogue(args.items, args.seed), p.MATCH.fields)
+    print(f"indexed {args.items:,} items in {time.perf_counter() - t0:.2f}s")
+
+    per_item = _best_of(lambda q: _rank_per_item(p, q, indexed), QUERIES, args.rounds)
+    columnar = _best_of(lambda q: p._rank(q, indexed), QUERIES, args.rounds)
+    print(f"{len(QUERIES)} queries, best of {args.rounds}:")
+    print(f"per-item: {per_item * 1000:.0f} ms")
+    print(f"columnar: {columnar * 1000:.0f} ms  ({per_item / columnar:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -54,6 +54,10 @@ def _insert_batches(material_id, warehouse_id, suffixes):
     conn.close()
 
 
+def _seq(batch_no):
+    return int(batch_no.split('-')[-1])
+
+
 class TestGenerateBatchNoSequence:
     def test_continues_from_current_max(self, sample_material):
         from database import generate_batch_no
@@ -81,13 +85,68 @@ class TestGenerateBatchNoSequence:
     def test_malformed_suffixes_are_ignored(self, sample_material):
         from database import generate_batch_no
         wh_id = sample_material['warehouse_id']
-        base = _current_max_seq(wh_id)
+        # 分配即占号（未落库的号也不会再发），所以以上一次分配结果为基准
+        last = _seq(generate_batch_no(sample_material['id'], warehouse_id=wh_id))
         _insert_batches(sample_material['id'], wh_id, ['ABC'])
 
         assert generate_batch_no(sample_material['id'], warehouse_id=wh_id) == \
-            f'{TODAY}-{base + 1:03d}'
+            f'{TODAY}-{last + 1:03d}'
 
     def test_rejects_missing_warehouse_id(self, sample_material):
         from database import generate_batch_no
         with pytest.raises(ValueError):
             generate_batch_no(sample_material['id'], warehouse_id=None)
+
+
+class TestReserveBatchNos:
+    """序号表分配：整段预留、随事务回滚、稳态不再扫描当天全部批次。"""
+
+    def test_block_is_contiguous_and_never_reissued(self, sample_material):
+        from database import generate_batch_no, reserve_batch_nos
+        wh_id = sample_material['warehouse_id']
+        block = reserve_batch_nos(wh_id, 5)
+        seqs = [_seq(bn) for bn in block]
+        assert seqs == list(range(seqs[0], seqs[0] + 5))
+        assert seqs[0] > _current_max_seq(wh_id)
+        # 预留的号没落库也不会再发出去（空号是允许的）
+        assert _seq(generate_batch_no(sample_material['id'], warehouse_id=wh_id)) == seqs[-1] + 1
+
+    def test_rolled_back_transaction_returns_its_numbers(self, sample_material):
+        from database import generate_batch_no
+        from db import get_engine
+        wh_id = sample_material['warehouse_id']
+        with get_engine().connect() as conn:
+            tx = conn.begin()
+            in_tx = generate_batch_no(sample_material['id'], warehouse_id=wh_id, conn=conn)
+            tx.rollback()
+        assert generate_batch_no(sample_material['id'], warehouse_id=wh_id) == in_tx
+
+    def test_steady_state_only_looks_at_new_batches(self, sample_material):
+        """稳态每次分配只核对水位之后新增的批次，不再按 LIKE 扫当天全部批次。"""
+        from sqlalchemy import event
+        from database import generate_batch_no
+        from db import get_engine
+        wh_id = sample_material['warehouse_id']
+        base = max(_current_max_seq(wh_id), _seq(
+            generate_batch_no(sample_material['id'], warehouse_id=wh_id)))
+        _insert_batches(sample_material['id'], wh_id,
+                        [f'{base + i:03d}' for i in range(1, 51)])
+
+        seen = []
+
+        def _on_exec(conn, cursor, statement, params, context, executemany):
+            seen.append(statement)
+
+        event.listen(get_engine(), "before_cursor_execute", _on_exec)
+        try:
+            issued = []
+            for _ in range(3):
+                bn = generate_batch_no(sample_material['id'], warehouse_id=wh_id)
+                issued.append(_seq(bn))
+                _insert_batches(sample_material['id'], wh_id, [bn.split('-')[-1]])
+        finally:
+            event.remove(get_engine(), "before_cursor_execute", _on_exec)
+
+        assert issued == [base + 51, base + 52, base + 53]
+        scans = [s for s in seen if 'LIKE' in s]
+        assert scans and all('batches.id >' in s for s in scans), scans
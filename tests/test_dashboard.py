@@ -202,6 +202,10 @@ def _seed_dashboard_setup(admin_client):
             "operator, reason_category, warehouse_id, tenant_id, created_at)"
             " VALUES (?, 'in', 1, 'sys', 'purchase', ?, ?, ?)",
             (mat_b, wh_b, t_b, now))
+    # 直接写库绕过了写路径：按租户重算日汇总（仪表盘读它）
+    from daily_stats import BACKFILL_TENANT_SQL
+    for tenant_id in (t_a, t_b):
+        cur.execute(BACKFILL_TENANT_SQL, {"tenant_id": tenant_id})
     conn.commit()
     conn.close()
 
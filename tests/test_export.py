@@ -4,6 +4,8 @@ Export tests: Excel export for materials and inventory records.
 import pytest
 from io import BytesIO
 
+from openpyxl import load_workbook
+
 
 class TestMaterialsExport:
     """Materials Excel export tests."""
@@ -29,6 +31,36 @@ class TestMaterialsExport:
         assert ws.max_row >= 2
 
 
+    def test_export_materials_status_filter_and_batch_grouping(
+            self, admin_client, sample_material, default_warehouse_id):
+        """状态按物料总库存（活跃批次求和）判定；无活跃批次的物料出一行 0 库存。"""
+        import uuid
+        from database import get_db_connection
+        sku = f"EXP-{uuid.uuid4().hex[:8].upper()}"
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO materials (name, sku, category, quantity, unit, safe_stock, location, warehouse_id)"
+            " VALUES (?, ?, 'Test Category', 0, 'pcs', 10, 'Z-09', ?)",
+            (f"Empty {sku}", sku, default_warehouse_id))
+        conn.commit()
+        conn.close()
+
+        def _rows(status):
+            resp = admin_client.get("/api/materials/export-excel", params={"status": status})
+            assert resp.status_code == 200
+            ws = load_workbook(filename=BytesIO(resp.content)).active
+            return [r for r in ws.iter_rows(min_row=2, values_only=True)]
+
+        danger = [r for r in _rows("danger") if r[2] == sku]
+        assert danger == [(f"Empty {sku}", None, sku, 'Test Category', 'pcs', 10,
+                           None, 0, 'Z-09', None)]
+        normal = _rows("normal")
+        assert not [r for r in normal if r[2] == sku]
+        mine = [r for r in normal if r[2] == sample_material['sku']]
+        assert len(mine) == 1 and mine[0][7] == 100
+
+
 class TestRecordsExport:
     """Inventory records Excel export tests."""
 
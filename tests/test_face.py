@@ -879,14 +879,143 @@ def test_reembed_inflight_dedup(conn, monkeypatch):
     assert cur.fetchone()["n"] == 1
 
 
+def test_reembed_concurrent_batch_chunked_commits(conn, monkeypatch):
+    """批量补算：推理并发受 concurrency 限制，结果按块提交，失败照常计入进度。"""
+    from backend.face import orchestrator
+
+    orchestrator._reembed_failed.clear()
+    orchestrator._reembed_inflight.clear()
+    monkeypatch.setattr(orchestrator, "REEMBED_INSERT_CHUNK", 3)
+    monkeypatch.setattr(orchestrator, "REEMBED_FLUSH_INTERVAL_S", 3600)
+    for i in range(8):
+        sid = _create_subject(conn, f"Chunk {i}")
+        _enroll(conn, sid, [0.5, 0.5, 0.0], model_tag="old-v1",
+                source_image_b64=f"photo:{i}")
+
+    state = {"running": 0, "peak": 0}
+    commits = {"n": 0}
+    progress_seen = []
+    orig_commit = conn.commit
+
+    class _CountingConn:
+        def __getattr__(self, name):
+            return getattr(conn, name)
+
+        def commit(self):
+            commits["n"] += 1
+            orig_commit()
+
+    async def slow_infer(image_b64):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.02)
+        state["running"] -= 1
+        if image_b64 == "photo:5":
+            raise orchestrator.FaceEndpointError("no_face")
+        return {"embedding": _emb_bytes([1.0, 0.0, 0.0]), "model_tag": "new-v1"}
+
+    inserted = asyncio.run(orchestrator.ensure_enrollments_for_model(
+        _CountingConn(), 1, "new-v1", slow_infer, concurrency=3,
+        progress=lambda done, total: progress_seen.append((done, total)),
+    ))
+    assert inserted == 7
+    assert state["peak"] == 3
+    assert commits["n"] == 3  # 3 + 3 + 尾批 1
+    assert progress_seen[-1] == (8, 8)
+    assert not orchestrator._reembed_inflight
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) AS n FROM face_enrollments WHERE model_tag = 'new-v1'")
+    assert cur.fetchone()["n"] == 7
+
+
+def test_enroll_stores_source_photo_as_deduped_blob(conn, monkeypatch):
+    """注册照片存 face_source_images 原始字节（同图一份），enrollment 只存哈希；
+    懒重算从 blob 取回同一张照片。"""
+    import base64
+    import hashlib
+
+    from backend.face import endpoint_client, orchestrator
+
+    photo = b"\xff\xd8\xff\xe0fake-jpeg-bytes"
+    photo_b64 = base64.b64encode(photo).decode()
+    seen = []
+
+    async def fake_infer(cfg, image_b64):
+        seen.append(image_b64)
+        tag = "new-v1" if len(seen) > 2 else "old-v1"
+        return {"embedding": _emb_bytes([1.0, 0.0, 0.0]), "model_tag": tag}
+
+    monkeypatch.setattr(endpoint_client, "infer", fake_infer)
+    _set_config(conn, enabled=True)
+    sid = _create_subject(conn, "Blob Person")
+    asyncio.run(orchestrator.enroll_face(
+        conn, subject_id=sid, tenant_id=1,
+        images_b64=[photo_b64, "data:image/jpeg;base64," + photo_b64],
+    ))
+    cur = conn.cursor()
+    cur.execute("SELECT sha256, data, byte_size FROM face_source_images")
+    blobs = cur.fetchall()
+    assert len(blobs) == 1
+    assert bytes(blobs[0]["data"]) == photo
+    assert blobs[0]["byte_size"] == len(photo)
+    assert blobs[0]["sha256"] == hashlib.sha256(photo).hexdigest()
+    cur.execute(
+        "SELECT source_image_b64, source_image_sha256 FROM face_enrollments"
+        " WHERE subject_id = ?", (sid,))
+    rows = cur.fetchall()
+    assert [r["source_image_b64"] for r in rows] == [None, None]
+    assert {r["source_image_sha256"] for r in rows} == {blobs[0]["sha256"]}
+
+    orchestrator._reembed_failed.clear()
+    orchestrator._reembed_inflight.clear()
+
+    async def reembed(image_b64):
+        return await fake_infer(None, image_b64)
+
+    assert asyncio.run(orchestrator.ensure_enrollments_for_model(
+        conn, 1, "new-v1", reembed)) == 1
+    assert seen[-1] == photo_b64
+
+
+def test_init_database_migrates_legacy_source_photos(conn):
+    """旧库 source_image_b64 → 能解码的搬进 blob 表并清空旧列；解不开的原样保留。"""
+    import base64
+
+    import database
+
+    sid = _create_subject(conn, "Legacy Photo")
+    good = base64.b64encode(b"legacy-photo-bytes").decode()
+    _enroll(conn, sid, [1.0, 0.0, 0.0], model_tag="old-v1", source_image_b64=good)
+    _enroll(conn, sid, [1.0, 0.0, 0.0], model_tag="old-v2", source_image_b64=good)
+    _enroll(conn, sid, [1.0, 0.0, 0.0], model_tag="old-v3", source_image_b64="photo:x")
+
+    database.init_database()
+    database.init_database()  # 幂等
+
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT model_tag, source_image_b64, source_image_sha256 FROM face_enrollments"
+        " WHERE subject_id = ? ORDER BY id", (sid,))
+    rows = [tuple(r) for r in cur.fetchall()]
+    assert rows[0][1] is None and rows[0][2]
+    assert rows[1][1:] == rows[0][1:]
+    assert rows[2] == ("old-v3", "photo:x", None)
+    cur.execute("SELECT COUNT(*) AS n, SUM(byte_size) AS b FROM face_source_images")
+    r = cur.fetchone()
+    assert (r["n"], r["b"]) == (1, len(b"legacy-photo-bytes"))
+
+
 def test_bg_recompute_full_batch_and_singleton(conn, monkeypatch):
     """配置变更触发的后台批量补算：全量补齐 + 进度 status + 同 key 不重复启动。"""
+    import jobs
     from backend.face import endpoint_client, orchestrator
 
+    def _latest_job():
+        return jobs.list_jobs(tenant_id=1, job_type=orchestrator.RECOMPUTE_JOB_TYPE,
+                              limit=1)[0]["job_id"]
+
     orchestrator._reembed_failed.clear()
     orchestrator._reembed_inflight.clear()
-    orchestrator._recompute_tasks.clear()
-    orchestrator._recompute_status.clear()
 
     for i in range(5):
         sid = _create_subject(conn, f"Batch {i}")
@@ -911,7 +1040,7 @@ def test_bg_recompute_full_batch_and_singleton(conn, monkeypatch):
         # 任务仍在（或刚建未完成）→ 同 key 幂等拒绝二次启动
         assert orchestrator.start_background_recompute(
             1, "lan", "http://fake.local", None) is False
-        await orchestrator._recompute_tasks[(1, "lan", "http://fake.local")]
+        await jobs.await_job(_latest_job())
     asyncio.run(_run())
 
     st = orchestrator.get_recompute_status(1)
@@ -924,11 +1053,72 @@ def test_bg_recompute_full_batch_and_singleton(conn, monkeypatch):
     async def _rerun():
         assert orchestrator.start_background_recompute(
             1, "lan", "http://fake.local", None) is True
-        await orchestrator._recompute_tasks[(1, "lan", "http://fake.local")]
+        await jobs.await_job(_latest_job())
     asyncio.run(_rerun())
     assert calls["infer"] == 5  # 已全部补齐，零额外推理
 
 
+# ── 本机推理（mode=local）走专用执行器，不阻塞事件循环 ──────────────────────
+
+
+def test_local_infer_concurrent_enrollments_overlap(conn, monkeypatch):
+    """两路并发 local 注册：推理在执行器线程里重叠执行，事件循环期间照常调度。"""
+    import threading
+    import time as _time
+    from backend.face import endpoint_client, orchestrator
+
+    monkeypatch.setattr(endpoint_client, "_local_executor", None)
+    monkeypatch.setattr(endpoint_client, "LOCAL_INFER_WORKERS", 2)
+    state = {"running": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def slow_local(image_b64):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        _time.sleep(0.2)  # 同步 CPU 活（PIL + SCRFD + MFN）的替身
+        with lock:
+            state["running"] -= 1
+        return {"embedding": _emb_bytes([1.0, 0.0, 0.0]),
+                "model_tag": endpoint_client.LOCAL_MODEL_TAG}
+
+    monkeypatch.setattr(endpoint_client, "_infer_local", slow_local)
+    _set_config(conn, enabled=True, mode="local")
+    sid_a = _create_subject(conn, "Local A")
+    sid_b = _create_subject(conn, "Local B")
+    before = endpoint_client.local_infer_stats()
+
+    async def _run():
+        ticks = 0
+        stop = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not stop.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        t = asyncio.create_task(ticker())
+        t0 = _time.perf_counter()
+        await asyncio.gather(
+            orchestrator.enroll_face(conn, subject_id=sid_a, tenant_id=1, images_b64=["a"]),
+            orchestrator.enroll_face(conn, subject_id=sid_b, tenant_id=1, images_b64=["b"]),
+        )
+        elapsed = _time.perf_counter() - t0
+        stop.set()
+        await t
+        return elapsed, ticks
+
+    elapsed, ticks = asyncio.run(_run())
+    assert state["peak"] == 2
+    assert elapsed < 0.35  # 串行至少 0.4s
+    assert ticks >= 5  # 推理期间事件循环没被卡住
+    after = endpoint_client.local_infer_stats()
+    assert after["completed"] - before["completed"] == 2
+    assert after["queued"] == 0 and after["running"] == 0
+    assert after["last_ms"] >= 150
+
+
 # ── endpoint_client /infer parsing: passive liveness (spoof) ─────────────
 
 
@@ -21,10 +21,10 @@ def _emb_b64(vec):
     return _b64.b64encode(_emb_bytes(vec)).decode()
 
 
-def _set_cfg(admin_client, token, *, min_confidence=0.5,
+def _set_cfg(admin_client, token, *, min_confidence=0.5, mode="lan",
              endpoint="http://device-recog-fake.invalid:8001"):
     r = admin_client.put("/api/face/config", json={
-        "enabled": True, "mode": "lan", "endpoint": endpoint,
+        "enabled": True, "mode": mode, "endpoint": endpoint,
         "auth_token": token, "min_confidence": min_confidence,
     })
     assert r.status_code == 200, r.text
@@ -240,3 +240,96 @@ class TestDeviceRecognizeFlow:
                 "SELECT model_tag FROM face_enrollments WHERE subject_id = :sid"),
                 {"sid": sid}).fetchall()}
         assert {old_mt, new_mt} <= tags
+
+
+class TestDeviceRecognizeLocalInfer:
+    """mode=local 的识别走 infer_local → 专用执行器 → WE2SimulatorPool。
+
+    模拟器换成慢替身（不需要模型文件），其余链路全是真的：两路并发识别应在
+    池里各借一个实例重叠执行，事件循环期间照常调度。
+    """
+
+    def test_concurrent_recognitions_overlap_on_simulator_pool(
+            self, admin_client, monkeypatch, _track_subjects):
+        import asyncio
+        import io
+        import threading
+        import time
+
+        from PIL import Image
+        from starlette.requests import Request
+
+        import face.we2.simulator as we2_sim
+        from face import endpoint_client
+        from face.we2 import WE2SimulatorPool
+        from routers.face import DeviceRecognizePayload, face_device_recognize
+
+        tok = "tok-" + uuid.uuid4().hex
+        mt = "dev-mt-local-" + uuid.uuid4().hex[:8]
+        vec = [0.0, 1.0, 0.0]
+        _set_cfg(admin_client, tok, mode="local", endpoint="")
+        sid = admin_client.post(
+            "/api/face/subjects", json={"name": "Dev Local"}).json()["id"]
+        _track_subjects.append(sid)
+        r = admin_client.post("/api/face/enrollments", json={
+            "subject_id": sid,
+            "embeddings": [{"embedding_b64": _emb_b64(vec), "model_tag": mt}],
+        })
+        assert r.status_code == 200, r.text
+
+        state = {"running": 0, "peak": 0, "sims": set()}
+        lock = threading.Lock()
+
+        class _SlowSim:
+            def infer(self, image):
+                with lock:
+                    state["running"] += 1
+                    state["peak"] = max(state["peak"], state["running"])
+                    state["sims"].add(id(self))
+                time.sleep(0.2)  # SCRFD + MFN 的替身
+                with lock:
+                    state["running"] -= 1
+                return {"faces": [{"det_score": 0.9, "embedding_bytes": _emb_bytes(vec)}],
+                        "model_tag": mt}
+
+        monkeypatch.setattr(endpoint_client, "_local_executor", None)
+        monkeypatch.setattr(endpoint_client, "LOCAL_INFER_WORKERS", 2)
+        monkeypatch.setattr(we2_sim, "_pool", WE2SimulatorPool(2, factory=_SlowSim))
+
+        buf = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(buf, format="PNG")
+        payload = DeviceRecognizePayload(image_base64=_b64.b64encode(buf.getvalue()).decode())
+        request = Request({"type": "http", "method": "POST", "path": "/api/face/device/recognize",
+                           "headers": [(b"authorization", f"Bearer {tok}".encode())]})
+        before = endpoint_client.local_infer_stats()
+
+        async def _run():
+            ticks = 0
+            stop = asyncio.Event()
+
+            async def ticker():
+                nonlocal ticks
+                while not stop.is_set():
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            t = asyncio.create_task(ticker())
+            t0 = time.perf_counter()
+            results = await asyncio.gather(
+                face_device_recognize(payload, request),
+                face_device_recognize(payload, request),
+            )
+            elapsed = time.perf_counter() - t0
+            stop.set()
+            await t
+            return results, elapsed, ticks
+
+        results, elapsed, ticks = asyncio.run(_run())
+        assert [r["matched"] for r in results] == [True, True], results
+        assert all(r["name"] == "Dev Local" for r in results)
+        assert state["peak"] == 2 and len(state["sims"]) == 2  # 各借一个模拟器实例
+        assert elapsed < 0.35  # 串行至少 0.4s
+        assert ticks >= 5  # 推理期间事件循环没被卡住
+        after = endpoint_client.local_infer_stats()
+        assert after["completed"] - before["completed"] == 2
+        assert after["queued"] == 0 and after["running"] == 0
@@ -216,3 +216,43 @@ class TestFaceVerifyMcpWarehouseScope:
         # 规则在无 payload warehouse_id 时仍生效并拒绝，而非具体原因。
         assert body["status"] == "deny", body
         assert body["failure_reason"] == "device_unresolved", body
+
+
+class TestFaceSourceImageGc:
+    """删除 enrollment 后，没有引用的注册照片会从 face_source_images 清掉；
+    仍被其他 enrollment 引用的照片保留。"""
+
+    def test_delete_enrollment_drops_orphan_photo_only(self, admin_client):
+        from sqlalchemy import select
+
+        from db import get_engine
+        from metadata import face_enrollments as _t_fe, face_source_images as _t_img
+
+        sid = admin_client.post("/api/face/subjects", json={"name": "GcPerson"}).json()["id"]
+        tid = admin_client.get("/api/face/subjects").json()[0]["tenant_id"]
+        shared, solo = "a" * 64, "b" * 64
+        with get_engine().begin() as c:
+            for sha in (shared, solo):
+                c.execute(_t_img.insert().values(
+                    tenant_id=tid, sha256=sha, data=b"img-" + sha.encode(), byte_size=68))
+            ids = [
+                c.execute(_t_fe.insert().values(
+                    subject_id=sid, tenant_id=tid, model_tag="gc-mt",
+                    embedding=b"\0" * 12, source_image_sha256=sha, is_active=1,
+                )).inserted_primary_key[0]
+                for sha in (shared, shared, solo)
+            ]
+        try:
+            for eid in (ids[0], ids[2]):
+                r = admin_client.delete(f"/api/face/enrollments/{eid}")
+                assert r.status_code == 200, r.text
+            with get_engine().connect() as c:
+                left = set(c.execute(
+                    select(_t_img.c.sha256).where(_t_img.c.tenant_id == tid)).scalars())
+            assert shared in left and solo not in left
+        finally:
+            admin_client.delete(f"/api/face/subjects/{sid}")
+        with get_engine().connect() as c:
+            left = set(c.execute(
+                select(_t_img.c.sha256).where(_t_img.c.tenant_id == tid)).scalars())
+        assert shared not in left
@@ -291,3 +291,44 @@ def test_simulator_dequant_matches_manual():
     # Float32 round-trip is exact for the LE wire format.
     sim_arr = np.frombuffer(sim_bytes, dtype=np.float32)
     assert np.array_equal(sim_arr, manual)
+
+
+# ---------------------------------------------------------------------------
+# Interpreter pool
+# ---------------------------------------------------------------------------
+
+def test_simulator_pool_hands_out_distinct_instances_concurrently():
+    """Pool of N: N concurrent callers each hold their own simulator instance."""
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from face.we2 import WE2SimulatorPool
+
+    class _FakeSim:
+        def __init__(self):
+            self.busy = False
+
+        def infer(self, image):
+            assert not self.busy, "one simulator instance used by two callers"
+            self.busy = True
+            time.sleep(0.05)
+            self.busy = False
+            return {"faces": [], "face_count": 0, "model_tag": "fake", "sim": id(self)}
+
+    pool = WE2SimulatorPool(2, factory=_FakeSim)
+    assert pool.size == 2
+    barrier = threading.Barrier(2)
+
+    def _call(_):
+        barrier.wait()
+        return pool.infer(None)["sim"]
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        used = set(ex.map(_call, range(2)))
+    assert len(used) == 2
+
+    # A third caller on a busy pool waits for a returned instance, never a new one.
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        used3 = set(ex.map(lambda _: pool.infer(None)["sim"], range(3)))
+    assert used3 <= used
@@ -68,6 +68,43 @@ class TestImportPreview:
         data = resp.json()
         assert data['success'] is True
 
+    def test_preview_queries_do_not_scale_with_rows(self, admin_client, sample_material):
+        """行级匹配走批量 IN 查询：SQL 条数与行数无关。"""
+        from openpyxl import Workbook
+        from sqlalchemy import event
+        from db import get_engine
+
+        def run(n):
+            wb = Workbook()
+            ws = wb.active
+            ws.append(['物料名称', '物料编码(SKU)', '批次号', '库存', '联系方'])
+            ws.append([sample_material['name'], sample_material['sku'], 'NO-SUCH-BATCH', 5, '供应商X'])
+            for i in range(n):
+                ws.append([f'批量预览 {i}', f'PREVIEW-BULK-{i}', f'B-{i}', i, f'供应商{i}'])
+            buffer = BytesIO()
+            wb.save(buffer)
+            buffer.seek(0)
+            seen = []
+
+            def _on_exec(conn, cursor, statement, params, context, executemany):
+                seen.append(statement)
+
+            event.listen(get_engine(), "before_cursor_execute", _on_exec)
+            try:
+                resp = admin_client.post(
+                    "/api/materials/import-excel/preview",
+                    files={"file": ("bulk.xlsx", buffer, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+                )
+            finally:
+                event.remove(get_engine(), "before_cursor_execute", _on_exec)
+            data = resp.json()
+            assert data['success'] is True, data
+            assert data['is_batch_mode'] is True
+            assert len(data['preview']) == n + 1
+            return len(seen)
+
+        assert run(5) == run(120)
+
     def test_preview_rejects_records_export_template(self, admin_client):
         """Inventory records exports should not be accepted as inventory import templates."""
         from openpyxl import Workbook
@@ -329,6 +366,124 @@ class TestImportConfirm:
             assert confirm_resp.status_code == 200
 
 
+class TestImportConfirmBulk:
+    """confirm 走集合式执行：预加载 + 内存推演 + 批量写入，语句数不随行数增长。"""
+
+    @staticmethod
+    def _seed(warehouse_id, batch_qtys):
+        import uuid
+        from database import get_db_connection
+        sku = f"BULK-{uuid.uuid4().hex[:8].upper()}"
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO materials (name, sku, category, quantity, unit, warehouse_id) "
+            "VALUES (?, ?, 'Bulk', 0, 'pcs', ?)", (f"Bulk {sku}", sku, warehouse_id))
+        mid = cur.lastrowid
+        for i, qty in enumerate(batch_qtys):
+            cur.execute(
+                "INSERT INTO batches (batch_no, material_id, quantity, initial_quantity, "
+                "is_exhausted, warehouse_id, created_at) VALUES (?, ?, ?, ?, 0, ?, ?)",
+                (f"{sku}-B{i}", mid, qty, qty, warehouse_id, f"2025-01-0{i + 1} 00:00:00"))
+        conn.commit()
+        conn.close()
+        return sku, mid
+
+    @staticmethod
+    def _row(sku, operation, difference, **kw):
+        return {"sku": sku, "name": f"Bulk {sku}", "category": "Bulk", "unit": "pcs",
+                "import_quantity": 0, "difference": difference, "operation": operation, **kw}
+
+    def _count_statements(self, admin_client, payload):
+        from sqlalchemy import event
+        from db import get_engine
+        seen = []
+
+        def _on_exec(conn, cursor, statement, params, context, executemany):
+            seen.append(statement)
+
+        event.listen(get_engine(), "before_cursor_execute", _on_exec)
+        try:
+            resp = admin_client.post("/api/materials/import-excel/confirm", json=payload)
+        finally:
+            event.remove(get_engine(), "before_cursor_execute", _on_exec)
+        assert resp.status_code == 200, resp.text
+        assert resp.json()['success'] is True, resp.json()
+        return len(seen)
+
+    def test_statement_count_independent_of_row_count(self, admin_client, default_warehouse_id):
+        def payload(n):
+            import uuid
+            supplier = f"批量供应商-{uuid.uuid4().hex[:6]}"
+            rows = []
+            for _ in range(n):
+                sku, _mid = self._seed(default_warehouse_id, [10])
+                rows.append(self._row(sku, "in", 5, contact_name=supplier))
+                rows.append(self._row(sku, "out", -3))
+            return {"changes": rows, "warehouse_id": default_warehouse_id}
+
+        small = self._count_statements(admin_client, payload(3))
+        large = self._count_statements(admin_client, payload(40))
+        assert large == small, f"statements grew with rows: {small} -> {large}"
+
+    def test_later_rows_see_earlier_rows_in_memory(self, admin_client, default_warehouse_id):
+        """同一文件里后行能看到前行的新批次 / 新物料，FIFO 扣减与逐行执行一致。"""
+        from database import get_db_connection
+        sku, mid = self._seed(default_warehouse_id, [5, 5])
+        new_sku = f"{sku}-NEW"
+        resp = admin_client.post("/api/materials/import-excel/confirm", json={
+            "warehouse_id": default_warehouse_id,
+            "confirm_new_skus": True,
+            "changes": [
+                self._row(sku, "in", 3),
+                self._row(sku, "out", -12),  # 5 + 5 + 3：耗尽两个老批次，再扣 2 个新批次
+                {**self._row(new_sku, "new", 4, import_quantity=4), "is_new": True},
+                {**self._row(new_sku, "new", 0, import_quantity=1), "is_new": True},
+            ],
+        })
+        assert resp.status_code == 200, resp.text
+        body = resp.json()
+        assert body['success'] is True, body
+        assert (body['in_count'], body['out_count'], body['new_count'], body['records_created']) == (1, 1, 2, 4)
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        batches = cur.execute(
+            "SELECT quantity, initial_quantity, is_exhausted FROM batches "
+            "WHERE material_id = ? ORDER BY id", (mid,)).fetchall()
+        assert [tuple(b) for b in batches] == [(0, 5, 1), (0, 5, 1), (1, 3, 0)]
+        consumed = cur.execute(
+            "SELECT bc.quantity FROM batch_consumptions bc JOIN inventory_records r "
+            "ON r.id = bc.record_id WHERE r.material_id = ? AND r.type = 'out' "
+            "ORDER BY bc.batch_id", (mid,)).fetchall()
+        assert [c[0] for c in consumed] == [5, 5, 2]
+        new_rows = cur.execute(
+            "SELECT m.id, SUM(b.quantity) FROM materials m JOIN batches b ON b.material_id = m.id "
+            "WHERE m.sku = ? AND b.is_exhausted = 0 GROUP BY m.id", (new_sku,)).fetchall()
+        conn.close()
+        # 第二行按"SKU已存在"处理：4 → 1，走 FIFO 出库 3
+        assert len(new_rows) == 1 and new_rows[0][1] == 1
+
+    def test_shortfall_aborts_before_any_write(self, admin_client, default_warehouse_id):
+        from database import get_db_connection
+        sku, mid = self._seed(default_warehouse_id, [2])
+        resp = admin_client.post("/api/materials/import-excel/confirm", json={
+            "warehouse_id": default_warehouse_id,
+            "changes": [self._row(sku, "in", 4, contact_name="不应创建的联系方"),
+                        self._row(sku, "out", -9)],
+        })
+        body = resp.json()
+        assert body['success'] is False
+        assert (body['in_count'], body['records_created']) == (1, 1)
+        conn = get_db_connection()
+        cur = conn.cursor()
+        assert cur.execute("SELECT COUNT(*) FROM batches WHERE material_id = ?", (mid,)).fetchone()[0] == 1
+        assert cur.execute("SELECT COUNT(*) FROM inventory_records WHERE material_id = ?",
+                           (mid,)).fetchone()[0] == 0
+        assert cur.execute("SELECT COUNT(*) FROM contacts WHERE name = '不应创建的联系方'").fetchone()[0] == 0
+        conn.close()
+
+
 class TestImportUnitSanitization:
     """Imported cells must strip Excel formula residue (e.g. '=+VLOOKUP(...)').
 
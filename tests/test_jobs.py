@@ -0,0 +1,207 @@
+"""
+Background job framework (backend/jobs.py) and the /api/jobs routes.
+"""
+import gzip
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+
+def _is_sqlite_backend() -> bool:
+    from db import get_engine
+    return get_engine().dialect.name == "sqlite"
+
+
+sqlite_only = pytest.mark.skipif(
+    not _is_sqlite_backend(),
+    reason="sqlite-only feature (db export streams a literal .db file)",
+)
+
+
+@pytest.fixture()
+def jobs(admin_client):
+    import jobs as jobs_module
+    return jobs_module
+
+
+def _job_type(jobs, limit=1):
+    job_type = f"test_{uuid.uuid4().hex[:8]}"
+    jobs.register_job_type(job_type, limit=limit)
+    return job_type
+
+
+def test_per_type_limit_queues_and_pending_cancel(jobs):
+    job_type = _job_type(jobs, limit=1)
+    release = threading.Event()
+
+    def work(ctx, n):
+        ctx.progress(0, n)
+        assert release.wait(5)
+        ctx.progress(n, message="done")
+        return {"n": n}
+
+    first = jobs.submit_job(job_type, work, 3, tenant_id=1)
+    second = jobs.submit_job(job_type, work, 4, tenant_id=1)
+    third = jobs.submit_job(job_type, work, 5, tenant_id=1)
+    assert jobs.get_job(second["job_id"])["status"] == jobs.PENDING
+
+    cancelled = jobs.cancel_job(third["job_id"])
+    assert cancelled["status"] == jobs.CANCELLED
+
+    release.set()
+    done = jobs.wait_job(first["job_id"], 5)
+    assert done["status"] == jobs.SUCCEEDED and done["result"] == {"n": 3}
+    assert done["done"] == done["total"] == 3 and done["percent"] == 100.0
+    # 第一个结束后排队的第二个才开跑
+    assert jobs.wait_job(second["job_id"], 5)["result"] == {"n": 4}
+    assert jobs.get_job(third["job_id"])["status"] == jobs.CANCELLED
+
+
+def test_running_job_stops_at_checkpoint(jobs):
+    job_type = _job_type(jobs)
+    started = threading.Event()
+    steps = []
+
+    def work(ctx):
+        started.set()
+        for i in range(500):
+            ctx.check_cancelled()
+            steps.append(i)
+            time.sleep(0.01)
+        return "finished"
+
+    job = jobs.submit_job(job_type, work)
+    assert started.wait(5)
+    jobs.cancel_job(job["job_id"])
+    final = jobs.wait_job(job["job_id"], 5)
+    assert final["status"] == jobs.CANCELLED and final["result"] is None
+    assert len(steps) < 500
+
+
+def test_failure_records_http_detail_and_dedupe(jobs):
+    job_type = _job_type(jobs, limit=2)
+    gate = threading.Event()
+
+    def fail(ctx):
+        assert gate.wait(5)
+        raise HTTPException(status_code=400, detail="文件格式错误")
+
+    job = jobs.submit_job(job_type, fail, tenant_id=1, dedupe_key="tenant:1")
+    with pytest.raises(jobs.JobConflict) as exc:
+        jobs.submit_job(job_type, fail, tenant_id=1, dedupe_key="tenant:1")
+    assert exc.value.job["job_id"] == job["job_id"]
+
+    gate.set()
+    final = jobs.wait_job(job["job_id"], 5)
+    assert final["status"] == jobs.FAILED and final["error"] == "文件格式错误"
+    # 结束后同 key 可再次提交
+    again = jobs.submit_job(job_type, fail, tenant_id=1, dedupe_key="tenant:1")
+    jobs.wait_job(again["job_id"], 5)
+
+
+def test_async_job_runs_on_submitting_loop(jobs):
+    import asyncio
+    job_type = _job_type(jobs)
+
+    async def work(ctx, x):
+        await asyncio.sleep(0.01)
+        ctx.progress(1, 1)
+        return x * 2
+
+    async def run():
+        job = jobs.submit_job(job_type, work, 21)
+        return await jobs.await_job(job["job_id"])
+
+    final = asyncio.run(run())
+    assert final["status"] == jobs.SUCCEEDED and final["result"] == 42
+
+
+def test_recover_orphaned_marks_dead_owner_failed(jobs):
+    import socket
+    from sqlalchemy import insert
+    from db import get_engine
+    from metadata import background_jobs
+
+    job_id = uuid.uuid4().hex
+    with get_engine().begin() as c:
+        c.execute(insert(background_jobs).values(
+            id=job_id, job_type="db_import", status=jobs.RUNNING,
+            owner=f"{socket.gethostname()}:99999999",
+        ))
+    assert jobs.recover_orphaned_jobs() >= 1
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.FAILED and job["error"]
+
+
+@sqlite_only
+def test_background_export_download_and_prune(admin_client, jobs):
+    resp = admin_client.get("/api/database/export?background=true&compression=gzip")
+    assert resp.status_code == 202, resp.text
+    job_id = resp.json()["job_id"]
+    assert resp.json()["job_type"] == "db_export"
+
+    for _ in range(200):
+        job = admin_client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] not in jobs.ACTIVE_STATUSES:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "succeeded", job
+    assert job["download"] is True
+    assert any(j["job_id"] == job_id for j in admin_client.get("/api/jobs").json()["jobs"])
+
+    download = admin_client.get(f"/api/jobs/{job_id}/download")
+    assert download.status_code == 200
+    assert download.headers["content-disposition"].endswith('.db.gz"')
+    raw = gzip.decompress(download.content)
+    assert raw.startswith(b"SQLite format 3\x00")
+
+    # 已结束任务再取消：原样返回
+    assert admin_client.post(f"/api/jobs/{job_id}/cancel").json()["status"] == "succeeded"
+
+    jobs.prune_finished_jobs(retention_days=-1)
+    assert admin_client.get(f"/api/jobs/{job_id}").status_code == 404
+    assert admin_client.get(f"/api/jobs/{job_id}/download").status_code == 404
+
+
+def test_unbound_api_key_sees_no_jobs_and_view_cannot_cancel(admin_client, app_instance, jobs):
+    """未绑定用户的 API key（user_id 为 NULL）：created_by 为 NULL 的系统任务不能
+    因为 None == None 对它可见；取消是写操作，只读 key 不能取消。"""
+    from fastapi.testclient import TestClient
+    from database import get_db_connection
+
+    job_type = _job_type(jobs)
+    release = threading.Event()
+    system_job = jobs.submit_job(job_type, lambda ctx: release.wait(5), tenant_id=1)
+    keys = {}
+    try:
+        for role in ("view", "operate"):
+            resp = admin_client.post("/api/api-keys", json={"name": f"unbound-{role}", "role": role})
+            assert resp.status_code == 200, resp.text
+            keys[role] = resp.json()
+            conn = get_db_connection()
+            conn.execute("UPDATE api_keys SET user_id = NULL WHERE id = ?", (keys[role]["id"],))
+            conn.commit()
+            conn.close()
+
+        view = TestClient(app_instance, headers={"X-API-Key": keys["view"]["key"]})
+        assert view.get("/api/jobs").json() == {"jobs": []}
+        assert view.get(f"/api/jobs/{system_job['job_id']}").status_code == 404
+        assert view.post(f"/api/jobs/{system_job['job_id']}/cancel").status_code == 403
+
+        operate = TestClient(app_instance, headers={"X-API-Key": keys["operate"]["key"]})
+        assert operate.post(f"/api/jobs/{system_job['job_id']}/cancel").status_code == 404
+        assert jobs.get_job(system_job["job_id"])["status"] in jobs.ACTIVE_STATUSES
+
+        # 租户管理员照常能看到系统任务
+        assert any(j["job_id"] == system_job["job_id"]
+                   for j in admin_client.get("/api/jobs").json()["jobs"])
+    finally:
+        release.set()
+        jobs.wait_job(system_job["job_id"], 5)
+        conn = get_db_connection()
+        conn.executemany("DELETE FROM api_keys WHERE id = ?", [(k["id"],) for k in keys.values()])
+        conn.commit()
+        conn.close()
@@ -699,6 +699,8 @@ class TestMCPSlimResponse:
 
             def http_get(self, path, params=None):
                 params = params or {}
+                if path == "/materials/stock-lookup":  # 旧版后端没有一站式端点
+                    return {"success": False, "error": "Not Found", "status_code": 404}
                 if path == "/materials/product-stats":
                     return {"error": "not found"}
                 if path == "/fuzzy-match":
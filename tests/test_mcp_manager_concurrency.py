@@ -268,3 +268,145 @@ async def test_start_connection_forwards_safe_log_context(monkeypatch, tmp_path)
             await proc._log_task
         except (asyncio.CancelledError, Exception):
             pass
+
+
+@pytest.mark.parametrize(
+    ("shared", "raw_value", "expected"),
+    [
+        ("1", None, 8),
+        ("0", None, 1),
+        ("1", "3", 3),
+        ("1", "0", 1),
+        ("1", "500", 32),
+        ("0", "invalid", 1),
+    ],
+)
+def test_get_autostart_concurrency(monkeypatch, shared, raw_value, expected):
+    import mcp_manager
+
+    monkeypatch.setenv("MCP_SHARED_RUNTIME", shared)
+    if raw_value is None:
+        monkeypatch.delenv("MCP_AUTOSTART_CONCURRENCY", raising=False)
+    else:
+        monkeypatch.setenv("MCP_AUTOSTART_CONCURRENCY", raw_value)
+
+    assert mcp_manager.get_autostart_concurrency() == expected
+
+
+class _RestoreManager:
+    """Records start order and handshakes in flight during restore."""
+
+    def __init__(self, slow=(), timeout_ids=(), failing=()):
+        self.restore_progress = None
+        self.started = []
+        self.in_flight = 0
+        self.peak = 0
+        self._slow, self._timeout, self._failing = set(slow), set(timeout_ids), set(failing)
+
+    async def start_connection(self, conn_id, endpoint, api_key, debug_mode=False):
+        if conn_id in self._failing:
+            raise RuntimeError("boom")
+        self.started.append(conn_id)
+
+    def get_connection_status(self, conn_id):
+        return {"status": "running"}
+
+    async def wait_for_protocol_ready(self, conn_id, timeout=30.0):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.05 if conn_id in self._slow else 0.01)
+        finally:
+            self.in_flight -= 1
+        return conn_id not in self._timeout
+
+
+@pytest.mark.asyncio
+async def test_restore_bounds_handshakes_and_reports_progress(admin_client, monkeypatch):
+    from types import SimpleNamespace
+    import app as app_module
+
+    rows = [SimpleNamespace(id=f"r{i}", name=f"agent {i}", mcp_endpoint="wss://x",
+                            api_key="k", debug_mode=0) for i in range(10)]
+    monkeypatch.setattr(app_module, "_load_auto_start_mcp_connections", lambda: rows)
+    monkeypatch.setenv("MCP_AUTOSTART_CONCURRENCY", "3")
+    mgr = _RestoreManager(slow={"r0"}, timeout_ids={"r4"}, failing={"r7"})
+
+    await app_module._restore_auto_start_mcp_connections(mgr)
+
+    # 高优先级先启动；慢握手不阻塞后续连接补位
+    assert mgr.started[:3] == ["r0", "r1", "r2"]
+    assert mgr.started.index("r3") < mgr.started.index("r9")
+    assert mgr.peak == 3
+    snap = mgr.restore_progress.snapshot()
+    assert snap["running"] is False and snap["concurrency"] == 3
+    assert (snap["total"], snap["ready"], snap["timeout"], snap["failed"]) == (10, 8, 1, 1)
+    assert [c["id"] for c in snap["connections"]] == [r.id for r in rows]
+    assert snap["connections"][4]["state"] == "timeout"
+
+
+def test_autostart_order_prefers_recently_active_agents(admin_client):
+    import uuid
+    from datetime import datetime, timedelta
+    from sqlalchemy import delete, insert
+    import app as app_module
+    from database import hash_api_key
+    from db import get_engine
+    from metadata import api_keys, mcp_connections
+
+    tag = uuid.uuid4().hex[:6]
+    now = datetime.now()
+    specs = [  # (conn id, key last_used_at, connection updated_at)
+        (f"idle-{tag}", None, now),
+        (f"old-{tag}", now - timedelta(days=3), now - timedelta(days=9)),
+        (f"hot-{tag}", now - timedelta(minutes=1), now - timedelta(days=9)),
+    ]
+    with get_engine().begin() as c:
+        for conn_id, used, updated in specs:
+            key = f"key-{conn_id}"
+            c.execute(insert(mcp_connections).values(
+                id=conn_id, name=conn_id, mcp_endpoint=f"wss://example.invalid/{conn_id}",
+                api_key=key, auto_start=1, updated_at=updated.isoformat()))
+            c.execute(insert(api_keys).values(
+                key_hash=hash_api_key(key), name=conn_id, last_used_at=used))
+    try:
+        order = [r.id for r in app_module._load_auto_start_mcp_connections()
+                 if r.id.endswith(tag)]
+        assert order == [f"hot-{tag}", f"old-{tag}", f"idle-{tag}"]
+    finally:
+        with get_engine().begin() as c:
+            c.execute(delete(mcp_connections).where(mcp_connections.c.id.like(f"%{tag}")))
+            c.execute(delete(api_keys).where(api_keys.c.name.like(f"%{tag}")))
+
+
+def test_restore_status_route(admin_client):
+    import uuid
+    from sqlalchemy import delete, insert
+    import mcp_manager
+    from app import app
+    from db import get_engine
+    from metadata import mcp_connections
+
+    ids = [f"rs-{uuid.uuid4().hex[:8]}" for _ in range(2)]
+    with get_engine().begin() as c:
+        for conn_id in ids:
+            c.execute(insert(mcp_connections).values(
+                id=conn_id, name=conn_id, mcp_endpoint=f"wss://example.invalid/{conn_id}",
+                api_key="k", tenant_id=1))
+    admin_client.get("/api/mcp/connections")  # 触发 manager 的 lazy 初始化
+    mgr = app.state.mcp_manager
+    previous = mgr.restore_progress
+    try:
+        mgr.restore_progress = None
+        assert admin_client.get("/api/mcp/restore-status").json() == {
+            "available": False, "running": False}
+        progress = mcp_manager.RestoreProgress(ids, 8)
+        progress.mark(ids[0], "ready")
+        mgr.restore_progress = progress
+        body = admin_client.get("/api/mcp/restore-status").json()
+        assert body["available"] and body["running"]
+        assert (body["total"], body["ready"], body["queued"]) == (2, 1, 1)
+    finally:
+        mgr.restore_progress = previous
+        with get_engine().begin() as c:
+            c.execute(delete(mcp_connections).where(mcp_connections.c.id.in_(ids)))
@@ -0,0 +1,145 @@
+"""只读 MCP 工具的会话级结果缓存（warehouse_mcp._session_cache）。
+
+语音对话里同一查询常被连问两遍；MCP_READ_CACHE_TTL 开启后同一会话、同一
+（归一化后的）参数在 TTL 内直接复用上次结果。写工具让同租户缓存失效，
+人脸核验过的结果、失败结果不缓存，会话之间互不可见。
+"""
+
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MCP_DIR = os.path.join(REPO_ROOT, 'mcp')
+if MCP_DIR not in sys.path:
+    sys.path.insert(0, MCP_DIR)
+
+
+class _CountingProvider:
+    def __init__(self):
+        self.calls = []
+        self.stock = 12
+
+    def query_stock(self, product_name, show_batches=True):
+        self.calls.append(("query_stock", product_name))
+        return {"success": True,
+                "product": {"name": product_name, "current_stock": self.stock, "unit": "个"}}
+
+    def get_today_statistics(self):
+        self.calls.append(("get_today_statistics",))
+        return {"success": True, "today_in": 3, "today_out": 1}
+
+    def query_batch(self, batch_no):
+        self.calls.append(("query_batch", batch_no))
+        return {"success": False, "error": "not_found", "message": "没有该批次"}
+
+    def stock_out(self, product_name, quantity, *args, **kwargs):
+        self.calls.append(("stock_out", product_name, quantity))
+        self.stock -= quantity
+        return {"success": True,
+                "product": {"name": product_name, "out_quantity": quantity,
+                            "new_quantity": self.stock, "unit": "个"}}
+
+
+@pytest.fixture()
+def mcp_module(monkeypatch):
+    w = importlib.import_module("warehouse_mcp")
+    provider = _CountingProvider()
+    monkeypatch.setattr(w, "MCP_READ_CACHE_TTL", 30.0)
+    monkeypatch.setattr(w, "_get_provider", lambda: provider)
+    monkeypatch.setattr(w, "_face_guard", lambda *a, **k: {"status": "skipped"})
+    w._process_read_cache.clear()
+    w.provider = provider
+    yield w
+    w._process_read_cache.clear()
+
+
+def _call(w, tool, *args, **kwargs):
+    fn = getattr(getattr(w, tool), "fn", getattr(w, tool))
+    return asyncio.run(fn(*args, **kwargs))
+
+
+def _reads(provider, tool):
+    return sum(1 for c in provider.calls if c[0] == tool)
+
+
+def test_repeat_read_hits_cache_by_normalized_args(mcp_module):
+    w = mcp_module
+    first = _call(w, "query_stock", "M3螺丝")
+    # 「型号」前缀会被 _normalize_query_args 剥掉，落到同一个键
+    second = _call(w, "query_stock", "型号M3螺丝")
+    assert first == second and first["ok"] is True
+    assert _reads(w.provider, "query_stock") == 1
+
+    _call(w, "get_today_statistics")
+    _call(w, "get_today_statistics")
+    assert _reads(w.provider, "get_today_statistics") == 1
+
+    # 命中返回的是副本，调用方改了也不污染缓存
+    second["data"]["mutated"] = True
+    assert "mutated" not in _call(w, "query_stock", "M3螺丝")["data"]
+
+
+def test_disabled_by_default_and_expires(mcp_module, monkeypatch):
+    w = mcp_module
+    monkeypatch.setattr(w, "MCP_READ_CACHE_TTL", 0.0)
+    _call(w, "query_stock", "螺丝")
+    _call(w, "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 2
+
+    monkeypatch.setattr(w, "MCP_READ_CACHE_TTL", 30.0)
+    _call(w, "query_stock", "螺丝")
+    clock = [w.time.monotonic() + 31]
+    monkeypatch.setattr(w.time, "monotonic", lambda: clock[0])
+    _call(w, "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 4
+
+
+def test_write_tool_invalidates(mcp_module):
+    w = mcp_module
+    assert _call(w, "query_stock", "螺丝")["data"]
+    _call(w, "stock_out", "螺丝", 2, "consume")
+    again = _call(w, "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 2
+    assert "10" in again["say"]
+
+
+def test_failures_and_face_verified_results_are_not_cached(mcp_module, monkeypatch):
+    w = mcp_module
+    _call(w, "query_batch", "B-1")
+    _call(w, "query_batch", "B-1")
+    assert _reads(w.provider, "query_batch") == 2
+
+    # 查询配置了人脸规则（每次真实核验）时，不能让缓存绕过它
+    monkeypatch.setattr(w, "_face_guard", lambda *a, **k: {"status": "pass"})
+    _call(w, "query_stock", "螺丝")
+    _call(w, "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 2
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_isolated_but_writes_invalidate_tenant(mcp_module):
+    w = mcp_module
+    sessions = {
+        name: w.create_runtime_state("http://127.0.0.1:2125/api", f"key-{name}",
+                                     connection_id=f"conn-{name}", tenant_id=tenant)
+        for name, tenant in (("a", 1), ("b", 1), ("c", 2))
+    }
+
+    async def call(name, tool, *args):
+        with w.runtime_context(sessions[name]):
+            fn = getattr(getattr(w, tool), "fn", getattr(w, tool))
+            return await fn(*args)
+
+    for name in ("a", "a", "b", "c"):
+        await call(name, "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 3  # 会话之间不共享
+
+    # 租户 1 的会话 a 出库 → 同租户会话 b 失效；租户 2 的会话 c 不受影响
+    await call("a", "stock_out", "螺丝", 1, "consume")
+    await call("b", "query_stock", "螺丝")
+    await call("c", "query_stock", "螺丝")
+    assert _reads(w.provider, "query_stock") == 4
@@ -35,7 +35,8 @@ class _FakeSharedRuntime:
         self.stopped = True
 
     def create_session_state(self, api_base_url, api_key, *, debug=False,
-                             external_tenant_id=None, external_warehouse_id=None):
+                             external_tenant_id=None, external_warehouse_id=None,
+                             connection_id=None, tenant_id=None):
         # 签名要跟真实的 SharedMCPRuntime 对齐：外部 ERP 模式下管理器会把本连接
         # 绑定的对方租户/仓库一并传进来，缺参数会让启动直接失败。
         return {
@@ -264,53 +265,79 @@ async def test_two_websocket_sessions_do_not_cross_tenant_provider(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_shared_runtime_sends_timeout_error(monkeypatch):
+async def test_timed_out_request_gets_error_and_session_survives(monkeypatch):
     import mcp_shared_runtime
+    from mcp import types
+    from mcp.shared.message import SessionMessage
 
     runtime = mcp_shared_runtime.SharedMCPRuntime()
     await runtime.start()
     monkeypatch.setattr(mcp_shared_runtime, 'TOOL_CALL_TIMEOUT', 0.2)
-
-    class _NoResponseServer:
-        async def run(self, *args, **kwargs):
-            await asyncio.Event().wait()
-
-    runtime._server = _NoResponseServer()
-    timeout_payload = {}
-    response_received = asyncio.Event()
+    cancelled = []
+
+    class _SlowToolServer:
+        """Never answers the ``slow`` tool; answers ``fast`` immediately."""
+
+        async def run(self, incoming, outgoing, options):
+            async with outgoing:
+                async for session_message in incoming:
+                    root = session_message.message.root
+                    if isinstance(root, types.JSONRPCNotification):
+                        if root.method == 'notifications/cancelled':
+                            request_id = root.params['requestId']
+                            cancelled.append(request_id)
+                            # 与 FastMCP 一致：取消后仍为该 id 发一个错误响应
+                            await outgoing.send(SessionMessage(types.JSONRPCMessage(
+                                types.JSONRPCError(
+                                    jsonrpc='2.0', id=request_id,
+                                    error=types.ErrorData(code=0, message='Request cancelled'),
+                                )
+                            )))
+                        continue
+                    if root.params['name'] == 'fast':
+                        await outgoing.send(SessionMessage(types.JSONRPCMessage(
+                            types.JSONRPCResponse(jsonrpc='2.0', id=root.id, result={'ok': True})
+                        )))
+
+    runtime._server = _SlowToolServer()
+    received = []
+    done = asyncio.Event()
+    release = asyncio.Event()
+
+    def call(request_id, name):
+        return json.dumps({
+            'jsonrpc': '2.0', 'id': request_id, 'method': 'tools/call',
+            'params': {'name': name, 'arguments': {}},
+        })
 
     async def watcher(websocket):
-        await websocket.send(json.dumps({
-            'jsonrpc': '2.0',
-            'id': 99,
-            'method': 'tools/call',
-            'params': {
-                'name': 'query_stock',
-                'arguments': {'product_name': 'timeout'},
-            },
-        }))
-        timeout_payload.update(json.loads(await websocket.recv()))
-        response_received.set()
+        await websocket.send(call(99, 'slow'))
+        received.append(json.loads(await websocket.recv()))
+        await websocket.send(call(100, 'fast'))
+        received.append(json.loads(await websocket.recv()))
+        done.set()
+        await release.wait()
 
     server = await websockets.serve(watcher, '127.0.0.1', 0, ping_interval=None)
     port = server.sockets[0].getsockname()[1]
     state = runtime.create_session_state('http://127.0.0.1:9/api', 'tenant-timeout')
+    session = asyncio.create_task(runtime._run_session(
+        f'ws://127.0.0.1:{port}', state, 'timeout-test', None,
+    ))
 
     try:
-        with pytest.raises(mcp_shared_runtime.MCPToolTimeout):
-            await asyncio.wait_for(
-                runtime._run_session(
-                    f'ws://127.0.0.1:{port}',
-                    state,
-                    'timeout-test',
-                    None,
-                ),
-                timeout=3,
-            )
-        await asyncio.wait_for(response_received.wait(), timeout=1)
-        assert timeout_payload['id'] == 99
-        assert timeout_payload['error']['code'] == -32001
+        await asyncio.wait_for(done.wait(), timeout=3)
+        assert received[0]['id'] == 99
+        assert received[0]['error']['code'] == -32001
+        # 取消产生的迟到响应被丢弃，下一条收到的就是 id=100 的正常结果
+        assert received[1] == {'jsonrpc': '2.0', 'id': 100, 'result': {'ok': True}}
+        assert cancelled == [99]
+        assert not session.done()
     finally:
+        release.set()
+        session.cancel()
+        with suppress(asyncio.CancelledError):
+            await session
         server.close()
         await server.wait_closed()
         await runtime.stop()
@@ -356,3 +383,148 @@ async def test_shared_runtime_retries_failed_session(monkeypatch):
         task.cancel()
         with suppress(asyncio.CancelledError):
             await task
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('debug', [False, True])
+async def test_protocol_summaries_only_logged_in_debug(debug):
+    import mcp_shared_runtime
+
+    runtime = mcp_shared_runtime.SharedMCPRuntime()
+    await runtime.start()
+    events = []
+    done = asyncio.Event()
+    release = asyncio.Event()
+
+    async def watcher(websocket):
+        await websocket.send(json.dumps({
+            'jsonrpc': '2.0',
+            'id': 0,
+            'method': 'initialize',
+            'params': {
+                'protocolVersion': '2025-06-18',
+                'capabilities': {},
+                'clientInfo': {'name': 'framing-test', 'version': '1.0'},
+            },
+        }))
+        assert 'result' in json.loads(await websocket.recv())
+        await websocket.send(json.dumps({
+            'jsonrpc': '2.0', 'method': 'notifications/initialized', 'params': {},
+        }))
+        # 二进制帧同样按一次解析处理
+        await websocket.send(json.dumps({
+            'jsonrpc': '2.0', 'id': 1, 'method': 'tools/list', 'params': {},
+        }).encode('utf-8'))
+        tools = json.loads(await websocket.recv())
+        assert tools['id'] == 1 and tools['result']['tools']
+        done.set()
+        await release.wait()
+
+    server = await websockets.serve(watcher, '127.0.0.1', 0, ping_interval=None)
+    port = server.sockets[0].getsockname()[1]
+    state = runtime.create_session_state('http://127.0.0.1:9/api', 'tenant-x', debug=debug)
+    task = asyncio.create_task(runtime._run_session(
+        f'ws://127.0.0.1:{port}', state, 'framing-test',
+        lambda event, message: events.append((event, message)),
+    ))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=10)
+        kinds = [event for event, _ in events]
+        ready = [message for event, message in events if event == 'protocol_ready']
+        assert ready and ready[0].startswith('RPC server->cloud response id=0 outcome=result bytes=')
+        protocol = [message for event, message in events if event == 'protocol']
+        if debug:
+            assert 'RPC cloud->server request method=tools/list id=1 bytes=' in '\n'.join(protocol)
+            assert any(m.startswith('RPC server->cloud response id=1 outcome=result') for m in protocol)
+        else:
+            assert 'protocol' not in kinds
+    finally:
+        release.set()
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        server.close()
+        await server.wait_closed()
+        await runtime.stop()
+
+
+@pytest.mark.asyncio
+async def test_soak_idle_sessions_do_not_wake_the_loop(monkeypatch):
+    """Soak: N idle sessions (default 500) must not poll the event loop.
+
+    The old per-session watchdog woke every 200 ms, i.e. 5 timer callbacks
+    per session per second. With per-request deadlines an idle session
+    schedules nothing. Set ``MCP_SOAK_SESSIONS`` to change N.
+    """
+    import time
+
+    import mcp_shared_runtime
+
+    sessions = int(os.environ.get('MCP_SOAK_SESSIONS', '500'))
+    monkeypatch.setattr(mcp_shared_runtime, 'WS_PING_INTERVAL', None)
+    runtime = mcp_shared_runtime.SharedMCPRuntime()
+    await runtime.start()
+
+    connected = 0
+    all_connected = asyncio.Event()
+    release = asyncio.Event()
+
+    async def watcher(websocket):
+        nonlocal connected
+        connected += 1
+        if connected == sessions:
+            all_connected.set()
+        await release.wait()
+
+    server = await websockets.serve(watcher, '127.0.0.1', 0, ping_interval=None)
+    port = server.sockets[0].getsockname()[1]
+    endpoint = f'ws://127.0.0.1:{port}'
+    tasks = [
+        asyncio.create_task(runtime._run_session(
+            endpoint,
+            runtime.create_session_state('http://127.0.0.1:9/api', f'soak-{i}'),
+            f'soak-{i}',
+            None,
+        ))
+        for i in range(sessions)
+    ]
+    loop = asyncio.get_running_loop()
+    timer_calls = 0
+    original_call_at = loop.call_at
+
+    def counting_call_at(*args, **kwargs):
+        nonlocal timer_calls
+        timer_calls += 1
+        return original_call_at(*args, **kwargs)
+
+    try:
+        await asyncio.wait_for(all_connected.wait(), timeout=60)
+        await asyncio.sleep(0.2)  # 让握手后的收尾回调跑完
+
+        monkeypatch.setattr(loop, 'call_at', counting_call_at)
+        window = 1.0
+        cpu_start, wall_start = time.process_time(), time.monotonic()
+        max_lag = 0.0
+        probes = 0
+        while time.monotonic() - wall_start < window:
+            probes += 1
+            tick = time.monotonic()
+            await asyncio.sleep(0.05)
+            max_lag = max(max_lag, time.monotonic() - tick - 0.05)
+        cpu = time.process_time() - cpu_start
+        monkeypatch.setattr(loop, 'call_at', original_call_at)
+
+        # 扣掉探针自己的 sleep；旧实现会是 sessions * 5 次以上
+        session_timers = timer_calls - probes
+        stats = (f"{sessions} idle sessions: {session_timers} session timer callbacks/s, "
+                 f"cpu {cpu * 1000:.1f}ms over {window:.1f}s, max loop lag {max_lag * 1000:.1f}ms")
+        assert not any(task.done() for task in tasks)
+        assert session_timers < max(10, sessions // 50), stats
+    finally:
+        release.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
+        await runtime.stop()
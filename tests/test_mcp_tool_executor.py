@@ -0,0 +1,191 @@
+"""
+MCP tool executor (mcp/tool_executor.py): dedicated thread pool, per-connection
+and per-tenant caps, round-robin fairness across connections, and per-tool
+queue-wait / execution-time metrics.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+_MCP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mcp")
+if _MCP_DIR not in sys.path:
+    sys.path.insert(0, _MCP_DIR)
+
+from tool_executor import ToolExecutor  # noqa: E402
+
+
+def _blocking(gate, started, label):
+    def work():
+        started.append(label)
+        assert gate.wait(5)
+        return label
+    return work
+
+
+@pytest.mark.asyncio
+async def test_per_connection_cap_and_round_robin_fairness():
+    executor = ToolExecutor(max_workers=2, per_connection=2, per_tenant=10)
+    gate = threading.Event()
+    started = []
+
+    # 吵闹连接先刷 6 个调用，安静连接随后来 1 个
+    noisy = [asyncio.create_task(executor.run(
+        _blocking(gate, started, f"noisy-{i}"), tool="search", connection="noisy", tenant=1))
+        for i in range(6)]
+    await asyncio.sleep(0.05)
+    quiet = asyncio.create_task(executor.run(
+        _blocking(gate, started, "quiet"), tool="query_stock", connection="quiet", tenant=2))
+    await asyncio.sleep(0.05)
+
+    assert started == ["noisy-0", "noisy-1"]
+    assert executor.snapshot()["queued"] == 5
+
+    gate.set()
+    results = await asyncio.gather(*noisy, quiet)
+    assert sorted(results) == sorted([f"noisy-{i}" for i in range(6)] + ["quiet"])
+    # 第一个名额空出来就轮到安静连接，不必等吵闹连接排完
+    assert started.index("quiet") <= 3
+
+
+@pytest.mark.asyncio
+async def test_idle_connection_not_blocked_by_capped_queue():
+    """别的连接的排队只卡在它自己的上限上时，新连接有空闲名额就该直接执行。"""
+    executor = ToolExecutor(max_workers=8, per_connection=1, per_tenant=10)
+    gate = threading.Event()
+    started = []
+
+    busy = [asyncio.create_task(executor.run(
+        _blocking(gate, started, f"a-{i}"), tool="t", connection="a")) for i in range(2)]
+    await asyncio.sleep(0.05)
+    assert started == ["a-0"] and executor.snapshot()["queued"] == 1
+
+    quiet = asyncio.create_task(executor.run(lambda: "b", tool="t", connection="b"))
+    assert await asyncio.wait_for(quiet, 1) == "b"
+    assert started == ["a-0"], "a 的第二个调用仍应被它自己的连接上限挡住"
+
+    gate.set()
+    await asyncio.gather(*busy)
+
+
+@pytest.mark.asyncio
+async def test_per_tenant_cap_spans_connections():
+    executor = ToolExecutor(max_workers=8, per_connection=4, per_tenant=3)
+    gate = threading.Event()
+    started = []
+    tasks = [asyncio.create_task(executor.run(
+        _blocking(gate, started, f"c{i}"), tool="t", connection=f"c{i}", tenant="acme"))
+        for i in range(5)]
+    await asyncio.sleep(0.05)
+    assert len(started) == 3 and executor.snapshot()["running"] == 3
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert executor.snapshot()["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_calls_release_slots_only_when_thread_finishes():
+    executor = ToolExecutor(max_workers=1, per_connection=1, per_tenant=1)
+    gate = threading.Event()
+    started = []
+
+    running = asyncio.create_task(executor.run(
+        _blocking(gate, started, "running"), tool="t", connection="a"))
+    queued = asyncio.create_task(executor.run(
+        _blocking(gate, started, "queued"), tool="t", connection="a"))
+    await asyncio.sleep(0.05)
+
+    queued.cancel()
+    running.cancel()
+    await asyncio.gather(running, queued, return_exceptions=True)
+    snap = executor.snapshot()
+    # 排队的直接出队；执行中的线程还没结束，名额仍被占着
+    assert (snap["queued"], snap["running"]) == (0, 1)
+
+    gate.set()
+    for _ in range(100):
+        if executor.snapshot()["running"] == 0:
+            break
+        await asyncio.sleep(0.01)
+    assert executor.snapshot()["running"] == 0
+    assert await executor.run(lambda: "next", tool="t", connection="a") == "next"
+    assert started == ["running"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_split_queue_wait_and_execution():
+    executor = ToolExecutor(max_workers=1, per_connection=1, per_tenant=1)
+
+    def slow():
+        time.sleep(0.1)
+        return 1
+
+    def boom():
+        raise ValueError("bad input")
+
+    results = await asyncio.gather(
+        executor.run(slow, tool="search", connection="a"),
+        executor.run(slow, tool="search", connection="b"),
+        executor.run(boom, tool="stock_in", connection="c"),
+        return_exceptions=True,
+    )
+    assert results[:2] == [1, 1] and isinstance(results[2], ValueError)
+
+    tools = executor.snapshot()["tools"]
+    assert tools["search"]["calls"] == 2
+    assert tools["search"]["exec_seconds_total"] >= 0.2
+    # 第二个 search 至少排队了第一个的执行时间
+    assert tools["search"]["queue_wait_seconds_max"] >= 0.09
+    assert tools["stock_in"]["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_context_vars_follow_the_call():
+    import contextvars
+
+    var = contextvars.ContextVar("tenant_state", default=None)
+    executor = ToolExecutor(max_workers=2)
+
+    async def call(value):
+        var.set(value)
+        return await executor.run(lambda: (var.get(), threading.current_thread().name),
+                                  tool="t", connection=value)
+
+    (a, thread_a), (b, _) = await asyncio.gather(call("tenant-a"), call("tenant-b"))
+    assert (a, b) == ("tenant-a", "tenant-b")
+    assert thread_a.startswith("mcp-tool")
+
+
+def test_tool_stats_route_and_prometheus_collector(admin_client, monkeypatch):
+    import metrics
+    import mcp_shared_runtime
+    from app import app
+
+    admin_client.get("/api/mcp/connections")  # 触发 manager 的 lazy 初始化
+    mgr = app.state.mcp_manager
+    monkeypatch.setattr(mgr, "tool_stats", lambda: None)
+    assert admin_client.get("/api/mcp/tool-stats").json() == {"available": False}
+
+    snapshot = {
+        "workers": 16, "per_connection": 4, "per_tenant": 8, "running": 1, "queued": 2,
+        "tools": {"search": {
+            "calls": 3, "errors": 0,
+            "queue_wait_seconds_total": 0.5, "queue_wait_seconds_max": 0.3,
+            "exec_seconds_total": 1.25, "exec_seconds_max": 0.6,
+        }},
+    }
+    monkeypatch.setattr(mgr, "tool_stats", lambda: snapshot)
+    body = admin_client.get("/api/mcp/tool-stats").json()
+    assert body["available"] is True and body["tools"]["search"]["calls"] == 3
+
+    monkeypatch.setattr(mcp_shared_runtime, "tool_stats", lambda: snapshot)
+    lines = "\n".join(mcp_shared_runtime._render_tool_metrics())
+    assert 'mcp_tool_queue_wait_seconds_total{tool="search"} 0.5' in lines
+    assert 'mcp_tool_exec_seconds_total{tool="search"} 1.25' in lines
+    assert "mcp_tool_queued 2" in lines
+
+    monkeypatch.setattr(metrics, "_collectors", [mcp_shared_runtime._render_tool_metrics])
+    assert 'mcp_tool_calls_total{tool="search"} 3' in metrics.registry.render()
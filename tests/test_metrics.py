@@ -0,0 +1,105 @@
+"""
+Request metrics (backend/metrics.py): per-route latency histograms, SQL
+statement counts / time, Prometheus exposition and the Server-Timing header.
+"""
+import sqlite3
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+
+@pytest.fixture()
+def metrics(monkeypatch):
+    import metrics as module
+    monkeypatch.setattr(module, "METRICS_ENABLED", True)
+    hooks = (("before_cursor_execute", module._before_cursor_execute),
+             ("after_cursor_execute", module._after_cursor_execute),
+             ("handle_error", module._handle_error))
+    preinstalled = [event.contains(Engine, name, fn) for name, fn in hooks]
+    module.registry.reset()
+    yield module
+    for (name, fn), keep in zip(hooks, preinstalled):
+        if not keep and event.contains(Engine, name, fn):
+            event.remove(Engine, name, fn)
+    module.registry.reset()
+
+
+def _probe_app(metrics):
+    from db import get_engine
+
+    app = FastAPI()
+    metrics.install(app)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        with get_engine().connect() as c:
+            c.execute(text("SELECT 1")).all()
+            c.execute(text("SELECT 2")).all()
+        raw = sqlite3.connect(":memory:", factory=metrics.sqlite_connection_factory())
+        raw.execute("CREATE TEMP TABLE t (x)")
+        raw.cursor().executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+        raw.close()
+        return {"id": item_id}
+
+    return TestClient(app)
+
+
+def test_route_template_latency_and_sql_counts(admin_client, metrics):
+    client = _probe_app(metrics)
+    assert client.get("/items/1").status_code == 200
+    assert client.get("/items/2").status_code == 200
+    assert client.get("/nope").status_code == 404
+
+    body = metrics.registry.render()
+    lbl = 'method="GET",route="/items/{item_id}"'
+    assert f'http_requests_total{{{lbl},status="200"}} 2' in body
+    assert f'http_request_duration_seconds_count{{{lbl}}} 2' in body
+    assert f'http_request_duration_seconds_bucket{{{lbl},le="+Inf"}} 2' in body
+    # 2 条 SQLAlchemy + 2 条 raw sqlite3，每个请求 4 条
+    assert f'http_request_sql_statements_total{{{lbl}}} 8' in body
+    assert 'route="<other>",status="404"' in body
+    assert "/items/1" not in body
+
+
+def test_server_timing_header(admin_client, metrics, monkeypatch):
+    monkeypatch.setattr(metrics, "SERVER_TIMING", True)
+    client = _probe_app(metrics)
+    header = client.get("/items/3").headers["server-timing"]
+    assert header.startswith("app;dur=") and 'desc="4 queries"' in header
+
+
+def test_server_timing_works_without_metrics(admin_client, metrics, monkeypatch):
+    """单开 SERVER_TIMING 也要挂中间件；只加响应头，不记 Prometheus 指标。"""
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    monkeypatch.setattr(metrics, "SERVER_TIMING", True)
+    assert metrics.tracking_enabled()
+    client = _probe_app(metrics)
+    header = client.get("/items/4").headers["server-timing"]
+    assert header.startswith("app;dur=") and 'desc="4 queries"' in header
+    assert "http_requests_total{" not in metrics.registry.render()
+
+
+def test_sql_outside_request_is_ignored(admin_client, metrics):
+    from db import get_engine
+    _probe_app(metrics)
+    with get_engine().connect() as c:
+        c.execute(text("SELECT 1")).all()
+    assert metrics.current_stats() is None
+    assert "http_request_sql_statements_total{" not in metrics.registry.render()
+
+
+def test_metrics_endpoint_gated_by_flag_and_token(client, monkeypatch):
+    import metrics as module
+    monkeypatch.setattr(module, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(module, "METRICS_ENABLED", True)
+    monkeypatch.setattr(module, "METRICS_TOKEN", "scrape-me")
+    assert client.get("/metrics").status_code == 401
+    resp = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE http_request_duration_seconds histogram" in resp.text
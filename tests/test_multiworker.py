@@ -0,0 +1,110 @@
+"""
+Multi-worker support (backend/multiworker.py): the table-backed invalidation
+bus, the cross-process worker lock and the non-owner MCP manager proxy.
+"""
+import asyncio
+import uuid
+
+import pytest
+
+
+@pytest.fixture()
+def multiworker(admin_client):
+    import multiworker as module
+    return module
+
+
+def test_table_bus_delivers_to_other_workers_only(multiworker):
+    bus_a = multiworker.TableBus(worker_id=f"a-{uuid.uuid4().hex[:6]}")
+    bus_b = multiworker.TableBus(worker_id=f"b-{uuid.uuid4().hex[:6]}")
+    assert bus_a.exchange() == [] and bus_b.exchange() == []
+
+    bus_a.broadcast("fuzzy", {"entity_type": "material", "entity_id": 7})
+    bus_a.broadcast("fuzzy", {"entity_type": "contact"})
+    assert bus_a.exchange() == []          # 自己发的不回送
+    assert bus_b.exchange() == [
+        ("fuzzy", {"entity_type": "material", "entity_id": 7}),
+        ("fuzzy", {"entity_type": "contact"}),
+    ]
+    assert bus_b.exchange() == []          # 已见过的不重复投递
+
+    # 新 worker 从当前位置开始，不回放历史事件
+    assert multiworker.TableBus(worker_id="late").exchange() == []
+
+
+def test_fuzzy_invalidation_is_broadcast_and_applied_remotely(multiworker, monkeypatch):
+    import app as app_module
+
+    sent = []
+    monkeypatch.setattr(multiworker, "get_bus", lambda: type(
+        "Capture", (multiworker.InvalidationBus,),
+        {"broadcast": lambda self, topic, payload: sent.append((topic, payload)),
+         "exchange": lambda self: []})())
+
+    matcher = app_module.get_fuzzy_matcher()
+    matcher._ensure_index()
+    matcher.invalidate_cache(entity_type="material")
+    assert sent == [("fuzzy", {"entity_type": "material", "tenant_id": None,
+                               "warehouse_id": None, "entity_id": None})]
+
+    # 其他 worker 发来的失效：只清本地，不再回播
+    matcher._ensure_index()
+    sent.clear()
+    multiworker.dispatch([("fuzzy", {"entity_type": "contact"})])
+    assert "contact" in matcher._dirty_partitions
+    assert "material" not in matcher._dirty_partitions
+    assert sent == []
+
+
+def test_incomplete_bus_backend_fails_at_creation(multiworker):
+    class BroadcastOnly(multiworker.InvalidationBus):
+        def broadcast(self, topic, payload):
+            pass
+
+    with pytest.raises(TypeError):
+        BroadcastOnly()
+
+
+def test_worker_lock_is_exclusive_until_released(multiworker):
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    first, second = multiworker.WorkerLock(name), multiworker.WorkerLock(name)
+    assert first.try_acquire() and first.held
+    assert not second.try_acquire()
+    first.release()
+    assert second.try_acquire()
+    second.release()
+
+
+def test_remote_mcp_manager_forwards_commands_and_reads_db_status(multiworker, monkeypatch):
+    from sqlalchemy import insert
+    from db import get_engine
+    from mcp_manager import MCP_COMMAND_TOPIC, RemoteMCPManager
+    from metadata import mcp_connections
+
+    conn_id = f"mw-{uuid.uuid4().hex[:8]}"
+    with get_engine().begin() as c:
+        c.execute(insert(mcp_connections).values(
+            id=conn_id, name=conn_id, mcp_endpoint="wss://example.invalid/mcp",
+            api_key="secret", status="running", restart_count=2,
+        ))
+
+    sent = []
+    monkeypatch.setattr(multiworker, "broadcast",
+                        lambda topic, **payload: sent.append((topic, payload)))
+    mgr = RemoteMCPManager()
+
+    async def run():
+        assert await mgr.start_connection(conn_id, "wss://x", "secret")
+        assert await mgr.toggle_debug(conn_id, "wss://x", "secret", True)
+        mgr.remove_connection(conn_id)
+        return await mgr.wait_for_protocol_ready(conn_id, timeout=1)
+    assert asyncio.run(run()) is True
+
+    assert sent == [
+        (MCP_COMMAND_TOPIC, {"conn_id": conn_id, "op": "start"}),
+        (MCP_COMMAND_TOPIC, {"conn_id": conn_id, "op": "debug", "enable": True}),
+        (MCP_COMMAND_TOPIC, {"conn_id": conn_id, "op": "remove"}),
+    ]
+    status = mgr.get_connection_status(conn_id)
+    assert status["status"] == "running" and status["restart_count"] == 2
+    assert mgr.get_connection_status("missing")["status"] == "stopped"
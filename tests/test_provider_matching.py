@@ -463,6 +463,117 @@ class TestCaching:
         assert err is None
         assert item["stockQty"] == 3, "库存数字来自缓存，应取实时值"
 
+    def test_refresh_ahead_renews_in_background(self):
+        """快到期的缓存：本次调用不等拉取，后台提前刷新，缓存不会真正过期。"""
+        import threading
+        from providers.matching import _item_cache
+        p = self._make(PARTS, ttl=10.0)
+        p._locate("上钳口")
+        key = p._cache_key()
+        _item_cache.get(key).fetched_at -= 9     # 已过 80% 的 TTL，未到期
+
+        gate = threading.Event()
+        slow_fetch = p._fetch_items
+
+        def blocked():
+            assert gate.wait(5)
+            return slow_fetch()
+        p._fetch_items = blocked
+
+        item, err = p._locate("上钳口")          # 对方接口卡住也立刻返回
+        assert err is None and item["partNo"] == "100201"
+        assert p.fetch_count == 1
+        p._locate("下钳口")                       # 同 key 不会再起第二个
+        gate.set()
+        for _ in range(200):
+            if p.fetch_count == 2 and time.monotonic() - _item_cache.get(key).fetched_at < 5:
+                break
+            time.sleep(0.01)
+        assert p.fetch_count == 2
+        assert time.monotonic() - _item_cache.get(key).fetched_at < 5, "缓存应已续期"
+
+    def test_unchanged_items_reuse_index(self):
+        """刷新时只重建匹配字段变了的记录，其余复用预计算。"""
+        p = self._make(PARTS, ttl=3600)
+        before, _, _ = p._load_items()
+        by_code = {e.raw["partNo"]: e for e in before}
+
+        p.items = [dict(it) for it in PARTS]
+        p.items[1]["stockQty"] = 1               # 只改库存
+        p.items[2]["partName"] = "撬棍"          # 改名
+        after, _, _ = p._load_items(force=True)
+        after_by_code = {e.raw["partNo"]: e for e in after}
+
+        assert after_by_code["100201"] is by_code["100201"]
+        assert after_by_code["100202"] is not by_code["100202"]
+        assert after_by_code["100202"].fields is by_code["100202"].fields
+        assert after_by_code["100202"].raw["stockQty"] == 1
+        assert after_by_code["LH-815"].fields["name"][0] == "撬棍"
+        assert p._locate("撬棍")[0]["partNo"] == "LH-815"
+
+    def _make_delta(self, items):
+        from providers.matching import LocalMatchMixin, MatchConfig
+        self._fresh_cache()
+
+        class P(LocalMatchMixin):
+            MATCH = MatchConfig(fields={"name": "partName", "code": "partNo", "spec": "partType"})
+            CACHE_TTL = 3600
+
+            def __init__(self):
+                self.config = {"api_base_url": "http://delta"}
+                self.items = list(items)
+                self.full_fetches = 0
+                self.since_calls = []
+                self.changed, self.removed, self.delta_err = [], [], None
+
+            def _fetch_items(self):
+                self.full_fetches += 1
+                return list(self.items), None
+
+            def _fetch_items_since(self, since):
+                self.since_calls.append(since)
+                return self.changed, self.removed, self.delta_err
+
+        return P()
+
+    def test_delta_fetch_merges_changes(self):
+        p = self._make_delta(PARTS)
+        t0 = time.time()
+        p._locate("上钳口")
+        assert p.full_fetches == 1
+
+        p.changed = [{"partName": "新到货扳手", "partNo": "NEW001", "partType": "M8"},
+                     {"partName": "上钳口", "partNo": "100201", "partType": "4IO-2.0-3.2-12-A",
+                      "stockQty": 30}]
+        p.removed = ["LV0045"]
+        item, err = p._locate("新到货扳手")      # 未命中触发的强制刷新走增量
+        assert err is None and item["partNo"] == "NEW001"
+        assert p.full_fetches == 1 and len(p.since_calls) == 1
+        assert t0 <= p.since_calls[0] <= time.time()
+
+        indexed, _, _ = p._load_items()
+        codes = [e.raw["partNo"] for e in indexed]
+        assert "LV0045" not in codes and codes.count("100201") == 1
+        assert p._locate("上钳口")[0]["stockQty"] == 30
+
+    def test_delta_is_opt_in(self):
+        """没实现增量钩子的 Provider 不走增量；钩子是可选属性，不是会抛异常的桩。"""
+        assert _P()._fetch_items_since is None
+        assert _P()._supports_delta() is False
+        assert self._make_delta(PARTS)._supports_delta() is True
+
+    def test_delta_failure_or_due_full_refresh_falls_back_to_full(self):
+        p = self._make_delta(PARTS)
+        p._locate("上钳口")
+        p.delta_err = {"success": False, "error": "api_error", "message": "增量接口挂了"}
+        p._load_items(force=True)
+        assert (p.full_fetches, len(p.since_calls)) == (2, 1)
+
+        p.delta_err = None
+        p.FULL_REFRESH_INTERVAL = 0.0            # 到了必须全量的时间
+        p._load_items(force=True)
+        assert (p.full_fetches, len(p.since_calls)) == (3, 1)
+
     def test_refresh_item_failure_falls_back_to_cached_record(self):
         """取实时数据失败时用缓存记录兜底，不能让整个查询失败。"""
         from providers.matching import LocalMatchMixin, MatchConfig
@@ -484,6 +595,73 @@ class TestCaching:
         assert err is None and item["stockQty"] == 9
 
 
+class TestColumnarRanking:
+    """``_rank`` 的列式整列打分（``_score_columns`` + ``process.cdist``）。
+
+    整列打分只是换了算法，分数必须与逐条 ``_score_indexed`` 逐位相同 ——
+    阈值、并列判定（tie_epsilon）都建立在分数上，差一点都会改变命中行为。
+    """
+
+    WORDS = ["上钳口", "下钳口", "电极帽", "撬具", "扳手", "螺丝", "银色", "M3",
+             "液压", "油缸", "铣刀", "钨钢", "垫片", "轴承", "密封圈", "前口"]
+    SPECS = ["4IO-2.0-3.2-12-A", "LH-815", "银色", "M8 不锈钢", "3.2", "", None]
+    QUERIES = ["上钳口", "前口", "电级帽", "A00012", "4IO-2.0-3.2-12-A", "矿泉水",
+               "M3螺丝 银色", "撬具LH-815", "LH-815撬具", "钳", "a", "银色",
+               "液压 油缸", "铣刀钨钢 M8", "查询库存", "", "   "]
+
+    @classmethod
+    def _catalogue(cls, n, seed=7):
+        import random
+        rnd = random.Random(seed)
+        return [{
+            "partName": "".join(rnd.sample(cls.WORDS, rnd.randint(1, 3))) if rnd.random() > 0.05 else "",
+            "partNo": f"{rnd.choice('ABLV')}{rnd.randint(0, 99999):05d}" if rnd.random() > 0.1 else None,
+            "partType": rnd.choice(cls.SPECS),
+        } for _ in range(n)]
+
+    @staticmethod
+    def _rank_per_item(p, query, indexed):
+        """改造前 ``_rank`` 的快路径：逐条 ``_score_indexed``。"""
+        from providers.matching import _Query
+        q = _Query(query)
+        scored = [(p._score_indexed(q, e), e.raw) for e in indexed]
+        scored = [x for x in scored if x[0] >= p.MATCH.candidate_floor]
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored
+
+    def test_parity_with_per_item_scoring(self, p):
+        from providers.matching import _index_items
+        items = self._catalogue(3000) + PARTS
+        indexed, _ = _index_items(items, p.MATCH.fields)
+        for query in self.QUERIES:
+            want = self._rank_per_item(p, query, indexed)
+            got = p._rank(query, indexed)
+            assert [s for s, _ in got] == [s for s, _ in want], query
+            assert all(a is b for (_, a), (_, b) in zip(got, want)), f"{query!r}: 顺序不一致"
+
+    def test_parity_with_partial_field_mapping_and_weights(self):
+        from providers.matching import _Indexed
+
+        class P(_P):
+            MATCH = MatchConfig(fields={"name": "partName", "code": "partNo", "spec": None},
+                                weights={"code": 1.2})
+
+        p = P()
+        items = self._catalogue(500, seed=3) + PARTS
+        plain = [_Indexed(it, p.MATCH.fields) for it in items]   # 非 _IndexedList：按需建列
+        for query in self.QUERIES:
+            want = self._rank_per_item(p, query, plain)
+            got = p._rank(query, plain)
+            assert got == want, query
+
+    def test_behaviour_through_locate(self, p):
+        assert p._locate("上钳口")[0]["partNo"] == "100201"
+        assert p._locate("撬具LH-815")[0]["partNo"] == "LH-815"
+        item, err = p._locate("钳口")
+        assert item is None and err["error"] == "ambiguous_name"
+        assert p._locate("帮我放首歌")[0] is None
+
+
 class TestReviewFindings:
     """独立审核发现的缺陷，逐条锁死。
 
@@ -0,0 +1,154 @@
+"""LocalMatchMixin 全量列表的跨进程共享快照（mcp/providers/shared_cache.py）。
+
+子进程模式下每个连接一个 warehouse_mcp.py 进程，_item_cache 各管各的。
+配 MCP_ITEM_CACHE_DIR 后同一 _cache_key() 的进程共用一份快照：一个进程拉，
+其余直接用；强制刷新不会拿更早的快照冒充最新数据；写操作失效连快照一起删。
+"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+_MCP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mcp")
+if _MCP_DIR not in sys.path:
+    sys.path.insert(0, _MCP_DIR)
+
+from providers import shared_cache  # noqa: E402
+from providers.matching import LocalMatchMixin, MatchConfig, _item_cache  # noqa: E402
+
+PARTS = [
+    {"partName": "上钳口", "partNo": "100201", "partType": "4IO-2.0-3.2-12-A", "stockQty": 3},
+    {"partName": "撬具", "partNo": "LH-815", "partType": "LH-815", "stockQty": 2},
+    {"partName": "电极帽", "partNo": "LV0045", "partType": "银色", "stockQty": 0},
+]
+
+
+class _P(LocalMatchMixin):
+    MATCH = MatchConfig(fields={"name": "partName", "code": "partNo", "spec": "partType"})
+    CACHE_TTL = 3600
+
+    def __init__(self, items=None):
+        self.config = {"api_base_url": "http://shared", "external_tenant_id": "T1"}
+        self.items = list(PARTS if items is None else items)
+        self.fetch_count = 0
+
+    def _fetch_items(self):
+        self.fetch_count += 1
+        return list(self.items), None
+
+
+@pytest.fixture()
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "MCP_ITEM_CACHE_DIR", str(tmp_path))
+    _item_cache.invalidate()
+    yield tmp_path
+    _item_cache.invalidate()
+
+
+def _snapshots(directory):
+    return sorted(p for p in os.listdir(directory) if p.endswith(".json"))
+
+
+def test_disabled_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "MCP_ITEM_CACHE_DIR", "")
+    _item_cache.invalidate()
+    assert shared_cache.get_shared_store() is None
+    assert _P()._locate("上钳口")[0]["partNo"] == "100201"
+    assert os.listdir(tmp_path) == []
+
+
+def test_sibling_process_reuses_published_snapshot(shared_dir):
+    a = _P()
+    assert a._locate("上钳口")[0]["partNo"] == "100201"
+    assert a.fetch_count == 1 and len(_snapshots(shared_dir)) == 1
+
+    _item_cache.invalidate()              # 相当于另一个进程：本地缓存为空
+    b = _P()
+    indexed, err, from_cache = b._load_items()
+    assert err is None and from_cache is True and b.fetch_count == 0
+    assert [e.raw for e in indexed] == PARTS
+    # 预计算原样带过来，不必重建；打分结果与本地建索引一致
+    assert indexed[0].fields["name"] == ("上钳口", "上钳口", "shang qian kou")
+    assert b._locate("电极帽")[0]["partNo"] == "LV0045"
+    assert b.fetch_count == 0
+
+
+def test_forced_refresh_ignores_older_snapshot(shared_dir):
+    _P()._locate("上钳口")
+    _item_cache.invalidate()
+
+    b = _P(PARTS + [{"partName": "新到货扳手", "partNo": "NEW001", "partType": "M8"}])
+    item, err = b._locate("新到货扳手")   # 快照里没有 → 强制刷新必须真的去拉
+    assert err is None and item["partNo"] == "NEW001"
+    assert b.fetch_count == 1
+
+    _item_cache.invalidate()
+    c = _P()
+    assert c._locate("新到货扳手")[0]["partNo"] == "NEW001", "应采用 b 刚发布的快照"
+    assert c.fetch_count == 0
+
+
+def test_invalidate_drops_snapshot(shared_dir):
+    p = _P()
+    p._locate("上钳口")
+    assert _snapshots(shared_dir)
+    p.invalidate_cache()
+    assert _snapshots(shared_dir) == []
+    p._locate("上钳口")
+    assert p.fetch_count == 2
+
+
+def test_snapshot_with_different_field_mapping_is_ignored(shared_dir):
+    _P()._locate("上钳口")
+    _item_cache.invalidate()
+
+    class Other(_P):
+        MATCH = MatchConfig(fields={"name": "partName", "code": "partNo", "spec": None})
+
+        def _cache_key(self):
+            return _P()._cache_key()      # 同一 key、不同字段映射
+
+    o = Other()
+    o._load_items()
+    assert o.fetch_count == 1
+
+
+_WORKER = textwrap.dedent("""
+    import os, sys, time
+    sys.path.insert(0, {mcp_dir!r})
+    from providers.matching import LocalMatchMixin, MatchConfig
+
+    class P(LocalMatchMixin):
+        MATCH = MatchConfig(fields={{"name": "partName", "code": "partNo", "spec": "partType"}})
+        CACHE_TTL = 3600
+
+        def __init__(self):
+            self.config = {{"api_base_url": "http://shared-mp"}}
+
+        def _fetch_items(self):
+            with open({log!r}, "a") as f:
+                f.write(str(os.getpid()) + "\\n")
+            time.sleep(0.5)               # 慢 ERP：其它进程都在等锁
+            return [{{"partName": "上钳口", "partNo": "100201", "partType": "X"}}], None
+
+    item, err = P()._locate("上钳口")
+    print(item["partNo"] if item else err)
+""")
+
+
+def test_single_flight_across_processes(tmp_path):
+    log = tmp_path / "fetches.log"
+    cache_dir = tmp_path / "items"
+    script = _WORKER.format(mcp_dir=_MCP_DIR, log=str(log))
+    env = dict(os.environ, MCP_ITEM_CACHE_DIR=str(cache_dir))
+    procs = [subprocess.Popen([sys.executable, "-c", script], env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for _ in range(4)]
+    outputs = [p.communicate(timeout=60) for p in procs]
+    for p, (out, err) in zip(procs, outputs):
+        assert p.returncode == 0, err
+        assert out.strip() == "100201"
+    assert len(log.read_text().splitlines()) == 1, "四个进程应只拉一次全量"
@@ -0,0 +1,135 @@
+"""
+Slow-query log (backend/slow_query.py): statement fingerprints, per-fingerprint
+aggregation / top-N, route + tenant attribution, EXPLAIN capture and the
+admin endpoints.
+"""
+import sqlite3
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+
+@pytest.fixture()
+def slow_query(monkeypatch):
+    import metrics
+    import slow_query as module
+    hooks = (("before_cursor_execute", metrics._before_cursor_execute),
+             ("after_cursor_execute", metrics._after_cursor_execute),
+             ("handle_error", metrics._handle_error))
+    preinstalled = [event.contains(Engine, name, fn) for name, fn in hooks]
+    observers = list(metrics._sql_observers)
+    monkeypatch.setattr(module, "SLOW_QUERY_LOG", True)
+    monkeypatch.setattr(module, "SLOW_QUERY_MS", 0.0)
+    module.reset()
+    module.install()
+    metrics.install(FastAPI())  # 挂 Engine 钩子
+    yield module
+    metrics._sql_observers[:] = observers
+    for (name, fn), keep in zip(hooks, preinstalled):
+        if not keep and event.contains(Engine, name, fn):
+            event.remove(Engine, name, fn)
+    module.reset()
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT * FROM t WHERE id = 42 AND name = 'o''brien'",
+     "SELECT * FROM t WHERE id = ? AND name = ?"),
+    ("SELECT a FROM t1 WHERE x = %(x_1)s AND y = %s AND z = :z",
+     "SELECT a FROM t1 WHERE x = ? AND y = ? AND z = ?"),
+    ("SELECT a\n  FROM t WHERE id IN (?, ?, ?)  LIMIT 10 OFFSET 20",
+     "SELECT a FROM t WHERE id IN (?+) LIMIT ? OFFSET ?"),
+    ("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)",
+     "INSERT INTO t (a, b) VALUES (?, ?), ..."),
+    ("SELECT price * 1.5e3 FROM t", "SELECT price * ? FROM t"),
+])
+def test_fingerprint_strips_parameters(statement, expected):
+    from slow_query import fingerprint
+    assert fingerprint(statement) == expected
+
+
+def test_aggregates_by_fingerprint_and_ranks_by_total(admin_client, slow_query):
+    import metrics
+    from db import get_engine
+
+    with get_engine().connect() as c:
+        for i in range(3):
+            c.execute(text(f"SELECT {i} + 1")).all()
+        c.execute(text("SELECT :v"), {"v": "x"}).all()
+    raw = sqlite3.connect(":memory:", factory=metrics.sqlite_connection_factory())
+    raw.execute("CREATE TEMP TABLE t (x)")
+    raw.cursor().executemany("INSERT INTO t VALUES (?)", [(1,), (2,), (3,)])
+    raw.close()
+
+    by_fp = {q["fingerprint"]: q for q in slow_query.top(500)}
+    assert by_fp["SELECT ? + ?"]["count"] == 3
+    assert by_fp["SELECT ?"]["count"] == 1
+    assert by_fp["INSERT INTO t VALUES (?)"]["rows"] == 3
+    totals = [q["total_ms"] for q in slow_query.top(500)]
+    assert totals == sorted(totals, reverse=True)
+    assert len(slow_query.top(1)) == 1
+
+
+def test_slow_query_records_route_tenant_and_plan(admin_client, slow_query, monkeypatch, caplog):
+    # 指标关闭时，有慢查询观察者也会挂中间件以提供路由 / 租户上下文
+    import metrics
+    from db import get_engine
+    from deps import Action, CurrentUser, Resource, require_permission
+
+    monkeypatch.setattr(slow_query, "SLOW_QUERY_EXPLAIN", True)
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    app = FastAPI()
+    metrics.install(app)
+
+    async def fake_user():
+        return CurrentUser(user_id=1, role="admin", is_guest=False, tenant_id=7)
+
+    @app.get("/probe/{n}")
+    def probe(n: int, user=Depends(require_permission(Resource.SYSTEM, Action.READ))):
+        with get_engine().connect() as c:
+            c.execute(text("SELECT name FROM sqlite_master WHERE type = :t"), {"t": "table"}).all()
+        return {"n": n}
+
+    from deps import get_current_user
+    app.dependency_overrides[get_current_user] = fake_user
+    with caplog.at_level("WARNING", logger="warehouse.slow_query"):
+        assert TestClient(app).get("/probe/1").status_code == 200
+
+    entry = next(q for q in slow_query.top(500)
+                 if q["fingerprint"] == "SELECT name FROM sqlite_master WHERE type = ?")
+    assert entry["slow_count"] == 1
+    assert entry["last_route"] == "GET /probe/{n}"
+    assert entry["last_tenant_id"] == 7
+    assert entry["plan"] and "sqlite_master" in " ".join(entry["plan"]).lower()
+    assert "slow query" in caplog.text and "sqlite_master" in caplog.text
+
+
+def test_fast_queries_are_aggregated_but_not_logged(admin_client, slow_query, monkeypatch, caplog):
+    from db import get_engine
+
+    monkeypatch.setattr(slow_query, "SLOW_QUERY_MS", 60_000.0)
+    with caplog.at_level("WARNING", logger="warehouse.slow_query"):
+        with get_engine().connect() as c:
+            c.execute(text("SELECT 1")).all()
+    entry = next(q for q in slow_query.top(500) if q["fingerprint"] == "SELECT ?")
+    assert entry["count"] >= 1 and entry["slow_count"] == 0 and entry["plan"] is None
+    assert "slow query" not in caplog.text
+
+
+def test_admin_endpoints(admin_client, slow_query):
+    slow_query.observe("SELECT * FROM t WHERE id = 1", 0.5, -1, None)
+    resp = admin_client.get("/api/system/slow-queries?limit=5")
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert body["enabled"] is True
+    assert any(q["fingerprint"] == "SELECT * FROM t WHERE id = ?" for q in body["queries"])
+
+    assert admin_client.post("/api/system/slow-queries/reset").json()["success"] is True
+    assert slow_query.top() == []
+
+
+def test_admin_endpoints_require_admin(client):
+    assert client.get("/api/system/slow-queries").status_code == 401
+    assert client.post("/api/system/slow-queries/reset").status_code == 401
@@ -0,0 +1,198 @@
+"""
+/api/materials/stock-lookup：query_stock 的一站式查询端点。
+
+DefaultProvider.query_stock 以前串行调 product-stats → fuzzy-match →
+（未命中）fuzzy-match → product-stats → batches；现在一次往返。这里验证：
+端点本身的判定（精确 / 同名多义 / 模糊解析 / 未命中），provider 确实只打一个
+请求，以及新旧两条路径对同一批查询给出逐字段相同的结果。
+"""
+import importlib
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+
+def _import_default_provider():
+    mcp_dir = Path(__file__).resolve().parents[1] / "mcp"
+    if str(mcp_dir) not in sys.path:
+        sys.path.insert(0, str(mcp_dir))
+    importlib.import_module("warehouse_mcp")
+    from providers.default import DefaultProvider
+    return DefaultProvider
+
+
+@pytest.fixture()
+def seeded(admin_client, default_warehouse_id):
+    from app import get_fuzzy_matcher
+    from database import get_db_connection
+
+    tag = uuid.uuid4().hex[:6].upper()
+    single = {"name": f"合一主控板{tag}", "sku": f"QL-ZK-{tag}"}
+    twin_name = f"同名垫片{tag}"
+    conn = get_db_connection()
+    cur = conn.cursor()
+    rows = [(single["name"], single["sku"], [("A区-01", 12, "")]),
+            (twin_name, f"DP-A-{tag}", [("B区-01", 5, "黑色"), ("B区-02", 7, "黑色")]),
+            (twin_name, f"DP-B-{tag}", [("B区-03", 9, "白色")])]
+    for name, sku, batches in rows:
+        cur.execute(
+            "INSERT INTO materials (name, sku, category, quantity, unit, "
+            "safe_stock, location, warehouse_id) "
+            "VALUES (?, ?, 'Test', 0, '个', 10, '', ?)",
+            (name, sku, default_warehouse_id),
+        )
+        mid = cur.lastrowid
+        for location, qty, variant in batches:
+            cur.execute(
+                "INSERT INTO batches (batch_no, material_id, quantity, initial_quantity, "
+                "is_exhausted, warehouse_id, created_at, location, variant, tenant_id) "
+                "VALUES (?, ?, ?, ?, 0, ?, datetime('now'), ?, ?, 1)",
+                (f"SL-{uuid.uuid4().hex[:8].upper()}", mid, qty, qty,
+                 default_warehouse_id, location, variant),
+            )
+    conn.commit()
+    conn.close()
+    get_fuzzy_matcher().invalidate_cache(entity_type="material")
+    return {"single": single, "twin_name": twin_name, "tag": tag}
+
+
+_MISSING = {"success": False, "error": "Not Found",
+            "message": "API 返回错误 (404)", "status_code": 404}  # 旧版后端没有该端点
+
+
+def _provider(admin_client, *, legacy=False, lookup_error=None):
+    DefaultProvider = _import_default_provider()
+
+    class P(DefaultProvider):
+        def __init__(self):
+            self.max_results = 10
+            self.paths = []
+
+        def http_get(self, path, params=None):
+            self.paths.append(path)
+            if path == "/materials/stock-lookup" and (legacy or lookup_error):
+                return lookup_error or _MISSING
+            r = admin_client.get(f"/api{path}", params=params or {})
+            if r.status_code != 200:
+                return {"error": r.json().get("detail", r.text)}
+            return r.json()
+
+    return P()
+
+
+def test_endpoint_exact_hit_carries_stats_and_batches(admin_client, seeded):
+    sku = seeded["single"]["sku"]
+    body = admin_client.get("/api/materials/stock-lookup", params={"q": sku}).json()
+    assert body["ambiguous"] is False and body["resolved_from"] is None
+    assert body["stats"]["name"] == seeded["single"]["name"]
+    assert body["stats"]["current_stock"] == 12
+    assert [b["location"] for b in body["batches"]["batches"]] == ["A区-01"]
+    assert "candidates" in body["match"]
+
+
+def test_endpoint_flags_same_name_ambiguity(admin_client, seeded):
+    body = admin_client.get("/api/materials/stock-lookup",
+                            params={"q": seeded["twin_name"]}).json()
+    assert body["ambiguous"] is True
+    assert body["batches"] is None
+    assert sum(c["name"] == seeded["twin_name"] for c in body["match"]["candidates"]) == 2
+
+
+def test_endpoint_resolves_fuzzy_and_reports_miss(admin_client, seeded):
+    spoken = seeded["single"]["sku"].replace("-", "").lower()
+    body = admin_client.get("/api/materials/stock-lookup", params={"q": spoken}).json()
+    assert body["resolved_from"] == spoken
+    assert body["material_id"] and body["stats"]["sku"] == seeded["single"]["sku"]
+
+    body = admin_client.get("/api/materials/stock-lookup",
+                            params={"q": f"完全不存在的东西{uuid.uuid4().hex}"}).json()
+    assert body["stats"] is None and body["resolved_name"] is None
+
+
+def test_provider_makes_one_round_trip(admin_client, seeded):
+    p = _provider(admin_client)
+    resp = p.query_stock(seeded["single"]["name"], show_batches=True)
+    assert resp["success"] is True
+    assert resp["product"]["current_stock"] == 12
+    assert p.paths == ["/materials/stock-lookup"]
+
+
+def test_combined_and_legacy_paths_agree(admin_client, seeded):
+    single, twin, tag = seeded["single"], seeded["twin_name"], seeded["tag"]
+    queries = [
+        single["name"],
+        single["sku"],
+        single["sku"].replace("-", "").lower(),
+        twin,
+        f"DP-A-{tag}",
+        f"同名垫片{tag} 黑色",
+        f"完全不存在的东西{tag}",
+    ]
+    for q in queries:
+        combined = _provider(admin_client).query_stock(q, show_batches=True)
+        legacy_provider = _provider(admin_client, legacy=True)
+        legacy = legacy_provider.query_stock(q, show_batches=True)
+        assert combined == legacy, q
+        assert len(legacy_provider.paths) > 1
+
+
+@pytest.mark.parametrize("lookup_error", [
+    {"success": False, "error": "Internal Server Error",
+     "message": "API 返回错误 (500)", "status_code": 500},
+    {"success": False, "error": "Not authenticated",
+     "message": "API 返回错误 (401)", "status_code": 401},
+    {"success": False, "error": "Read timed out.", "message": "API 请求失败: Read timed out."},
+    {"success": False, "error": "无法连接到后端服务", "message": "请确保后端服务已启动: x"},
+])
+def test_backend_failure_is_returned_without_legacy_calls(admin_client, seeded, lookup_error):
+    """只有端点不存在才回落；超时 / 5xx / 鉴权失败原样返回，不再追加三个请求。"""
+    p = _provider(admin_client, lookup_error=lookup_error)
+    assert p.query_stock(seeded["single"]["name"]) == lookup_error
+    assert p.paths == ["/materials/stock-lookup"]
+
+
+@pytest.mark.parametrize("missing", [
+    _MISSING,
+    {"success": False, "error": "Method Not Allowed",
+     "message": "API 返回错误 (405)", "status_code": 405},
+    # all-in-one 部署的旧版后端：SPA 兜底路由对未知 /api 路径返回 index.html
+    {"success": False, "error": "Expecting value: line 1 column 1 (char 0)",
+     "message": "API 请求失败: Expecting value: line 1 column 1 (char 0)", "status_code": 200},
+])
+def test_missing_endpoint_falls_back_to_legacy(admin_client, seeded, missing):
+    p = _provider(admin_client, lookup_error=missing)
+    resp = p.query_stock(seeded["single"]["name"])
+    assert resp["success"] is True and resp["product"]["current_stock"] == 12
+    assert p.paths[0] == "/materials/stock-lookup" and len(p.paths) > 1
+
+
+def test_http_get_reports_status_code(monkeypatch):
+    """BaseProvider.http_get 的错误带 status_code，非 JSON 响应也带。"""
+    import requests
+    from providers import base
+
+    class Resp:
+        def __init__(self, status_code, body):
+            self.status_code, self._body = status_code, body
+
+        def json(self):
+            if self._body is None:
+                raise ValueError("Expecting value")
+            return self._body
+
+    DefaultProvider = _import_default_provider()
+    p = DefaultProvider({"api_base_url": "http://backend/api"})
+    for status, body in [(404, {"detail": "Not Found"}), (503, {"detail": "down"}), (200, None)]:
+        monkeypatch.setattr(base.requests, "get", lambda *a, _r=Resp(status, body), **k: _r)
+        assert p.http_get("/x")["status_code"] == status
+
+    def boom(*a, **k):
+        raise requests.exceptions.ReadTimeout("Read timed out.")
+    monkeypatch.setattr(base.requests, "get", boom)
+    assert "status_code" not in p.http_get("/x")
+
+
+def test_requires_auth(client):
+    assert client.get("/api/materials/stock-lookup", params={"q": "x"}).status_code == 401
@@ -0,0 +1,127 @@
+"""
+Batch stock movement API: /api/materials/stock-movements:batch.
+
+Lines run through the same implementation as the single stock-in / stock-out
+endpoints, in order, inside one transaction (per-line SAVEPOINT by default,
+all-or-nothing with ``atomic``).
+"""
+import uuid
+
+import pytest
+
+
+@pytest.fixture()
+def material(admin_client, default_warehouse_id):
+    from database import get_db_connection
+    sku = f"BATCHMV-{uuid.uuid4().hex[:8].upper()}"
+    name = f"Batch Move {sku}"
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO materials (name, sku, category, quantity, unit, safe_stock, location, warehouse_id)
+        VALUES (?, ?, 'Test', 0, 'pcs', 0, 'A-01', ?)
+    ''', (name, sku, default_warehouse_id))
+    conn.commit()
+    conn.close()
+    return {'name': name, 'sku': sku, 'warehouse_id': default_warehouse_id}
+
+
+def _stock(name):
+    from database import get_db_connection
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT COALESCE(SUM(b.quantity), 0) AS qty FROM batches b
+        JOIN materials m ON m.id = b.material_id
+        WHERE m.name = ? AND b.is_exhausted = 0
+    ''', (name,)).fetchone()
+    conn.close()
+    return row['qty']
+
+
+def _line(direction, product, qty, **kw):
+    reason = "purchase" if direction == "in" else "sell"
+    return {"direction": direction, "product_name": product, "quantity": qty,
+            "reason_category": reason, **kw}
+
+
+class TestStockMovementsBatch:
+
+    def test_lines_apply_in_order_with_fifo(self, admin_client, material):
+        resp = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": material['warehouse_id'],
+            "lines": [
+                _line("in", material['name'], 30),
+                _line("in", material['sku'], 20),   # SKU 精确匹配
+                _line("out", material['name'], 40),  # 后行看得到前行的入库
+            ],
+        })
+        assert resp.status_code == 200, resp.text
+        data = resp.json()
+        assert data['success'] is True and data['applied'] == 3
+        first_batch = data['results'][0]['result']['batch']['batch_no']
+        consumed = data['results'][2]['result']['batch_consumptions']
+        assert [(c['batch_no'], c['quantity']) for c in consumed][0] == (first_batch, 30)
+        assert sum(c['quantity'] for c in consumed) == 40
+        assert _stock(material['name']) == 10
+
+    def test_failed_line_rolls_back_alone(self, admin_client, material):
+        resp = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": material['warehouse_id'],
+            "lines": [
+                _line("in", material['name'], 5),
+                _line("out", material['name'], 999),
+                _line("in", f"不存在-{uuid.uuid4().hex[:6]}", 1, fuzzy=False),
+                _line("out", material['name'], 2),
+            ],
+        })
+        data = resp.json()
+        assert data['success'] is False
+        assert [r['applied'] for r in data['results']] == [True, False, False, True]
+        assert data['results'][1]['result']['error'] == "库存不足"
+        assert _stock(material['name']) == 3
+
+    def test_partial_fallback_matches_single_endpoint(self, admin_client, material):
+        wh = material['warehouse_id']
+        setup = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": wh,
+            "lines": [_line("in", material['name'], 4), _line("in", material['name'], 10)],
+        }).json()
+        small = setup['results'][0]['result']['batch']['batch_no']
+
+        ask = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": wh,
+            "lines": [_line("out", material['name'], 6, batch_no=small)],
+        }).json()['results'][0]['result']
+        assert ask['error'] == "batch_insufficient_stock" and ask['can_fallback'] is True
+
+        done = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": wh,
+            "lines": [_line("out", material['name'], 6, batch_no=small,
+                            allow_partial_fallback=True)],
+        }).json()
+        assert done['applied'] == 1
+        assert _stock(material['name']) == 8
+
+    def test_atomic_rolls_back_everything(self, admin_client, material):
+        resp = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": material['warehouse_id'],
+            "atomic": True,
+            "lines": [
+                _line("in", material['name'], 5),
+                _line("out", material['name'], 50),
+            ],
+        })
+        data = resp.json()
+        assert data['success'] is False and data['applied'] == 0 and data['failed'] == 1
+        assert data['results'][0]['result']['success'] is True
+        assert data['results'][0]['applied'] is False
+        assert _stock(material['name']) == 0
+
+    def test_rejects_too_many_lines(self, admin_client, material, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module, "MAX_STOCK_BATCH_LINES", 2)
+        resp = admin_client.post("/api/materials/stock-movements:batch", json={
+            "warehouse_id": material['warehouse_id'],
+            "lines": [_line("in", material['name'], 1)] * 3,
+        })
+        assert resp.status_code == 400
+        assert _stock(material['name']) == 0
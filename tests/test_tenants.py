@@ -319,6 +319,205 @@ def test_tenant_database_export_is_scoped(admin_client, app_instance, monkeypatc
             pass
 
 
+@sqlite_only
+def test_tenant_database_export_gzip_roundtrips_through_import(admin_client, app_instance, monkeypatch):
+    import gzip
+
+    monkeypatch.setenv("DEPLOY_MODE", "multi_tenant")
+    _as_global_admin(admin_client)
+
+    suffix = uuid.uuid4().hex[:8]
+    tenant_id, warehouse_id, username = _create_tenant_admin_with_warehouse(admin_client, suffix)
+
+    from database import get_db_connection
+    conn = get_db_connection()
+    conn.executemany("""
+        INSERT INTO materials (name, sku, category, quantity, unit, warehouse_id, tenant_id)
+        VALUES (?, ?, 'GzCat', 1, 'pcs', ?, ?)
+    """, [(f"Gz {suffix} {i}", f"GZ-{suffix}-{i}", warehouse_id, tenant_id) for i in range(2500)])
+    conn.commit()
+    conn.close()
+
+    tenant_client = _login_as(app_instance, username)
+    assert tenant_client.get("/api/database/export", params={"compression": "lz4"}).status_code == 400
+
+    resp = tenant_client.get("/api/database/export", params={"compression": "gzip"})
+    assert resp.status_code == 200, resp.text
+    assert resp.headers["content-type"] == "application/gzip"
+    assert ".db.gz" in resp.headers["content-disposition"]
+    raw = gzip.decompress(resp.content)
+    assert raw.startswith(b"SQLite format 3")
+
+    # 导入按文件头识别 gzip 并解压
+    resp = tenant_client.post(
+        "/api/database/import",
+        files={"file": ("backup.db.gz", BytesIO(resp.content), "application/gzip")},
+    )
+    assert resp.status_code == 200, resp.text
+    conn = get_db_connection()
+    count = conn.execute(
+        "SELECT COUNT(*) FROM materials WHERE tenant_id = ? AND sku LIKE ?",
+        (tenant_id, f"GZ-{suffix}-%"),
+    ).fetchone()[0]
+    conn.close()
+    assert count == 2500
+
+
+@sqlite_only
+def test_tenant_database_import_remaps_ids_across_chunks(admin_client, app_instance, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setenv("DEPLOY_MODE", "multi_tenant")
+    # 小块尺寸：让每张表都跨多个 fetchmany / executemany 块
+    monkeypatch.setattr(app_module, "DB_IMPORT_CHUNK", 3)
+    _as_global_admin(admin_client)
+
+    suffix = uuid.uuid4().hex[:8]
+    tenant_id, warehouse_id, username = _create_tenant_admin_with_warehouse(admin_client, suffix)
+    tenant_client = _login_as(app_instance, username)
+
+    from database import get_db_connection
+    conn = get_db_connection()
+    conn.executemany("""
+        INSERT INTO materials (name, sku, category, quantity, unit, warehouse_id, tenant_id)
+        VALUES (?, ?, 'JobCat', 0, ?, ?, ?)
+    """, [(f"Job {suffix} {i}", f"JOB-{suffix}-{i}", '=+VLOOKUP(A1,B:C,2,0)' if i == 0 else 'pcs',
+           warehouse_id, tenant_id) for i in range(5)])
+    conn.commit()
+    conn.close()
+    for i in range(5):
+        for qty in (4, 6):
+            resp = tenant_client.post("/api/materials/stock-in", json={
+                "product_name": f"Job {suffix} {i}", "quantity": qty,
+                "reason_category": "purchase", "warehouse_id": warehouse_id, "fuzzy": False,
+            })
+            assert resp.status_code == 200, resp.text
+        resp = tenant_client.post("/api/materials/stock-out", json={
+            "product_name": f"Job {suffix} {i}", "quantity": 7,
+            "reason_category": "sell", "warehouse_id": warehouse_id, "fuzzy": False,
+        })
+        assert resp.status_code == 200, resp.text
+
+    backup = tenant_client.get("/api/database/export").content
+
+    resp = tenant_client.post(
+        "/api/database/import",
+        files={"file": ("backup.db", BytesIO(backup), "application/octet-stream")},
+    )
+    assert resp.status_code == 200, resp.text
+    details = resp.json()["details"]
+    assert details["materials"] == 5
+    assert details["batches"] == 10
+    assert details["inventory_records"] == 15
+    assert details["batch_consumptions"] == 10
+
+    conn = get_db_connection()
+    # 外键全部重映射到本租户新插入的行
+    assert conn.execute("""
+        SELECT COUNT(*) FROM batches b JOIN materials m ON m.id = b.material_id
+        WHERE b.tenant_id = ? AND m.tenant_id = ?
+    """, (tenant_id, tenant_id)).fetchone()[0] == 10
+    assert conn.execute("""
+        SELECT COUNT(*) FROM batch_consumptions bc
+        JOIN inventory_records r ON r.id = bc.record_id AND r.tenant_id = ? AND r.type = 'out'
+        JOIN batches b ON b.id = bc.batch_id AND b.tenant_id = ? AND b.material_id = r.material_id
+    """, (tenant_id, tenant_id)).fetchone()[0] == 10
+    remaining = conn.execute("""
+        SELECT m.sku, m.unit, SUM(b.quantity) AS qty FROM materials m
+        JOIN batches b ON b.material_id = m.id
+        WHERE m.tenant_id = ? GROUP BY m.id ORDER BY m.sku
+    """, (tenant_id,)).fetchall()
+    conn.close()
+    assert [(r["sku"], r["qty"]) for r in remaining] == [(f"JOB-{suffix}-{i}", 3) for i in range(5)]
+    assert remaining[0]["unit"] == "个"
+
+
+@sqlite_only
+def test_tenant_database_import_job_remaps_ids_across_chunks(admin_client, app_instance, monkeypatch):
+    import time
+    import app as app_module
+
+    monkeypatch.setenv("DEPLOY_MODE", "multi_tenant")
+    # 小块尺寸：让每张表都跨多个 fetchmany / executemany 块
+    monkeypatch.setattr(app_module, "DB_IMPORT_CHUNK", 3)
+    _as_global_admin(admin_client)
+
+    suffix = uuid.uuid4().hex[:8]
+    tenant_id, warehouse_id, username = _create_tenant_admin_with_warehouse(admin_client, suffix)
+    tenant_client = _login_as(app_instance, username)
+
+    from database import get_db_connection
+    conn = get_db_connection()
+    conn.executemany("""
+        INSERT INTO materials (name, sku, category, quantity, unit, warehouse_id, tenant_id)
+        VALUES (?, ?, 'JobCat', 0, ?, ?, ?)
+    """, [(f"Job {suffix} {i}", f"JOB-{suffix}-{i}", '=+VLOOKUP(A1,B:C,2,0)' if i == 0 else 'pcs',
+           warehouse_id, tenant_id) for i in range(5)])
+    conn.commit()
+    conn.close()
+    for i in range(5):
+        for qty in (4, 6):
+            resp = tenant_client.post("/api/materials/stock-in", json={
+                "product_name": f"Job {suffix} {i}", "quantity": qty,
+                "reason_category": "purchase", "warehouse_id": warehouse_id, "fuzzy": False,
+            })
+            assert resp.status_code == 200, resp.text
+        resp = tenant_client.post("/api/materials/stock-out", json={
+            "product_name": f"Job {suffix} {i}", "quantity": 7,
+            "reason_category": "sell", "warehouse_id": warehouse_id, "fuzzy": False,
+        })
+        assert resp.status_code == 200, resp.text
+
+    backup = tenant_client.get("/api/database/export").content
+
+    resp = tenant_client.post(
+        "/api/database/import?background=true",
+        files={"file": ("backup.db", BytesIO(backup), "application/octet-stream")},
+    )
+    assert resp.status_code == 202, resp.text
+    job_id = resp.json()["job_id"]
+
+    for _ in range(200):
+        job = tenant_client.get(f"/api/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "succeeded", job
+    assert job["job_type"] == "db_import" and job["tenant_id"] == tenant_id
+    assert job["done"] == job["total"] and job["percent"] == 100.0
+    details = job["result"]["details"]
+    assert details["materials"] == 5
+    assert details["batches"] == 10
+    assert details["inventory_records"] == 15
+    assert details["batch_consumptions"] == 10
+
+    # 其他租户看不到这个任务
+    assert admin_client.get(f"/api/jobs/{job_id}").status_code == 200
+    other_tid, _, other_user = _create_tenant_admin_with_warehouse(admin_client, uuid.uuid4().hex[:8])
+    other = _login_as(app_instance, other_user)
+    assert other.get(f"/api/jobs/{job_id}").status_code == 404
+
+    conn = get_db_connection()
+    # 外键全部重映射到本租户新插入的行
+    assert conn.execute("""
+        SELECT COUNT(*) FROM batches b JOIN materials m ON m.id = b.material_id
+        WHERE b.tenant_id = ? AND m.tenant_id = ?
+    """, (tenant_id, tenant_id)).fetchone()[0] == 10
+    assert conn.execute("""
+        SELECT COUNT(*) FROM batch_consumptions bc
+        JOIN inventory_records r ON r.id = bc.record_id AND r.tenant_id = ? AND r.type = 'out'
+        JOIN batches b ON b.id = bc.batch_id AND b.tenant_id = ? AND b.material_id = r.material_id
+    """, (tenant_id, tenant_id)).fetchone()[0] == 10
+    remaining = conn.execute("""
+        SELECT m.sku, m.unit, SUM(b.quantity) AS qty FROM materials m
+        JOIN batches b ON b.material_id = m.id
+        WHERE m.tenant_id = ? GROUP BY m.id ORDER BY m.sku
+    """, (tenant_id,)).fetchall()
+    conn.close()
+    assert [(r["sku"], r["qty"]) for r in remaining] == [(f"JOB-{suffix}-{i}", 3) for i in range(5)]
+    assert remaining[0]["unit"] == "个"
+
+
 @sqlite_only
 def test_tenant_database_clear_only_clears_current_tenant(admin_client, app_instance, monkeypatch):
     monkeypatch.setenv("DEPLOY_MODE", "multi_tenant")
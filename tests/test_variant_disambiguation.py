@@ -468,6 +468,8 @@ class TestVariantScopedMarker:
 
             def http_get(self, path, params=None):
                 params = params or {}
+                if path == "/materials/stock-lookup":  # 走逐个端点的旧路径
+                    return {"success": False, "error": "Not Found", "status_code": 404}
                 if path == "/materials/product-stats":
                     if params.get("material_id") == 7:
                         return {"name": "螺丝", "sku": "SKU-S",
@@ -535,6 +537,8 @@ class TestQueryStockVariantFiltered:
 
             def http_get(self, path, params=None):
                 params = params or {}
+                if path == "/materials/stock-lookup":  # 走逐个端点的旧路径
+                    return {"success": False, "error": "Not Found", "status_code": 404}
                 if path == "/materials/product-stats":
                     if params.get("material_id") == 42:
                         return {"name": "M3螺丝", "sku": "SKU-A",
@@ -0,0 +1,196 @@
+"""Parity tests for the vectorized SCRFD decode + NMS in the WE2 simulator.
+
+``_scrfd_decode_and_nms`` (NumPy, per-stride anchor grids + threshold mask +
+batched transforms + matrix NMS) must produce **bit-identical** detections to
+the original nested-loop implementation, kept as
+``_scrfd_decode_and_nms_reference``. Two layers of proof:
+
+- Golden fixture ``tests/fixtures/we2_scrfd_golden.json``: raw INT8 SCRFD
+  output tensors (real fixture-face outputs + dense synthetic ones that stress
+  the clamps and NMS) together with the detections the loop implementation
+  produced for them. Both implementations must reproduce it exactly.
+- Randomized parity over many seeds / image sizes against the reference.
+
+Regenerate the golden file (only when the decode contract intentionally
+changes)::
+
+    python tests/test_we2_scrfd_decode.py --update
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+BACKEND_DIR = REPO_ROOT / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+GOLDEN_PATH = REPO_ROOT / "tests" / "fixtures" / "we2_scrfd_golden.json"
+FIXTURE_FACE = REPO_ROOT / "tests" / "fixtures" / "we2_test_face.jpg"
+
+# Quantization params of the bundled scrfd_500m_kps.int8.tflite outputs.
+_QUANT = {
+    "score_scales": [0.00390625, 0.00390625, 0.00390625],
+    "score_zps": [-128, -128, -128],
+    "bbox_scales": [0.019490458071231842, 0.01881924830377102, 0.015103490091860294],
+    "bbox_zps": [0, 0, 0],
+    "kps_scales": [0.02451060339808464, 0.023661937564611435, 0.01342423353344202],
+    "kps_zps": [0, 0, 0],
+}
+_ROWS = (800, 200, 50)  # 160x160 input, strides 8/16/32, 2 anchors
+
+
+def _run(fn, case):
+    score = [_unpack(b, (n, 1)) for b, n in zip(case["score"], _ROWS)]
+    bbox = [_unpack(b, (n, 4)) for b, n in zip(case["bbox"], _ROWS)]
+    kps = [_unpack(b, (n, 10)) for b, n in zip(case["kps"], _ROWS)]
+    q = case["quant"]
+    return fn(
+        score, bbox, kps,
+        q["score_scales"], q["score_zps"],
+        q["bbox_scales"], q["bbox_zps"],
+        q["kps_scales"], q["kps_zps"],
+        160, 160, case["img_w"], case["img_h"],
+        case["score_thresh"], case["nms_thresh"],
+    )
+
+
+def _pack(arr) -> str:
+    return base64.b64encode(np.asarray(arr, dtype=np.int8).tobytes()).decode("ascii")
+
+
+def _unpack(b64: str, shape) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(b64), dtype=np.int8).reshape(shape).copy()
+
+
+def _as_json(dets) -> list:
+    """Detections → JSON-stable form (tuples → lists; floats round-trip exactly)."""
+    return [
+        {
+            "bbox": [float(v) for v in d["bbox"]],
+            "score": float(d["score"]),
+            "landmarks": [[float(x), float(y)] for x, y in d["landmarks"]],
+            "stride_idx": int(d["stride_idx"]),
+        }
+        for d in dets
+    ]
+
+
+def _synthetic_case(seed: int, *, img_w: int, img_h: int, density: float,
+                    zero_low: bool = False) -> dict:
+    """Dense random SCRFD outputs: many above-threshold anchors, wide bbox
+    distances (exercise both clamp stages) and overlapping boxes (exercise NMS).
+    ``zero_low`` pins every non-hit anchor to score 0.0 exactly."""
+    rng = np.random.default_rng(seed)
+    case = {"name": f"synthetic-{seed}", "img_w": img_w, "img_h": img_h,
+            "score_thresh": 0.70, "nms_thresh": 0.40, "quant": _QUANT,
+            "score": [], "bbox": [], "kps": []}
+    for n in _ROWS:
+        hi = rng.random(n) < density
+        low = np.full(n, -128) if zero_low else rng.integers(-128, 52, n)
+        score = np.where(hi, rng.integers(52, 128, n), low)
+        case["score"].append(_pack(score.reshape(n, 1)))
+        case["bbox"].append(_pack(rng.integers(-40, 128, (n, 4))))
+        case["kps"].append(_pack(rng.integers(-128, 128, (n, 10))))
+    return case
+
+
+def _fixture_face_case(img_w: int, img_h: int) -> dict:
+    from PIL import Image
+
+    from face.we2 import get_simulator
+    from face.we2 import simulator as sim_mod
+
+    sim = get_simulator()
+    sim._ensure_loaded()
+    img = Image.open(FIXTURE_FACE).convert("RGB")
+    fd_rgb = sim_mod._resize_bgr_planar_to_rgb_interleaved(
+        sim_mod._image_to_bgr_planar(img), sim_mod.FD_INPUT_W, sim_mod.FD_INPUT_H)
+    fd_input = sim_mod._quantize_uint8_to_int8(fd_rgb, sim._fd_input_zp)[np.newaxis, ...]
+    sim._fd_interp.set_tensor(sim._fd_input_idx, fd_input)
+    sim._fd_interp.invoke()
+    get = sim._fd_interp.get_tensor
+    return {
+        "name": f"fixture-face-{img_w}x{img_h}", "img_w": img_w, "img_h": img_h,
+        "score_thresh": 0.70, "nms_thresh": 0.40, "quant": _QUANT,
+        "score": [_pack(get(t)) for t in sim._fd_score_tensors],
+        "bbox": [_pack(get(t)) for t in sim._fd_bbox_tensors],
+        "kps": [_pack(get(t)) for t in sim._fd_kps_tensors],
+    }
+
+
+def _build_golden() -> dict:
+    from face.we2.simulator import _scrfd_decode_and_nms_reference
+
+    cases = [
+        _fixture_face_case(160, 160),
+        _fixture_face_case(640, 480),
+        _synthetic_case(1, img_w=640, img_h=480, density=0.15),
+        _synthetic_case(2, img_w=1280, img_h=720, density=0.1),
+        _synthetic_case(3, img_w=333, img_h=517, density=0.05),
+        # threshold 0 → zero-score anchors pass decode but must drop before NMS
+        dict(_synthetic_case(4, img_w=160, img_h=160, density=0.05, zero_low=True),
+             score_thresh=0.0),
+    ]
+    for c in cases:
+        c["expected"] = _as_json(_run(_scrfd_decode_and_nms_reference, c))
+    return {"cases": cases}
+
+
+def _load_golden() -> list:
+    return json.loads(GOLDEN_PATH.read_text(encoding="utf-8"))["cases"]
+
+
+@pytest.mark.parametrize("impl", ["_scrfd_decode_and_nms", "_scrfd_decode_and_nms_reference"])
+def test_scrfd_decode_matches_golden(impl):
+    from face.we2 import simulator as sim_mod
+
+    fn = getattr(sim_mod, impl)
+    cases = _load_golden()
+    assert any(c["expected"] for c in cases)
+    for case in cases:
+        got = _run(fn, case)
+        assert _as_json(got) == case["expected"], case["name"]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_scrfd_decode_vectorized_matches_reference_randomized(seed):
+    from face.we2.simulator import _scrfd_decode_and_nms, _scrfd_decode_and_nms_reference
+
+    rng = np.random.default_rng(1000 + seed)
+    img_w = int(rng.integers(40, 2000))
+    img_h = int(rng.integers(40, 2000))
+    case = _synthetic_case(1000 + seed, img_w=img_w, img_h=img_h,
+                           density=float(rng.uniform(0.01, 0.4)),
+                           zero_low=bool(seed % 2))
+    case["score_thresh"] = (0.70, 0.5, 0.0)[seed % 3]
+    want = _run(_scrfd_decode_and_nms_reference, case)
+    got = _run(_scrfd_decode_and_nms, case)
+    assert _as_json(got) == _as_json(want)
+    # same python types as the loop version (callers float()/tuple-unpack them)
+    for g in got:
+        assert type(g["bbox"]) is tuple and all(type(v) is float for v in g["bbox"])
+        assert type(g["score"]) is float and type(g["stride_idx"]) is int
+        assert all(type(p) is tuple for p in g["landmarks"])
+
+
+def test_scrfd_decode_no_detections():
+    from face.we2.simulator import _scrfd_decode_and_nms
+
+    case = _synthetic_case(7, img_w=320, img_h=240, density=0.0)
+    assert _run(_scrfd_decode_and_nms, case) == []
+
+
+if __name__ == "__main__":
+    if "--update" in sys.argv:
+        GOLDEN_PATH.write_text(json.dumps(_build_golden()), encoding="utf-8")
+        print(f"updated {GOLDEN_PATH}")
+    else:
+        print(__doc__)
@@ -0,0 +1,129 @@
+"""Tests for the streaming XLSX writer used by the Excel export endpoints."""
+from __future__ import annotations
+
+import sys
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+from io import BytesIO
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from xlsx_stream import iter_xlsx  # noqa: E402
+
+
+def _roundtrip(rows, **kw):
+    data = b"".join(iter_xlsx(rows, **kw))
+    return load_workbook(BytesIO(data)).active
+
+
+def test_roundtrip_values_and_layout():
+    rows = [
+        ("a & <b> \"q\"", 1, 2.5, None, Decimal("3"), "  pad  "),
+        ("ctrl\x01\x1fchars\ttab", 0, -1.25, "", True, datetime(2025, 1, 2, 3, 4, 5)),
+    ] * 1500  # 跨多个 flush 窗口
+    ws = _roundtrip(rows, headers=["名称", "n", "f", "空", "dec", "尾"],
+                    sheet_title="库存数据", column_widths=[22, 10, 10, 8, 8, 12],
+                    flush_rows=100)
+    assert ws.title == "库存数据"
+    assert ws.max_row == 3001
+    assert [c.value for c in ws[1]] == ["名称", "n", "f", "空", "dec", "尾"]
+    assert [c.value for c in ws[2]] == ["a & <b> \"q\"", 1, 2.5, None, 3, "  pad  "]
+    assert [c.value for c in ws[3]] == [
+        "ctrlchars\ttab", 0, -1.25, None, True, "2025-01-02 03:04:05"]
+    assert ws.column_dimensions["A"].width == 22
+
+
+def test_rows_consumed_lazily():
+    """首个 sheet 数据块在行源耗尽前就产出（边取数边发送，而非攒完再存）。"""
+    consumed = {"n": 0}
+
+    def rows():
+        for i in range(10_000):
+            consumed["n"] += 1
+            yield (f"row-{i}", i)
+
+    gen = iter_xlsx(rows(), headers=["a", "b"], flush_rows=500)
+    next(gen)  # 包结构部件
+    next(gen)  # 第一批 sheet 数据
+    assert consumed["n"] < 10_000
+    assert b"".join(gen)
+
+
+def test_memory_bounded_by_flush_window():
+    def rows(n):
+        for i in range(n):
+            yield (f"物料-{i}", i, "批次-" + str(i), "备注" * 5)
+
+    def peak(n):
+        tracemalloc.start()
+        try:
+            total = sum(len(c) for c in iter_xlsx(rows(n), headers=["a", "b", "c", "d"]))
+            return tracemalloc.get_traced_memory()[1], total
+        finally:
+            tracemalloc.stop()
+
+    small_peak, _ = peak(2_000)
+    big_peak, _ = peak(40_000)
+    # 行数 ×20，峰值内存基本不变：只有一个 flush 窗口的 XML + deflate 状态
+    assert big_peak < small_peak * 2
+    assert big_peak < 8 * 1024 * 1024
+
+
+def _xlsx_bytes(rows):
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    for r in rows:
+        ws.append(r)
+    buf = BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+
+def test_iter_rows_reports_formula_cells_in_one_pass():
+    from xlsx_stream import iter_xlsx_rows
+    buf = _xlsx_bytes([
+        ["sku", "qty", "loc"],
+        ["A", 1, "=B2&\"x\""],   # openpyxl 写出的公式没有缓存值
+        [],
+        ["B", 2.0, "L-1"],
+    ])
+    rows = list(iter_xlsx_rows(buf))
+    assert [r[0] for r in rows] == [1, 2, 4]          # 整行空的第 3 行不产出
+    assert rows[1][1] == ("A", 1, None) and rows[1][2] == {2}
+    assert rows[2][1] == ("B", 2, "L-1") and not rows[2][2]
+
+
+def test_iter_rows_rejects_oversized_archive():
+    import pytest
+    from xlsx_stream import XlsxTooLarge, iter_xlsx_rows
+    buf = _xlsx_bytes([["x" * 1000] for _ in range(200)])
+    with pytest.raises(XlsxTooLarge):
+        next(iter_xlsx_rows(buf, max_unzipped_bytes=10_000))
+
+
+def test_iter_rows_falls_back_when_openpyxl_internals_missing(monkeypatch):
+    """一遍解析依赖 openpyxl 私有接口；接口没了就退回公开的两遍读取，结果不变。"""
+    import sys
+    from xlsx_stream import iter_xlsx_rows
+    rows = [
+        ["sku", "qty", "loc", None],
+        ["A", 1, "=B2&\"x\""],
+        [],
+        ["B", 2.0, "L-1", None],
+        [None, None, "=SUM(B2:B4)"],
+    ]
+    fast = list(iter_xlsx_rows(_xlsx_bytes(rows)))
+
+    monkeypatch.setitem(sys.modules, "openpyxl.worksheet._reader", None)  # import 即失败
+    fallback = list(iter_xlsx_rows(_xlsx_bytes(rows)))
+    assert fallback == fast
+    assert [r[0] for r in fallback] == [1, 2, 4, 5]
+    assert fallback[3] == (5, (None, None, None), {2})